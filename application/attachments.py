@@ -0,0 +1,121 @@
+"""
+This module provides AttachmentStream, which carries attachment bytes
+from a file, a buffer or a base64 upload to a repository in fixed-size
+chunks, enforcing the size limit and hashing as the chunks go by.
+"""
+
+import base64
+import hashlib
+import mimetypes
+import os
+from typing import Iterable, Iterator, Optional
+
+# Bytes read, hashed and written per step
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTACHMENT_SIZE = 256 * 1024 * 1024
+
+
+def size_error() -> ValueError:
+    return ValueError(f"File too large. Maximum allowed size is {MAX_ATTACHMENT_SIZE // (1024 * 1024)}MB.")
+
+
+def check_attachment_size(size: int):
+    if size > MAX_ATTACHMENT_SIZE:
+        raise size_error()
+
+
+class AttachmentStream:
+    """
+    AttachmentStream is a one-shot iterable of attachment chunks.
+
+    Iterating it yields the chunks of its source while counting and
+    hashing them, and raises ValueError as soon as the total passes
+    max_size, so oversized uploads are rejected without being buffered.
+    Once exhausted, digest and size describe everything that was read.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes],
+        filename: Optional[str] = None,
+        mimetype: Optional[str] = None,
+        size_hint: Optional[int] = None,
+        max_size: int = None
+    ):
+        """
+        Initialize the stream.
+
+        :param chunks: The source chunks, read at most once.
+        :param filename: The attachment filename.
+        :param mimetype: The attachment mimetype.
+        :param size_hint: The expected total size if known up front, which
+            lets SQLite preallocate the BLOB.
+        :param max_size: The size limit; defaults to MAX_ATTACHMENT_SIZE.
+        """
+        self._chunks = chunks
+        self.filename = filename
+        self.mimetype = mimetype
+        self.max_size = MAX_ATTACHMENT_SIZE if max_size is None else max_size
+        if size_hint is not None and size_hint > self.max_size:
+            raise size_error()
+        self.size_hint = size_hint
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._consumed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._consumed:
+            raise RuntimeError("Attachment stream already consumed")
+        self._consumed = True
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            self.size += len(chunk)
+            if self.size > self.max_size:
+                raise size_error()
+            self._hash.update(chunk)
+            yield chunk
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 hex digest of the chunks read so far."""
+        return self._hash.hexdigest()
+
+    @classmethod
+    def from_path(cls, path: str, chunk_size: int = CHUNK_SIZE) -> "AttachmentStream":
+        """Stream a file, named and typed after its path."""
+        def chunks():
+            with open(path, "rb") as f:
+                yield from iter(lambda: f.read(chunk_size), b"")
+
+        mimetype, _ = mimetypes.guess_type(path)
+        return cls(chunks(), os.path.basename(path), mimetype, size_hint=os.path.getsize(path))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, filename: Optional[str] = None, mimetype: Optional[str] = None,
+                   chunk_size: int = CHUNK_SIZE) -> "AttachmentStream":
+        """Stream an in-memory buffer without copying it first."""
+        view = memoryview(data)
+        chunks = (bytes(view[start:start + chunk_size]) for start in range(0, len(view), chunk_size))
+        return cls(chunks, filename, mimetype, size_hint=len(view))
+
+    @classmethod
+    def from_base64(cls, text: str, filename: Optional[str] = None, mimetype: Optional[str] = None,
+                    chunk_size: int = CHUNK_SIZE) -> "AttachmentStream":
+        """Decode base64 text chunk by chunk instead of all at once."""
+        # Every 4 base64 characters decode to 3 bytes on their own
+        step = chunk_size // 3 * 4
+        chunks = (base64.b64decode(text[start:start + step]) for start in range(0, len(text), step))
+        return cls(chunks, filename, mimetype)
+
+
+def iter_chunks(data, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a buffer (bytes or mmap) in chunks of at most chunk_size."""
+    if not data:
+        return
+    view = memoryview(data)
+    try:
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+    finally:
+        view.release()
@@ -0,0 +1,175 @@
+"""
+This module provides the change feed: a typed event for every todo that
+is created, updated or deleted, numbered in publishing order and
+broadcast to in-process subscribers such as the Flet sessions. Recent
+events are kept, so a subscriber that missed some can catch up from the
+last sequence number it saw instead of reloading everything.
+"""
+
+import collections
+import contextlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+from application.models import TodoSummary
+
+logger = logging.getLogger(__name__)
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# The fields of a todo that listings show, and so the ones an update
+# event reports as changed
+SUMMARY_FIELDS = ("title", "completed", "attachment_filename", "attachment_mimetype", "attachment_size", "attachment_hash")
+ATTACHMENT_FIELDS = ("attachment_filename", "attachment_mimetype", "attachment_size", "attachment_hash")
+
+# Writes to todos hashing to the same stripe are serialized
+_LOCK_STRIPES = 64
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """
+    One change to one todo. todo is its state after the change, and None
+    for deletes; fields names what an update changed.
+    """
+    seq: int
+    kind: str
+    todo_id: str
+    fields: Tuple[str, ...] = ()
+    todo: Optional[TodoSummary] = None
+
+
+def changed_fields(old, new) -> Tuple[str, ...]:
+    """
+    The summary fields that differ between two versions of a todo.
+
+    :param old: The previous TodoItem or TodoSummary.
+    :param new: The new TodoItem or TodoSummary.
+    :return: The names of the changed fields, in SUMMARY_FIELDS order.
+    """
+    return tuple(name for name in SUMMARY_FIELDS if getattr(old, name) != getattr(new, name))
+
+
+class ChangeFeed:
+    """
+    ChangeFeed numbers and broadcasts change events within one process.
+
+    Subscribers are called on the publishing thread, in sequence order,
+    while the feed's lock is held, so they must return quickly. An
+    asyncio subscriber should hand the event to its loop with
+    call_soon_threadsafe().
+
+    The feed also holds the write locks of the repositories publishing to
+    it, so writers in different sessions wait for each other too.
+    """
+
+    def __init__(self, history: int = 1000):
+        """
+        Initialize the feed.
+
+        :param history: The number of recent events kept for catch-up.
+        """
+        self._history = collections.deque(maxlen=history)
+        self._subscribers: List[Callable[[ChangeEvent], None]] = []
+        self._seq = 0
+        # Reentrant, so a subscriber may unsubscribe from within a delivery
+        self._lock = threading.RLock()
+        self._write_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    @contextlib.contextmanager
+    def locked(self, todo_ids: Iterable[str]):
+        """
+        Hold the write locks of some todos, so that writing them and
+        publishing their events happen one at a time.
+
+        :param todo_ids: The IDs of the todos about to be written.
+        """
+        # Stripes are taken in index order, so batches cannot deadlock
+        stripes = sorted({hash(todo_id) % _LOCK_STRIPES for todo_id in todo_ids})
+        with contextlib.ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._write_locks[stripe])
+            yield
+
+    def locked_all(self):
+        """Hold every write lock, for bulk writes that do not know their todos up front."""
+        return self.locked(range(_LOCK_STRIPES))
+
+    @property
+    def last_seq(self) -> int:
+        """The sequence number of the latest event, 0 before the first."""
+        return self._seq
+
+    def publish(self, kind: str, todo_id: str, fields: Tuple[str, ...] = (), todo: Optional[TodoSummary] = None) -> ChangeEvent:
+        """
+        Number an event, keep it for catch-up and deliver it to every
+        subscriber. A failing subscriber is logged and skipped.
+
+        :param kind: CREATED, UPDATED or DELETED.
+        :param todo_id: The ID of the changed todo.
+        :param fields: The fields an update changed.
+        :param todo: The todo after the change, or None for deletes.
+        :return: The published event.
+        """
+        with self._lock:
+            self._seq += 1
+            event = ChangeEvent(self._seq, kind, todo_id, tuple(fields), todo)
+            self._history.append(event)
+            for callback in list(self._subscribers):
+                self._deliver(callback, event)
+        return event
+
+    @staticmethod
+    def _deliver(callback, event: ChangeEvent):
+        try:
+            callback(event)
+        except Exception:
+            logger.exception("Change feed subscriber failed on event %d", event.seq)
+
+    def since(self, seq: int) -> Optional[List[ChangeEvent]]:
+        """
+        The events published after a sequence number.
+
+        :param seq: The last sequence number the caller saw.
+        :return: The later events, oldest first, or None if some of them
+            are no longer kept.
+        """
+        with self._lock:
+            return self._since(seq)
+
+    def _since(self, seq: int) -> Optional[List[ChangeEvent]]:
+        if seq >= self._seq:
+            return []
+        if not self._history or self._history[0].seq > seq + 1:
+            return None
+        return [event for event in self._history if event.seq > seq]
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None], since: Optional[int] = None) -> Callable[[], None]:
+        """
+        Deliver every future event to a callback.
+
+        :param callback: Called with each ChangeEvent.
+        :param since: If given, the events after this sequence number are
+            delivered first, with nothing published in between.
+        :return: A function that ends the subscription.
+        :raises ValueError: If events after since are no longer kept; the
+            caller has to reload instead and subscribe without since.
+        """
+        with self._lock:
+            if since is not None:
+                missed = self._since(since)
+                if missed is None:
+                    raise ValueError(f"Changes after event {since} are no longer kept")
+                for event in missed:
+                    self._deliver(callback, event)
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
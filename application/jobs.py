@@ -0,0 +1,217 @@
+"""
+This module provides the background job queue: work such as storing an
+attachment and rendering its thumbnail is handed to a bounded pool of
+workers instead of running in a UI event handler. Every job has a status
+that callers can poll or wait for, and failed attempts are retried.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """
+    One unit of background work and its progress. future resolves with
+    the job's result, or its last error, once it is done or has failed.
+    attempts counts the runs of all its steps.
+    """
+    name: str
+    todo_id: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = PENDING
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    future: Future = field(default_factory=Future, repr=False, compare=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+
+class JobQueue:
+    """
+    JobQueue runs jobs on an executor with at most workers of them at
+    once, and at most max_pending waiting or running.
+
+    A job that raises is retried after a growing delay, up to retries more
+    times, unless the error is one of permanent (by default ValueError,
+    which the services raise for bad input such as an unknown todo). The
+    delay is waited out on a timer, so it does not hold a worker. A job
+    made of several steps retries only the step that failed, each with
+    retries of its own.
+
+    The default executor is a thread pool. A ProcessPoolExecutor can be
+    passed for CPU-bound work, as long as job functions and their
+    arguments can be pickled.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_pending: int = 1000,
+        permanent: Tuple[type, ...] = (ValueError,),
+        executor: Optional[Executor] = None
+    ):
+        """
+        Initialize the queue.
+
+        :param workers: The number of jobs run at once by an owned pool.
+        :param retries: How many times a failed job is run again.
+        :param backoff: The delay before the first retry, in seconds; it
+            doubles for each further one.
+        :param max_pending: The number of unfinished jobs above which
+            submit() refuses new ones.
+        :param permanent: Exception types that fail a job without a retry.
+        :param executor: A pool to run jobs on, left running by close();
+            if None the queue owns a thread pool of workers threads.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_pending = max_pending
+        self.permanent = permanent
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix="todo-jobs")
+        self._jobs: Dict[str, Job] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        *args,
+        todo_id: Optional[str] = None,
+        then: Sequence[Callable[[Any], Any]] = ()
+    ) -> Job:
+        """
+        Queue a job.
+
+        :param name: What the job does, e.g. "attachment".
+        :param fn: The function to run; it is called again on a retry, so
+            it must be safe to repeat.
+        :param args: The arguments fn is called with.
+        :param todo_id: The todo the job works on, if any.
+        :param then: Further steps, each called with the result of the one
+            before once it succeeded; the job resolves with the last result.
+        :return: The queued job.
+        :raises RuntimeError: If the queue is closed or full.
+        """
+        job = Job(name, todo_id)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Job queue is closed")
+            if len(self._jobs) >= self.max_pending:
+                raise RuntimeError("Too many background jobs, try again later")
+            self._jobs[job.id] = job
+        self._start(job, fn, args, tuple(then), 1)
+        return job
+
+    def _start(self, job: Job, fn, args, then, attempt: int):
+        with self._lock:
+            self._timers.pop(job.id, None)
+            if job.finished:
+                # Failed by close() while its retry timer was firing
+                return
+            if not self._closed:
+                job.status = RUNNING
+                job.attempts += 1
+        if job.status != RUNNING:
+            self._finish(job, FAILED, error=RuntimeError("Job queue is closed"))
+            return
+        try:
+            future = self.executor.submit(fn, *args)
+        except RuntimeError as err:
+            # The executor was shut down meanwhile
+            self._finish(job, FAILED, error=err)
+            return
+        future.add_done_callback(lambda done: self._settle(job, fn, args, then, attempt, done))
+
+    def _settle(self, job: Job, fn, args, then, attempt: int, done: Future):
+        error = done.exception()
+        if error is None:
+            if then:
+                # A later step failing does not repeat this one
+                self._start(job, then[0], (done.result(),), then[1:], 1)
+            else:
+                self._finish(job, DONE, result=done.result())
+            return
+        job.error = str(error) or type(error).__name__
+        if isinstance(error, self.permanent) or attempt > self.retries:
+            logger.warning("Job %s (%s) failed after %d attempts: %s", job.id, job.name, job.attempts, job.error)
+            self._finish(job, FAILED, error=error)
+            return
+        delay = self.backoff * 2 ** (attempt - 1)
+        with self._lock:
+            if not self._closed:
+                job.status = PENDING
+                timer = self._timers[job.id] = threading.Timer(delay, self._start, (job, fn, args, then, attempt + 1))
+                timer.daemon = True
+                timer.start()
+                return
+        self._finish(job, FAILED, error=error)
+
+    def _finish(self, job: Job, status: str, result=None, error: Optional[BaseException] = None):
+        with self._lock:
+            if self._jobs.pop(job.id, None) is None:
+                return
+            job.status = status
+            job.finished_at = time.time()
+        # Resolved without the lock, so waiters may use the queue at once
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Get an unfinished job by its ID.
+
+        :param job_id: The ID of the job.
+        :return: The job, or None once it has finished.
+        """
+        return self._jobs.get(job_id)
+
+    def pending(self, todo_id: Optional[str] = None) -> List[Job]:
+        """
+        List the unfinished jobs, oldest first.
+
+        :param todo_id: Only list the jobs working on this todo.
+        :return: The pending and running jobs.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if todo_id is None or job.todo_id == todo_id]
+
+    def close(self):
+        """
+        Stop accepting jobs and fail the ones waiting for a retry. Running
+        jobs finish; an owned pool is shut down without waiting for them.
+        """
+        with self._lock:
+            self._closed = True
+            timers, self._timers = list(self._timers.items()), {}
+        for job_id, timer in timers:
+            timer.cancel()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._finish(job, FAILED, error=RuntimeError("Job queue is closed"))
+        if self._owns_executor:
+            self.executor.shutdown(wait=False)
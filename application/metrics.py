@@ -0,0 +1,218 @@
+"""
+This module provides MetricsRegistry, which records per-operation
+latency histograms, row counts, attachment bytes and errors for the
+service and repository layers, logs slow operations, and renders
+everything in the Prometheus text exposition format, together with the
+counters of the read caches it is given.
+"""
+
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Stats:
+    __slots__ = ("buckets", "count", "seconds", "errors", "slow", "rows", "bytes_read", "bytes_written")
+
+    def __init__(self):
+        # Per-bucket counts; the last slot is +Inf
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.slow = 0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+class Operation:
+    """
+    One measured call, as returned by MetricsRegistry.measure(). The
+    caller fills in rows and bytes before the block ends.
+    """
+
+    __slots__ = ("registry", "layer", "name", "rows", "bytes_read", "bytes_written", "_start")
+
+    def __init__(self, registry: "MetricsRegistry", layer: str, name: str):
+        self.registry = registry
+        self.layer = layer
+        self.name = name
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self) -> "Operation":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.record(self, time.perf_counter() - self._start, error=exc_type is not None)
+        return False
+
+
+class MetricsRegistry:
+    """
+    MetricsRegistry keeps cumulative metrics per (layer, operation) pair.
+    It is thread-safe and meant to be shared by every session of a
+    process, like the connection pool.
+    """
+
+    def __init__(self, slow_threshold: Optional[float] = 0.25):
+        """
+        Initialize an empty registry.
+
+        :param slow_threshold: Operations taking at least this many seconds
+            are logged as warnings and counted as slow; None disables it.
+        """
+        self.slow_threshold = slow_threshold
+        self._stats: Dict[Tuple[str, str], _Stats] = {}
+        self._caches: List[Callable[[], Dict[str, dict]]] = []
+        self._lock = threading.Lock()
+
+    def watch_cache(self, stats: Callable[[], Dict[str, dict]]):
+        """
+        Render the counters of a read cache with the other metrics.
+
+        :param stats: Returns the counters by cache name, as TodoCache.stats() does.
+        """
+        with self._lock:
+            self._caches.append(stats)
+
+    def measure(self, layer: str, name: str) -> Operation:
+        """
+        Measure a block of code:
+
+            with metrics.measure("repository", "list_all") as op:
+                todos = repo.list_all()
+                op.rows = len(todos)
+        """
+        return Operation(self, layer, name)
+
+    def record(self, op: Operation, seconds: float, error: bool = False):
+        slow = self.slow_threshold is not None and seconds >= self.slow_threshold
+        with self._lock:
+            stats = self._stats.get((op.layer, op.name))
+            if stats is None:
+                stats = self._stats[(op.layer, op.name)] = _Stats()
+            stats.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            stats.count += 1
+            stats.seconds += seconds
+            stats.errors += error
+            stats.slow += slow
+            stats.rows += op.rows
+            stats.bytes_read += op.bytes_read
+            stats.bytes_written += op.bytes_written
+        if slow:
+            logger.warning(
+                f"Slow {op.layer} operation {op.name}: {seconds * 1000:.1f}ms, "
+                f"{op.rows} rows, {op.bytes_read} bytes read, {op.bytes_written} bytes written"
+                f"{' (failed)' if error else ''}"
+            )
+
+    def snapshot(self) -> Dict[Tuple[str, str], dict]:
+        """Return a copy of the metrics, keyed by (layer, operation)."""
+        with self._lock:
+            return {
+                key: {name: getattr(stats, name) for name in _Stats.__slots__}
+                for key, stats in self._stats.items()
+            }
+
+    def render_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = sorted(self.snapshot().items())
+        lines = [
+            "# HELP todo_operation_duration_seconds Latency of service and repository operations.",
+            "# TYPE todo_operation_duration_seconds histogram",
+        ]
+        for (layer, name), stats in snapshot:
+            labels = f'layer="{layer}",operation="{name}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), stats["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'todo_operation_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"todo_operation_duration_seconds_sum{{{labels}}} {stats['seconds']!r}")
+            lines.append(f"todo_operation_duration_seconds_count{{{labels}}} {stats['count']}")
+        for metric, field, description in _COUNTERS:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for (layer, name), stats in snapshot:
+                lines.append(f'{metric}{{layer="{layer}",operation="{name}"}} {stats[field]}')
+        with self._lock:
+            watched = list(self._caches)
+        caches = [cache for stats in watched for cache in sorted(stats().items())]
+        if caches:
+            for metric, kind, field, description in _CACHE_METRICS:
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} {kind}")
+                for name, stats in caches:
+                    lines.append(f'{metric}{{cache="{name}"}} {stats[field]}')
+        return "\n".join(lines) + "\n"
+
+
+_COUNTERS = (
+    ("todo_operation_errors_total", "errors", "Operations that raised an exception."),
+    ("todo_operation_slow_total", "slow", "Operations slower than the slow-operation threshold."),
+    ("todo_operation_rows_total", "rows", "Todo rows read or written by operations."),
+    ("todo_attachment_read_bytes_total", "bytes_read", "Attachment bytes read by operations."),
+    ("todo_attachment_written_bytes_total", "bytes_written", "Attachment bytes written by operations."),
+)
+
+_CACHE_METRICS = (
+    ("todo_cache_hits_total", "counter", "hits", "Read cache lookups that found their entry."),
+    ("todo_cache_misses_total", "counter", "misses", "Read cache lookups that did not."),
+    ("todo_cache_evictions_total", "counter", "evictions", "Entries evicted to stay within the cache budget."),
+    ("todo_cache_entries", "gauge", "entries", "Entries held by the read cache."),
+    ("todo_cache_bytes", "gauge", "bytes", "Bytes held by the read cache."),
+    ("todo_cache_max_bytes", "gauge", "max_bytes", "Budget of the read cache in bytes."),
+)
+
+
+
+def count_rows(result) -> int:
+    """The number of todos in an operation's result."""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    items = getattr(result, "items", None)
+    if isinstance(items, list):
+        return len(items)
+    return 1 if hasattr(result, "id") else 0
+
+
+def measured(method):
+    """
+    Decorate a service method so that each call is recorded in the
+    service's metrics registry, if it has one.
+    """
+    name = method.__name__
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return await method(self, *args, **kwargs)
+            with self.metrics.measure("service", name) as op:
+                result = await method(self, *args, **kwargs)
+                op.rows = count_rows(result)
+                return result
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+            with self.metrics.measure("service", name) as op:
+                result = method(self, *args, **kwargs)
+                op.rows = count_rows(result)
+                return result
+    return wrapper
@@ -1,7 +1,31 @@
+import base64
+import dataclasses
+import hashlib
+import json
 from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from uuid import uuid4
-from typing import Optional
+from typing import Callable, List, Optional, Tuple
 
+
+def utc_timestamp() -> str:
+    # Same layout as SQLite's CURRENT_TIMESTAMP plus microseconds, so
+    # timestamps from either source sort correctly as strings.
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def with_slots(cls):
+    """
+    Rebuild a dataclass with __slots__ for its fields, so instances carry
+    no per-object __dict__. dataclass(slots=True) does the same but needs
+    Python 3.10.
+    """
+    names = tuple(f.name for f in dataclasses.fields(cls))
+    namespace = {key: value for key, value in cls.__dict__.items()
+                 if key not in names and key not in ("__dict__", "__weakref__")}
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+@with_slots
 @dataclass
 class TodoItem:
     title: str
@@ -10,3 +34,100 @@ class TodoItem:
     attachment_filename: Optional[str] = None      # e.g. "image.png" or "document.pdf"
     attachment_mimetype: Optional[str] = None        # e.g. "image/png" or "application/pdf"
     attachment_data: Optional[bytes] = None          # Binary file data (BLOB)
+    created_at: str = field(default_factory=utc_timestamp)
+    attachment_hash: Optional[str] = None            # SHA-256 hex digest of attachment_data
+    attachment_size: int = 0
+
+    def set_attachment(self, data: Optional[bytes], filename: Optional[str] = None, mimetype: Optional[str] = None):
+        self.attachment_filename = filename
+        self.attachment_mimetype = mimetype
+        self.attachment_data = data
+        self.attachment_hash = None
+        self.attachment_size = 0
+        self.fill_attachment_meta()
+
+    def fill_attachment_meta(self):
+        # Items built directly (not through set_attachment) may carry bytes
+        # without their digest and size yet
+        if self.attachment_data is not None and self.attachment_hash is None:
+            self.attachment_hash = hashlib.sha256(self.attachment_data).hexdigest()
+            self.attachment_size = len(self.attachment_data)
+
+
+class AttachmentHandle:
+    """
+    Lazy reference to the attachment bytes of a todo. Nothing is read from
+    the repository until load() is called.
+    """
+
+    def __init__(self, loader: Callable[[], Optional[bytes]], size: int):
+        self._loader = loader
+        self.size = size
+
+    def load(self) -> Optional[bytes]:
+        return self._loader()
+
+
+@dataclass
+class TodoSummary:
+    """Metadata-only view of a TodoItem, used for listings."""
+    id: str
+    title: str
+    completed: bool = False
+    attachment_filename: Optional[str] = None
+    attachment_mimetype: Optional[str] = None
+    attachment_size: int = 0
+    created_at: str = ""
+    attachment_hash: Optional[str] = None
+    attachment: Optional[AttachmentHandle] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_item(cls, todo: TodoItem, loader: Callable[[], Optional[bytes]]) -> "TodoSummary":
+        size = todo.attachment_size or (len(todo.attachment_data) if todo.attachment_data else 0)
+        return cls(
+            id=todo.id,
+            title=todo.title,
+            completed=todo.completed,
+            attachment_filename=todo.attachment_filename,
+            attachment_mimetype=todo.attachment_mimetype,
+            attachment_size=size,
+            created_at=todo.created_at,
+            attachment_hash=todo.attachment_hash,
+            attachment=AttachmentHandle(loader, size) if size else None
+        )
+
+
+@dataclass
+class TodoPage:
+    """One page of a keyset-paginated listing, ordered by (created_at, id)."""
+    items: List[TodoSummary]
+    next_cursor: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TodoStats:
+    """
+    Counts over every todo in a repository, e.g. for a "3 of 120 done"
+    header. attachment_bytes sums the attachments' sizes as read back,
+    before compression or deduplication.
+    """
+    total: int = 0
+    completed: int = 0
+    with_attachment: int = 0
+    attachment_bytes: int = 0
+
+    def __add__(self, other: "TodoStats") -> "TodoStats":
+        return TodoStats(*(mine + theirs for mine, theirs in zip(dataclasses.astuple(self), dataclasses.astuple(other))))
+
+
+def encode_cursor(created_at: str, todo_id: str) -> str:
+    raw = json.dumps([created_at, todo_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, todo_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    return created_at, todo_id
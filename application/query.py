@@ -0,0 +1,167 @@
+"""
+This module provides TodoQuery, the filters, sort order and limit that
+repositories evaluate in query(), update_where() and delete_where(), so
+callers stop listing everything and filtering in Python.
+"""
+
+import dataclasses
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, TypeVar
+from application.models import TodoStats
+
+CREATED = "created"
+TITLE = "title"
+# Sort orders; a leading "-" means descending. Ties are broken by id.
+ORDERS = (CREATED, "-" + CREATED, TITLE, "-" + TITLE)
+
+# The fields update_where() may set
+UPDATABLE_FIELDS = ("title", "completed")
+
+T = TypeVar("T")
+
+
+def prefix_end(prefix: str) -> Optional[str]:
+    """
+    The smallest string sorting after every string that starts with
+    prefix, so a prefix match becomes the range [prefix, prefix_end).
+
+    :return: The bound, or None if there is none.
+    """
+    for index in range(len(prefix) - 1, -1, -1):
+        if ord(prefix[index]) < 0x10FFFF:
+            return prefix[:index] + chr(ord(prefix[index]) + 1)
+    return None
+
+
+def has_attachment(todo) -> bool:
+    # Rows written before digests were recorded only have their bytes,
+    # which summaries do not carry but count in attachment_size
+    return (
+        todo.attachment_hash is not None
+        or getattr(todo, "attachment_data", None) is not None
+        or bool(todo.attachment_size)
+    )
+
+
+def attachment_size(todo) -> int:
+    return todo.attachment_size or len(getattr(todo, "attachment_data", None) or b"")
+
+
+def count_stats(todos: Iterable) -> TodoStats:
+    """
+    Count TodoItems or TodoSummaries one by one: what stats() costs in
+    repositories without counters, and what check_stats() compares the
+    counters with.
+    """
+    total = completed = with_attachment = attachment_bytes = 0
+    for todo in todos:
+        total += 1
+        completed += bool(todo.completed)
+        if has_attachment(todo):
+            with_attachment += 1
+            attachment_bytes += attachment_size(todo)
+    return TodoStats(total, completed, with_attachment, attachment_bytes)
+
+
+def check_changes(changes: Dict[str, object]):
+    """
+    Validate the field values given to update_where().
+
+    :raises ValueError: If a field cannot be set that way, or none is given.
+    """
+    if not changes:
+        raise ValueError("Nothing to update")
+    unknown = sorted(set(changes) - set(UPDATABLE_FIELDS))
+    if unknown:
+        raise ValueError(f"Cannot update {', '.join(unknown)} by query")
+    if "completed" in changes and not isinstance(changes["completed"], bool):
+        raise ValueError("completed must be True or False")
+    if "title" in changes and not isinstance(changes["title"], str):
+        raise ValueError("title must be a string")
+
+
+def needs_change(todo, changes: Dict[str, object]) -> bool:
+    """Whether a todo differs from any of the values update_where() sets."""
+    return any(getattr(todo, name) != value for name, value in changes.items())
+
+
+@dataclass(frozen=True)
+class TodoQuery:
+    """
+    A filter over todos with a sort order and an optional limit. Filters
+    left as None match everything; the ones given must all match.
+
+    mimetype matches exactly, or as a prefix if it ends in "/" (e.g.
+    "image/"). title_prefix is case-sensitive. created_from is inclusive
+    and created_to exclusive, both in the created_at string format.
+    """
+    completed: Optional[bool] = None
+    has_attachment: Optional[bool] = None
+    mimetype: Optional[str] = None
+    title_prefix: Optional[str] = None
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
+    ids: Optional[FrozenSet[str]] = None
+    order: str = CREATED
+    limit: Optional[int] = None
+
+    def __post_init__(self):
+        if self.order not in ORDERS:
+            raise ValueError(f"Invalid order: {self.order} (use one of {', '.join(ORDERS)})")
+        if self.limit is not None and self.limit < 0:
+            raise ValueError("limit must not be negative")
+        if self.ids is not None and not isinstance(self.ids, frozenset):
+            object.__setattr__(self, "ids", frozenset(self.ids))
+
+    @property
+    def descending(self) -> bool:
+        return self.order.startswith("-")
+
+    @property
+    def sort_field(self) -> str:
+        # The TodoItem field sorted on
+        return "created_at" if self.order.lstrip("-") == CREATED else "title"
+
+    @property
+    def mimetype_prefix(self) -> bool:
+        return self.mimetype is not None and self.mimetype.endswith("/")
+
+    def with_limit(self, limit: Optional[int]) -> "TodoQuery":
+        return dataclasses.replace(self, limit=limit)
+
+    def matches(self, todo) -> bool:
+        """
+        Whether a TodoItem or TodoSummary passes every filter.
+
+        :param todo: The todo to test.
+        """
+        if self.ids is not None and todo.id not in self.ids:
+            return False
+        if self.completed is not None and todo.completed != self.completed:
+            return False
+        if self.has_attachment is not None and has_attachment(todo) != self.has_attachment:
+            return False
+        if self.mimetype is not None:
+            mimetype = todo.attachment_mimetype or ""
+            if not (mimetype.startswith(self.mimetype) if self.mimetype_prefix else mimetype == self.mimetype):
+                return False
+        if self.title_prefix is not None and not todo.title.startswith(self.title_prefix):
+            return False
+        if self.created_from is not None and todo.created_at < self.created_from:
+            return False
+        if self.created_to is not None and todo.created_at >= self.created_to:
+            return False
+        return True
+
+    def sort_key(self, todo):
+        return getattr(todo, self.sort_field), todo.id
+
+    def apply(self, todos: Iterable[T]) -> List[T]:
+        """
+        Filter, sort and limit todos held in memory.
+
+        :param todos: TodoItems or TodoSummaries.
+        :return: The matching todos in query order.
+        """
+        matching = sorted((todo for todo in todos if self.matches(todo)), key=self.sort_key, reverse=self.descending)
+        return matching if self.limit is None else matching[:self.limit]
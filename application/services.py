@@ -1,36 +1,143 @@
-import os
-import mimetypes
-from application.models import TodoItem
-from domain.interfaces import ITodoRepository
+import asyncio
+import dataclasses
+import functools
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from application.attachments import AttachmentStream, check_attachment_size
+from application.changes import ChangeFeed
+from application.jobs import Job, JobQueue
+from application.metrics import MetricsRegistry, measured
+from application.models import TodoItem, TodoPage, TodoStats, TodoSummary, decode_cursor, encode_cursor
+from application.query import CREATED, TodoQuery
+from domain.interfaces import IAsyncTodoRepository, ITodoRepository
+
+def apply_changes(
+    todo: TodoItem,
+    title: str = None,
+    attachment_data: bytes = None,
+    attachment_filename: str = None,
+    attachment_mimetype: str = None,
+    completed: bool = None
+):
+    # Fields left as None keep their current value
+    if title is not None:
+        todo.title = title
+    if attachment_data:
+        check_attachment_size(len(attachment_data))
+        todo.set_attachment(attachment_data, attachment_filename, attachment_mimetype)
+    if completed is not None:
+        todo.completed = completed
+
+def _page_query(query: TodoQuery, cursor: Optional[str], fetch: int) -> TodoQuery:
+    """
+    The query fetching a page of query in creation order after cursor: it
+    starts at the cursor's created_at, so todos up to the cursor are
+    fetched again and skipped by _cut_page().
+    """
+    created_from = decode_cursor(cursor)[0] if cursor else query.created_from
+    return dataclasses.replace(query, created_from=created_from, order=CREATED, limit=fetch)
+
+
+def _cut_page(found: List[TodoSummary], cursor: Optional[str], limit: int, fetch: int) -> Optional[TodoPage]:
+    """
+    The page after cursor among the todos fetched with _page_query(), by
+    (created_at, id). None if too many of them were skipped and a larger
+    fetch is needed, which only happens when many todos share one
+    created_at.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    todos = [todo for todo in found if after is None or (todo.created_at, todo.id) > tuple(after)]
+    if len(todos) <= limit and len(found) == fetch:
+        return None
+    if len(todos) <= limit:
+        return TodoPage(items=todos)
+    last = todos[limit - 1]
+    return TodoPage(items=todos[:limit], next_cursor=encode_cursor(last.created_at, last.id))
+
+# Called with a todo once its new attachment is stored, e.g. to render a
+# thumbnail; runs as part of the background attachment job
+AttachmentProcessor = Callable[[TodoItem], None]
+
+def store_attachment(repository: ITodoRepository, todo_id: str, open_stream: Callable[[], AttachmentStream]) -> TodoItem:
+    # The first step of an attachment job. A retry opens the stream again,
+    # since a stream can only be read once.
+    return repository.write_attachment(todo_id, open_stream())
+
+def run_processors(processors: Sequence[AttachmentProcessor], todo: TodoItem) -> TodoItem:
+    # The second step, retried on its own, so a failing thumbnail does not
+    # store the attachment again
+    for processor in processors:
+        processor(todo)
+    return todo
+
+def submit_attachment(
+    jobs: Optional[JobQueue],
+    repository: ITodoRepository,
+    todo_id: str,
+    open_stream: Callable[[], AttachmentStream],
+    processors: Sequence[AttachmentProcessor]
+) -> Job:
+    if jobs is None:
+        raise RuntimeError("No job queue to store attachments in the background")
+    then = [functools.partial(run_processors, list(processors))] if processors else []
+    return jobs.submit("attachment", store_attachment, repository, todo_id, open_stream, todo_id=todo_id, then=then)
 
 class TodoService:
-    def __init__(self, repository: ITodoRepository):
+    def __init__(
+        self,
+        repository: ITodoRepository,
+        metrics: Optional[MetricsRegistry] = None,
+        changes: Optional[ChangeFeed] = None,
+        jobs: Optional[JobQueue] = None,
+        attachment_processors: Sequence[AttachmentProcessor] = ()
+    ):
         self.repository = repository
+        # Every public method is recorded under layer "service" when set
+        self.metrics = metrics
+        # The feed a ChangeFeedTodoRepo in the repository stack publishes
+        # to, for callers that follow changes made by others
+        self.changes = changes
+        # Runs attach_in_background() jobs, followed by the processors
+        self.jobs = jobs
+        self.attachment_processors = list(attachment_processors)
 
-    def create_todo(self, title: str, attachment_data: bytes = None, **kwargs):
+    @staticmethod
+    def validate_title(title: str):
         if len(title) > 100:
             raise ValueError("Title too long")
+
+    @measured
+    def create_todo(self, title: str, attachment_data: bytes = None, **kwargs):
+        self.validate_title(title)
         return self.repository.add(TodoItem(title=title, **kwargs))
     
+    @measured
     def add_todo(
         self,
         title: str,
         attachment_path: str = None,
         attachment_data: bytes = None,
         attachment_filename: str = None,
-        attachment_mimetype: str = None
+        attachment_mimetype: str = None,
+        attachment_stream: AttachmentStream = None,
+        completed: bool = False
     ) -> TodoItem:
+        # Files and uploads are streamed into the repository chunk by chunk;
+        # only bytes the caller already holds are stored in one piece
         if attachment_path and not attachment_data:
-            if os.path.getsize(attachment_path) > 5 * 1024 * 1024:
-                raise ValueError("File too large. Maximum allowed size is 5MB.")
-            attachment_filename = os.path.basename(attachment_path)
-            attachment_mimetype, _ = mimetypes.guess_type(attachment_path)
-            with open(attachment_path, "rb") as f:
-                attachment_data = f.read()
-        if attachment_data and len(attachment_data) > 5 * 1024 * 1024:
-            raise ValueError("File too large. Maximum allowed size is 5MB.")
+            attachment_stream = AttachmentStream.from_path(attachment_path)
+        if attachment_stream is not None:
+            todo = self.repository.add(TodoItem(title=title, completed=completed))
+            try:
+                return self.repository.write_attachment(todo.id, attachment_stream)
+            except BaseException:
+                self.repository.delete(todo.id)
+                raise
+        if attachment_data:
+            check_attachment_size(len(attachment_data))
         todo = TodoItem(
             title=title,
+            completed=completed,
             attachment_filename=attachment_filename,
             attachment_mimetype=attachment_mimetype,
             attachment_data=attachment_data
@@ -38,6 +145,7 @@ class TodoService:
         self.repository.add(todo)
         return todo
 
+    @measured
     def update_todo(
         self,
         todo_id: str,
@@ -46,33 +154,322 @@ class TodoService:
         attachment_data: bytes = None,
         attachment_filename: str = None,
         attachment_mimetype: str = None,
-        completed: bool = None
+        completed: bool = None,
+        attachment_stream: AttachmentStream = None
     ):
+        if attachment_path and not attachment_data:
+            attachment_stream = AttachmentStream.from_path(attachment_path)
+        if attachment_stream is not None:
+            todo = self.repository.write_attachment(todo_id, attachment_stream)
+            if title is None and completed is None:
+                return todo
         todo = self.repository.get(todo_id)
         if not todo:
             raise ValueError("Todo not found")
-        if title is not None:
-            todo.title = title
-        if attachment_path or attachment_data:
-            if attachment_path and not attachment_data:
-                if os.path.getsize(attachment_path) > 5 * 1024 * 1024:
-                    raise ValueError("File too large. Maximum allowed size is 5MB.")
-                attachment_filename = os.path.basename(attachment_path)
-                attachment_mimetype, _ = mimetypes.guess_type(attachment_path)
-                with open(attachment_path, "rb") as f:
-                    attachment_data = f.read()
-            if attachment_data and len(attachment_data) > 5 * 1024 * 1024:
-                raise ValueError("File too large. Maximum allowed size is 5MB.")
-            todo.attachment_filename = attachment_filename
-            todo.attachment_mimetype = attachment_mimetype
-            todo.attachment_data = attachment_data
-        if completed is not None:
-            todo.completed = completed
+        apply_changes(todo, title, attachment_data, attachment_filename, attachment_mimetype, completed)
         self.repository.update(todo)
         return todo
 
+    def attach_in_background(self, todo_id: str, open_stream: Callable[[], AttachmentStream]) -> Job:
+        # Stores the attachment and runs the attachment processors on the
+        # job queue; the returned job resolves with the updated todo
+        return submit_attachment(self.jobs, self.repository, todo_id, open_stream, self.attachment_processors)
+
+    @measured
+    def get_todo(self, todo_id: str) -> Optional[TodoItem]:
+        return self.repository.get(todo_id)
+
+    @measured
     def delete_todo(self, todo_id: str):
         self.repository.delete(todo_id)
 
-    def list_todos(self):
-        return self.repository.list_all()
+    # The *_queued variants return without waiting for a group commit
+    # writer to commit the write, together with a future that resolves
+    # once it is committed, or with its error
+
+    @measured
+    def add_todo_queued(self, title: str, completed: bool = False) -> Tuple[TodoItem, Future]:
+        todo = TodoItem(title=title, completed=completed)
+        return todo, self.repository.add_queued(todo)
+
+    @measured
+    def update_todo_queued(self, todo_id: str, title: str = None, completed: bool = None) -> Tuple[TodoItem, Future]:
+        todo = self.repository.get(todo_id)
+        if not todo:
+            raise ValueError("Todo not found")
+        apply_changes(todo, title, completed=completed)
+        return todo, self.repository.update_queued(todo)
+
+    @measured
+    def delete_todo_queued(self, todo_id: str) -> Future:
+        return self.repository.delete_queued(todo_id)
+
+    # Bulk variants write each batch with a single repository call, i.e. one
+    # transaction for SQLite and one save for the file repository.
+
+    @measured
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        for todo in todos:
+            self.validate_title(todo.title)
+        return self.repository.add_many(todos)
+
+    @measured
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        for todo in todos:
+            self.validate_title(todo.title)
+        return self.repository.update_many(todos)
+
+    @measured
+    def delete_many(self, todo_ids: Iterable[str]):
+        self.repository.delete_many(todo_ids)
+
+    @measured
+    def list_todos(self, with_attachments: bool = False):
+        # Listings are metadata-only by default; attachment bytes are fetched
+        # lazily through each summary's attachment handle.
+        if with_attachments:
+            return self.repository.list_all()
+        return self.repository.list_summaries()
+
+    @measured
+    def list_todos_page(self, cursor: str = None, limit: int = 50):
+        return self.repository.list_page(cursor, limit)
+
+    @measured
+    def search_todos(self, query: str, limit: int = 20):
+        return self.repository.search(query, limit)
+
+    # Queries filter, sort and write in the repository, using its indexes
+
+    @measured
+    def query_todos(self, query: TodoQuery) -> List[TodoSummary]:
+        return self.repository.query(query)
+
+    @measured
+    def query_todos_page(self, query: TodoQuery, cursor: str = None, limit: int = 50) -> TodoPage:
+        # Keyset pages over (created_at, id), so todos sharing a created_at
+        # are neither repeated nor skipped; query's order and limit are ignored
+        fetch = limit + 1
+        while True:
+            page = _cut_page(self.repository.query(_page_query(query, cursor, fetch)), cursor, limit, fetch)
+            if page is not None:
+                return page
+            fetch *= 2
+
+    @measured
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        if "title" in changes:
+            self.validate_title(changes["title"])
+        return self.repository.update_where(query, **changes)
+
+    @measured
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        return self.repository.delete_where(query)
+
+    # Counts come from counters the repository keeps up to date on every
+    # write, not from listing the todos
+
+    @measured
+    def stats(self) -> TodoStats:
+        return self.repository.stats()
+
+    @measured
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        return self.repository.check_stats(repair)
+
+    @measured
+    def get_attachment(self, todo_id: str):
+        return self.repository.get_attachment(todo_id)
+
+    @measured
+    def iter_attachment(self, todo_id: str) -> Iterator[bytes]:
+        return self.repository.iter_attachment(todo_id)
+
+    def close(self):
+        self.repository.close()
+
+
+class AsyncTodoService:
+    """
+    Coroutine version of TodoService for asyncio callers such as the Flet
+    UI. Attachment files are streamed by the repository, off the event loop.
+    """
+
+    def __init__(
+        self,
+        repository: IAsyncTodoRepository,
+        metrics: Optional[MetricsRegistry] = None,
+        changes: Optional[ChangeFeed] = None,
+        jobs: Optional[JobQueue] = None,
+        attachment_processors: Sequence[AttachmentProcessor] = ()
+    ):
+        self.repository = repository
+        self.metrics = metrics
+        self.changes = changes
+        self.jobs = jobs
+        self.attachment_processors = list(attachment_processors)
+
+    @measured
+    async def add_todo(
+        self,
+        title: str,
+        attachment_path: str = None,
+        attachment_data: bytes = None,
+        attachment_filename: str = None,
+        attachment_mimetype: str = None,
+        attachment_stream: AttachmentStream = None,
+        completed: bool = False
+    ) -> TodoItem:
+        if attachment_path and not attachment_data:
+            attachment_stream = AttachmentStream.from_path(attachment_path)
+        if attachment_stream is not None:
+            todo = await self.repository.add(TodoItem(title=title, completed=completed))
+            try:
+                return await self.repository.write_attachment(todo.id, attachment_stream)
+            except BaseException:
+                await self.repository.delete(todo.id)
+                raise
+        if attachment_data:
+            check_attachment_size(len(attachment_data))
+        todo = TodoItem(
+            title=title,
+            completed=completed,
+            attachment_filename=attachment_filename,
+            attachment_mimetype=attachment_mimetype,
+            attachment_data=attachment_data
+        )
+        await self.repository.add(todo)
+        return todo
+
+    @measured
+    async def update_todo(
+        self,
+        todo_id: str,
+        title: str = None,
+        attachment_path: str = None,
+        attachment_data: bytes = None,
+        attachment_filename: str = None,
+        attachment_mimetype: str = None,
+        completed: bool = None,
+        attachment_stream: AttachmentStream = None
+    ):
+        if attachment_path and not attachment_data:
+            attachment_stream = AttachmentStream.from_path(attachment_path)
+        if attachment_stream is not None:
+            todo = await self.repository.write_attachment(todo_id, attachment_stream)
+            if title is None and completed is None:
+                return todo
+        todo = await self.repository.get(todo_id)
+        if not todo:
+            raise ValueError("Todo not found")
+        apply_changes(todo, title, attachment_data, attachment_filename, attachment_mimetype, completed)
+        await self.repository.update(todo)
+        return todo
+
+    def attach_in_background(self, todo_id: str, open_stream: Callable[[], AttachmentStream]) -> Job:
+        # Job workers call the blocking repository the async adapter wraps;
+        # await asyncio.wrap_future(job.future) for the updated todo
+        return submit_attachment(self.jobs, self.repository.repository, todo_id, open_stream, self.attachment_processors)
+
+    @measured
+    async def get_todo(self, todo_id: str) -> Optional[TodoItem]:
+        return await self.repository.get(todo_id)
+
+    @measured
+    async def delete_todo(self, todo_id: str):
+        await self.repository.delete(todo_id)
+
+    @measured
+    async def add_todo_queued(self, title: str, completed: bool = False) -> Tuple[TodoItem, asyncio.Future]:
+        todo = TodoItem(title=title, completed=completed)
+        return todo, await self.repository.add_queued(todo)
+
+    @measured
+    async def update_todo_queued(
+        self, todo_id: str, title: str = None, completed: bool = None
+    ) -> Tuple[TodoItem, asyncio.Future]:
+        todo = await self.repository.get(todo_id)
+        if not todo:
+            raise ValueError("Todo not found")
+        apply_changes(todo, title, completed=completed)
+        return todo, await self.repository.update_queued(todo)
+
+    @measured
+    async def delete_todo_queued(self, todo_id: str) -> asyncio.Future:
+        return await self.repository.delete_queued(todo_id)
+
+    @measured
+    async def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        for todo in todos:
+            TodoService.validate_title(todo.title)
+        return await self.repository.add_many(todos)
+
+    @measured
+    async def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        for todo in todos:
+            TodoService.validate_title(todo.title)
+        return await self.repository.update_many(todos)
+
+    @measured
+    async def delete_many(self, todo_ids: Iterable[str]):
+        await self.repository.delete_many(todo_ids)
+
+    @measured
+    async def list_todos(self, with_attachments: bool = False):
+        if with_attachments:
+            return await self.repository.list_all()
+        return await self.repository.list_summaries()
+
+    @measured
+    async def list_todos_page(self, cursor: str = None, limit: int = 50):
+        return await self.repository.list_page(cursor, limit)
+
+    @measured
+    async def search_todos(self, query: str, limit: int = 20):
+        return await self.repository.search(query, limit)
+
+    @measured
+    async def query_todos(self, query: TodoQuery) -> List[TodoSummary]:
+        return await self.repository.query(query)
+
+    @measured
+    async def query_todos_page(self, query: TodoQuery, cursor: str = None, limit: int = 50) -> TodoPage:
+        fetch = limit + 1
+        while True:
+            page = _cut_page(await self.repository.query(_page_query(query, cursor, fetch)), cursor, limit, fetch)
+            if page is not None:
+                return page
+            fetch *= 2
+
+    @measured
+    async def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        if "title" in changes:
+            TodoService.validate_title(changes["title"])
+        return await self.repository.update_where(query, **changes)
+
+    @measured
+    async def delete_where(self, query: TodoQuery) -> List[str]:
+        return await self.repository.delete_where(query)
+
+    @measured
+    async def stats(self) -> TodoStats:
+        return await self.repository.stats()
+
+    @measured
+    async def get_attachment(self, todo_id: str):
+        return await self.repository.get_attachment(todo_id)
+
+    @measured
+    def iter_attachment(self, todo_id: str) -> AsyncIterator[bytes]:
+        return self.repository.iter_attachment(todo_id)
+
+    def summarize(self, todo: TodoItem) -> TodoSummary:
+        # The summary's attachment handle loads lazily, like those of listed summaries
+        return TodoSummary.from_item(todo, self.repository.attachment_loader(todo.id))
+
+    async def close(self):
+        await self.repository.close()
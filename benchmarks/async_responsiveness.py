@@ -0,0 +1,98 @@
+"""
+Measure how long the event loop stalls while large attachments are
+written, with blocking service calls made on the loop against the
+AsyncTodoService running them on an executor.
+
+A ticker coroutine stands in for every other Flet session: it wakes up
+every few milliseconds and records how late it was woken. Meanwhile
+writer sessions add todos with large attachments to SQLite.
+
+    python -m benchmarks.async_responsiveness --writers 8 --adds 5 --size-mb 5
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from application.services import AsyncTodoService, TodoService
+from infrastructure.async_repo import ExecutorTodoRepo
+from infrastructure.blob_store import BlobStore
+from infrastructure.sqlite_pool import SQLiteConnectionPool
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+from benchmarks.sqlite_concurrency import percentile
+
+TICK = 0.005
+
+
+async def ticker(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+
+async def blocking_writer(service: TodoService, adds: int, payload: bytes):
+    # What a handler calling the synchronous service does: the insert runs
+    # on the loop thread and nothing else is served until it returns
+    for i in range(adds):
+        service.add_todo(f"Blocking {i}", attachment_data=payload, attachment_filename="big.bin")
+        await asyncio.sleep(0)
+
+
+async def async_writer(service: AsyncTodoService, adds: int, payload: bytes):
+    for i in range(adds):
+        await service.add_todo(f"Async {i}", attachment_data=payload, attachment_filename="big.bin")
+
+
+async def scenario(writer, service, args, payloads):
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(service, args.adds, payload) for payload in payloads))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    return lags, elapsed
+
+
+def report(name, lags, elapsed, writes):
+    print(
+        f"{name:>9}: {writes} writes in {elapsed:.2f}s, loop lag "
+        f"p50={percentile(lags, 0.50) * 1000:7.2f}ms "
+        f"p99={percentile(lags, 0.99) * 1000:7.2f}ms "
+        f"max={max(lags) * 1000:7.2f}ms ({len(lags)} ticks)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8, help="Concurrent sessions adding attachments")
+    parser.add_argument("--adds", type=int, default=5, help="Attachments added per session")
+    parser.add_argument("--size-mb", type=float, default=5, help="Attachment size in MB")
+    parser.add_argument("--workers", type=int, default=4, help="Executor threads")
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    writes = args.writers * args.adds
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("blocking", "async"):
+            # Distinct payloads so the blob store cannot deduplicate them
+            payloads = [os.urandom(size) for _ in range(args.writers)]
+            pool = SQLiteConnectionPool(os.path.join(directory, f"{name}.db"), max_size=args.workers)
+            repo = SQLiteTodoRepo(blob_store=BlobStore(os.path.join(directory, f"{name}-uploads")), pool=pool)
+            if name == "blocking":
+                lags, elapsed = asyncio.run(scenario(blocking_writer, TodoService(repo), args, payloads))
+            else:
+                service = AsyncTodoService(ExecutorTodoRepo(repo, max_workers=args.workers))
+                lags, elapsed = asyncio.run(scenario(async_writer, service, args, payloads))
+                service.repository.executor.shutdown()
+            report(name, lags, elapsed, writes)
+            repo.blob_store.close()
+            pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Measure what attachment compression saves and what it costs in CPU.
+
+A corpus of typical attachments (text notes, CSV, JSON, a PDF-like mix of
+text and compressed streams, a PNG and random bytes) is run through the
+codec policy, reporting the stored size and the encode and decode CPU
+time per MB of each. The corpus is then streamed into a SQLite
+repository and read back twice, compressed and after
+`recompress(decompress=True)`, to compare database size and read cost.
+
+    python -m benchmarks.compression --mb 4 --copies 20
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import zlib
+from application.attachments import AttachmentStream
+from application.models import TodoItem
+from infrastructure.attachment_codec import decode, encode
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+WORDS = ("todo review report budget meeting notes draft client invoice schedule "
+         "deadline release plan follow up call summary action item owner status").split()
+
+
+def text(rng: random.Random, size: int) -> bytes:
+    lines, out = [], 0
+    while out < size:
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 14))) + ".\n")
+        out += len(lines[-1])
+    return "".join(lines).encode()[:size]
+
+
+def csv_rows(rng: random.Random, size: int) -> bytes:
+    rows, out = ["id,title,amount,date\n"], 0
+    while out < size:
+        rows.append(f"{len(rows)},{rng.choice(WORDS)} {rng.choice(WORDS)},{rng.uniform(0, 10000):.2f},"
+                    f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}\n")
+        out += len(rows[-1])
+    return "".join(rows).encode()[:size]
+
+
+def json_records(rng: random.Random, size: int) -> bytes:
+    out, records = 0, []
+    while out < size:
+        record = {"id": len(records), "title": " ".join(rng.choices(WORDS, k=4)),
+                  "completed": rng.random() < 0.5, "tags": rng.sample(WORDS, 3)}
+        records.append(record)
+        out += 80
+    return json.dumps(records, indent=2).encode()[:size]
+
+
+def pdf_like(rng: random.Random, size: int) -> bytes:
+    # Text objects between already deflated streams, as in most PDFs
+    parts, out = [b"%PDF-1.7\n"], 9
+    while out < size:
+        part = b"obj << /Type /Page /Contents " + text(rng, 600) + b" >> stream\n" + \
+            zlib.compress(rng.randbytes(2000)) + b"\nendstream\n"
+        parts.append(part)
+        out += len(part)
+    return b"".join(parts)[:size]
+
+
+def corpus(mb: float, seed: int = 0):
+    rng = random.Random(seed)
+    size = int(mb * 1024 * 1024)
+    return [
+        ("notes.txt", "text/plain", text(rng, size)),
+        ("export.csv", "text/csv", csv_rows(rng, size)),
+        ("todos.json", "application/json", json_records(rng, size)),
+        ("scan.pdf", "application/pdf", pdf_like(rng, size)),
+        ("photo.png", "image/png", b"\x89PNG\r\n\x1a\n" + os.urandom(size - 8)),
+        ("backup.bin", "application/octet-stream", os.urandom(size)),
+    ]
+
+
+def cpu_ms(call, repeat: int = 3):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        result = call()
+        elapsed = (time.process_time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def codec_table(files):
+    print(f"{'file':>12} {'raw MB':>8} {'stored MB':>10} {'ratio':>6} {'codec':>6} {'encode ms/MB':>13} {'decode ms/MB':>13}")
+    raw_total = stored_total = 0
+    for filename, mimetype, data in files:
+        mb = len(data) / 1024 / 1024
+        encode_ms, (stored, codec) = cpu_ms(lambda: encode(mimetype, data))
+        decode_ms, _ = cpu_ms(lambda: decode(codec, stored))
+        raw_total += len(data)
+        stored_total += len(stored)
+        print(f"{filename:>12} {mb:8.2f} {len(stored) / 1024 / 1024:10.2f} {len(data) / len(stored):6.2f} "
+              f"{codec or '-':>6} {encode_ms / mb:13.1f} {decode_ms / mb:13.1f}")
+    print(f"{'total':>12} {raw_total / 1024 / 1024:8.2f} {stored_total / 1024 / 1024:10.2f} "
+          f"{raw_total / stored_total:6.2f}")
+
+
+def database_size(path: str) -> int:
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def read_all(repo: SQLiteTodoRepo, ids):
+    return sum(len(chunk) for todo_id in ids for chunk in repo.iter_attachment(todo_id))
+
+
+def repository_table(files, copies: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "todos.db")
+        repo = SQLiteTodoRepo(path)
+        ids = []
+        start = time.process_time()
+        for copy in range(copies):
+            for filename, mimetype, data in files:
+                todo = repo.add(TodoItem(title=f"{filename} {copy}"))
+                repo.write_attachment(todo.id, AttachmentStream.from_bytes(data, filename, mimetype))
+                ids.append(todo.id)
+        write_ms = (time.process_time() - start) * 1000
+        compressed_read_ms, raw_bytes = cpu_ms(lambda: read_all(repo, ids), repeat=1)
+        with repo.pool.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        compressed_size = database_size(path)
+
+        start = time.process_time()
+        repo.recompress(decompress=True)
+        decompress_ms = (time.process_time() - start) * 1000
+        raw_read_ms, _ = cpu_ms(lambda: read_all(repo, ids), repeat=1)
+        with repo.pool.connection() as conn:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        raw_size = database_size(path)
+        repo.close()
+
+    mb = raw_bytes / 1024 / 1024
+    print(f"\nSQLite, {len(ids)} streamed attachments, {mb:.1f}MB:")
+    print(f"  compressed:   {compressed_size / 1024 / 1024:8.1f}MB on disk, write {write_ms / mb:6.1f} CPU ms/MB, "
+          f"read {compressed_read_ms / mb:6.1f} CPU ms/MB")
+    print(f"  uncompressed: {raw_size / 1024 / 1024:8.1f}MB on disk, read {raw_read_ms / mb:6.1f} CPU ms/MB "
+          f"(recompress --decompress took {decompress_ms / 1000:.1f}s CPU)")
+    print(f"  saved {1 - compressed_size / raw_size:.0%} of the database for "
+          f"{(compressed_read_ms - raw_read_ms) / mb:+.1f} CPU ms/MB on reads")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mb", type=float, default=4, help="Size of each corpus file in MB")
+    parser.add_argument("--copies", type=int, default=5, help="Copies of the corpus stored in the repository")
+    args = parser.parse_args()
+
+    files = corpus(args.mb)
+    codec_table(files)
+    repository_table(files, args.copies)
+
+
+if __name__ == "__main__":
+    main()
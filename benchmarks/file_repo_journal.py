@@ -0,0 +1,60 @@
+"""
+Compare FileTodoRepo write cost in snapshot mode (whole-file rewrite on
+every mutation) against journal mode (one appended record per mutation).
+
+    python -m benchmarks.file_repo_journal --count 2000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from application.models import TodoItem
+from infrastructure.file_repo import FileTodoRepo
+
+
+def run(journal: bool, count: int, directory: str) -> dict:
+    path = os.path.join(directory, f"todos_{'journal' if journal else 'snapshot'}.json")
+    repo = FileTodoRepo(path, journal=journal)
+    todos = [TodoItem(title=f"Task {i}") for i in range(count)]
+
+    start = time.perf_counter()
+    for todo in todos:
+        repo.add(todo)
+    add_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for todo in todos:
+        todo.completed = True
+        repo.update(todo)
+    update_seconds = time.perf_counter() - start
+
+    repo.close()
+    start = time.perf_counter()
+    FileTodoRepo(path, journal=journal).close()
+    load_seconds = time.perf_counter() - start
+
+    return {
+        "mode": "journal" if journal else "snapshot",
+        "add_per_sec": count / add_seconds,
+        "update_per_sec": count / update_seconds,
+        "load_seconds": load_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="Number of todos to write")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for journal in (False, True):
+            result = run(journal, args.count, directory)
+            print(
+                f"{result['mode']:>8}: {result['add_per_sec']:10.0f} adds/s "
+                f"{result['update_per_sec']:10.0f} updates/s "
+                f"load {result['load_seconds'] * 1000:8.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
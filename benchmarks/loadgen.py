@@ -0,0 +1,248 @@
+"""
+Load-test a running API server with a mixed workload and report request
+rates and latency percentiles.
+
+Start the server first (python main.py serve). Each of --concurrency
+clients keeps one connection open and sends requests back to back,
+picking each from the --mix weights:
+
+    list      GET /todos?limit=20
+    get       GET /todos/<id> of a random known todo
+    create    POST /todos
+    toggle    PATCH /todos/<id> flipping completed
+    delete    DELETE /todos/<id> of a todo this run created
+    attach    PUT /todos/<id>/attachment of --attachment-kb bytes
+    download  GET /todos/<id>/attachment of a todo attached above
+
+Before the clock starts, --seed-todos todos are created for get and
+toggle to work on. Todos the run creates are deleted afterwards.
+
+    python -m benchmarks.loadgen --concurrency 64 --duration 30
+    python main.py loadgen --mix get=80,toggle=20 --requests 50000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from benchmarks.sqlite_concurrency import percentile
+
+DEFAULT_MIX = "list=20,get=40,create=15,toggle=15,delete=5,attach=3,download=2"
+OPS = ("list", "get", "create", "toggle", "delete", "attach", "download")
+
+
+class Connection:
+    """A minimal HTTP/1.1 client over one keep-alive connection."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      content_type: str = "application/json") -> Tuple[int, bytes]:
+        """
+        Send a request and read the whole response. A connection the
+        server closed is opened again first.
+
+        :return: The status and the response body.
+        """
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        if body:
+            head += f"Content-Type: {content_type}\r\n"
+        self._writer.write(head.encode("latin-1") + b"\r\n" + body)
+        try:
+            response_head = await self._reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise ConnectionError("Server closed the connection")
+        lines = response_head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = await self._reader.readexactly(int(headers.get("content-length", "0")))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, data
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Workload:
+    """The todos known to the clients, shared by all of them."""
+
+    def __init__(self, rng: random.Random, attachment: bytes):
+        self.rng = rng
+        self.attachment = attachment
+        self.ids: List[str] = []
+        # Created by this run, so safe to delete
+        self.created: List[str] = []
+        self.attached: List[str] = []
+
+    def pick(self, ids: List[str]) -> Optional[str]:
+        return self.rng.choice(ids) if ids else None
+
+    def take(self, ids: List[str]) -> Optional[str]:
+        # Removed from the pool so no other client deletes it too
+        if not ids:
+            return None
+        index = self.rng.randrange(len(ids))
+        ids[index], ids[-1] = ids[-1], ids[index]
+        return ids.pop()
+
+    def forget(self, todo_id: str):
+        for ids in (self.ids, self.attached):
+            if todo_id in ids:
+                ids.remove(todo_id)
+
+    async def run(self, conn: Connection, op: str) -> int:
+        """Send the request of one operation and return its status."""
+        if op == "list":
+            return (await conn.request("GET", "/todos?limit=20"))[0]
+        if op == "create":
+            status, data = await conn.request("POST", "/todos", json.dumps({"title": "Load test todo"}).encode())
+            if status == 201:
+                todo_id = json.loads(data)["id"]
+                self.ids.append(todo_id)
+                self.created.append(todo_id)
+            return status
+        if op == "delete":
+            todo_id = self.take(self.created)
+            if todo_id is None:
+                return await self.run(conn, "create")
+            self.forget(todo_id)
+            return (await conn.request("DELETE", f"/todos/{todo_id}"))[0]
+        if op == "download":
+            todo_id = self.pick(self.attached)
+            if todo_id is None:
+                return await self.run(conn, "attach")
+            return (await conn.request("GET", f"/todos/{todo_id}/attachment"))[0]
+        todo_id = self.pick(self.ids)
+        if todo_id is None:
+            return await self.run(conn, "create")
+        if op == "get":
+            return (await conn.request("GET", f"/todos/{todo_id}"))[0]
+        if op == "toggle":
+            body = json.dumps({"completed": self.rng.random() < 0.5}).encode()
+            return (await conn.request("PATCH", f"/todos/{todo_id}", body))[0]
+        status, _ = await conn.request(
+            "PUT", f"/todos/{todo_id}/attachment?filename=load.bin", self.attachment, "application/octet-stream"
+        )
+        # Unless a delete took it meanwhile
+        if status == 200 and todo_id in self.ids and todo_id not in self.attached:
+            self.attached.append(todo_id)
+        return status
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPS:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r} (use {', '.join(OPS)})")
+        try:
+            mix[op] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight of {op} is not a number")
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("the weights must not all be 0")
+    return mix
+
+
+async def client(workload: Workload, conn: Connection, mix: Dict[str, float], deadline: float, budget: List[int],
+                 latencies, errors):
+    ops, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline and budget[0] != 0:
+        budget[0] -= 1
+        op = workload.rng.choices(ops, weights)[0]
+        start = time.perf_counter()
+        try:
+            status = await workload.run(conn, op)
+        except (ConnectionError, OSError, ValueError) as err:
+            status = None
+            errors[op].append(str(err) or type(err).__name__)
+        latencies[op].append(time.perf_counter() - start)
+        if status is not None and status >= 400:
+            errors[op].append(f"HTTP {status}")
+    conn.close()
+
+
+async def run(args) -> None:
+    url = urlsplit(args.url)
+    host, port = url.hostname or "127.0.0.1", url.port or 80
+    rng = random.Random(args.seed)
+    workload = Workload(rng, rng.randbytes(args.attachment_kb * 1024))
+    setup = Connection(host, port)
+    for _ in range(args.seed_todos):
+        await workload.run(setup, "create")
+
+    latencies, errors = defaultdict(list), defaultdict(list)
+    # Requests left to send, shared by the clients; -1 means no limit
+    budget = [args.requests if args.requests else -1]
+    start = time.perf_counter()
+    deadline = start + (args.duration if not args.requests else float("inf"))
+    await asyncio.gather(*(
+        client(workload, Connection(host, port), args.mix, deadline, budget, latencies, errors)
+        for _ in range(args.concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+
+    # Leave the server as it was found
+    for todo_id in workload.created:
+        await setup.request("DELETE", f"/todos/{todo_id}")
+    setup.close()
+
+    total = sum(len(samples) for samples in latencies.values())
+    failed = sum(len(found) for found in errors.values())
+    print(f"{args.concurrency} clients, {total} requests in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} requests/s), {failed} errors")
+    everything = [sample for samples in latencies.values() for sample in samples]
+    for op, samples in sorted(latencies.items()) + [("all", everything)]:
+        if not samples:
+            continue
+        print(
+            f"{op:>10}: n={len(samples):7d} {len(samples) / elapsed:7.0f}/s "
+            f"p50={percentile(samples, 0.50) * 1000:7.2f}ms "
+            f"p90={percentile(samples, 0.90) * 1000:7.2f}ms "
+            f"p99={percentile(samples, 0.99) * 1000:7.2f}ms "
+            f"max={max(samples) * 1000:7.2f}ms "
+            f"errors={len(errors.get(op, [])) if op != 'all' else failed}"
+        )
+    for op, found in sorted(errors.items()):
+        for error in found[:3]:
+            print(f"  {op} error: {error}")
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="The server to load")
+    parser.add_argument("--concurrency", type=int, default=32, help="Clients sending requests at once")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run for")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests instead")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed-todos", type=int, default=200, help="Todos created before the run")
+    parser.add_argument("--attachment-kb", type=int, default=64, help="Size of attached files")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, prog=None):
+    asyncio.run(run(parse_args(argv, prog)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure the memory held per todo by the in-memory repositories, using
+tracemalloc.
+
+Todos are generated in batches and handed to the repository, so only
+what the repository keeps is counted. Every --attachment-every th todo
+carries a small attachment; the bytes themselves are shared and not
+counted, only the structures referring to them.
+
+    python -m benchmarks.memory_footprint --todos 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from application.models import TodoItem
+from infrastructure.columnar_repo import ColumnarTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+
+BATCH = 10000
+PAYLOAD = b"x" * 512
+
+
+def todos(count: int, every: int):
+    for i in range(count):
+        todo = TodoItem(title=f"Task {i} review the quarterly report")
+        if every and i % every == 0:
+            todo.set_attachment(PAYLOAD, f"report-{i}.pdf", "application/pdf")
+        yield todo
+
+
+def fill(repo, count: int, every: int):
+    batch = []
+    for todo in todos(count, every):
+        batch.append(todo)
+        if len(batch) == BATCH:
+            repo.add_many(batch)
+            batch = []
+    if batch:
+        repo.add_many(batch)
+
+
+def measure(name: str, factory, count: int, every: int):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    repo = factory()
+    fill(repo, count, every)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    held = current - before
+    print(
+        f"{name:>12}: {held / 1024 / 1024:8.1f}MB held, {held / count:7.1f} bytes/todo, "
+        f"peak {(peak - before) / 1024 / 1024:8.1f}MB, filled in {elapsed:.1f}s"
+    )
+    return repo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--todos", type=int, default=1000000, help="Todos to store")
+    parser.add_argument("--attachment-every", type=int, default=100, help="Every Nth todo has an attachment (0 for none)")
+    parser.add_argument("--backend", choices=["items", "memory", "columnar", "all"], default="all")
+    args = parser.parse_args()
+
+    if args.backend in ("items", "all"):
+        # The TodoItem objects alone, as a list holds them
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        items = list(todos(args.todos, args.attachment_every))
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(f"{'TodoItem':>12}: {held / 1024 / 1024:8.1f}MB held, {held / args.todos:7.1f} bytes/todo")
+        del items
+    if args.backend in ("memory", "all"):
+        repo = measure("memory", InMemoryTodoRepo, args.todos, args.attachment_every)
+        del repo
+    if args.backend in ("columnar", "all"):
+        repo = measure("columnar", ColumnarTodoRepo, args.todos, args.attachment_every)
+        del repo
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare MmapTodoRepo with FileTodoRepo and SQLiteTodoRepo on opening a
+store, toggling completed, adding and deleting single todos.
+
+Each store is seeded with --count todos in one batch. Opening is timed
+until the first get() returns, so stores that parse their file on open
+pay for it there. --ops toggles, adds and deletes then run one call
+each, as the GUI and CLI issue them.
+
+    python -m benchmarks.mmap_store --count 100000 --ops 1000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from application.models import TodoItem
+from infrastructure.file_repo import FileTodoRepo
+from infrastructure.mmap_repo import MmapTodoRepo
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+STORAGES = {
+    "file": lambda directory: FileTodoRepo(os.path.join(directory, "todos.json")),
+    "journal": lambda directory: FileTodoRepo(os.path.join(directory, "todos.json"), journal=True),
+    "sqlite": lambda directory: SQLiteTodoRepo(os.path.join(directory, "todos.db")),
+    "mmap": lambda directory: MmapTodoRepo(os.path.join(directory, "todos.mmap")),
+}
+
+
+def directory_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def run(storage: str, count: int, ops: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        make = STORAGES[storage]
+        repo = make(directory)
+        todos = [TodoItem(title=f"Task {i}") for i in range(count)]
+        repo.add_many(todos)
+        repo.close()
+
+        start = time.perf_counter()
+        repo = make(directory)
+        repo.get(todos[0].id)
+        open_seconds = time.perf_counter() - start
+
+        chosen = rng.sample(todos, min(ops, count))
+        start = time.perf_counter()
+        for todo in chosen:
+            todo.completed = not todo.completed
+            repo.update(todo)
+        toggle_seconds = time.perf_counter() - start
+
+        added = [TodoItem(title=f"New task {i}") for i in range(ops)]
+        start = time.perf_counter()
+        for todo in added:
+            repo.add(todo)
+        add_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for todo in chosen:
+            repo.delete(todo.id)
+        delete_seconds = time.perf_counter() - start
+
+        repo.close()
+        size = directory_size(directory)
+    return {
+        "storage": storage,
+        "open_ms": open_seconds * 1000,
+        "toggles_per_sec": len(chosen) / toggle_seconds,
+        "adds_per_sec": ops / add_seconds,
+        "deletes_per_sec": len(chosen) / delete_seconds,
+        "size_mb": size / (1024 * 1024),
+    }
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000, help="Number of todos to seed each store with")
+    parser.add_argument("--ops", type=int, default=200, help="Number of toggles, adds and deletes to time")
+    # The snapshot file store rewrites every todo on each call, which
+    # takes minutes at the default sizes
+    parser.add_argument("--storage", nargs="+", choices=list(STORAGES), default=["journal", "sqlite", "mmap"],
+                        help="Stores to compare (default journal sqlite mmap)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args(argv)
+    for storage in args.storage:
+        result = run(storage, args.count, args.ops, args.seed)
+        print(
+            f"{result['storage']:>8}: open {result['open_ms']:8.1f} ms "
+            f"{result['toggles_per_sec']:10.0f} toggles/s "
+            f"{result['adds_per_sec']:10.0f} adds/s "
+            f"{result['deletes_per_sec']:10.0f} deletes/s "
+            f"{result['size_mb']:7.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
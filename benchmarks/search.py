@@ -0,0 +1,105 @@
+"""
+Measure search latency over a large number of todos in the in-memory
+inverted index and the SQLite FTS5 index.
+
+Titles are drawn from a fixed vocabulary, so common words match many
+todos and ranking has real work to do. Queries mix whole words, short
+prefixes and two-word searches.
+
+    python -m benchmarks.search --todos 1000000 --queries 500
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from application.models import TodoItem
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+from benchmarks.sqlite_concurrency import percentile
+
+BATCH = 10000
+
+
+def vocabulary(rng, size):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def todos(rng, words, count):
+    for i in range(count):
+        filename = f"{rng.choice(words)}.pdf" if i % 5 == 0 else None
+        title = " ".join(rng.choice(words) for _ in range(rng.randint(2, 6)))
+        yield TodoItem(title=title, attachment_filename=filename)
+
+
+def fill(repo, rng, words, count):
+    batch = []
+    for todo in todos(rng, words, count):
+        batch.append(todo)
+        if len(batch) == BATCH:
+            repo.add_many(batch)
+            batch = []
+    if batch:
+        repo.add_many(batch)
+
+
+def queries(rng, words, count):
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            yield rng.choice(words)
+        elif kind < 0.7:
+            yield rng.choice(words)[:3]
+        else:
+            yield f"{rng.choice(words)} {rng.choice(words)[:2]}"
+
+
+def measure(name, repo, query_list, limit):
+    latencies = []
+    for query in query_list:
+        start = time.perf_counter()
+        repo.search(query, limit)
+        latencies.append(time.perf_counter() - start)
+    print(
+        f"{name:>8}: n={len(latencies):5d} "
+        f"p50={percentile(latencies, 0.50) * 1000:7.2f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:7.2f}ms "
+        f"mean={statistics.mean(latencies) * 1000:7.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--todos", type=int, default=200000, help="Todos to index")
+    parser.add_argument("--queries", type=int, default=500, help="Searches per backend")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="Distinct words in titles")
+    parser.add_argument("--limit", type=int, default=20, help="Results per search")
+    parser.add_argument("--backend", choices=["memory", "sqlite", "all"], default="all")
+    args = parser.parse_args()
+
+    words = vocabulary(random.Random(1), args.vocabulary)
+    query_list = list(queries(random.Random(2), words, args.queries))
+
+    if args.backend in ("memory", "all"):
+        repo = InMemoryTodoRepo()
+        start = time.perf_counter()
+        fill(repo, random.Random(3), words, args.todos)
+        print(f"  memory: indexed {args.todos} todos in {time.perf_counter() - start:.1f}s")
+        measure("memory", repo, query_list, args.limit)
+        del repo
+
+    if args.backend in ("sqlite", "all"):
+        with tempfile.TemporaryDirectory() as directory:
+            repo = SQLiteTodoRepo(os.path.join(directory, "todos.db"))
+            start = time.perf_counter()
+            fill(repo, random.Random(3), words, args.todos)
+            print(f"  sqlite: indexed {args.todos} todos in {time.perf_counter() - start:.1f}s")
+            measure("sqlite", repo, query_list, args.limit)
+            repo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Run many simulated sessions against one SQLite database at once and
+report per-operation latency percentiles.
+
+Each session is a thread with its own SQLiteTodoRepo over a shared
+connection pool, as with concurrent Flet sessions. Sessions mix page
+reads with adds and completion toggles. With --durability grouped or
+async, writes of all sessions go through one group commit writer.
+
+    python -m benchmarks.sqlite_concurrency --sessions 32 --ops 200
+    python -m benchmarks.sqlite_concurrency --write-ratio 0.9 --synchronous FULL --durability grouped
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from application.models import TodoItem
+from application.services import TodoService
+from infrastructure.group_commit import DURABILITY, IMMEDIATE, GroupCommitWriter
+from infrastructure.sqlite_pool import SQLiteConnectionPool
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def session(service: TodoService, ops: int, write_ratio: float, seed: int, latencies, errors):
+    rng = random.Random(seed)
+    own_ids = []
+    for _ in range(ops):
+        if rng.random() < write_ratio:
+            if own_ids and rng.random() < 0.5:
+                op = "toggle"
+                todo_id = rng.choice(own_ids)
+                call = lambda: service.update_todo(todo_id, completed=rng.random() < 0.5)
+            else:
+                op = "add"
+                call = lambda: own_ids.append(service.add_todo(f"Task {rng.random():.6f}").id)
+        else:
+            op = "list_page"
+            call = lambda: service.list_todos_page(limit=30)
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception as err:
+            errors.append(f"{op}: {err}")
+            continue
+        latencies[op].append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=32, help="Concurrent simulated sessions")
+    parser.add_argument("--ops", type=int, default=200, help="Operations per session")
+    parser.add_argument("--write-ratio", type=float, default=0.3, help="Share of operations that write")
+    parser.add_argument("--pool-size", type=int, default=8, help="Maximum pooled connections")
+    parser.add_argument("--seed-todos", type=int, default=1000, help="Todos in the database before the run")
+    parser.add_argument("--durability", choices=DURABILITY, default=IMMEDIATE, help="How adds and toggles commit")
+    parser.add_argument("--window-ms", type=float, default=5, help="Group commit window in milliseconds")
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous level (FULL fsyncs every commit)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pool = SQLiteConnectionPool(
+            os.path.join(directory, "todos.db"), max_size=args.pool_size, synchronous=args.synchronous
+        )
+        SQLiteTodoRepo(pool=pool).add_many(TodoItem(title=f"Seed {i}") for i in range(args.seed_todos))
+        writer = None
+        commits = []
+        if args.durability != IMMEDIATE:
+            committer = SQLiteTodoRepo(pool=pool)
+            write_batch = committer.write_batch
+            committer.write_batch = lambda writes: (commits.append(len(writes)), write_batch(writes))
+            writer = GroupCommitWriter(committer, window=args.window_ms / 1000)
+
+        latencies = defaultdict(list)
+        errors = []
+        threads = [
+            threading.Thread(
+                target=session,
+                args=(
+                    TodoService(SQLiteTodoRepo(pool=pool, durability=args.durability, writer=writer)),
+                    args.ops, args.write_ratio, seed, latencies, errors
+                )
+            )
+            for seed in range(args.sessions)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if writer is not None:
+            # Async writes still queued are part of the run
+            writer.close()
+        elapsed = time.perf_counter() - start
+        pool.close()
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"{args.sessions} sessions, {total} ops in {elapsed:.2f}s ({total / elapsed:.0f} ops/s), {len(errors)} errors")
+    if commits:
+        print(f"{sum(commits)} writes in {len(commits)} group commits ({sum(commits) / len(commits):.1f} per commit)")
+    for op, samples in sorted(latencies.items()):
+        print(
+            f"{op:>10}: n={len(samples):6d} "
+            f"p50={percentile(samples, 0.50) * 1000:7.2f}ms "
+            f"p99={percentile(samples, 0.99) * 1000:7.2f}ms "
+            f"mean={statistics.mean(samples) * 1000:7.2f}ms"
+        )
+    for error in errors[:5]:
+        print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Measure how long a short CLI command takes to start, and fail if it
+goes over budget.
+
+`main.py cli add` is run repeatedly in a fresh interpreter from an empty
+directory and the median wall time is compared with --budget-ms. One
+more run under `python -X importtime` shows which top-level imports the
+time goes to. The GUI stack must not be imported at all.
+
+    python -m benchmarks.startup --runs 10 --budget-ms 250
+    python -m benchmarks.startup --storage sqlite
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORBIDDEN = ["flet", "flet_core", "flet_runtime", "PIL"]
+
+
+def command(storage: str):
+    return [sys.executable, os.path.join(ROOT, "main.py"), "cli", "--storage", storage, "add", "Startup check"]
+
+
+def run(args, directory: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(args, cwd=directory, env=env, capture_output=True, text=True, check=True)
+
+
+def import_times(stderr: str):
+    """
+    Parse `-X importtime` output into the cumulative microseconds of each
+    top-level import, and the set of every imported module.
+    """
+    top, modules = {}, set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        if not name[1:].startswith(" "):
+            top[name.strip()] = int(cumulative)
+    return top, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--storage", default="memory", help="Storage backend passed to the CLI")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs")
+    parser.add_argument("--budget-ms", type=float, default=250, help="Maximum median wall time")
+    parser.add_argument("--top", type=int, default=10, help="Top-level imports to show")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        run([sys.executable, "-c", "pass"], directory)
+        start = time.perf_counter()
+        run([sys.executable, "-c", "pass"], directory)
+        bare = (time.perf_counter() - start) * 1000
+
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            run(command(args.storage), directory)
+            times.append((time.perf_counter() - start) * 1000)
+        traced = run([sys.executable, "-X", "importtime"] + command(args.storage)[1:], directory)
+
+    top, modules = import_times(traced.stderr)
+    median = statistics.median(times)
+    print(f"cli add ({args.storage}): median {median:.0f}ms, min {min(times):.0f}ms, "
+          f"max {max(times):.0f}ms over {args.runs} runs (bare interpreter {bare:.0f}ms)")
+    print("slowest top-level imports:")
+    for name, cumulative in sorted(top.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:7.1f}ms  {name}")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"median {median:.0f}ms is over the {args.budget_ms:.0f}ms budget")
+    loaded = sorted(name for name in FORBIDDEN if name in modules)
+    if loaded:
+        failures.append(f"imports the GUI stack: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Drive TodoService through the basic workloads on each storage backend
+and report throughput, latency percentiles and peak RSS.
+
+Every (storage, todos, attachment size) scenario runs in a fresh worker
+process, so its peak RSS is its own. The store is first seeded with
+--todos items in batches, which is not measured; every --attachment-every
+th seeded todo carries an attachment of the scenario's size. Then each
+workload runs --ops operations, or stops after --max-seconds:
+
+    insert    add_todo, with an attachment if the scenario has one
+    get       get_todo of random seeded todos
+    toggle    update_todo flipping completed
+    list_page list_todos_page, following the cursor and wrapping around
+    list_all  list_todos (summaries, no attachment bytes)
+    delete    delete_todo of the todos inserted above
+
+Seeds are fixed, so runs are repeatable. --json writes the results with
+the commit and environment they were measured on, and --compare prints
+the change against such a file from an earlier run:
+
+    python -m benchmarks.suite --storage sqlite --todos 1000 100000 --json before.json
+    python main.py bench --storage all --todos 1000 100000 1000000 --compare before.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from application.models import TodoItem
+from application.services import TodoService
+from infrastructure.blob_store import BlobStore
+from infrastructure.columnar_repo import ColumnarTodoRepo
+from infrastructure.file_repo import FileTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from infrastructure.mmap_repo import MmapTodoRepo
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+from infrastructure.sharded_sqlite_repo import ShardedSQLiteTodoRepo
+from benchmarks.sqlite_concurrency import percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STORAGES = ["memory", "columnar", "file", "journal", "mmap", "sqlite", "sharded"]
+SEED_BATCH = 10000
+PAGE_SIZE = 50
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def build_repository(storage: str, directory: str, blob_store=None):
+    if storage == "memory":
+        return InMemoryTodoRepo(blob_store=blob_store)
+    if storage == "columnar":
+        return ColumnarTodoRepo(blob_store=blob_store)
+    if storage == "file":
+        return FileTodoRepo(os.path.join(directory, "todos.json"), blob_store=blob_store)
+    if storage == "journal":
+        return FileTodoRepo(os.path.join(directory, "todos.json"), journal=True, blob_store=blob_store)
+    if storage == "mmap":
+        return MmapTodoRepo(os.path.join(directory, "todos.mmap"), blob_store=blob_store)
+    if storage == "sqlite":
+        return SQLiteTodoRepo(os.path.join(directory, "todos.db"), blob_store=blob_store)
+    if storage == "sharded":
+        return ShardedSQLiteTodoRepo(os.path.join(directory, "shards"), blob_store=blob_store)
+    raise ValueError(f"Invalid storage type: {storage}")
+
+
+def payload(base: bytes, i: int) -> bytes:
+    # Distinct bytes per todo, so the blob store cannot deduplicate them
+    return i.to_bytes(8, "big")[:len(base)] + base[8:]
+
+
+def seed(service: TodoService, count: int, base: bytes, every: int, batch_size: int, sample):
+    # Returns the IDs of the todos at the sampled positions
+    ids = []
+    for start in range(0, count, batch_size):
+        batch = []
+        for i in range(start, min(count, start + batch_size)):
+            todo = TodoItem(title=f"Seeded task {i}")
+            if base and i % every == 0:
+                todo.set_attachment(payload(base, i), "seed.bin", "application/octet-stream")
+            if i in sample:
+                ids.append(todo.id)
+            batch.append(todo)
+        service.add_many(batch)
+    return ids
+
+
+def timed(op, calls, max_seconds):
+    latencies = []
+    deadline = time.perf_counter() + max_seconds
+    start = time.perf_counter()
+    for call in calls:
+        began = time.perf_counter()
+        call()
+        ended = time.perf_counter()
+        latencies.append(ended - began)
+        if ended > deadline:
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        "workload": op,
+        "ops": len(latencies),
+        "seconds": elapsed,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def workloads(service: TodoService, rng: random.Random, ids, count: int, ops: int, base: bytes):
+    inserted = []
+
+    def insert(i):
+        def call():
+            data = payload(base, count + i) if base else None
+            todo = service.add_todo(f"Inserted task {i}", attachment_data=data,
+                                    attachment_filename="bench.bin" if base else None)
+            inserted.append(todo.id)
+        return call
+
+    completed = {}
+
+    def toggle(todo_id):
+        def call():
+            completed[todo_id] = not completed.get(todo_id, False)
+            service.update_todo(todo_id, completed=completed[todo_id])
+        return call
+
+    cursor = [None]
+
+    def list_page():
+        page = service.list_todos_page(cursor[0], PAGE_SIZE)
+        cursor[0] = page.next_cursor
+
+    yield "insert", (insert(i) for i in range(ops))
+    yield "get", ((lambda todo_id=rng.choice(ids): service.get_todo(todo_id)) for _ in range(ops))
+    yield "toggle", (toggle(rng.choice(ids)) for _ in range(ops))
+    yield "list_page", (list_page for _ in range(ops))
+    yield "list_all", (service.list_todos for _ in range(ops))
+    yield "delete", ((lambda todo_id=todo_id: service.delete_todo(todo_id)) for todo_id in list(inserted))
+
+
+def run_scenario(scenario: dict) -> dict:
+    """Run every workload of one scenario; meant for a fresh process."""
+    rng = random.Random(scenario["seed"])
+    size = scenario["attachment_kb"] * 1024
+    base = random.Random(scenario["seed"] + 1).randbytes(size) if size else b""
+    with tempfile.TemporaryDirectory() as directory:
+        blob_store = BlobStore(os.path.join(directory, "uploads")) if scenario["blob_store"] else None
+        repo = build_repository(scenario["storage"], directory, blob_store)
+        service = TodoService(repo)
+        count = scenario["todos"]
+        sample = set(rng.sample(range(count), min(count, scenario["ops"])))
+        # The snapshot file repository rewrites the whole file per batch
+        batch_size = count if scenario["storage"] == "file" else SEED_BATCH
+        start = time.perf_counter()
+        ids = seed(service, count, base, scenario["attachment_every"], batch_size, sample)
+        seed_seconds = time.perf_counter() - start
+        results = [
+            timed(op, calls, scenario["max_seconds"])
+            for op, calls in workloads(service, rng, ids, count, scenario["ops"], base)
+        ]
+        service.close()
+        if blob_store:
+            blob_store.close()
+    return dict(scenario, seed_seconds=seed_seconds, peak_rss_mb=peak_rss_mb(), results=results)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def scenario_key(scenario: dict):
+    return scenario["storage"], scenario["blob_store"], scenario["todos"], scenario["attachment_kb"]
+
+
+def describe(scenario: dict) -> str:
+    storage = scenario["storage"] + ("+blobs" if scenario["blob_store"] else "")
+    attachments = f"{scenario['attachment_kb']}KB attachments" if scenario["attachment_kb"] else "no attachments"
+    return f"{storage}, {scenario['todos']} todos, {attachments}"
+
+
+def report(scenario: dict):
+    rss = scenario["peak_rss_mb"]
+    print(f"{describe(scenario)}: seeded in {scenario['seed_seconds']:.1f}s, "
+          f"peak RSS {'n/a' if rss is None else f'{rss:.0f}MB'}")
+    for result in scenario["results"]:
+        print(
+            f"  {result['workload']:>9}: n={result['ops']:6d} {result['ops_per_sec']:9.0f} ops/s "
+            f"p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms"
+        )
+
+
+def change(new: float, old: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def compare(scenarios, baseline: dict, threshold: float) -> int:
+    """Print the change against a baseline run and return the number of regressions."""
+    old_scenarios = {scenario_key(scenario): scenario for scenario in baseline["scenarios"]}
+    print(f"\nCompared with {baseline['environment'].get('commit') or 'baseline'} "
+          f"(regression: throughput or p99 worse by more than {threshold:.0%})")
+    regressions = 0
+    for scenario in scenarios:
+        old = old_scenarios.get(scenario_key(scenario))
+        if old is None:
+            continue
+        print(describe(scenario))
+        old_results = {result["workload"]: result for result in old["results"]}
+        for result in scenario["results"]:
+            before = old_results.get(result["workload"])
+            if before is None:
+                continue
+            throughput = change(result["ops_per_sec"], before["ops_per_sec"])
+            p99 = change(result["p99_ms"], before["p99_ms"])
+            regressed = throughput < -threshold or p99 > threshold
+            regressions += regressed
+            print(f"  {result['workload']:>9}: ops/s {throughput:+7.1%}  p99 {p99:+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--storage", nargs="+", choices=STORAGES + ["all"], default=["all"],
+                        help="Backends to measure")
+    parser.add_argument("--blob-store", action="store_true", help="Keep attachments in a blob store")
+    parser.add_argument("--todos", nargs="+", type=int, default=[1000, 100000],
+                        help="Store sizes to measure, e.g. 1000 100000 1000000")
+    parser.add_argument("--attachment-kb", nargs="+", type=int, default=[0, 64],
+                        help="Attachment sizes in KB; 0 measures todos without attachments")
+    parser.add_argument("--attachment-every", type=int, default=100,
+                        help="Every Nth seeded todo carries an attachment")
+    parser.add_argument("--ops", type=int, default=1000, help="Operations per workload")
+    parser.add_argument("--max-seconds", type=float, default=10, help="Time limit per workload")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file")
+    parser.add_argument("--compare", help="A --json file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change reported as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, prog=None):
+    args = parse_args(argv, prog)
+    storages = STORAGES if "all" in args.storage else args.storage
+    scenarios = []
+    for storage in storages:
+        for todos in args.todos:
+            for attachment_kb in args.attachment_kb:
+                scenario = {
+                    "storage": storage,
+                    "blob_store": args.blob_store,
+                    "todos": todos,
+                    "attachment_kb": attachment_kb,
+                    "attachment_every": args.attachment_every,
+                    "ops": args.ops,
+                    "max_seconds": args.max_seconds,
+                    "seed": args.seed,
+                }
+                # A new process per scenario keeps peak RSS and allocator
+                # state from leaking between scenarios
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    scenario = executor.submit(run_scenario, scenario).result()
+                report(scenario)
+                scenarios.append(scenario)
+
+    output = {"environment": environment(), "scenarios": scenarios}
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(scenarios, json.load(f), args.threshold)
+
+
+if __name__ == "__main__":
+    main()
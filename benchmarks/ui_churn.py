@@ -0,0 +1,114 @@
+"""
+Measure how much of the Flet control tree each task-list action touches,
+for lists of 1k and 10k todos.
+
+TodoApp runs against a real ft.Page whose connection only records the
+commands that would go over the websocket. For every action it reports
+the number of controls added to and removed from the client and the
+number of "set" commands, next to a full rebuild of the list (what every
+action used to do).
+
+    python -m benchmarks.ui_churn --sizes 1000 10000
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+import flet as ft
+from flet_core.connection import Connection
+from application.models import TodoItem
+from application.services import AsyncTodoService
+from infrastructure.async_repo import AsyncInMemoryTodoRepo
+from presentation.flet_ui import TodoApp
+
+
+class RecordingConnection(Connection):
+    """Connection that answers like the Flet server and counts commands."""
+
+    def __init__(self):
+        super().__init__()
+        self._ids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        self.added = self.removed = self.sets = 0
+
+    def send_command(self, session_id, command):
+        return self.send_commands(session_id, [command])
+
+    def send_commands(self, session_id, commands):
+        results = []
+        for command in commands:
+            if command.name == "add":
+                ids = [f"_{next(self._ids)}" for _ in command.commands]
+                self.added += len(ids)
+                results.append(" ".join(ids))
+            elif command.name == "remove":
+                self.removed += len(command.values)
+            elif command.name == "set":
+                self.sets += 1
+        return SimpleNamespace(results=results, error="")
+
+
+def measure(conn, action):
+    conn.reset()
+    start = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - start
+    return conn.added, conn.removed, conn.sets, elapsed
+
+
+def run(size):
+    conn = RecordingConnection()
+    loop = asyncio.new_event_loop()
+    run_until_complete = loop.run_until_complete
+    page = ft.Page(conn, "bench", loop)
+    service = AsyncTodoService(AsyncInMemoryTodoRepo())
+    run_until_complete(service.add_many(TodoItem(title=f"Task {i}") for i in range(size)))
+    app = TodoApp(page, service)
+    run_until_complete(app.start())
+    while app.next_cursor:
+        run_until_complete(app.load_next_page())
+
+    some_id = next(iter(app.cards))
+    checkbox = app.cards[some_id].content.content.controls[0].controls[0]
+
+    def toggle():
+        checkbox.value = True
+        run_until_complete(app.toggle_complete(some_id, SimpleNamespace(control=checkbox)))
+
+    def add():
+        app.new_task.value = "New task"
+        run_until_complete(app.add_task(None))
+
+    def edit():
+        app.edit_task(run_until_complete(app.service.list_todos_page(limit=1)).items[0])
+        run_until_complete(app.save_edit("Edited", page.dialog))
+
+    def delete():
+        run_until_complete(app.delete_task(some_id, None))
+
+    def rebuild():
+        run_until_complete(app.load_tasks())
+        while app.next_cursor:
+            run_until_complete(app.append_page())
+        page.update()
+
+    print(f"{size} todos:")
+    for name, action in (("toggle", toggle), ("add", add), ("edit", edit), ("delete", delete), ("full rebuild", rebuild)):
+        added, removed, sets, elapsed = measure(conn, action)
+        print(f"  {name:>12}: +{added:7d} -{removed:7d} controls, {sets:5d} sets, {elapsed * 1000:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="List sizes to measure")
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
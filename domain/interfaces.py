@@ -1,6 +1,10 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List
-from application.models import TodoItem
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage
+from application.query import TodoQuery
 class ITodoRepository(ABC):
     @abstractmethod
     def add(self, todo: TodoItem) -> TodoItem:
@@ -21,3 +25,203 @@ class ITodoRepository(ABC):
     @abstractmethod
     def list_all(self) -> List[TodoItem]:
         pass
+
+    @abstractmethod
+    def list_summaries(self) -> List[TodoSummary]:
+        pass
+
+    @abstractmethod
+    def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        pass
+
+    @abstractmethod
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        pass
+
+    @abstractmethod
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        pass
+
+    @abstractmethod
+    def delete_many(self, todo_ids: Iterable[str]) -> None:
+        pass
+
+    @abstractmethod
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        pass
+
+    @abstractmethod
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        pass
+
+    @abstractmethod
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        pass
+
+    @abstractmethod
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        pass
+
+    @abstractmethod
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        pass
+
+    @abstractmethod
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        pass
+
+    @abstractmethod
+    def stats(self) -> TodoStats:
+        pass
+
+    @abstractmethod
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        pass
+
+    def add_queued(self, todo: TodoItem) -> Future:
+        """
+        Add a Todo item, returning a future that resolves with None once the
+        insert is committed, or with its error. Repositories that commit
+        before returning hand back a future that is already resolved.
+        """
+        return _resolved(self.add, todo)
+
+    def update_queued(self, todo: TodoItem) -> Future:
+        """Update a Todo item, returning a future like add_queued()."""
+        return _resolved(self.update, todo)
+
+    def delete_queued(self, todo_id: str) -> Future:
+        """Delete a Todo item, returning a future like add_queued()."""
+        return _resolved(self.delete, todo_id)
+
+    def close(self) -> None:
+        """Release resources such as open files or connections."""
+        pass
+
+
+class IAsyncTodoRepository(ABC):
+    """Coroutine counterpart of ITodoRepository for asyncio callers."""
+
+    @abstractmethod
+    async def add(self, todo: TodoItem) -> TodoItem:
+        pass
+
+    @abstractmethod
+    async def get(self, todo_id: str) -> Optional[TodoItem]:
+        pass
+
+    @abstractmethod
+    async def update(self, todo: TodoItem) -> TodoItem:
+        pass
+
+    @abstractmethod
+    async def delete(self, todo_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def list_all(self) -> List[TodoItem]:
+        pass
+
+    @abstractmethod
+    async def list_summaries(self) -> List[TodoSummary]:
+        pass
+
+    @abstractmethod
+    async def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        pass
+
+    @abstractmethod
+    async def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        pass
+
+    @abstractmethod
+    async def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        pass
+
+    @abstractmethod
+    async def delete_many(self, todo_ids: Iterable[str]) -> None:
+        pass
+
+    @abstractmethod
+    async def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        pass
+
+    @abstractmethod
+    async def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        pass
+
+    @abstractmethod
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Async generator of the attachment bytes of a todo, in chunks."""
+        pass
+
+    @abstractmethod
+    async def query(self, query: TodoQuery) -> List[TodoSummary]:
+        pass
+
+    @abstractmethod
+    async def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def delete_where(self, query: TodoQuery) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def stats(self) -> TodoStats:
+        pass
+
+    @abstractmethod
+    def attachment_loader(self, todo_id: str) -> Callable[[], Optional[bytes]]:
+        """Blocking loader for the AttachmentHandle of a todo built by the caller."""
+        pass
+
+    async def add_queued(self, todo: TodoItem) -> asyncio.Future:
+        """
+        Add a Todo item, returning a future that resolves with None once the
+        insert is committed, or with its error.
+        """
+        return await _resolved_async(self.add(todo))
+
+    async def update_queued(self, todo: TodoItem) -> asyncio.Future:
+        """Update a Todo item, returning a future like add_queued()."""
+        return await _resolved_async(self.update(todo))
+
+    async def delete_queued(self, todo_id: str) -> asyncio.Future:
+        """Delete a Todo item, returning a future like add_queued()."""
+        return await _resolved_async(self.delete(todo_id))
+
+    async def close(self) -> None:
+        """Release resources such as open files, connections or threads."""
+        pass
+
+
+def _resolved(write, *args) -> Future:
+    # The outcome of a write that has committed by the time it returns
+    future = Future()
+    try:
+        write(*args)
+    except Exception as err:
+        future.set_exception(err)
+    else:
+        future.set_result(None)
+    return future
+
+
+async def _resolved_async(write) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    try:
+        await write
+    except Exception as err:
+        future.set_exception(err)
+    else:
+        future.set_result(None)
+    return future
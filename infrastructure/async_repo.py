@@ -0,0 +1,239 @@
+"""
+This module provides asyncio adapters for the synchronous repositories:
+one that runs blocking SQLite and file I/O on a bounded thread pool, and
+native coroutines over the in-memory repository.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterable, List, Optional
+from domain.interfaces import IAsyncTodoRepository, ITodoRepository
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage
+from application.query import TodoQuery
+
+
+class ExecutorTodoRepo(IAsyncTodoRepository):
+    """
+    ExecutorTodoRepo runs every call of a blocking repository on a thread
+    pool so the event loop keeps serving other sessions meanwhile. At most
+    max_workers calls run at once; further calls wait in the pool's queue.
+    """
+
+    def __init__(self, repository: ITodoRepository, executor: Optional[ThreadPoolExecutor] = None,
+                 max_workers: int = 4):
+        """
+        Initialize the adapter.
+
+        :param repository: The blocking repository to wrap.
+        :param executor: A pool shared with other adapters (e.g. one per Flet
+            session), left running by close(); if None the adapter owns a pool.
+        :param max_workers: The size of an owned pool.
+        """
+        self.repository = repository
+        self.blob_store = getattr(repository, "blob_store", None)
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="todo-repo")
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def add(self, todo: TodoItem) -> TodoItem:
+        return await self._run(self.repository.add, todo)
+
+    async def get(self, todo_id: str) -> Optional[TodoItem]:
+        return await self._run(self.repository.get, todo_id)
+
+    async def update(self, todo: TodoItem) -> TodoItem:
+        return await self._run(self.repository.update, todo)
+
+    async def delete(self, todo_id: str) -> None:
+        return await self._run(self.repository.delete, todo_id)
+
+    # The repository queues the write on a worker thread; the commit is
+    # awaited on the loop through the returned future
+
+    async def add_queued(self, todo: TodoItem) -> asyncio.Future:
+        return asyncio.wrap_future(await self._run(self.repository.add_queued, todo))
+
+    async def update_queued(self, todo: TodoItem) -> asyncio.Future:
+        return asyncio.wrap_future(await self._run(self.repository.update_queued, todo))
+
+    async def delete_queued(self, todo_id: str) -> asyncio.Future:
+        return asyncio.wrap_future(await self._run(self.repository.delete_queued, todo_id))
+
+    async def list_all(self) -> List[TodoItem]:
+        return await self._run(self.repository.list_all)
+
+    async def list_summaries(self) -> List[TodoSummary]:
+        return await self._run(self.repository.list_summaries)
+
+    async def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        return await self._run(self.repository.get_attachment, todo_id)
+
+    async def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        return await self._run(self.repository.list_page, cursor, limit)
+
+    async def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        return await self._run(self.repository.add_many, list(todos))
+
+    async def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        return await self._run(self.repository.update_many, list(todos))
+
+    async def delete_many(self, todo_ids: Iterable[str]) -> None:
+        return await self._run(self.repository.delete_many, list(todo_ids))
+
+    async def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        return await self._run(self.repository.search, query, limit)
+
+    async def query(self, query: TodoQuery) -> List[TodoSummary]:
+        return await self._run(self.repository.query, query)
+
+    async def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        return await self._run(self.repository.update_where, query, **changes)
+
+    async def delete_where(self, query: TodoQuery) -> List[str]:
+        return await self._run(self.repository.delete_where, query)
+
+    async def stats(self) -> TodoStats:
+        return await self._run(self.repository.stats)
+
+    async def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        # The stream is read, e.g. from a file, on the worker thread too
+        return await self._run(self.repository.write_attachment, todo_id, stream)
+
+    async def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        # Each chunk is read by a worker call of its own, so a slow consumer
+        # holds no worker between chunks. The lock keeps the closing call
+        # from running while a cancelled read is still on its worker.
+        chunks = self.repository.iter_attachment(todo_id, chunk_size)
+        lock = threading.Lock()
+
+        def read():
+            with lock:
+                return next(chunks, None)
+
+        def close():
+            with lock:
+                chunks.close()
+
+        try:
+            while True:
+                chunk = await self._run(read)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # Closes the repository's read, and with it its connection
+            try:
+                self.executor.submit(close)
+            except RuntimeError:
+                # The executor is shut down, so no read is left running
+                close()
+
+    def attachment_loader(self, todo_id: str):
+        return functools.partial(self.repository.get_attachment, todo_id)
+
+    async def close(self) -> None:
+        await self._run(self.repository.close)
+        if self._owns_executor:
+            self.executor.shutdown(wait=False)
+
+
+class AsyncInMemoryTodoRepo(IAsyncTodoRepository):
+    """
+    AsyncInMemoryTodoRepo exposes an InMemoryTodoRepo as native coroutines.
+    Its operations only touch dictionaries and sorted lists, so they run
+    directly on the event loop instead of paying for a thread hop.
+    """
+
+    def __init__(self, repository: Optional[InMemoryTodoRepo] = None):
+        """
+        Initialize the adapter.
+
+        :param repository: The in-memory repository to wrap; it must not use
+            a blob store, whose file I/O would block the loop.
+        """
+        repository = repository or InMemoryTodoRepo()
+        if repository.blob_store is not None:
+            raise ValueError("Use ExecutorTodoRepo for repositories with a blob store")
+        self.repository = repository
+        self.blob_store = None
+
+    async def add(self, todo: TodoItem) -> TodoItem:
+        return self.repository.add(todo)
+
+    async def get(self, todo_id: str) -> Optional[TodoItem]:
+        return self.repository.get(todo_id)
+
+    async def update(self, todo: TodoItem) -> TodoItem:
+        return self.repository.update(todo)
+
+    async def delete(self, todo_id: str) -> None:
+        return self.repository.delete(todo_id)
+
+    async def list_all(self) -> List[TodoItem]:
+        return self.repository.list_all()
+
+    async def list_summaries(self) -> List[TodoSummary]:
+        return self.repository.list_summaries()
+
+    async def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        return self.repository.get_attachment(todo_id)
+
+    async def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        return self.repository.list_page(cursor, limit)
+
+    async def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        return self.repository.add_many(todos)
+
+    async def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        return self.repository.update_many(todos)
+
+    async def delete_many(self, todo_ids: Iterable[str]) -> None:
+        return self.repository.delete_many(todo_ids)
+
+    async def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        return self.repository.search(query, limit)
+
+    async def query(self, query: TodoQuery) -> List[TodoSummary]:
+        return self.repository.query(query)
+
+    async def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        return self.repository.update_where(query, **changes)
+
+    async def delete_where(self, query: TodoQuery) -> List[str]:
+        return self.repository.delete_where(query)
+
+    async def stats(self) -> TodoStats:
+        return self.repository.stats()
+
+    async def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        # Reading the stream may mean file I/O, so it is the one call that
+        # leaves the loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.repository.write_attachment, todo_id, stream
+        )
+
+    async def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        for chunk in self.repository.iter_attachment(todo_id, chunk_size):
+            yield chunk
+
+    def attachment_loader(self, todo_id: str):
+        return functools.partial(self.repository.get_attachment, todo_id)
+
+    async def close(self) -> None:
+        self.repository.close()
+
+
+def async_repository(repository: ITodoRepository, executor: Optional[ThreadPoolExecutor] = None) -> IAsyncTodoRepository:
+    """
+    Wrap a blocking repository for asyncio callers: purely in-memory
+    repositories get native coroutines, everything else an executor.
+    """
+    if type(repository) is InMemoryTodoRepo and repository.blob_store is None:
+        return AsyncInMemoryTodoRepo(repository)
+    return ExecutorTodoRepo(repository, executor)
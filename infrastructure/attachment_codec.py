@@ -0,0 +1,151 @@
+"""
+This module provides the codecs SQLiteTodoRepo compresses attachment
+bytes with, and the per-mimetype policy that picks one. Formats that are
+compressed already are skipped by type, and anything not known to be
+text is first checked with a quick entropy probe of its first bytes.
+"""
+
+import collections
+import math
+import zlib
+from typing import Iterable, Iterator, Optional, Tuple
+
+ZLIB = "zlib"
+CODECS = (ZLIB,)
+
+COMPRESS = "compress"
+SKIP = "skip"
+PROBE = "probe"
+
+# Mimetype prefixes and what to do with them; the first match wins and
+# anything unlisted is probed
+POLICY = (
+    ("text/", COMPRESS),
+    ("application/json", COMPRESS),
+    ("application/x-ndjson", COMPRESS),
+    ("application/xml", COMPRESS),
+    ("application/javascript", COMPRESS),
+    ("application/sql", COMPRESS),
+    ("image/svg+xml", COMPRESS),
+    ("image/png", SKIP),
+    ("image/jpeg", SKIP),
+    ("image/gif", SKIP),
+    ("image/webp", SKIP),
+    ("image/avif", SKIP),
+    ("image/heic", SKIP),
+    ("video/", SKIP),
+    ("audio/", SKIP),
+    ("application/zip", SKIP),
+    ("application/gzip", SKIP),
+    ("application/x-gzip", SKIP),
+    ("application/x-bzip2", SKIP),
+    ("application/x-xz", SKIP),
+    ("application/x-7z-compressed", SKIP),
+    ("application/zstd", SKIP),
+    ("application/epub+zip", SKIP),
+    # .docx, .xlsx and .pptx are zip archives
+    ("application/vnd.openxmlformats-officedocument.", SKIP),
+)
+
+# Bytes of an attachment the entropy probe looks at
+PROBE_SIZE = 64 * 1024
+# Samples above this many bits per byte are taken to be compressed already
+MAX_ENTROPY = 7.0
+# Compressed bytes kept in one piece must save at least this fraction
+MIN_SAVING = 0.1
+LEVEL = 6
+
+
+def entropy(sample: bytes) -> float:
+    """
+    The Shannon entropy of a sample, in bits per byte: near 8 for
+    compressed or encrypted data, 4 to 5 for typical text.
+    """
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in collections.Counter(sample).values())
+
+
+def choose_codec(mimetype: Optional[str], sample: bytes) -> Optional[str]:
+    """
+    Pick the codec for an attachment.
+
+    :param mimetype: The attachment mimetype, if known.
+    :param sample: The first bytes of the attachment; only PROBE_SIZE are read.
+    :return: The codec name, or None to store the bytes as they are.
+    """
+    if not sample:
+        return None
+    action = PROBE
+    for prefix, prefix_action in POLICY:
+        if mimetype and mimetype.startswith(prefix):
+            action = prefix_action
+            break
+    if action == SKIP:
+        return None
+    if action == PROBE and entropy(sample[:PROBE_SIZE]) > MAX_ENTROPY:
+        return None
+    return ZLIB
+
+
+def _check(codec: str):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown attachment codec: {codec}")
+
+
+def encode(mimetype: Optional[str], data: bytes) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Encode attachment bytes held in memory according to the policy.
+
+    :param mimetype: The attachment mimetype.
+    :param data: The attachment bytes.
+    :return: The bytes to store and their codec, or the bytes unchanged
+        and None if compressing does not save MIN_SAVING.
+    """
+    codec = choose_codec(mimetype, data)
+    if codec is None:
+        return data, None
+    compressed = zlib.compress(data, LEVEL)
+    if len(compressed) > len(data) * (1 - MIN_SAVING):
+        return data, None
+    return compressed, codec
+
+
+def decode(codec: Optional[str], data):
+    """
+    Decode stored attachment bytes.
+
+    :param codec: The codec they were stored with, or None.
+    :param data: The stored bytes.
+    :return: The attachment bytes.
+    """
+    if codec is None or data is None:
+        return data
+    _check(codec)
+    return zlib.decompress(data)
+
+
+def compress_chunks(codec: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress a stream of chunks without holding it whole."""
+    _check(codec)
+    compressor = zlib.compressobj(LEVEL)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompress_chunks(codec: str, chunks: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    """Decompress a stream of chunks into chunks of at most chunk_size."""
+    _check(codec)
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+    data = decompressor.flush()
+    if data:
+        yield data
@@ -0,0 +1,106 @@
+"""
+This module provides the registry of storage backends. A backend is a
+named factory that builds a repository from an optional blob store. Its
+module is only imported when the backend is selected, so a short CLI
+call does not pay for the backends it does not use.
+
+Other packages can add backends through the "todoapp.backends" entry
+point group. Each entry point names a factory accepting blob_store:
+
+    [project.entry-points."todoapp.backends"]
+    redis = "todo_redis:RedisTodoRepo"
+"""
+
+import importlib
+from typing import Callable, Dict, List, Union
+from domain.interfaces import ITodoRepository
+
+ENTRY_POINT_GROUP = "todoapp.backends"
+
+BackendFactory = Callable[..., ITodoRepository]
+
+# "module:attribute" targets are imported on first use
+_BACKENDS: Dict[str, Union[str, BackendFactory]] = {
+    "memory": "infrastructure.in_memory_repo:InMemoryTodoRepo",
+    "columnar": "infrastructure.columnar_repo:ColumnarTodoRepo",
+    "file": "infrastructure.file_repo:FileTodoRepo",
+    "journal": "infrastructure.backends:_journal_repo",
+    "mmap": "infrastructure.mmap_repo:MmapTodoRepo",
+    "sqlite": "infrastructure.sqlite_repo:SQLiteTodoRepo",
+    "sharded": "infrastructure.sharded_sqlite_repo:ShardedSQLiteTodoRepo",
+}
+
+
+def _journal_repo(blob_store=None) -> ITodoRepository:
+    from infrastructure.file_repo import FileTodoRepo
+    return FileTodoRepo(journal=True, blob_store=blob_store)
+
+
+def _entry_points():
+    from importlib import metadata
+    found = metadata.entry_points()
+    if hasattr(found, "select"):
+        return list(found.select(group=ENTRY_POINT_GROUP))
+    # Python 3.9 returns a dict of groups
+    return list(found.get(ENTRY_POINT_GROUP, []))
+
+
+def _resolve(target: Union[str, BackendFactory]) -> BackendFactory:
+    if callable(target):
+        return target
+    module, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def register_backend(name: str, factory: Union[str, BackendFactory]) -> None:
+    """
+    Register a storage backend, replacing any backend of the same name.
+
+    :param name: The name selected with --storage.
+    :param factory: A callable accepting blob_store, or its "module:attribute" path.
+    """
+    _BACKENDS[name] = factory
+
+
+def backend_names() -> List[str]:
+    """
+    List the registered backends and those installed through entry points.
+
+    :return: The backend names, built-in ones first.
+    """
+    names = list(_BACKENDS)
+    names += sorted({ep.name for ep in _entry_points()} - set(names))
+    return names
+
+
+def load_backend(name: str) -> BackendFactory:
+    """
+    Import the factory of a backend. Entry points are only scanned for
+    names that are not registered.
+
+    :param name: The backend name.
+    :return: The repository factory.
+    :raises ValueError: If there is no such backend.
+    """
+    if name not in _BACKENDS:
+        for ep in _entry_points():
+            if ep.name == name:
+                _BACKENDS[name] = ep.load()
+                break
+        else:
+            raise ValueError(f"Invalid storage type: {name}")
+    factory = _resolve(_BACKENDS[name])
+    _BACKENDS[name] = factory
+    return factory
+
+
+def create_repository(name: str, blob_store=None) -> ITodoRepository:
+    """
+    Build a repository of the given backend.
+
+    :param name: The backend name.
+    :param blob_store: The blob store for attachment bytes, or None to keep them inline.
+    :return: The new repository.
+    :raises ValueError: If there is no such backend.
+    """
+    return load_backend(name)(blob_store=blob_store)
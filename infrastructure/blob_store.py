@@ -0,0 +1,216 @@
+"""
+This module provides a content-addressed store for attachment bytes,
+shared by all repositories so identical attachments are stored once.
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+from application.attachments import AttachmentStream, CHUNK_SIZE
+
+
+class BlobStore:
+    """
+    BlobStore keeps each distinct attachment once on disk, keyed by its
+    SHA-256 digest and sharded into root/ab/cd/<digest> directories.
+
+    Reference counts live in a small SQLite index next to the blobs.
+    Repositories take a reference when a todo starts pointing at a blob and
+    release it when the todo is deleted or its attachment replaced; gc()
+    then removes blobs nobody references any more.
+    """
+
+    def __init__(self, root: str = "uploads"):
+        """
+        Initialize the blob store.
+        
+        :param root: The directory holding the blobs and their index.
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(str(self.root / "blobs.db"), check_same_thread=False)
+        self._index.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._index.commit()
+
+    def path(self, digest: str) -> Path:
+        """
+        Get the on-disk location of a blob.
+        
+        :param digest: The SHA-256 hex digest of the blob.
+        :return: The path of the blob file.
+        """
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def put(self, data: bytes, digest: Optional[str] = None) -> str:
+        """
+        Store bytes and take a reference to them.
+        
+        :param data: The bytes to store.
+        :param digest: The SHA-256 hex digest of data, if already known.
+        :return: The digest the blob is stored under.
+        """
+        return self.put_many([(data, digest)])[0]
+
+    def put_many(self, blobs: Iterable[Tuple[bytes, Optional[str]]]) -> List[str]:
+        """
+        Store several blobs, recording all their references in one index
+        transaction.
+        
+        :param blobs: (data, digest) pairs; digest may be None.
+        :return: The digests the blobs are stored under.
+        """
+        digests = []
+        # The lock also keeps gc() from deleting a blob between writing it
+        # and recording the reference
+        with self._lock:
+            rows = []
+            for data, digest in blobs:
+                if digest is None:
+                    digest = hashlib.sha256(data).hexdigest()
+                self._write(digest, data)
+                rows.append((digest, len(data)))
+                digests.append(digest)
+            with self._index:
+                self._index.executemany(
+                    "INSERT INTO blobs (hash, size, refcount) VALUES (?, ?, 1) "
+                    "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1",
+                    rows
+                )
+        return digests
+
+    def put_stream(self, stream: AttachmentStream) -> Tuple[str, int]:
+        """
+        Store an attachment arriving in chunks and take a reference to it.
+        The stream hashes the chunks as they are written, so the bytes are
+        never held in memory as a whole.
+        
+        :param stream: The attachment to store.
+        :return: The digest the blob is stored under, and its size.
+        """
+        # The temporary file sits in the root directory, where gc() does
+        # not look, so it can be written without holding the lock
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in stream:
+                    f.write(chunk)
+            digest, size = stream.digest, stream.size
+            path = self.path(digest)
+            with self._lock:
+                if path.exists():
+                    os.unlink(tmp_path)
+                else:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(tmp_path, path)
+                with self._index:
+                    self._index.execute(
+                        "INSERT INTO blobs (hash, size, refcount) VALUES (?, ?, 1) "
+                        "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1",
+                        (digest, size)
+                    )
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, size
+
+    def _write(self, digest: str, data: bytes):
+        path = self.path(digest)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and rename so readers never see a
+        # partially written blob
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def release(self, digest: str):
+        """
+        Drop one reference to a blob. The bytes stay on disk until gc().
+        
+        :param digest: The SHA-256 hex digest of the blob.
+        """
+        self.release_many([digest])
+
+    def release_many(self, digests: Iterable[str]):
+        """
+        Drop one reference to each of several blobs.
+        
+        :param digests: The SHA-256 hex digests of the blobs.
+        """
+        with self._lock, self._index:
+            self._index.executemany(
+                "UPDATE blobs SET refcount = refcount - 1 WHERE hash = ? AND refcount > 0",
+                [(digest,) for digest in digests]
+            )
+
+    def open(self, digest: str) -> Optional[Union[mmap.mmap, bytes]]:
+        """
+        Map a blob into memory instead of copying it into Python bytes.
+        
+        :param digest: The SHA-256 hex digest of the blob.
+        :return: A read-only mmap of the blob, or None if it is missing.
+        """
+        try:
+            with open(self.path(digest), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # Empty files cannot be mapped
+                    return b""
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    def iter_chunks(self, digest: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read a blob from disk in chunks, without mapping all of it.
+
+        :param digest: The SHA-256 hex digest of the blob.
+        :param chunk_size: The maximum size of each chunk.
+        :return: An iterator over the blob bytes; empty if it is missing.
+        """
+        try:
+            f = open(self.path(digest), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+
+    def gc(self) -> int:
+        """
+        Delete unreferenced blobs, including files left behind without an
+        index entry by an interrupted put().
+        
+        :return: The number of files removed.
+        """
+        removed = 0
+        with self._lock:
+            with self._index:
+                live = {row[0] for row in self._index.execute("SELECT hash FROM blobs WHERE refcount > 0")}
+                self._index.execute("DELETE FROM blobs WHERE refcount <= 0")
+            for path in self.root.glob("??/??/*"):
+                if path.name not in live:
+                    path.unlink()
+                    removed += 1
+        return removed
+
+    def close(self):
+        """Close the reference-count index."""
+        self._index.close()
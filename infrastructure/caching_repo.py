@@ -0,0 +1,478 @@
+"""
+This module provides a read-through caching decorator for any
+ITodoRepository, keeping recently read Todo items and attachments in
+memory within a byte budget.
+"""
+
+import dataclasses
+import functools
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Hashable, Iterable, Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE, iter_chunks
+from domain.interfaces import ITodoRepository
+from infrastructure.repositories import TodoRepository
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage, AttachmentHandle
+from application.query import TodoQuery
+
+
+class ByteLRU:
+    """
+    ByteLRU is a least-recently-used cache bounded by the total size of
+    its values in bytes rather than by the number of entries.
+
+    Every write to the backing store bumps a generation number. A value
+    read from the store is only cached if no write happened since the
+    read began, so a slow reader cannot put back a value that a
+    concurrent writer has already invalidated.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Initialize an empty cache.
+
+        :param max_bytes: The budget for the sizes of all cached values.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """
+        Look up a value, marking it most recently used.
+
+        :return: The cached value, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def fits(self, size: int) -> bool:
+        """Whether a value of this size can be cached at all."""
+        return size <= self.max_bytes
+
+    def put(self, key: Hashable, value, size: int, generation: int):
+        """
+        Cache a value read from the backing store, evicting the least
+        recently used values until it fits.
+
+        :param size: The size of the value in bytes.
+        :param generation: The generation read before the value was loaded.
+        """
+        if not self.fits(size):
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            while self._entries and self.bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.bytes += size
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TodoCache:
+    """
+    TodoCache holds the two LRUs used by CachingTodoRepo: Todo items
+    without their attachment bytes, and attachment bytes by todo ID.
+    Sharing one TodoCache between repositories over the same store (e.g.
+    one per Flet session) keeps invalidation consistent across them.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, attachment_share: float = 0.75):
+        """
+        Initialize the cache.
+
+        :param max_bytes: The total budget in bytes.
+        :param attachment_share: The part of the budget given to attachments.
+        """
+        attachment_bytes = int(max_bytes * attachment_share)
+        self.items = ByteLRU(max_bytes - attachment_bytes)
+        self.attachments = ByteLRU(attachment_bytes)
+
+    def stats(self) -> dict:
+        """Return hit, miss and eviction counters and current usage."""
+        return {
+            name: {
+                "hits": lru.hits,
+                "misses": lru.misses,
+                "evictions": lru.evictions,
+                "entries": len(lru),
+                "bytes": lru.bytes,
+                "max_bytes": lru.max_bytes,
+            }
+            for name, lru in (("items", self.items), ("attachments", self.attachments))
+        }
+
+
+# Approximate size of a TodoItem object and its field slots, excluding
+# the strings it refers to
+_ITEM_OVERHEAD = 400
+
+
+def _item_size(todo: TodoItem) -> int:
+    # Rough footprint of a cached item without its attachment bytes
+    size = _ITEM_OVERHEAD
+    for value in (todo.title, todo.id, todo.attachment_filename, todo.attachment_mimetype,
+                  todo.created_at, todo.attachment_hash):
+        if value is not None:
+            size += sys.getsizeof(value)
+    return size
+
+
+class CachingTodoRepo(TodoRepository):
+    """
+    CachingTodoRepo wraps another repository and serves get() and
+    get_attachment() from memory where it can. Writes go straight to the
+    wrapped repository and invalidate the affected entries; listings and
+    searches are passed through.
+    """
+
+    def __init__(self, inner: ITodoRepository, max_bytes: int = 64 * 1024 * 1024,
+                 cache: Optional[TodoCache] = None):
+        """
+        Initialize the caching repository.
+
+        :param inner: The repository to cache.
+        :param max_bytes: The cache budget in bytes when no cache is given.
+        :param cache: A cache shared with other repositories over the same
+            store, or None for a private one.
+        """
+        self.inner = inner
+        self.cache = cache or TodoCache(max_bytes)
+        self.blob_store = getattr(inner, "blob_store", None)
+
+    def cache_stats(self) -> dict:
+        """Return the cache's hit, miss and eviction counters and usage; see TodoCache.stats()."""
+        return self.cache.stats()
+
+    def _invalidate(self, todo_ids: Iterable[str]):
+        todo_ids = list(todo_ids)
+        self.cache.items.invalidate(todo_ids)
+        self.cache.attachments.invalidate(todo_ids)
+
+    def _attach(self, summary: TodoSummary) -> TodoSummary:
+        # Lazy attachment handles load through this cache
+        if summary.attachment is not None:
+            summary.attachment = AttachmentHandle(
+                functools.partial(self.get_attachment, summary.id), summary.attachment.size
+            )
+        return summary
+
+    def add(self, todo: TodoItem):
+        """
+        Add a new Todo item to the wrapped repository.
+
+        :param todo: The Todo item to be added.
+        :return: The added Todo item.
+        """
+        try:
+            return self.inner.add(todo)
+        finally:
+            self._invalidate([todo.id])
+
+    def get(self, todo_id: str) -> Optional[TodoItem]:
+        """
+        Get a Todo item by its ID, from the cache if possible.
+
+        :param todo_id: The ID of the Todo item.
+        :return: A copy of the Todo item the caller may modify, or None.
+        """
+        cached = self.cache.items.get(todo_id)
+        if cached is None:
+            generation = self.cache.items.generation
+            attachment_generation = self.cache.attachments.generation
+            todo = self.inner.get(todo_id)
+            if todo is None:
+                return None
+            data = todo.attachment_data
+            stored = dataclasses.replace(todo, attachment_data=None)
+            self.cache.items.put(todo_id, (stored, data is not None), _item_size(stored), generation)
+            # Copied (e.g. out of a blob store mmap) only if it can be cached
+            if data is not None and self.cache.attachments.fits(len(data)):
+                self.cache.attachments.put(todo_id, bytes(data), len(data), attachment_generation)
+            return todo
+        stored, has_attachment = cached
+        data = self.get_attachment(todo_id) if has_attachment else None
+        return dataclasses.replace(stored, attachment_data=data)
+
+    def update(self, todo: TodoItem):
+        """
+        Update an existing Todo item in the wrapped repository.
+
+        :param todo: The Todo item to be updated.
+        :return: The updated Todo item.
+        """
+        try:
+            return self.inner.update(todo)
+        finally:
+            self._invalidate([todo.id])
+
+    def delete(self, todo_id: str):
+        """
+        Delete a Todo item from the wrapped repository.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        """
+        try:
+            return self.inner.delete(todo_id)
+        finally:
+            self._invalidate([todo_id])
+
+    def _invalidate_on_commit(self, future: Future, todo_id: str) -> Future:
+        # A read between queueing and committing may cache the queued
+        # version, which is wrong if the write then fails
+        future.add_done_callback(lambda _: self._invalidate([todo_id]))
+        return future
+
+    def add_queued(self, todo: TodoItem) -> Future:
+        """
+        Add a new Todo item without waiting for the commit.
+
+        :param todo: The Todo item to be added.
+        :return: A future resolving once the insert is committed.
+        """
+        try:
+            future = self.inner.add_queued(todo)
+        finally:
+            self._invalidate([todo.id])
+        return self._invalidate_on_commit(future, todo.id)
+
+    def update_queued(self, todo: TodoItem) -> Future:
+        """
+        Update a Todo item without waiting for the commit.
+
+        :param todo: The Todo item to be updated.
+        :return: A future resolving once the update is committed.
+        """
+        try:
+            future = self.inner.update_queued(todo)
+        finally:
+            self._invalidate([todo.id])
+        return self._invalidate_on_commit(future, todo.id)
+
+    def delete_queued(self, todo_id: str) -> Future:
+        """
+        Delete a Todo item without waiting for the commit.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        :return: A future resolving once the delete is committed.
+        """
+        try:
+            future = self.inner.delete_queued(todo_id)
+        finally:
+            self._invalidate([todo_id])
+        return self._invalidate_on_commit(future, todo_id)
+
+    def list_all(self) -> List[TodoItem]:
+        """
+        List all Todo items in the wrapped repository.
+
+        :return: A list of all Todo items.
+        """
+        return self.inner.list_all()
+
+    def list_summaries(self) -> List[TodoSummary]:
+        """
+        List all Todo items without loading attachment bytes.
+
+        :return: A list of Todo summaries.
+        """
+        return [self._attach(summary) for summary in self.inner.list_summaries()]
+
+    def get_attachment(self, todo_id: str):
+        """
+        Get the attachment bytes of a Todo item, from the cache if possible.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        data = self.cache.attachments.get(todo_id)
+        if data is None:
+            generation = self.cache.attachments.generation
+            data = self.inner.get_attachment(todo_id)
+            if data is not None and self.cache.attachments.fits(len(data)):
+                data = bytes(data)
+                self.cache.attachments.put(todo_id, data, len(data), generation)
+        return data
+
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        """
+        List one page of Todo summaries ordered by creation time.
+
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of summaries on the page.
+        :return: The page of summaries and the cursor of the next page.
+        """
+        page = self.inner.list_page(cursor, limit)
+        page.items = [self._attach(summary) for summary in page.items]
+        return page
+
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Add several Todo items to the wrapped repository.
+
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        todos = list(todos)
+        try:
+            return self.inner.add_many(todos)
+        finally:
+            self._invalidate(todo.id for todo in todos)
+
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Update several Todo items in the wrapped repository.
+
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        """
+        todos = list(todos)
+        try:
+            return self.inner.update_many(todos)
+        finally:
+            self._invalidate(todo.id for todo in todos)
+
+    def delete_many(self, todo_ids: Iterable[str]):
+        """
+        Delete several Todo items from the wrapped repository.
+
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        """
+        todo_ids = list(todo_ids)
+        try:
+            return self.inner.delete_many(todo_ids)
+        finally:
+            self._invalidate(todo_ids)
+
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        """
+        Full-text search over titles and attachment filenames.
+
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        return [self._attach(summary) for summary in self.inner.search(query, limit)]
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        """
+        List the Todo items matching a query.
+
+        :param query: The filters, sort order and limit.
+        :return: The matching summaries in query order.
+        """
+        return [self._attach(summary) for summary in self.inner.query(query)]
+
+    def stats(self) -> TodoStats:
+        """
+        Count the Todo items in the wrapped repository.
+
+        :return: The counts.
+        """
+        return self.inner.stats()
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the wrapped repository's counters with a count of its items.
+
+        :param repair: Fix the counters if they differ.
+        :return: The counters as they were, and the count.
+        """
+        return self.inner.check_stats(repair)
+
+    def _clear_on_error(self, write, *args, **kwargs) -> List[str]:
+        # Which rows a failed bulk write touched is unknown, so nothing
+        # cached can be trusted
+        try:
+            todo_ids = write(*args, **kwargs)
+        except BaseException:
+            self.cache.items.clear()
+            self.cache.attachments.clear()
+            raise
+        self._invalidate(todo_ids)
+        return todo_ids
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        """
+        Set fields of every Todo item matching a query in the wrapped
+        repository.
+
+        :param query: The filters, sort order and limit.
+        :param changes: The new values, for fields in UPDATABLE_FIELDS.
+        :return: The IDs of the updated items.
+        """
+        return self._clear_on_error(self.inner.update_where, query, **changes)
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        """
+        Delete every Todo item matching a query from the wrapped repository.
+
+        :param query: The filters, sort order and limit.
+        :return: The IDs of the deleted items.
+        """
+        return self._clear_on_error(self.inner.delete_where, query)
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        """
+        Stream a new attachment into the wrapped repository.
+
+        :param todo_id: The ID of the Todo item.
+        :param stream: The new attachment, with its filename and mimetype.
+        :return: The updated Todo item.
+        """
+        try:
+            return self.inner.write_attachment(todo_id, stream)
+        finally:
+            self._invalidate([todo_id])
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read the attachment of a Todo item in chunks, from the cache if it
+        holds the bytes; streamed reads are not added to the cache.
+
+        :param todo_id: The ID of the Todo item.
+        :param chunk_size: The maximum size of each chunk.
+        :return: An iterator over the attachment bytes.
+        """
+        data = self.cache.attachments.get(todo_id)
+        if data is not None:
+            return iter_chunks(data, chunk_size)
+        return self.inner.iter_attachment(todo_id, chunk_size)
+
+    def close(self) -> None:
+        self.inner.close()
@@ -0,0 +1,317 @@
+"""
+This module provides a decorator for any ITodoRepository that publishes
+a change event to a ChangeFeed after every successful write.
+"""
+
+import dataclasses
+import functools
+from concurrent.futures import Future
+from typing import Iterable, Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.changes import ATTACHMENT_FIELDS, CREATED, DELETED, SUMMARY_FIELDS, UPDATED, ChangeFeed, changed_fields
+from domain.interfaces import ITodoRepository
+from infrastructure.repositories import TodoRepository
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage
+from application.query import TodoQuery
+
+class ChangeFeedTodoRepo(TodoRepository):
+    """
+    ChangeFeedTodoRepo wraps another repository and publishes a created,
+    updated or deleted event for each todo it writes.
+
+    Writes to the same todo, and the publishing of their events, happen
+    one at a time, so events reach subscribers in the order the changes
+    were stored. The locks belong to the feed, so this holds across all
+    the repositories publishing to it, e.g. one per session. Updates read the stored version first to tell which
+    fields changed; wrap it above any cache so those reads are cheap.
+    """
+
+    def __init__(self, inner: ITodoRepository, feed: ChangeFeed):
+        """
+        Initialize the repository.
+
+        :param inner: The repository to wrap.
+        :param feed: The feed to publish to, usually shared by all sessions.
+        """
+        self.inner = inner
+        self.feed = feed
+        self.blob_store = getattr(inner, "blob_store", None)
+
+    def _locked(self, todo_ids: Iterable[str]):
+        return self.feed.locked(todo_ids)
+
+    def _locked_all(self):
+        return self.feed.locked_all()
+
+    def _summary(self, todo: TodoItem) -> TodoSummary:
+        return TodoSummary.from_item(todo, functools.partial(self.get_attachment, todo.id))
+
+    def _publish_updates(self, todos: List[TodoItem], old: dict):
+        for todo in todos:
+            previous = old.get(todo.id)
+            if previous is None:
+                continue
+            fields = changed_fields(previous, todo)
+            if fields:
+                self.feed.publish(UPDATED, todo.id, fields, self._summary(todo))
+
+    def add(self, todo: TodoItem):
+        """
+        Add a new Todo item and publish its created event.
+
+        :param todo: The Todo item to be added.
+        :return: The added Todo item.
+        """
+        with self._locked([todo.id]):
+            result = self.inner.add(todo)
+            self.feed.publish(CREATED, todo.id, SUMMARY_FIELDS, self._summary(todo))
+        return result
+
+    def get(self, todo_id: str) -> Optional[TodoItem]:
+        """
+        Get a copy of a Todo item by its ID. In-memory repositories return
+        the stored item itself; a caller changing it in place before
+        update() would leave nothing to compare the update with.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The Todo item, or None if it does not exist.
+        """
+        todo = self.inner.get(todo_id)
+        return dataclasses.replace(todo) if todo is not None else None
+
+    def update(self, todo: TodoItem):
+        """
+        Update an existing Todo item and publish the fields that changed.
+
+        :param todo: The Todo item to be updated.
+        :return: The updated Todo item.
+        """
+        with self._locked([todo.id]):
+            old = self.inner.get(todo.id)
+            result = self.inner.update(todo)
+            self._publish_updates([todo], {todo.id: old})
+        return result
+
+    def delete(self, todo_id: str):
+        """
+        Delete a Todo item and publish its deleted event. Deleting an
+        unknown ID publishes one too; subscribers ignore it.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        """
+        with self._locked([todo_id]):
+            self.inner.delete(todo_id)
+            self.feed.publish(DELETED, todo_id)
+
+    def add_queued(self, todo: TodoItem) -> Future:
+        """
+        Add a new Todo item without waiting for the commit, and publish its
+        created event once it is queued, as add() does.
+
+        :param todo: The Todo item to be added.
+        :return: A future resolving once the insert is committed.
+        """
+        with self._locked([todo.id]):
+            future = self.inner.add_queued(todo)
+            self.feed.publish(CREATED, todo.id, SUMMARY_FIELDS, self._summary(todo))
+        return future
+
+    def update_queued(self, todo: TodoItem) -> Future:
+        """
+        Update a Todo item without waiting for the commit, and publish the
+        fields that changed.
+
+        :param todo: The Todo item to be updated.
+        :return: A future resolving once the update is committed.
+        """
+        with self._locked([todo.id]):
+            old = self.inner.get(todo.id)
+            future = self.inner.update_queued(todo)
+            self._publish_updates([todo], {todo.id: old})
+        return future
+
+    def delete_queued(self, todo_id: str) -> Future:
+        """
+        Delete a Todo item without waiting for the commit, and publish its
+        deleted event.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        :return: A future resolving once the delete is committed.
+        """
+        with self._locked([todo_id]):
+            future = self.inner.delete_queued(todo_id)
+            self.feed.publish(DELETED, todo_id)
+        return future
+
+    def list_all(self) -> List[TodoItem]:
+        """
+        List all Todo items in the wrapped repository.
+
+        :return: A list of all Todo items.
+        """
+        return self.inner.list_all()
+
+    def list_summaries(self) -> List[TodoSummary]:
+        """
+        List all Todo items without loading attachment bytes.
+
+        :return: A list of Todo summaries.
+        """
+        return self.inner.list_summaries()
+
+    def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        """
+        Get the attachment bytes of a Todo item.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        return self.inner.get_attachment(todo_id)
+
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        """
+        List one page of Todo summaries ordered by creation time.
+
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of summaries on the page.
+        :return: The page of summaries and the cursor of the next page.
+        """
+        return self.inner.list_page(cursor, limit)
+
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Add several Todo items and publish a created event for each.
+
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        todos = list(todos)
+        with self._locked(todo.id for todo in todos):
+            result = self.inner.add_many(todos)
+            for todo in todos:
+                self.feed.publish(CREATED, todo.id, SUMMARY_FIELDS, self._summary(todo))
+        return result
+
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Update several Todo items and publish the fields that changed.
+
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        """
+        todos = list(todos)
+        with self._locked(todo.id for todo in todos):
+            old = {todo.id: self.inner.get(todo.id) for todo in todos}
+            result = self.inner.update_many(todos)
+            self._publish_updates(todos, old)
+        return result
+
+    def delete_many(self, todo_ids: Iterable[str]):
+        """
+        Delete several Todo items and publish a deleted event for each ID.
+
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        """
+        todo_ids = list(todo_ids)
+        with self._locked(todo_ids):
+            result = self.inner.delete_many(todo_ids)
+            for todo_id in todo_ids:
+                self.feed.publish(DELETED, todo_id)
+        return result
+
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        """
+        Full-text search over titles and attachment filenames.
+
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        return self.inner.search(query, limit)
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        """
+        List the Todo items matching a query.
+
+        :param query: The filters, sort order and limit.
+        :return: The matching summaries in query order.
+        """
+        return self.inner.query(query)
+
+    def stats(self) -> TodoStats:
+        """
+        Count the Todo items in the wrapped repository.
+
+        :return: The counts.
+        """
+        return self.inner.stats()
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the wrapped repository's counters with a count of its items.
+
+        :param repair: Fix the counters if they differ.
+        :return: The counters as they were, and the count.
+        """
+        return self.inner.check_stats(repair)
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        """
+        Set fields of every Todo item matching a query and publish the
+        fields that changed. Other writes wait until the events are out.
+
+        :param query: The filters, sort order and limit.
+        :param changes: The new values, for fields in UPDATABLE_FIELDS.
+        :return: The IDs of the updated items.
+        """
+        with self._locked_all():
+            old = {summary.id: summary for summary in self.inner.query(query.with_limit(None))}
+            todo_ids = self.inner.update_where(query, **changes)
+            for todo_id in todo_ids:
+                previous = old.get(todo_id)
+                if previous is None:
+                    continue
+                summary = dataclasses.replace(previous, **changes)
+                self.feed.publish(UPDATED, todo_id, changed_fields(previous, summary), summary)
+        return todo_ids
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        """
+        Delete every Todo item matching a query and publish a deleted
+        event for each.
+
+        :param query: The filters, sort order and limit.
+        :return: The IDs of the deleted items.
+        """
+        with self._locked_all():
+            todo_ids = self.inner.delete_where(query)
+            for todo_id in todo_ids:
+                self.feed.publish(DELETED, todo_id)
+        return todo_ids
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        """
+        Stream a new attachment into the wrapped repository and publish
+        the update.
+
+        :param todo_id: The ID of the Todo item.
+        :param stream: The new attachment, with its filename and mimetype.
+        :return: The updated Todo item.
+        """
+        with self._locked([todo_id]):
+            todo = self.inner.write_attachment(todo_id, stream)
+            self.feed.publish(UPDATED, todo_id, ATTACHMENT_FIELDS, self._summary(todo))
+        return todo
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read the attachment of a Todo item in chunks.
+
+        :param todo_id: The ID of the Todo item.
+        :param chunk_size: The maximum size of each chunk.
+        :return: An iterator over the attachment bytes.
+        """
+        return self.inner.iter_attachment(todo_id, chunk_size)
+
+    def close(self) -> None:
+        self.inner.close()
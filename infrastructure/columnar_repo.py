@@ -0,0 +1,613 @@
+"""
+This module provides a compact in-memory implementation of the
+TodoRepository that stores todos column by column in flat arrays instead
+of as one Python object per todo.
+"""
+
+import bisect
+import dataclasses
+import functools
+import re
+import uuid
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from application.models import (
+    TodoItem, TodoStats, TodoSummary, TodoPage, AttachmentHandle, encode_cursor, decode_cursor
+)
+from application.query import count_stats
+from infrastructure.blob_store import BlobStore
+from infrastructure.in_memory_repo import externalize_attachments
+from infrastructure.repositories import TodoRepository
+from infrastructure.search_index import score, tokenize
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Markers in the ID hash table
+_EMPTY = -1
+_DELETED = -2
+_NO_TITLE = 2 ** 64 - 1
+# The arena is compacted once dead titles take more than half of it
+_MIN_COMPACT_BYTES = 1024 * 1024
+# Bytes that end a token in the title arena: anything but ASCII letters and
+# digits or UTF-8 continuation and lead bytes (see tokenize)
+_TOKEN_START = rb"(?<![0-9A-Za-z\x80-\xff])"
+
+
+def _uuid_bytes(todo_id: str) -> Optional[bytes]:
+    # The 16-byte form of a canonical UUID string, or None for other IDs
+    try:
+        value = uuid.UUID(todo_id)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return value.bytes if str(value) == todo_id else None
+
+
+def _format_created(micros: int) -> str:
+    return (_EPOCH + micros * _MICROSECOND).isoformat(" ", "microseconds")
+
+
+def _encode_created(created_at: str) -> Optional[int]:
+    # Microseconds since the epoch for timestamps in utc_timestamp()'s
+    # layout; anything else is kept as a string
+    if not isinstance(created_at, str) or len(created_at) != 26:
+        return None
+    try:
+        micros = (datetime.fromisoformat(created_at) - _EPOCH) // _MICROSECOND
+    except (ValueError, TypeError):
+        return None
+    return micros if _format_created(micros) == created_at else None
+
+
+def _term_pattern(term: str):
+    # Matches the UTF-8 bytes of any text that tokenize() lowercases to a
+    # token starting with term
+    parts = []
+    for char in term:
+        variants = sorted({variant for variant in (char, char.upper(), char.title())
+                           if len(variant) == 1 and variant.lower() == char})
+        encoded = [re.escape(variant.encode("utf-8")) for variant in variants]
+        parts.append(encoded[0] if len(encoded) == 1 else b"(?:" + b"|".join(encoded) + b")")
+    return re.compile(_TOKEN_START + b"".join(parts))
+
+
+def _attachment_stats(attachment: Optional[Tuple]) -> Tuple[int, int]:
+    # (1 if the _attachments entry counts as an attachment, its size), as
+    # has_attachment() and attachment_size() see the todo
+    if attachment is None:
+        return 0, 0
+    _, _, data, digest, size = attachment
+    if data is None and not digest and not size:
+        return 0, 0
+    return 1, size or len(data or b"")
+
+
+def _get_bit(bits: bytearray, row: int) -> bool:
+    return bool(bits[row >> 3] >> (row & 7) & 1)
+
+
+def _set_bit(bits: bytearray, row: int, value: bool):
+    if value:
+        bits[row >> 3] |= 1 << (row & 7)
+    else:
+        bits[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+
+class ColumnarTodoRepo(TodoRepository):
+    """
+    ColumnarTodoRepo keeps each field of every todo in a column indexed
+    by row number:
+
+    - IDs as 16-byte binary UUIDs in one bytearray, found through an
+      open-addressing hash table of row numbers
+    - titles as UTF-8 in one append-only arena, with offsets and lengths
+    - completion and liveness flags as bitsets
+    - creation times as 64-bit microsecond counts
+    - attachments out of line, in a dict holding only rows that have one
+
+    A todo takes well under 100 bytes plus its title, against several
+    hundred for a dict of TodoItem objects. TodoItems and summaries are
+    built on demand when read. IDs and timestamps that are not in the
+    canonical uuid4 / utc_timestamp() form are kept as strings on the
+    side. Search scans the title arena with a regular expression instead
+    of keeping an index.
+    """
+
+    def __init__(self, blob_store: Optional[BlobStore] = None):
+        """
+        Initialize the repository.
+
+        :param blob_store: If given, attachment bytes are kept in the blob
+            store and rows only hold their digest.
+        """
+        self.blob_store = blob_store
+        self._ids = bytearray()
+        self._title_start = array("Q")
+        self._title_len = array("I")
+        self._created = array("q")
+        self._completed = bytearray()
+        self._live = bytearray()
+        self._rows = 0
+        self._count = 0
+        self._free = array("i")
+        # Title arena, each title followed by a newline so tokens never run
+        # into the next title, and the (start, row) of every title written
+        self._text = bytearray()
+        self._garbage = 0
+        self._entry_starts = array("Q")
+        self._entry_rows = array("i")
+        # row -> (filename, mimetype, data, hash, size)
+        self._attachments: Dict[int, Tuple] = {}
+        # Running totals of the live rows for stats()
+        self._completed_count = 0
+        self._attached_count = 0
+        self._attachment_bytes = 0
+        # IDs and timestamps without a compact form
+        self._other_ids: Dict[str, int] = {}
+        self._row_ids: Dict[int, str] = {}
+        self._other_created: Dict[int, str] = {}
+        self._table = array("i", [_EMPTY]) * 8
+        self._table_used = 0
+        # Rows sorted by (created_at, id) for keyset pagination
+        self._order = array("i")
+
+    def __len__(self):
+        return self._count
+
+    # ID hash table
+
+    def _probe(self, key: bytes) -> Tuple[int, int]:
+        # (slot holding key or -1, slot to insert key at)
+        mask = len(self._table) - 1
+        slot = int.from_bytes(key[:8], "little") & mask
+        insert_at = -1
+        while True:
+            row = self._table[slot]
+            if row == _EMPTY:
+                return -1, slot if insert_at < 0 else insert_at
+            if row == _DELETED:
+                if insert_at < 0:
+                    insert_at = slot
+            elif self._ids[row * 16:row * 16 + 16] == key:
+                return slot, slot
+            slot = (slot + 1) & mask
+
+    def _resize_table(self):
+        size = 8
+        while size < self._count * 3:
+            size *= 2
+        self._table = array("i", [_EMPTY]) * size
+        self._table_used = 0
+        mask = size - 1
+        for row in self._live_rows():
+            if row in self._row_ids:
+                continue
+            slot = int.from_bytes(self._ids[row * 16:row * 16 + 8], "little") & mask
+            while self._table[slot] != _EMPTY:
+                slot = (slot + 1) & mask
+            self._table[slot] = row
+            self._table_used += 1
+
+    def _find(self, todo_id: str, key: Optional[bytes] = None) -> int:
+        row = self._other_ids.get(todo_id)
+        if row is not None:
+            return row
+        key = key or _uuid_bytes(todo_id)
+        if key is None:
+            return -1
+        slot, _ = self._probe(key)
+        return self._table[slot] if slot >= 0 else -1
+
+    def _todo_id(self, row: int) -> str:
+        other = self._row_ids.get(row)
+        if other is not None:
+            return other
+        return str(uuid.UUID(bytes=bytes(self._ids[row * 16:row * 16 + 16])))
+
+    # Rows
+
+    def _live_rows(self):
+        live = self._live
+        for row in range(self._rows):
+            if live[row >> 3] >> (row & 7) & 1:
+                yield row
+
+    def _new_row(self, todo_id: str, key: Optional[bytes]) -> int:
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = self._rows
+            self._rows += 1
+            self._ids.extend(bytes(16))
+            self._title_start.append(_NO_TITLE)
+            self._title_len.append(0)
+            self._created.append(0)
+            if row >> 3 >= len(self._live):
+                self._live.append(0)
+                self._completed.append(0)
+        if key is None:
+            self._other_ids[todo_id] = row
+            self._row_ids[row] = todo_id
+        else:
+            self._ids[row * 16:row * 16 + 16] = key
+            if (self._table_used + 1) * 3 > len(self._table) * 2:
+                self._count += 1
+                self._resize_table()
+                self._count -= 1
+            _, slot = self._probe(key)
+            if self._table[slot] == _EMPTY:
+                self._table_used += 1
+            self._table[slot] = row
+        _set_bit(self._live, row, True)
+        self._count += 1
+        return row
+
+    def _free_row(self, row: int):
+        todo_id = self._row_ids.pop(row, None)
+        if todo_id is not None:
+            del self._other_ids[todo_id]
+        else:
+            slot, _ = self._probe(bytes(self._ids[row * 16:row * 16 + 16]))
+            self._table[slot] = _DELETED
+        self._other_created.pop(row, None)
+        self._count_row(row, -1)
+        self._attachments.pop(row, None)
+        self._garbage += self._title_len[row] + 1
+        # No arena entry starts here, so stale entries of the row stop matching
+        self._title_start[row] = _NO_TITLE
+        self._title_len[row] = 0
+        _set_bit(self._live, row, False)
+        _set_bit(self._completed, row, False)
+        self._free.append(row)
+        self._count -= 1
+
+    def _count_row(self, row: int, sign: int):
+        # Add the row to the stats() totals, or take it out with sign -1
+        attached, size = _attachment_stats(self._attachments.get(row))
+        self._completed_count += sign * _get_bit(self._completed, row)
+        self._attached_count += sign * attached
+        self._attachment_bytes += sign * size
+
+    def _title(self, row: int) -> str:
+        start = self._title_start[row]
+        return self._text[start:start + self._title_len[row]].decode("utf-8")
+
+    def _set_title(self, row: int, title: str):
+        data = title.encode("utf-8")
+        start, length = self._title_start[row], self._title_len[row]
+        if length == len(data) and self._text[start:start + length] == data:
+            return
+        if length:
+            self._garbage += length + 1
+        start = len(self._text)
+        self._text += data
+        self._text += b"\n"
+        self._title_start[row] = start
+        self._title_len[row] = len(data)
+        self._entry_starts.append(start)
+        self._entry_rows.append(row)
+
+    def _compact_text(self):
+        # Rewrite the arena with only the current titles, in row order
+        text = bytearray()
+        starts, rows = array("Q"), array("i")
+        for row in self._live_rows():
+            start, length = self._title_start[row], self._title_len[row]
+            self._title_start[row] = len(text)
+            starts.append(len(text))
+            rows.append(row)
+            text += self._text[start:start + length]
+            text += b"\n"
+        self._text, self._entry_starts, self._entry_rows = text, starts, rows
+        self._garbage = 0
+
+    def _created_at(self, row: int) -> str:
+        other = self._other_created.get(row)
+        return other if other is not None else _format_created(self._created[row])
+
+    def _key(self, row: int) -> Tuple[str, str]:
+        return self._created_at(row), self._todo_id(row)
+
+    def _order_position(self, key: Tuple[str, str], right: bool = False) -> int:
+        # bisect over self._order by each row's (created_at, id)
+        low, high = 0, len(self._order)
+        while low < high:
+            middle = (low + high) // 2
+            current = self._key(self._order[middle])
+            if current < key or (right and current == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _unorder(self, row: int):
+        position = self._order_position(self._key(row))
+        while self._order[position] != row:
+            position += 1
+        del self._order[position]
+
+    def _is_last(self, row: int, micros: Optional[int], key: Optional[bytes], todo: TodoItem) -> bool:
+        # Whether the todo sorts after every ordered row. Canonical
+        # timestamps and UUIDs order like their compact forms, which are
+        # cheaper to compare than rebuilt strings.
+        last = self._order[-1]
+        if micros is not None and key is not None and last not in self._other_created and last not in self._row_ids:
+            return (self._created[last], self._ids[last * 16:last * 16 + 16]) <= (micros, key)
+        return self._key(last) <= (todo.created_at, todo.id)
+
+    def _write(self, row: int, todo: TodoItem, new: bool, key: Optional[bytes]):
+        # New rows are blank, so this only takes out what an update replaces
+        self._count_row(row, -1)
+        if not new:
+            old_key = self._key(row)
+            if old_key != (todo.created_at, todo.id):
+                self._unorder(row)
+                new = True
+        micros = _encode_created(todo.created_at)
+        if micros is None:
+            self._other_created[row] = todo.created_at
+            self._created[row] = 0
+        else:
+            self._other_created.pop(row, None)
+            self._created[row] = micros
+        self._set_title(row, todo.title)
+        _set_bit(self._completed, row, todo.completed)
+        if todo.attachment_data is not None or todo.attachment_hash or todo.attachment_filename:
+            self._attachments[row] = (
+                todo.attachment_filename, todo.attachment_mimetype, todo.attachment_data,
+                todo.attachment_hash, todo.attachment_size
+            )
+        else:
+            self._attachments.pop(row, None)
+        self._count_row(row, 1)
+        if new:
+            # Todos mostly arrive in creation order, so check the end first
+            if not self._order or self._is_last(row, micros, key, todo):
+                self._order.append(row)
+            else:
+                position = self._order_position((todo.created_at, todo.id), right=True)
+                self._order.insert(position, row)
+
+    def _store(self, todo: TodoItem):
+        key = _uuid_bytes(todo.id)
+        row = self._find(todo.id, key)
+        if row < 0:
+            self._write(self._new_row(todo.id, key), todo, True, key)
+        else:
+            self._write(row, todo, False, key)
+
+    def _item(self, row: int, todo_id: Optional[str] = None, hydrate: bool = True) -> TodoItem:
+        filename, mimetype, data, digest, size = self._attachments.get(row, (None, None, None, None, 0))
+        if data is None and digest and self.blob_store and hydrate:
+            data = self.blob_store.open(digest)
+        return TodoItem(
+            id=todo_id or self._todo_id(row),
+            title=self._title(row),
+            completed=_get_bit(self._completed, row),
+            attachment_filename=filename,
+            attachment_mimetype=mimetype,
+            attachment_data=data,
+            created_at=self._created_at(row),
+            attachment_hash=digest,
+            attachment_size=size
+        )
+
+    def _summary(self, row: int) -> TodoSummary:
+        todo_id = self._todo_id(row)
+        filename, mimetype, data, digest, size = self._attachments.get(row, (None, None, None, None, 0))
+        size = size or (len(data) if data else 0)
+        return TodoSummary(
+            id=todo_id,
+            title=self._title(row),
+            completed=_get_bit(self._completed, row),
+            attachment_filename=filename,
+            attachment_mimetype=mimetype,
+            attachment_size=size,
+            created_at=self._created_at(row),
+            attachment_hash=digest,
+            attachment=AttachmentHandle(functools.partial(self.get_attachment, todo_id), size) if size else None
+        )
+
+    # TodoRepository
+
+    def add(self, todo: TodoItem):
+        """
+        Add a new Todo item to the repository.
+
+        :param todo: The Todo item to be added.
+        :return: The added Todo item.
+        """
+        self.add_many([todo])
+        return todo
+
+    def get(self, todo_id: str) -> Optional[TodoItem]:
+        """
+        Get a Todo item by its ID.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The Todo item with the specified ID, or None.
+        """
+        row = self._find(todo_id)
+        return self._item(row, todo_id) if row >= 0 else None
+
+    def update(self, todo: TodoItem):
+        """
+        Update an existing Todo item in the repository.
+
+        :param todo: The Todo item to be updated.
+        :return: The updated Todo item.
+        :raises ValueError: If the Todo item is not found.
+        """
+        self.update_many([todo])
+        return todo
+
+    def delete(self, todo_id: str):
+        """
+        Delete a Todo item from the repository by its ID.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        """
+        self.delete_many([todo_id])
+
+    def add_many(self, todos):
+        """
+        Add several Todo items.
+
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        todos = list(todos)
+        for todo in externalize_attachments(self.blob_store, todos):
+            self._store(todo)
+        self._maybe_compact()
+        return todos
+
+    def update_many(self, todos):
+        """
+        Update several existing Todo items.
+
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        :raises ValueError: If any of the Todo items is not found; nothing is updated then.
+        """
+        todos = list(todos)
+        rows = [self._find(todo.id) for todo in todos]
+        if any(row < 0 for row in rows):
+            raise ValueError("Todo not found")
+        old = {todo.id: self._item(row, todo.id, hydrate=False) for todo, row in zip(todos, rows)}
+        for todo in externalize_attachments(self.blob_store, todos, old):
+            self._store(todo)
+        self._maybe_compact()
+        return todos
+
+    def delete_many(self, todo_ids):
+        """
+        Delete several Todo items by their IDs. Unknown IDs are ignored.
+
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        :return: The IDs that were actually deleted.
+        """
+        deleted, released = [], []
+        for todo_id in todo_ids:
+            row = self._find(todo_id)
+            if row < 0:
+                continue
+            _, _, data, digest, _ = self._attachments.get(row, (None, None, None, None, 0))
+            if data is None and digest:
+                released.append(digest)
+            self._unorder(row)
+            self._free_row(row)
+            deleted.append(todo_id)
+        if self.blob_store and released:
+            self.blob_store.release_many(released)
+        self._maybe_compact()
+        return deleted
+
+    def _maybe_compact(self):
+        if self._garbage > _MIN_COMPACT_BYTES and self._garbage * 2 > len(self._text):
+            self._compact_text()
+
+    def list_all(self) -> List[TodoItem]:
+        """
+        List all Todo items in the repository.
+
+        :return: A list of all Todo items.
+        """
+        return [self._item(row) for row in self._live_rows()]
+
+    def list_summaries(self) -> List[TodoSummary]:
+        """
+        List all Todo items without copying their attachment bytes.
+
+        :return: A list of summaries with lazy attachment handles.
+        """
+        return [self._summary(row) for row in self._live_rows()]
+
+    def get_attachment(self, todo_id: str):
+        """
+        Get the attachment bytes of a Todo item.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        row = self._find(todo_id)
+        if row < 0 or row not in self._attachments:
+            return None
+        _, _, data, digest, _ = self._attachments[row]
+        if data is None and digest and self.blob_store:
+            return self.blob_store.open(digest)
+        return data
+
+    def list_page(self, cursor=None, limit=50) -> TodoPage:
+        """
+        List one page of Todo summaries ordered by creation time.
+
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of items on the page.
+        :return: The page of summaries and the cursor of the following page.
+        """
+        start = self._order_position(decode_cursor(cursor), right=True) if cursor else 0
+        rows = self._order[start:start + limit]
+        items = [self._summary(row) for row in rows]
+        next_cursor = None
+        if rows and start + limit < len(self._order):
+            next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+        return TodoPage(items=items, next_cursor=next_cursor)
+
+    def _title_rows(self, term: str) -> set:
+        # Rows whose current title has a token starting with term
+        pattern = _term_pattern(term)
+        rows = set()
+        for match in pattern.finditer(self._text):
+            entry = bisect.bisect_right(self._entry_starts, match.start()) - 1
+            row = self._entry_rows[entry]
+            if self._title_start[row] == self._entry_starts[entry] and _get_bit(self._live, row):
+                rows.add(row)
+        return rows
+
+    def search(self, query, limit=50) -> List[TodoSummary]:
+        """
+        Full-text search over titles and attachment filenames.
+
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        filenames = {row: set(tokenize(attachment[0])) for row, attachment in self._attachments.items() if attachment[0]}
+        candidates = None
+        for term in set(terms):
+            rows = self._title_rows(term)
+            rows.update(row for row, tokens in filenames.items()
+                        if any(token.startswith(term) for token in tokens))
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return []
+        ranked = sorted(
+            candidates,
+            key=lambda row: -score(terms, set(tokenize(self._title(row))), filenames.get(row, set()))
+        )
+        return [self._summary(row) for row in ranked[:limit]]
+
+    def stats(self) -> TodoStats:
+        """
+        Count the Todo items from running totals kept up to date on every
+        write.
+
+        :return: The counts.
+        """
+        return TodoStats(self._count, self._completed_count, self._attached_count, self._attachment_bytes)
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare stats() with a count of every row.
+
+        :param repair: Reset the running totals to the count if they differ.
+        :return: The totals as they were, and the count.
+        """
+        stats, counted = self.stats(), count_stats(self._summary(row) for row in self._live_rows())
+        if repair and stats != counted:
+            _, self._completed_count, self._attached_count, self._attachment_bytes = dataclasses.astuple(counted)
+        return stats, counted
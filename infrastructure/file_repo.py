@@ -1,43 +1,133 @@
+import base64
+import dataclasses
 import json
+import threading
 from pathlib import Path
-from infrastructure.repositories import TodoRepository
+from typing import Optional
+from infrastructure.blob_store import BlobStore
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from infrastructure.journal import Journal
 from application.models import TodoItem
 
-class FileTodoRepo(TodoRepository):
-    def __init__(self, file_path: str = "todos.json"):
+_FIELDS = [f.name for f in dataclasses.fields(TodoItem)]
+
+def _todo_to_record(todo: TodoItem) -> dict:
+    record = {name: getattr(todo, name) for name in _FIELDS}
+    # JSON has no bytes type, so attachments are stored base64-encoded
+    if todo.attachment_data is not None:
+        record["attachment_data"] = base64.b64encode(todo.attachment_data).decode("ascii")
+    return record
+
+def _todo_from_record(record: dict) -> TodoItem:
+    record = dict(record)
+    if isinstance(record.get("attachment_data"), str):
+        record["attachment_data"] = base64.b64decode(record["attachment_data"])
+    return TodoItem(**record)
+
+class FileTodoRepo(InMemoryTodoRepo):
+    """
+    File-backed repository. By default every mutation rewrites the whole
+    JSON document; with journal=True each mutation instead appends one
+    record to a log next to it (todos.json -> todos.jsonl), which is
+    replayed at startup and compacted in the background once more than
+    compact_ratio of its records are dead.
+    """
+
+    def __init__(
+        self,
+        file_path: str = "todos.json",
+        journal: bool = False,
+        compact_ratio: float = 0.5,
+        compact_min_records: int = 1000,
+        blob_store: Optional[BlobStore] = None
+    ):
+        super().__init__(blob_store)
         self.file_path = Path(file_path)
-        self.todos = {}
+        self.journal = Journal(self.file_path.with_suffix(".jsonl")) if journal else None
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+        self._compaction = None
         self._load()
 
     def _load(self):
-        if self.file_path.exists():
-            with open(self.file_path, "r") as f:
-                data = json.load(f)
-                self.todos = {todo["id"]: TodoItem(**todo) for todo in data}
+        if self.journal:
+            self._load_journal()
+        elif self.file_path.exists():
+            self._load_snapshot()
+
+    def _load_snapshot(self):
+        with open(self.file_path, "r") as f:
+            data = json.load(f)
+            for todo in data:
+                self._store(_todo_from_record(todo))
+
+    def _load_journal(self):
+        migrate = not self.journal.path.exists() and self.file_path.exists()
+        if migrate:
+            # First start in journal mode: seed the log from the JSON document
+            self._load_snapshot()
+        for record in self.journal.replay():
+            if record["op"] == "put":
+                self._store(_todo_from_record(record["todo"]))
+            elif record["op"] == "delete":
+                self._remove(record["id"])
+        self.journal.open()
+        if migrate:
+            self.compact()
 
     def _save(self):
         with open(self.file_path, "w") as f:
-            json.dump([todo.__dict__ for todo in self.todos.values()], f, indent=4)
-
-    def add(self, todo: TodoItem):
-        self.todos[todo.id] = todo
-        self._save()
-        return todo
-
-    def get(self, todo_id: str) -> TodoItem:
-        return self.todos.get(todo_id)
-
-    def update(self, todo: TodoItem):
-        if todo.id not in self.todos:
-            raise ValueError("Todo not found")
-        self.todos[todo.id] = todo
-        self._save()
-        return todo
-
-    def delete(self, todo_id: str):
-        if todo_id in self.todos:
-            del self.todos[todo_id]
+            json.dump([_todo_to_record(todo) for todo in self.todos.values()], f, indent=4)
+
+    def _journal_snapshot(self):
+        todos = list(self.todos.values())
+        return ({"op": "put", "todo": _todo_to_record(todo)} for todo in todos)
+
+    def _persist(self, records: list):
+        if not self.journal:
             self._save()
+            return
+        self.journal.append_many(records)
+        total = self.journal.record_count
+        dead = total - len(self.todos)
+        if (
+            total >= self.compact_min_records
+            and dead / total > self.compact_ratio
+            and not self.journal.compacting
+        ):
+            self._compaction = threading.Thread(target=self.compact, daemon=True)
+            self._compaction.start()
+
+    def compact(self):
+        """Rewrite the journal so it only holds the live todos."""
+        if self.journal:
+            self.journal.compact(self._journal_snapshot)
+
+    def close(self):
+        """Wait for a running compaction and close the journal."""
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+        if self.journal:
+            self.journal.close()
+
+    # Single-item add/update/delete go through these via InMemoryTodoRepo,
+    # so a batch costs one _save() or one journal write. Records are built
+    # from the stored item, which only holds the attachment digest when a
+    # blob store is in use.
+
+    def add_many(self, todos):
+        todos = super().add_many(todos)
+        self._persist([{"op": "put", "todo": _todo_to_record(self.todos[todo.id])} for todo in todos])
+        return todos
+
+    def update_many(self, todos):
+        todos = super().update_many(todos)
+        self._persist([{"op": "put", "todo": _todo_to_record(self.todos[todo.id])} for todo in todos])
+        return todos
 
-    def list_all(self):
-        return list(self.todos.values())
+    def delete_many(self, todo_ids):
+        deleted = super().delete_many(todo_ids)
+        if deleted:
+            self._persist([{"op": "delete", "id": todo_id} for todo_id in deleted])
+        return deleted
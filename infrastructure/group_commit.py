@@ -0,0 +1,259 @@
+"""
+This module provides GroupCommitWriter, which queues single-todo writes
+and commits them in groups: a writer thread collects the writes that
+arrive within a short window and commits them in one transaction, so a
+burst of small writes (e.g. checkbox toggles from many sessions) shares
+one commit instead of paying for one each.
+"""
+
+import collections
+import dataclasses
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+from application.models import TodoItem
+
+logger = logging.getLogger(__name__)
+
+# Durability levels of SQLiteTodoRepo.add(), update() and delete()
+IMMEDIATE = "immediate"  # commit in their own transaction before returning
+GROUPED = "grouped"      # queue, and return once the group holding them committed
+ASYNC = "async"          # queue and return; the last window is lost if the process dies
+DURABILITY = (IMMEDIATE, GROUPED, ASYNC)
+
+ADD = "add"
+UPDATE = "update"
+DELETE = "delete"
+# Resolved once every write queued before it is committed
+_FLUSH = "flush"
+
+
+@dataclass(eq=False)
+class Write:
+    """
+    One queued write. todo is a copy of the item added or updated, and
+    None for deletes; future resolves with None once the write is
+    committed, or with its error.
+    """
+    kind: str
+    todo_id: Optional[str]
+    todo: Optional[TodoItem] = None
+    future: Future = field(default_factory=Future, repr=False)
+
+
+def coalesce(writes: List[Write]):
+    """
+    Drop updates that a later update of the same todo in the batch
+    overwrites anyway. Adds and deletes are kept in order; an update is
+    only merged with the next one if no add or delete of that todo comes
+    between them.
+
+    :param writes: The writes of one batch, in queue order.
+    :return: The writes to commit, and the dropped ones mapped to the
+        write whose outcome they share.
+    """
+    kept, carried, later = [], {}, {}
+    for write in reversed(writes):
+        if write.kind == UPDATE:
+            carrier = later.get(write.todo_id)
+            if carrier is not None:
+                carried[write] = carrier
+                continue
+            later[write.todo_id] = write
+        else:
+            later.pop(write.todo_id, None)
+        kept.append(write)
+    kept.reverse()
+    return kept, carried
+
+
+class GroupCommitWriter:
+    """
+    GroupCommitWriter commits queued writes through a repository's
+    write_batch() on one writer thread, in queue order.
+
+    The first write of a group waits up to window seconds for others to
+    join it, or until max_batch have; flush() cuts the wait short. If a
+    group fails, its writes are committed again one per transaction, so
+    only the bad ones fail. Queued writes are visible through pending(),
+    which lets repositories answer reads with them before they commit.
+
+    One writer is shared by every repository over the same database, so
+    writes from all sessions end up in the same groups.
+    """
+
+    def __init__(self, repository, window: float = 0.005, max_batch: int = 256, max_pending: int = 10000):
+        """
+        Initialize the writer and start its thread.
+
+        :param repository: The repository whose write_batch() commits each
+            group, usually a SQLiteTodoRepo without a writer of its own.
+        :param window: Seconds the first write of a group waits for more.
+        :param max_batch: The most writes committed in one transaction.
+        :param max_pending: The number of queued writes at which callers
+            wait for the writer to catch up.
+        """
+        self.repository = repository
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._writes: Deque[Write] = collections.deque()
+        # The latest queued write of each todo, until it is committed
+        self._pending: Dict[str, Write] = {}
+        # Writes queued or being committed, and flushes queued
+        self._unfinished = 0
+        self._flushes = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="todo-group-commit", daemon=True)
+        self._thread.start()
+
+    def _submit(self, kind: str, todo_id: str, todo: Optional[TodoItem] = None) -> Future:
+        # Queued in the same critical section that records it as pending,
+        # so pending() always shows the write that is committed last
+        write = Write(kind, todo_id, dataclasses.replace(todo) if todo is not None else None)
+        with self._cond:
+            while len(self._writes) >= self.max_pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Group commit writer is closed")
+            self._writes.append(write)
+            self._pending[todo_id] = write
+            self._unfinished += 1
+            self._cond.notify_all()
+        return write.future
+
+    def add(self, todo: TodoItem) -> Future:
+        """
+        Queue the insert of a Todo item. The item is copied, so the caller
+        may change it once this returns.
+
+        :param todo: The Todo item to be added.
+        :return: A future resolving once the insert is committed.
+        :raises RuntimeError: If the writer is closed.
+        """
+        return self._submit(ADD, todo.id, todo)
+
+    def update(self, todo: TodoItem) -> Future:
+        """
+        Queue the update of a Todo item. The item is copied, so the caller
+        may change it once this returns.
+
+        :param todo: The Todo item to be updated.
+        :return: A future resolving once the update is committed.
+        :raises RuntimeError: If the writer is closed.
+        """
+        return self._submit(UPDATE, todo.id, todo)
+
+    def delete(self, todo_id: str) -> Future:
+        """
+        Queue the delete of a Todo item.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        :return: A future resolving once the delete is committed.
+        :raises RuntimeError: If the writer is closed.
+        """
+        return self._submit(DELETE, todo_id)
+
+    def pending(self, todo_id: str) -> Optional[Write]:
+        """
+        Get the latest queued write of a todo.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The write, or None if the todo has no uncommitted write.
+        """
+        with self._cond:
+            return self._pending.get(todo_id)
+
+    def has_pending(self, todo_id: Optional[str] = None) -> bool:
+        """
+        Whether writes are queued or being committed.
+
+        :param todo_id: Only consider the writes of this todo.
+        """
+        with self._cond:
+            return todo_id in self._pending if todo_id is not None else self._unfinished > 0
+
+    def flush(self) -> Future:
+        """
+        Commit the queued writes without waiting for the rest of the window.
+
+        :return: A future resolving with None once every write queued
+            before the call is committed or has failed.
+        """
+        marker = Write(_FLUSH, None)
+        with self._cond:
+            if self._unfinished == 0:
+                marker.future.set_result(None)
+                return marker.future
+            self._writes.append(marker)
+            self._flushes += 1
+            self._cond.notify_all()
+        return marker.future
+
+    def close(self):
+        """Stop accepting writes, commit the queued ones and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _next_batch(self) -> Optional[List[Write]]:
+        with self._cond:
+            while not self._writes and not self._closed:
+                self._cond.wait()
+            if not self._writes:
+                return None
+            deadline = time.monotonic() + self.window
+            while len(self._writes) < self.max_batch and not self._flushes and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._writes.popleft() for _ in range(min(self.max_batch, len(self._writes)))]
+            self._flushes -= sum(1 for write in batch if write.kind == _FLUSH)
+            # Callers waiting for room in the queue
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._commit(batch)
+
+    def _commit(self, batch: List[Write]):
+        writes = [write for write in batch if write.kind != _FLUSH]
+        kept, carried = coalesce(writes)
+        errors = {}
+        if kept:
+            try:
+                self.repository.write_batch(kept)
+            except Exception as err:
+                if len(kept) == 1:
+                    errors[kept[0]] = err
+                else:
+                    # One bad write must not fail the others in its group
+                    for write in kept:
+                        try:
+                            self.repository.write_batch([write])
+                        except Exception as single_err:
+                            errors[write] = single_err
+        with self._cond:
+            for write in writes:
+                if self._pending.get(write.todo_id) is write:
+                    del self._pending[write.todo_id]
+            self._unfinished -= len(writes)
+        # Resolved without the lock, so callbacks may queue more writes
+        for write in batch:
+            error = errors.get(carried.get(write, write))
+            if error is None:
+                write.future.set_result(None)
+            else:
+                if write in errors:
+                    logger.error("Queued %s of todo %s failed: %s", write.kind, write.todo_id, error)
+                write.future.set_exception(error)
@@ -3,8 +3,47 @@ This module provides an in-memory implementation of the TodoRepository
 for managing Todo items.
 """
 
+import bisect
+import dataclasses
+import functools
+from typing import Callable, List, Optional, Tuple
+from infrastructure.blob_store import BlobStore
 from infrastructure.repositories import TodoRepository
-from application.models import TodoItem
+from infrastructure.search_index import SearchIndex
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage, encode_cursor, decode_cursor
+from application.query import (
+    TodoQuery, attachment_size, check_changes, count_stats, has_attachment, needs_change, prefix_end
+)
+
+def externalize_attachments(blob_store: Optional[BlobStore], todos, old=None):
+    """
+    Move the attachment bytes of todos being written into the blob store.
+
+    :param blob_store: The blob store, or None to keep the bytes inline.
+    :param todos: The Todo items being written.
+    :param old: The stored versions they replace, by ID, if any.
+    :return: The items to keep in memory, without attachment bytes.
+    """
+    for todo in todos:
+        todo.fill_attachment_meta()
+    if not blob_store:
+        return todos
+    old = old or {}
+    puts, released, stored = [], [], []
+    for todo in todos:
+        previous = old.get(todo.id)
+        old_hash = previous.attachment_hash if previous and previous.attachment_data is None else None
+        if todo.attachment_hash != old_hash:
+            if todo.attachment_data is not None:
+                puts.append((todo.attachment_data, todo.attachment_hash))
+            if old_hash:
+                released.append(old_hash)
+        if todo.attachment_data is not None:
+            todo = dataclasses.replace(todo, attachment_data=None)
+        stored.append(todo)
+    blob_store.put_many(puts)
+    blob_store.release_many(released)
+    return stored
 
 class InMemoryTodoRepo(TodoRepository):
     """
@@ -12,9 +51,99 @@ class InMemoryTodoRepo(TodoRepository):
     for managing Todo items in memory.
     """
 
-    def __init__(self):
-        """Initialize the in-memory repository."""
+    def __init__(self, blob_store: Optional[BlobStore] = None):
+        """
+        Initialize the in-memory repository.
+        
+        :param blob_store: If given, attachment bytes are kept in the blob
+            store and todos only hold their digest.
+        """
         self.todos = {}
+        self.blob_store = blob_store
+        # Sorted (created_at, id) keys for keyset pagination, and the key
+        # each todo was indexed under so moves can be undone.
+        self._order = []
+        self._keys = {}
+        self._search = SearchIndex()
+        # Secondary indexes for query(): IDs by completed state, with an
+        # attachment and by mimetype, and sorted (title, id) keys for
+        # title prefixes and title order
+        self._completed = {True: set(), False: set()}
+        self._attached = set()
+        self._mimetypes = {}
+        self._titles = []
+        # stats() reads the index sizes; only the attachment bytes need a
+        # counter of their own
+        self._attachment_bytes = 0
+
+    def _index(self, todo: TodoItem):
+        key = (todo.created_at, todo.id)
+        old_key = self._keys.get(todo.id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._unindex(todo.id)
+        bisect.insort(self._order, key)
+        self._keys[todo.id] = key
+
+    def _unindex(self, todo_id: str):
+        key = self._keys.pop(todo_id, None)
+        if key is not None:
+            del self._order[bisect.bisect_left(self._order, key)]
+
+    def _index_fields(self, todo: TodoItem):
+        self._completed[todo.completed].add(todo.id)
+        if has_attachment(todo):
+            self._attached.add(todo.id)
+            self._attachment_bytes += attachment_size(todo)
+        if todo.attachment_mimetype is not None:
+            self._mimetypes.setdefault(todo.attachment_mimetype, set()).add(todo.id)
+
+    def _unindex_fields(self, todo: TodoItem):
+        self._completed[todo.completed].discard(todo.id)
+        if todo.id in self._attached:
+            self._attached.discard(todo.id)
+            self._attachment_bytes -= attachment_size(todo)
+        ids = self._mimetypes.get(todo.attachment_mimetype)
+        if ids is not None:
+            ids.discard(todo.id)
+            if not ids:
+                del self._mimetypes[todo.attachment_mimetype]
+
+    def _store(self, todo: TodoItem):
+        old = self.todos.get(todo.id)
+        self.todos[todo.id] = todo
+        self._index(todo)
+        if old is not None:
+            self._unindex_fields(old)
+        self._index_fields(todo)
+        if old is None or old.title != todo.title:
+            if old is not None:
+                del self._titles[bisect.bisect_left(self._titles, (old.title, old.id))]
+            bisect.insort(self._titles, (todo.title, todo.id))
+        self._search.add(todo.id, todo.title, todo.attachment_filename)
+
+    def _remove(self, todo_id: str) -> Optional[TodoItem]:
+        todo = self.todos.pop(todo_id, None)
+        if todo is not None:
+            self._unindex(todo_id)
+            self._unindex_fields(todo)
+            del self._titles[bisect.bisect_left(self._titles, (todo.title, todo.id))]
+            self._search.remove(todo_id)
+        return todo
+
+    def _externalize(self, todos, old=None):
+        return externalize_attachments(self.blob_store, todos, old)
+
+    def _hydrate(self, todo: Optional[TodoItem]) -> Optional[TodoItem]:
+        # Always a copy: a caller changing it in place before update() must
+        # not change the stored item, whose old values the indexes and
+        # counters are unindexed by
+        if todo is None:
+            return None
+        if todo.attachment_data is not None or not todo.attachment_hash or not self.blob_store:
+            return dataclasses.replace(todo)
+        return dataclasses.replace(todo, attachment_data=self.blob_store.open(todo.attachment_hash))
 
     def add(self, todo: TodoItem):
         """
@@ -23,7 +152,7 @@ class InMemoryTodoRepo(TodoRepository):
         :param todo: The Todo item to be added.
         :return: The added Todo item.
         """
-        self.todos[todo.id] = todo
+        self.add_many([todo])
         return todo
 
     def get(self, todo_id: str) -> TodoItem:
@@ -33,7 +162,7 @@ class InMemoryTodoRepo(TodoRepository):
         :param todo_id: The ID of the Todo item.
         :return: The Todo item with the specified ID.
         """
-        return self.todos.get(todo_id)
+        return self._hydrate(self.todos.get(todo_id))
 
     def update(self, todo: TodoItem):
         """
@@ -43,9 +172,7 @@ class InMemoryTodoRepo(TodoRepository):
         :return: The updated Todo item.
         :raises ValueError: If the Todo item is not found.
         """
-        if todo.id not in self.todos:
-            raise ValueError("Todo not found")
-        self.todos[todo.id] = todo
+        self.update_many([todo])
         return todo
 
     def delete(self, todo_id: str):
@@ -54,8 +181,53 @@ class InMemoryTodoRepo(TodoRepository):
         
         :param todo_id: The ID of the Todo item to be deleted.
         """
-        if todo_id in self.todos:
-            del self.todos[todo_id]
+        self.delete_many([todo_id])
+
+    def add_many(self, todos):
+        """
+        Add several Todo items.
+        
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        todos = list(todos)
+        for todo in self._externalize(todos):
+            self._store(dataclasses.replace(todo))
+        return todos
+
+    def update_many(self, todos):
+        """
+        Update several existing Todo items.
+        
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        :raises ValueError: If any of the Todo items is not found; nothing is updated then.
+        """
+        todos = list(todos)
+        if any(todo.id not in self.todos for todo in todos):
+            raise ValueError("Todo not found")
+        for todo in self._externalize(todos, self.todos):
+            self._store(dataclasses.replace(todo))
+        return todos
+
+    def delete_many(self, todo_ids):
+        """
+        Delete several Todo items by their IDs. Unknown IDs are ignored.
+        
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        :return: The IDs that were actually deleted.
+        """
+        deleted, released = [], []
+        for todo_id in todo_ids:
+            todo = self._remove(todo_id)
+            if todo is None:
+                continue
+            deleted.append(todo_id)
+            if todo.attachment_data is None and todo.attachment_hash:
+                released.append(todo.attachment_hash)
+        if self.blob_store and released:
+            self.blob_store.release_many(released)
+        return deleted
 
     def list_all(self):
         """
@@ -63,4 +235,168 @@ class InMemoryTodoRepo(TodoRepository):
         
         :return: A list of all Todo items.
         """
-        return list(self.todos.values())
+        return [self._hydrate(todo) for todo in self.todos.values()]
+
+    def _summary(self, todo: TodoItem) -> TodoSummary:
+        return TodoSummary.from_item(todo, functools.partial(self.get_attachment, todo.id))
+
+    def list_summaries(self):
+        """
+        List all Todo items without copying their attachment bytes.
+        
+        :return: A list of summaries with lazy attachment handles.
+        """
+        return [self._summary(todo) for todo in self.todos.values()]
+
+    def get_attachment(self, todo_id: str):
+        """
+        Get the attachment bytes of a Todo item.
+        
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        todo = self._hydrate(self.todos.get(todo_id))
+        return todo.attachment_data if todo else None
+
+    def list_page(self, cursor=None, limit=50):
+        """
+        List one page of Todo summaries ordered by creation time.
+        
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of items on the page.
+        :return: The page of summaries and the cursor of the following page.
+        """
+        start = bisect.bisect_right(self._order, decode_cursor(cursor)) if cursor else 0
+        keys = self._order[start:start + limit]
+        items = [self._summary(self.todos[todo_id]) for _, todo_id in keys]
+        next_cursor = None
+        if keys and start + limit < len(self._order):
+            next_cursor = encode_cursor(*keys[-1])
+        return TodoPage(items=items, next_cursor=next_cursor)
+
+    def search(self, query, limit=50):
+        """
+        Full-text search over titles and attachment filenames.
+        
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        return [self._summary(self.todos[todo_id]) for todo_id in self._search.search(query, limit)]
+
+    @staticmethod
+    def _range(keys: list, start: Optional[str], end: Optional[str]) -> Tuple[int, int]:
+        # The positions of the sorted (value, id) keys with start <= value < end
+        lo = bisect.bisect_left(keys, (start,)) if start is not None else 0
+        hi = bisect.bisect_left(keys, (end,)) if end is not None else len(keys)
+        return lo, max(lo, hi)
+
+    def _select(self, query: TodoQuery, accept: Optional[Callable[[TodoItem], bool]] = None) -> List[TodoItem]:
+        """
+        The stored todos matching a query and accept, in query order. The
+        smallest candidate set among the indexes is read; if that is the
+        sorted index the query orders by, it is walked in order and the
+        walk stops at the limit.
+        """
+        sets = []
+        if query.ids is not None:
+            sets.append(query.ids)
+        if query.completed is not None:
+            sets.append(self._completed[query.completed])
+        if query.has_attachment:
+            sets.append(self._attached)
+        if query.mimetype is not None:
+            if query.mimetype_prefix:
+                sets.append(set().union(*(ids for mimetype, ids in self._mimetypes.items()
+                                          if mimetype.startswith(query.mimetype))))
+            else:
+                sets.append(self._mimetypes.get(query.mimetype, set()))
+        ranges = {
+            "created_at": (self._order, self._range(self._order, query.created_from, query.created_to)),
+            "title": (self._titles, self._range(
+                self._titles, query.title_prefix,
+                prefix_end(query.title_prefix) if query.title_prefix is not None else None
+            )),
+        }
+        keys, (lo, hi) = ranges[query.sort_field]
+        smallest = min(sets, key=len, default=None)
+        other_keys, (other_lo, other_hi) = next(value for name, value in ranges.items() if name != query.sort_field)
+        if other_hi - other_lo < min(hi - lo, len(smallest) if smallest is not None else hi - lo):
+            smallest = [todo_id for _, todo_id in other_keys[other_lo:other_hi]]
+
+        def wanted(todo):
+            return query.matches(todo) and (accept is None or accept(todo))
+
+        if smallest is None or len(smallest) >= hi - lo:
+            positions = range(hi - 1, lo - 1, -1) if query.descending else range(lo, hi)
+            found = []
+            for position in positions:
+                if query.limit is not None and len(found) >= query.limit:
+                    break
+                todo = self.todos[keys[position][1]]
+                if wanted(todo):
+                    found.append(todo)
+            return found
+        todos = [self.todos[todo_id] for todo_id in smallest if todo_id in self.todos]
+        found = sorted((todo for todo in todos if wanted(todo)), key=query.sort_key, reverse=query.descending)
+        return found if query.limit is None else found[:query.limit]
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        """
+        List the Todo items matching a query, using the secondary indexes.
+        
+        :param query: The filters, sort order and limit.
+        :return: The matching summaries in query order.
+        """
+        return [self._summary(todo) for todo in self._select(query)]
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        """
+        Set fields of every Todo item matching a query with one
+        update_many(). Items that already have the values are left alone.
+        
+        :param query: The filters, sort order and limit.
+        :param changes: The new values, for fields in UPDATABLE_FIELDS.
+        :return: The IDs of the updated items.
+        """
+        check_changes(changes)
+        todos = self._select(query, functools.partial(needs_change, changes=changes))
+        self.update_many([dataclasses.replace(todo, **changes) for todo in todos])
+        return [todo.id for todo in todos]
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        """
+        Delete every Todo item matching a query with one delete_many().
+        
+        :param query: The filters, sort order and limit.
+        :return: The IDs of the deleted items.
+        """
+        todo_ids = [todo.id for todo in self._select(query)]
+        self.delete_many(todo_ids)
+        return todo_ids
+
+    def stats(self) -> TodoStats:
+        """
+        Count the Todo items from the sizes of the indexes, kept up to date
+        on every write.
+        
+        :return: The counts.
+        """
+        return TodoStats(len(self.todos), len(self._completed[True]), len(self._attached), self._attachment_bytes)
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare stats() with a count of every Todo item.
+        
+        :param repair: Rebuild the indexes it reads if they differ.
+        :return: The counters as they were, and the count.
+        """
+        stats, counted = self.stats(), count_stats(self.todos.values())
+        if repair and stats != counted:
+            self._completed = {True: set(), False: set()}
+            self._attached = set()
+            self._mimetypes = {}
+            self._attachment_bytes = 0
+            for todo in self.todos.values():
+                self._index_fields(todo)
+        return stats, counted
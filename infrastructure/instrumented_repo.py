@@ -0,0 +1,318 @@
+"""
+This module provides a decorator for any ITodoRepository that records
+the latency, row count, attachment bytes and errors of every call in a
+MetricsRegistry.
+"""
+
+from concurrent.futures import Future
+from typing import Iterable, Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.metrics import MetricsRegistry
+from domain.interfaces import ITodoRepository
+from infrastructure.repositories import TodoRepository
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage
+from application.query import TodoQuery
+
+
+def _attachment_bytes(todos: Iterable[TodoItem]) -> int:
+    return sum(len(todo.attachment_data) for todo in todos if todo.attachment_data is not None)
+
+
+class InstrumentedTodoRepo(TodoRepository):
+    """
+    InstrumentedTodoRepo wraps another repository and measures each call
+    to it. Wrapping the storage repository, below any cache, shows what
+    actually reaches SQLite or disk.
+    """
+
+    def __init__(self, inner: ITodoRepository, metrics: MetricsRegistry, layer: str = "repository"):
+        """
+        Initialize the instrumented repository.
+
+        :param inner: The repository to measure.
+        :param metrics: The registry to record into, usually shared.
+        :param layer: The layer label of the recorded operations.
+        """
+        self.inner = inner
+        self.metrics = metrics
+        self.layer = layer
+        self.blob_store = getattr(inner, "blob_store", None)
+
+    def _measure(self, name: str):
+        return self.metrics.measure(self.layer, name)
+
+    def add(self, todo: TodoItem):
+        """
+        Add a new Todo item to the wrapped repository.
+
+        :param todo: The Todo item to be added.
+        :return: The added Todo item.
+        """
+        with self._measure("add") as op:
+            op.rows = 1
+            op.bytes_written = _attachment_bytes([todo])
+            return self.inner.add(todo)
+
+    def get(self, todo_id: str) -> Optional[TodoItem]:
+        """
+        Get a Todo item by its ID from the wrapped repository.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The Todo item, or None if it does not exist.
+        """
+        with self._measure("get") as op:
+            todo = self.inner.get(todo_id)
+            if todo is not None:
+                op.rows = 1
+                op.bytes_read = _attachment_bytes([todo])
+            return todo
+
+    def update(self, todo: TodoItem):
+        """
+        Update an existing Todo item in the wrapped repository.
+
+        :param todo: The Todo item to be updated.
+        :return: The updated Todo item.
+        """
+        with self._measure("update") as op:
+            op.rows = 1
+            op.bytes_written = _attachment_bytes([todo])
+            return self.inner.update(todo)
+
+    def delete(self, todo_id: str):
+        """
+        Delete a Todo item from the wrapped repository.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        """
+        with self._measure("delete") as op:
+            op.rows = 1
+            return self.inner.delete(todo_id)
+
+    def add_queued(self, todo: TodoItem) -> Future:
+        """
+        Add a new Todo item without waiting for the commit; only the time
+        to queue it is measured.
+
+        :param todo: The Todo item to be added.
+        :return: A future resolving once the insert is committed.
+        """
+        with self._measure("add_queued") as op:
+            op.rows = 1
+            op.bytes_written = _attachment_bytes([todo])
+            return self.inner.add_queued(todo)
+
+    def update_queued(self, todo: TodoItem) -> Future:
+        """
+        Update a Todo item without waiting for the commit.
+
+        :param todo: The Todo item to be updated.
+        :return: A future resolving once the update is committed.
+        """
+        with self._measure("update_queued") as op:
+            op.rows = 1
+            op.bytes_written = _attachment_bytes([todo])
+            return self.inner.update_queued(todo)
+
+    def delete_queued(self, todo_id: str) -> Future:
+        """
+        Delete a Todo item without waiting for the commit.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        :return: A future resolving once the delete is committed.
+        """
+        with self._measure("delete_queued") as op:
+            op.rows = 1
+            return self.inner.delete_queued(todo_id)
+
+    def list_all(self) -> List[TodoItem]:
+        """
+        List all Todo items in the wrapped repository.
+
+        :return: A list of all Todo items.
+        """
+        with self._measure("list_all") as op:
+            todos = self.inner.list_all()
+            op.rows = len(todos)
+            op.bytes_read = _attachment_bytes(todos)
+            return todos
+
+    def list_summaries(self) -> List[TodoSummary]:
+        """
+        List all Todo items without loading attachment bytes.
+
+        :return: A list of Todo summaries.
+        """
+        with self._measure("list_summaries") as op:
+            summaries = self.inner.list_summaries()
+            op.rows = len(summaries)
+            return summaries
+
+    def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        """
+        Get the attachment bytes of a Todo item.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        with self._measure("get_attachment") as op:
+            data = self.inner.get_attachment(todo_id)
+            if data is not None:
+                op.rows = 1
+                op.bytes_read = len(data)
+            return data
+
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        """
+        List one page of Todo summaries ordered by creation time.
+
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of summaries on the page.
+        :return: The page of summaries and the cursor of the next page.
+        """
+        with self._measure("list_page") as op:
+            page = self.inner.list_page(cursor, limit)
+            op.rows = len(page.items)
+            return page
+
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Add several Todo items to the wrapped repository.
+
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        todos = list(todos)
+        with self._measure("add_many") as op:
+            op.rows = len(todos)
+            op.bytes_written = _attachment_bytes(todos)
+            return self.inner.add_many(todos)
+
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Update several Todo items in the wrapped repository.
+
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        """
+        todos = list(todos)
+        with self._measure("update_many") as op:
+            op.rows = len(todos)
+            op.bytes_written = _attachment_bytes(todos)
+            return self.inner.update_many(todos)
+
+    def delete_many(self, todo_ids: Iterable[str]):
+        """
+        Delete several Todo items from the wrapped repository.
+
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        """
+        todo_ids = list(todo_ids)
+        with self._measure("delete_many") as op:
+            op.rows = len(todo_ids)
+            return self.inner.delete_many(todo_ids)
+
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        """
+        Full-text search over titles and attachment filenames.
+
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        with self._measure("search") as op:
+            summaries = self.inner.search(query, limit)
+            op.rows = len(summaries)
+            return summaries
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        """
+        List the Todo items matching a query.
+
+        :param query: The filters, sort order and limit.
+        :return: The matching summaries in query order.
+        """
+        with self._measure("query") as op:
+            summaries = self.inner.query(query)
+            op.rows = len(summaries)
+            return summaries
+
+    def stats(self) -> TodoStats:
+        """
+        Count the Todo items in the wrapped repository.
+
+        :return: The counts.
+        """
+        with self._measure("stats"):
+            return self.inner.stats()
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the wrapped repository's counters with a count of its items.
+
+        :param repair: Fix the counters if they differ.
+        :return: The counters as they were, and the count.
+        """
+        with self._measure("check_stats") as op:
+            stats, counted = self.inner.check_stats(repair)
+            op.rows = counted.total
+            return stats, counted
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        """
+        Set fields of every Todo item matching a query in the wrapped
+        repository.
+
+        :param query: The filters, sort order and limit.
+        :param changes: The new values, for fields in UPDATABLE_FIELDS.
+        :return: The IDs of the updated items.
+        """
+        with self._measure("update_where") as op:
+            todo_ids = self.inner.update_where(query, **changes)
+            op.rows = len(todo_ids)
+            return todo_ids
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        """
+        Delete every Todo item matching a query from the wrapped repository.
+
+        :param query: The filters, sort order and limit.
+        :return: The IDs of the deleted items.
+        """
+        with self._measure("delete_where") as op:
+            todo_ids = self.inner.delete_where(query)
+            op.rows = len(todo_ids)
+            return todo_ids
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        """
+        Stream a new attachment into the wrapped repository.
+
+        :param todo_id: The ID of the Todo item.
+        :param stream: The new attachment, with its filename and mimetype.
+        :return: The updated Todo item.
+        """
+        with self._measure("write_attachment") as op:
+            op.rows = 1
+            try:
+                return self.inner.write_attachment(todo_id, stream)
+            finally:
+                op.bytes_written = stream.size
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read the attachment of a Todo item in chunks. The operation is
+        recorded once the iterator is exhausted or closed.
+
+        :param todo_id: The ID of the Todo item.
+        :param chunk_size: The maximum size of each chunk.
+        :return: An iterator over the attachment bytes.
+        """
+        with self._measure("iter_attachment") as op:
+            for chunk in self.inner.iter_attachment(todo_id, chunk_size):
+                op.bytes_read += len(chunk)
+                yield chunk
+            op.rows = 1 if op.bytes_read else 0
+
+    def close(self) -> None:
+        self.inner.close()
@@ -0,0 +1,158 @@
+"""
+This module provides an append-only journal of JSON records, used by
+FileTodoRepo to persist each mutation as a single appended line instead
+of rewriting the whole file.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+
+class Journal:
+    """
+    Journal is an append-only log with one JSON record per line.
+
+    The log is rebuilt by replay() at startup and can be compacted
+    atomically: live records are written to a temporary file which then
+    replaces the log, so a crash leaves either the old or the new log.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the journal.
+        
+        :param path: The path of the log file.
+        """
+        self.path = Path(path)
+        self.record_count = 0
+        self._lock = threading.Lock()
+        self._file = None
+        # Lines appended while a compaction is running; they are copied
+        # into the compacted log before it replaces the current one.
+        self._pending = None
+
+    def replay(self) -> Iterator[dict]:
+        """
+        Yield every record in the log, in append order.
+
+        A torn last line left by a crash mid-append is skipped and
+        truncated so later appends start on a clean line.
+        """
+        self.record_count = 0
+        if not self.path.exists():
+            return
+        good_end = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_end += len(line)
+                self.record_count += 1
+                yield record
+        if good_end != self.path.stat().st_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(good_end)
+
+    def open(self):
+        """Open the log for appending."""
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, record: dict):
+        """
+        Append a single record to the log.
+        
+        :param record: A JSON-serializable record.
+        """
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.record_count += 1
+            if self._pending is not None:
+                self._pending.append(line)
+
+    def append_many(self, records: Iterable[dict]):
+        """
+        Append several records to the log in a single write.
+        
+        :param records: JSON-serializable records.
+        """
+        lines = [json.dumps(record, separators=(",", ":")) + "\n" for record in records]
+        if not lines:
+            return
+        with self._lock:
+            self._file.write("".join(lines))
+            self._file.flush()
+            self.record_count += len(lines)
+            if self._pending is not None:
+                self._pending.extend(lines)
+
+    @property
+    def compacting(self) -> bool:
+        return self._pending is not None
+
+    def compact(self, snapshot: Callable[[], Iterable[dict]]):
+        """
+        Rewrite the log so it only holds the live records.
+
+        Appends keep going to the old log while the new one is written,
+        and are replayed onto it before the atomic rename.
+        
+        :param snapshot: Returns the live records; called under the journal
+            lock so no append can interleave with taking the snapshot.
+        """
+        with self._lock:
+            if self._pending is not None:
+                return
+            self._pending = []
+            records = snapshot()
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                count = 0
+                for record in records:
+                    f.write(json.dumps(record, separators=(",", ":")) + "\n")
+                    count += 1
+                with self._lock:
+                    f.writelines(self._pending)
+                    count += len(self._pending)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._file.close()
+                    os.replace(tmp_path, self.path)
+                    self._fsync_dir()
+                    self._file = open(self.path, "a", encoding="utf-8")
+                    self.record_count = count
+                    self._pending = None
+        finally:
+            if self._pending is not None:
+                self._pending = None
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+    def _fsync_dir(self):
+        # Make the rename itself durable; not supported on every platform
+        try:
+            fd = os.open(self.path.parent, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Close the log file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
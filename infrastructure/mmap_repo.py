@@ -0,0 +1,978 @@
+"""
+This module provides a file-backed implementation of the TodoRepository
+that keeps each todo as a fixed-width record in a memory-mapped file, so
+opening a store maps it instead of parsing it, and a write touches the
+records it changes instead of rewriting the file.
+"""
+
+import functools
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import uuid
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.models import (
+    TodoItem, TodoStats, TodoSummary, TodoPage, AttachmentHandle, encode_cursor, decode_cursor
+)
+from application.query import TodoQuery, check_changes, count_stats
+from infrastructure.blob_store import BlobStore
+# The same compact forms of IDs and timestamps as the columnar store
+from infrastructure.columnar_repo import _encode_created, _format_created, _uuid_bytes
+from infrastructure.in_memory_repo import externalize_attachments
+from infrastructure.repositories import TodoRepository
+from infrastructure.search_index import score, tokenize
+
+_MAGIC = b"TODOMMAP"
+_VERSION = 1
+# magic, version, clean shutdown, heap generation, rows in use, free list
+# head, live todos, heap garbage bytes, index slots, index slots used,
+# completed, with attachment, attachment bytes
+_HEADER = struct.Struct("<8sHHIqqqqqqqqq")
+_HEADER_SIZE = 128
+# id, flags, next free row, created, created text length, (offset, length)
+# of title, filename and mimetype in the heap, (offset, length) of inline
+# attachment bytes, attachment size, attachment hash
+_RECORD = struct.Struct("<16sB3xiqIQIQIQIQQQ32s")
+_RECORD_SIZE = _RECORD.size
+_ID_AND_FLAGS = struct.Struct("<16sB")
+_FLAGS_AT = 16
+# (offset, length) of a heap entry, stored in the id or hash field
+_POINTER = struct.Struct("<QI")
+_SLOT = struct.Struct("<i")
+# Length of a string that is None
+_NONE = 0xFFFFFFFF
+# Index slot markers
+_EMPTY = -1
+_DELETED = -2
+_INITIAL_ROWS = 1024
+_MIN_INDEX_SLOTS = 2048
+# The heap is compacted once garbage takes more than half of it
+_MIN_COMPACT_BYTES = 1024 * 1024
+# Streamed attachments are spooled to disk past this size
+_SPOOL_SIZE = 8 * CHUNK_SIZE
+_HEX_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# Record flags
+_LIVE = 1
+_COMPLETED = 2
+_TEXT_ID = 4        # not a canonical UUID; the id field points to it
+_TEXT_CREATED = 8   # not in utc_timestamp()'s layout; created points to it
+_INLINE_DATA = 16   # the attachment bytes are in the heap
+_DIGEST = 32        # the hash field holds a raw SHA-256 digest
+_TEXT_HASH = 64     # any other hash; the hash field points to it
+
+
+def _pointer(offset: int, length: int, width: int) -> bytes:
+    return _POINTER.pack(offset, length).ljust(width, b"\0")
+
+
+class MmapTodoRepo(TodoRepository):
+    """
+    File-backed repository of fixed-width records in a memory-mapped file.
+
+    A store is three files next to each other:
+
+    - todos.mmap: a header with the counts, then one 128-byte record per
+      row: the ID as 16 UUID bytes, flags (completed among them), the
+      creation time as microseconds, and (offset, length) pointers into
+      the heap for the title, filename, mimetype and inline attachment.
+    - todos.<generation>.heap: the bytes the records point to, appended
+      and never changed in place.
+    - todos.idx: an open-addressing hash table from ID to row, so a todo
+      is found without reading the other records.
+
+    Toggling completed rewrites the record and nothing else, and
+    update_where() flips its flag byte in place. Deleted rows
+    are kept on a free list and reused. Strings and attachments replaced
+    by an update stay in the heap as garbage until it is compacted into
+    the next generation, once garbage is more than half of it.
+
+    Writes reach the page cache at once and are flushed to disk by
+    close(). A store that was not closed cleanly, e.g. after a crash, has
+    its index, free list and counts rebuilt from the records when opened.
+    Only one process may open a store at a time; threads may share it.
+    """
+
+    def __init__(self, file_path: str = "todos.mmap", blob_store: Optional[BlobStore] = None):
+        """
+        Open the store, creating it if it does not exist.
+
+        :param file_path: The path of the record file; the heap and index
+            files are kept next to it.
+        :param blob_store: If given, attachment bytes are kept in the blob
+            store and records only hold their digest.
+        :raises ValueError: If the file is not a store of this version.
+        """
+        self.blob_store = blob_store
+        self.file_path = Path(file_path)
+        self.index_path = self.file_path.with_suffix(".idx")
+        self._lock = threading.RLock()
+        self._records = None
+        self._heap_map = None
+        self._index = None
+        # Rows sorted by (created_at, id), built by the first listing that
+        # needs them and kept up to date after that
+        self._order: Optional[array] = None
+        self._open()
+
+    def __len__(self):
+        return self._count
+
+    # Files
+
+    def _open(self):
+        if not self.file_path.exists() or self.file_path.stat().st_size == 0:
+            with open(self.file_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, 1, 0, 0, -1, 0, 0, 0, 0, 0, 0, 0).ljust(_HEADER_SIZE, b"\0"))
+                f.truncate(_HEADER_SIZE + _INITIAL_ROWS * _RECORD_SIZE)
+        self._map_records()
+        self._open_heap()
+        if self._clean and self._index_slots and self.index_path.exists() \
+                and self.index_path.stat().st_size == self._index_slots * _SLOT.size:
+            self._map_index()
+        else:
+            self._recover()
+        # Cleared until close(), so a crash is noticed on the next open
+        self._clean = 0
+        self._write_header()
+
+    def _map_records(self):
+        self._file = open(self.file_path, "r+b")
+        self._records = mmap.mmap(self._file.fileno(), 0)
+        (magic, version, self._clean, self._generation, self._rows, self._free_head, self._count, self._garbage,
+         self._index_slots, self._index_used, self._completed_count, self._attached_count,
+         self._attachment_bytes) = _HEADER.unpack_from(self._records, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._records.close()
+            self._file.close()
+            self._records = None
+            raise ValueError(f"{self.file_path} is not a todo store of version {_VERSION}")
+
+    def _heap_path(self, generation: int) -> Path:
+        return self.file_path.with_name(f"{self.file_path.stem}.{generation}.heap")
+
+    def _open_heap(self):
+        self.heap_path = self._heap_path(self._generation)
+        # Heaps of other generations are left by an interrupted compaction
+        # or are the one a compaction replaced
+        pattern = re.compile(re.escape(self.file_path.stem) + r"\.\d+\.heap")
+        for path in self.file_path.parent.glob(f"{self.file_path.stem}.*.heap"):
+            if path != self.heap_path and pattern.fullmatch(path.name):
+                path.unlink()
+        self._heap_file = open(self.heap_path, "a+b", buffering=0)
+        self._heap_end = os.fstat(self._heap_file.fileno()).st_size
+        self._heap_map = None
+
+    def _map_index(self):
+        self._index_file = open(self.index_path, "r+b")
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+    def _close_files(self, index: bool = True):
+        for name in ("_records", "_file", "_heap_map", "_heap_file") + (("_index", "_index_file") if index else ()):
+            handle = getattr(self, name, None)
+            if handle is not None:
+                handle.close()
+                setattr(self, name, None)
+
+    def _write_header(self):
+        _HEADER.pack_into(
+            self._records, 0, _MAGIC, _VERSION, self._clean, self._generation, self._rows, self._free_head,
+            self._count, self._garbage, self._index_slots, self._index_used, self._completed_count,
+            self._attached_count, self._attachment_bytes
+        )
+
+    def close(self):
+        """Flush the files to disk, mark the store as cleanly closed and close it."""
+        with self._lock:
+            if self._records is None:
+                return
+            self._clean = 1
+            self._write_header()
+            self._records.flush()
+            self._index.flush()
+            self._close_files()
+
+    # Heap
+
+    def _append(self, data) -> int:
+        # Returns the offset the bytes were written at
+        offset = self._heap_end
+        view = memoryview(data)
+        while view:
+            view = view[self._heap_file.write(view):]
+        self._heap_end += len(data)
+        return offset
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if length == 0:
+            return b""
+        if self._heap_map is None or offset + length > len(self._heap_map):
+            # Appends since the heap was mapped are not in the mapping yet
+            if self._heap_map is not None:
+                self._heap_map.close()
+            self._heap_map = mmap.mmap(self._heap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._heap_map[offset:offset + length]
+
+    def _text(self, offset: int, length: int) -> Optional[str]:
+        return None if length == _NONE else self._read(offset, length).decode("utf-8")
+
+    def _put_text(self, value: Optional[str], old: Optional[tuple], at: int) -> Tuple[int, int]:
+        # The (offset, length) of a string; one the old record holds at the
+        # same position is reused if it is unchanged
+        if value is None:
+            return 0, _NONE
+        if old is not None and old[at + 1] != _NONE and self._text(old[at], old[at + 1]) == value:
+            return old[at], old[at + 1]
+        encoded = value.encode("utf-8")
+        return self._append(encoded), len(encoded)
+
+    @staticmethod
+    def _entries(record: tuple) -> List[Tuple[int, int]]:
+        # The (offset, length) of every heap entry a record points to
+        flags = record[1]
+        entries = []
+        if flags & _TEXT_ID:
+            entries.append(_POINTER.unpack_from(record[0]))
+        if flags & _TEXT_CREATED:
+            entries.append((record[3], record[4]))
+        for at in (5, 7, 9):
+            if record[at + 1] != _NONE:
+                entries.append((record[at], record[at + 1]))
+        if flags & _INLINE_DATA:
+            entries.append((record[11], record[12]))
+        if flags & _TEXT_HASH:
+            entries.append(_POINTER.unpack_from(record[14]))
+        return entries
+
+    # Records
+
+    def _capacity(self) -> int:
+        return (len(self._records) - _HEADER_SIZE) // _RECORD_SIZE
+
+    def _record(self, row: int) -> tuple:
+        return _RECORD.unpack_from(self._records, _HEADER_SIZE + row * _RECORD_SIZE)
+
+    def _put_record(self, row: int, fields):
+        _RECORD.pack_into(self._records, _HEADER_SIZE + row * _RECORD_SIZE, *fields)
+
+    def _live_records(self) -> Iterator[Tuple[int, tuple]]:
+        for row in range(self._rows):
+            record = self._record(row)
+            if record[1] & _LIVE:
+                yield row, record
+
+    def _new_row(self) -> int:
+        if self._free_head >= 0:
+            row = self._free_head
+            self._free_head = self._record(row)[2]
+            return row
+        if self._rows == self._capacity():
+            # Unmapped first, since a mapped file cannot be resized everywhere
+            capacity = self._capacity() * 2
+            self._records.close()
+            self._file.truncate(_HEADER_SIZE + capacity * _RECORD_SIZE)
+            self._records = mmap.mmap(self._file.fileno(), 0)
+        self._rows += 1
+        return self._rows - 1
+
+    def _free_row(self, row: int):
+        self._put_record(row, (bytes(16), 0, self._free_head, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, bytes(32)))
+        self._free_head = row
+
+    def _count_record(self, record: tuple, sign: int):
+        # Add a record to the stats() counters, or take it out with sign -1
+        flags = record[1]
+        size = record[13] or record[12]
+        self._completed_count += sign * bool(flags & _COMPLETED)
+        if flags & (_DIGEST | _TEXT_HASH) or size:
+            self._attached_count += sign
+            self._attachment_bytes += sign * size
+
+    def _todo_id(self, record: tuple) -> str:
+        if record[1] & _TEXT_ID:
+            return self._text(*_POINTER.unpack_from(record[0]))
+        return str(uuid.UUID(bytes=record[0]))
+
+    def _created_at(self, record: tuple) -> str:
+        if record[1] & _TEXT_CREATED:
+            return self._text(record[3], record[4])
+        return _format_created(record[3])
+
+    def _hash(self, record: tuple) -> Optional[str]:
+        if record[1] & _DIGEST:
+            return record[14].hex()
+        if record[1] & _TEXT_HASH:
+            return self._text(*_POINTER.unpack_from(record[14]))
+        return None
+
+    def _item(self, record: tuple, hydrate: bool = True, data: bool = True) -> TodoItem:
+        digest = self._hash(record)
+        attachment = None
+        if data and record[1] & _INLINE_DATA:
+            attachment = self._read(record[11], record[12])
+        elif data and hydrate and digest and self.blob_store:
+            attachment = self.blob_store.open(digest)
+        return TodoItem(
+            id=self._todo_id(record),
+            title=self._text(record[5], record[6]),
+            completed=bool(record[1] & _COMPLETED),
+            attachment_filename=self._text(record[7], record[8]),
+            attachment_mimetype=self._text(record[9], record[10]),
+            attachment_data=attachment,
+            created_at=self._created_at(record),
+            attachment_hash=digest,
+            attachment_size=record[13] if data else record[13] or record[12]
+        )
+
+    def _summary(self, record: tuple) -> TodoSummary:
+        todo_id = self._todo_id(record)
+        size = record[13] or record[12]
+        return TodoSummary(
+            id=todo_id,
+            title=self._text(record[5], record[6]),
+            completed=bool(record[1] & _COMPLETED),
+            attachment_filename=self._text(record[7], record[8]),
+            attachment_mimetype=self._text(record[9], record[10]),
+            attachment_size=size,
+            created_at=self._created_at(record),
+            attachment_hash=self._hash(record),
+            attachment=AttachmentHandle(functools.partial(self.get_attachment, todo_id), size) if size else None
+        )
+
+    def _encode(self, todo: TodoItem, old: Optional[tuple], data: Optional[Tuple[int, int]] = None) -> tuple:
+        # The record of todo. Heap entries of the old record that still hold
+        # the same value are reused, so a toggle appends nothing. data is
+        # the (offset, length) of attachment bytes already in the heap.
+        flags = _LIVE | (_COMPLETED if todo.completed else 0)
+        todo_id = _uuid_bytes(todo.id)
+        if todo_id is None:
+            flags |= _TEXT_ID
+            # A row keeps its ID, so the old pointer is still right
+            todo_id = old[0] if old is not None else _pointer(*self._put_text(todo.id, None, 0), 16)
+        created, created_len = _encode_created(todo.created_at), 0
+        if created is None:
+            flags |= _TEXT_CREATED
+            created, created_len = self._put_text(
+                todo.created_at, old if old is not None and old[1] & _TEXT_CREATED else None, 3
+            )
+        title = self._put_text(todo.title, old, 5)
+        filename = self._put_text(todo.attachment_filename, old, 7)
+        mimetype = self._put_text(todo.attachment_mimetype, old, 9)
+        digest = todo.attachment_hash
+        digest_field = bytes(32)
+        if digest is not None and _HEX_DIGEST.fullmatch(digest):
+            flags |= _DIGEST
+            digest_field = bytes.fromhex(digest)
+        elif digest is not None:
+            flags |= _TEXT_HASH
+            if old is not None and old[1] & _TEXT_HASH and self._hash(old) == digest:
+                digest_field = old[14]
+            else:
+                digest_field = _pointer(*self._put_text(digest, None, 0), 32)
+        data_offset = data_length = 0
+        if data is not None:
+            flags |= _INLINE_DATA
+            data_offset, data_length = data
+        elif todo.attachment_data is not None:
+            flags |= _INLINE_DATA
+            data_length = len(todo.attachment_data)
+            if old is not None and old[1] & _INLINE_DATA and digest is not None \
+                    and old[12] == data_length and self._hash(old) == digest:
+                data_offset = old[11]
+            else:
+                data_offset = self._append(todo.attachment_data)
+        return (
+            todo_id, flags, -1, created, created_len, *title, *filename, *mimetype,
+            data_offset, data_length, todo.attachment_size or 0, digest_field
+        )
+
+    def _write(self, row: int, todo: TodoItem, old: Optional[tuple], data: Optional[Tuple[int, int]] = None):
+        record = self._encode(todo, old, data)
+        if old is not None:
+            self._count_record(old, -1)
+            kept = set(self._entries(record))
+            self._garbage += sum(entry[1] for entry in self._entries(old) if entry not in kept)
+        self._put_record(row, record)
+        self._count_record(record, 1)
+
+    def _store(self, todo: TodoItem, data: Optional[Tuple[int, int]] = None, row: Optional[int] = None):
+        # row is where todo is stored, if the caller has looked it up
+        if row is None:
+            row = self._find(todo.id)
+        if row >= 0:
+            old = self._record(row)
+            old_created = self._created_at(old) if self._order is not None else None
+            self._write(row, todo, old, data)
+            if self._order is not None and old_created != todo.created_at:
+                self._unorder(row, (old_created, todo.id))
+                self._reorder(row, (todo.created_at, todo.id))
+            return
+        # Resized before the new record is written, since a rebuild indexes
+        # every live record
+        if (self._index_used + 1) * 2 > self._index_slots:
+            self._build_index(self._index_size(self._count + 1))
+        row = self._new_row()
+        self._write(row, todo, None, data)
+        self._index_add(todo.id, row)
+        self._count += 1
+        if self._order is not None:
+            self._reorder(row, (todo.created_at, todo.id))
+
+    def _remove(self, row: int, todo_id: str):
+        record = self._record(row)
+        if self._order is not None:
+            self._unorder(row, (self._created_at(record), todo_id))
+        self._index_remove(todo_id)
+        self._count_record(record, -1)
+        self._garbage += sum(length for _, length in self._entries(record))
+        self._free_row(row)
+        self._count -= 1
+
+    def _set_completed(self, row: int, completed: bool):
+        # In place: one flag byte and the counter
+        at = _HEADER_SIZE + row * _RECORD_SIZE + _FLAGS_AT
+        flags = self._records[at]
+        new_flags = flags | _COMPLETED if completed else flags & ~_COMPLETED
+        if new_flags != flags:
+            self._records[at] = new_flags
+            self._completed_count += 1 if completed else -1
+
+    # Index
+
+    @staticmethod
+    def _index_size(count: int) -> int:
+        slots = _MIN_INDEX_SLOTS
+        while slots < count * 4:
+            slots *= 2
+        return slots
+
+    @staticmethod
+    def _key(todo_id: str) -> Tuple[bytes, bool]:
+        # The bytes a todo is indexed by, and whether they are text
+        key = _uuid_bytes(todo_id)
+        return (key, False) if key is not None else (todo_id.encode("utf-8"), True)
+
+    def _record_key(self, record: tuple) -> Tuple[bytes, bool]:
+        if record[1] & _TEXT_ID:
+            return self._read(*_POINTER.unpack_from(record[0])), True
+        return record[0], False
+
+    def _probe(self, key: bytes, text: bool) -> Tuple[int, int]:
+        # (slot holding key or -1, slot to insert key at). UUID bytes are
+        # random enough to be their own hash; text IDs are hashed.
+        mask = self._index_slots - 1
+        digest = hashlib.blake2b(key, digest_size=8).digest() if text else key
+        slot = int.from_bytes(digest[:8], "little") & mask
+        insert_at = -1
+        while True:
+            row = _SLOT.unpack_from(self._index, slot * _SLOT.size)[0]
+            if row == _EMPTY:
+                return -1, slot if insert_at < 0 else insert_at
+            if row == _DELETED:
+                if insert_at < 0:
+                    insert_at = slot
+            else:
+                record_id, flags = _ID_AND_FLAGS.unpack_from(self._records, _HEADER_SIZE + row * _RECORD_SIZE)
+                if flags & _TEXT_ID:
+                    if text and self._read(*_POINTER.unpack_from(record_id)) == key:
+                        return slot, slot
+                elif not text and record_id == key:
+                    return slot, slot
+            slot = (slot + 1) & mask
+
+    def _find(self, todo_id: str) -> int:
+        slot, _ = self._probe(*self._key(todo_id))
+        return -1 if slot < 0 else _SLOT.unpack_from(self._index, slot * _SLOT.size)[0]
+
+    def _index_add(self, todo_id: str, row: int):
+        _, slot = self._probe(*self._key(todo_id))
+        if _SLOT.unpack_from(self._index, slot * _SLOT.size)[0] == _EMPTY:
+            self._index_used += 1
+        _SLOT.pack_into(self._index, slot * _SLOT.size, row)
+
+    def _index_remove(self, todo_id: str):
+        slot, _ = self._probe(*self._key(todo_id))
+        if slot >= 0:
+            _SLOT.pack_into(self._index, slot * _SLOT.size, _DELETED)
+
+    def _build_index(self, slots: int):
+        if self._index is not None:
+            self._index.close()
+            self._index_file.close()
+        with open(self.index_path, "wb") as f:
+            f.write(b"\xff" * (slots * _SLOT.size))
+        self._index_slots, self._index_used = slots, 0
+        self._map_index()
+        for row, record in self._live_records():
+            _, slot = self._probe(*self._record_key(record))
+            _SLOT.pack_into(self._index, slot * _SLOT.size, row)
+            self._index_used += 1
+
+    def _recover(self):
+        # The records are the truth; everything else is rebuilt from them
+        live_rows, live_bytes, last = set(), 0, -1
+        self._count = self._completed_count = self._attached_count = self._attachment_bytes = 0
+        for row in range(self._capacity()):
+            record = self._record(row)
+            if record[1] & _LIVE:
+                live_rows.add(row)
+                last = row
+                self._count += 1
+                self._count_record(record, 1)
+                live_bytes += sum(length for _, length in self._entries(record))
+        self._rows = last + 1
+        self._free_head = -1
+        for row in range(self._rows - 1, -1, -1):
+            if row not in live_rows:
+                self._free_row(row)
+        self._garbage = self._heap_end - live_bytes
+        self._order = None
+        self._build_index(self._index_size(self._count))
+
+    # Creation order
+
+    def _order_key(self, row: int) -> Tuple[str, str]:
+        record = self._record(row)
+        return self._created_at(record), self._todo_id(record)
+
+    def _ordered(self) -> array:
+        if self._order is None:
+            keys = sorted((self._created_at(record), self._todo_id(record), row) for row, record in self._live_records())
+            self._order = array("i", (row for _, _, row in keys))
+        return self._order
+
+    def _order_position(self, key: Tuple[str, str], right: bool = False) -> int:
+        low, high = 0, len(self._order)
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._order_key(self._order[middle])
+            if middle_key < key or (right and middle_key == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _reorder(self, row: int, key: Tuple[str, str]):
+        # Todos mostly arrive in creation order, so check the end first
+        if not self._order or self._order_key(self._order[-1]) < key:
+            self._order.append(row)
+        else:
+            self._order.insert(self._order_position(key, right=True), row)
+
+    def _unorder(self, row: int, key: Tuple[str, str]):
+        position = self._order_position(key)
+        while self._order[position] != row:
+            position += 1
+        del self._order[position]
+
+    # Compaction
+
+    def _maybe_compact(self):
+        if self._garbage > _MIN_COMPACT_BYTES and self._garbage * 2 > self._heap_end:
+            self.compact()
+
+    def compact(self):
+        """
+        Copy the live heap entries into a new heap generation and point the
+        records at them. Rows keep their numbers, so the index stays valid.
+        The new records are written to a copy of the record file that
+        replaces it in one rename, so a crash leaves the old or the new
+        generation, never a mix.
+        """
+        with self._lock:
+            self._write_header()
+            self._records.flush()
+            generation = self._generation + 1
+            heap_path = self._heap_path(generation)
+            records_path = self.file_path.with_name(self.file_path.name + ".tmp")
+            shutil.copyfile(self.file_path, records_path)
+            with open(heap_path, "wb") as heap, open(records_path, "r+b") as f, mmap.mmap(f.fileno(), 0) as records:
+                end = 0
+
+                def move(offset: int, length: int) -> int:
+                    nonlocal end
+                    moved = end
+                    for start in range(0, length, CHUNK_SIZE):
+                        heap.write(self._read(offset + start, min(CHUNK_SIZE, length - start)))
+                    end += length
+                    return moved
+
+                for row, record in self._live_records():
+                    fields = list(record)
+                    flags = record[1]
+                    if flags & _TEXT_ID:
+                        length = _POINTER.unpack_from(record[0])[1]
+                        fields[0] = _pointer(move(*_POINTER.unpack_from(record[0])), length, 16)
+                    if flags & _TEXT_CREATED:
+                        fields[3] = move(record[3], record[4])
+                    for at in (5, 7, 9):
+                        if record[at + 1] != _NONE:
+                            fields[at] = move(record[at], record[at + 1])
+                    if flags & _INLINE_DATA:
+                        fields[11] = move(record[11], record[12])
+                    if flags & _TEXT_HASH:
+                        length = _POINTER.unpack_from(record[14])[1]
+                        fields[14] = _pointer(move(*_POINTER.unpack_from(record[14])), length, 32)
+                    _RECORD.pack_into(records, _HEADER_SIZE + row * _RECORD_SIZE, *fields)
+                _HEADER.pack_into(
+                    records, 0, _MAGIC, _VERSION, 0, generation, self._rows, self._free_head, self._count, 0,
+                    self._index_slots, self._index_used, self._completed_count, self._attached_count,
+                    self._attachment_bytes
+                )
+                heap.flush()
+                os.fsync(heap.fileno())
+                records.flush()
+            self._close_files(index=False)
+            os.replace(records_path, self.file_path)
+            # Reading the new header; opening its heap removes the old one
+            self._map_records()
+            self._open_heap()
+
+    # TodoRepository
+
+    def add(self, todo: TodoItem):
+        """
+        Add a new Todo item to the repository.
+
+        :param todo: The Todo item to be added.
+        :return: The added Todo item.
+        """
+        self.add_many([todo])
+        return todo
+
+    def get(self, todo_id: str) -> Optional[TodoItem]:
+        """
+        Get a Todo item by its ID.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The Todo item, or None if there is none with that ID.
+        """
+        with self._lock:
+            row = self._find(todo_id)
+            return self._item(self._record(row)) if row >= 0 else None
+
+    def update(self, todo: TodoItem):
+        """
+        Update an existing Todo item in the repository.
+
+        :param todo: The Todo item to be updated.
+        :return: The updated Todo item.
+        :raises ValueError: If the Todo item is not found.
+        """
+        self.update_many([todo])
+        return todo
+
+    def delete(self, todo_id: str):
+        """
+        Delete a Todo item from the repository by its ID.
+
+        :param todo_id: The ID of the Todo item to be deleted.
+        """
+        self.delete_many([todo_id])
+
+    def add_many(self, todos):
+        """
+        Add several Todo items.
+
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        todos = list(todos)
+        with self._lock:
+            for todo in externalize_attachments(self.blob_store, todos):
+                self._store(todo)
+            self._write_header()
+            self._maybe_compact()
+        return todos
+
+    def update_many(self, todos):
+        """
+        Update several existing Todo items. Fields that did not change keep
+        their heap entries, so e.g. a toggle rewrites only the record.
+
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        :raises ValueError: If any of the Todo items is not found; nothing is updated then.
+        """
+        todos = list(todos)
+        with self._lock:
+            rows = [self._find(todo.id) for todo in todos]
+            if any(row < 0 for row in rows):
+                raise ValueError("Todo not found")
+            old = None
+            if self.blob_store:
+                old = {todo.id: self._item(self._record(row), hydrate=False) for todo, row in zip(todos, rows)}
+            for todo, row in zip(externalize_attachments(self.blob_store, todos, old), rows):
+                self._store(todo, row=row)
+            self._write_header()
+            self._maybe_compact()
+        return todos
+
+    def delete_many(self, todo_ids):
+        """
+        Delete several Todo items by their IDs. Unknown IDs are ignored.
+
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        :return: The IDs that were actually deleted.
+        """
+        deleted, released = [], []
+        with self._lock:
+            for todo_id in todo_ids:
+                row = self._find(todo_id)
+                if row < 0:
+                    continue
+                record = self._record(row)
+                digest = self._hash(record)
+                if not record[1] & _INLINE_DATA and digest:
+                    released.append(digest)
+                self._remove(row, todo_id)
+                deleted.append(todo_id)
+            self._write_header()
+            self._maybe_compact()
+        if self.blob_store and released:
+            self.blob_store.release_many(released)
+        return deleted
+
+    def list_all(self) -> List[TodoItem]:
+        """
+        List all Todo items in the repository.
+
+        :return: A list of all Todo items.
+        """
+        with self._lock:
+            return [self._item(record) for _, record in self._live_records()]
+
+    def list_summaries(self) -> List[TodoSummary]:
+        """
+        List all Todo items without reading their attachment bytes.
+
+        :return: A list of summaries with lazy attachment handles.
+        """
+        with self._lock:
+            return [self._summary(record) for _, record in self._live_records()]
+
+    def get_attachment(self, todo_id: str):
+        """
+        Get the attachment bytes of a Todo item.
+
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        with self._lock:
+            row = self._find(todo_id)
+            if row < 0:
+                return None
+            record = self._record(row)
+            if record[1] & _INLINE_DATA:
+                return self._read(record[11], record[12])
+            digest = self._hash(record)
+        return self.blob_store.open(digest) if digest and self.blob_store else None
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read the attachment of a Todo item in chunks, straight from the heap
+        or the blob store.
+
+        :param todo_id: The ID of the Todo item.
+        :param chunk_size: The maximum size of each chunk.
+        :return: An iterator over the attachment bytes; empty if there is none.
+        """
+        with self._lock:
+            row = self._find(todo_id)
+            if row < 0:
+                return iter(())
+            record = self._record(row)
+            if not record[1] & _INLINE_DATA:
+                digest = self._hash(record)
+                return self.blob_store.iter_chunks(digest, chunk_size) if digest and self.blob_store else iter(())
+            return self._iter_heap(todo_id, record, self._generation, chunk_size)
+
+    def _iter_heap(self, todo_id: str, record: tuple, generation: int, chunk_size: int) -> Iterator[bytes]:
+        # Heap entries never change in place, so the bytes stay readable
+        # while the todo is updated; only a compaction moves them
+        offset, length = record[11], record[12]
+        position = 0
+        while position < length:
+            with self._lock:
+                if self._generation != generation:
+                    row = self._find(todo_id)
+                    current = self._record(row) if row >= 0 else None
+                    if current is None or not current[1] & _INLINE_DATA or current[12] != length \
+                            or current[14] != record[14]:
+                        raise ValueError("Attachment changed while it was read")
+                    offset, generation = current[11], self._generation
+                chunk = self._read(offset + position, min(chunk_size, length - position))
+            position += len(chunk)
+            yield chunk
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        """
+        Stream a new attachment into the heap, or the blob store if there
+        is one. The stream is spooled before the store is locked, so a slow
+        stream does not hold up other calls.
+
+        :param todo_id: The ID of the Todo item.
+        :param stream: The new attachment, with its filename and mimetype.
+        :return: The updated Todo item, without its attachment bytes.
+        :raises ValueError: If the item does not exist or the stream is too large.
+        """
+        if self.blob_store:
+            digest, size = self.blob_store.put_stream(stream)
+            with self._lock:
+                row = self._find(todo_id)
+                if row < 0:
+                    self.blob_store.release(digest)
+                    raise ValueError("Todo not found")
+                todo = self._item(self._record(row), hydrate=False)
+                old_hash = todo.attachment_hash if todo.attachment_data is None else None
+                todo.attachment_filename, todo.attachment_mimetype = stream.filename, stream.mimetype
+                todo.attachment_data, todo.attachment_hash, todo.attachment_size = None, digest, size
+                self._store(todo)
+                self._write_header()
+                self._maybe_compact()
+            if old_hash:
+                self.blob_store.release(old_hash)
+            return todo
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE) as spool:
+            for chunk in stream:
+                spool.write(chunk)
+            spool.seek(0)
+            with self._lock:
+                row = self._find(todo_id)
+                if row < 0:
+                    raise ValueError("Todo not found")
+                offset = self._heap_end
+                for chunk in iter(lambda: spool.read(CHUNK_SIZE), b""):
+                    self._append(chunk)
+                todo = self._item(self._record(row), data=False)
+                todo.attachment_filename, todo.attachment_mimetype = stream.filename, stream.mimetype
+                todo.attachment_hash, todo.attachment_size = stream.digest, stream.size
+                self._store(todo, data=(offset, stream.size))
+                self._write_header()
+                self._maybe_compact()
+        return todo
+
+    def list_page(self, cursor=None, limit=50) -> TodoPage:
+        """
+        List one page of Todo summaries ordered by creation time. The first
+        call sorts every record; later writes keep the order up to date.
+
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of items on the page.
+        :return: The page of summaries and the cursor of the following page.
+        """
+        with self._lock:
+            order = self._ordered()
+            start = self._order_position(decode_cursor(cursor), right=True) if cursor else 0
+            rows = order[start:start + limit]
+            items = [self._summary(self._record(row)) for row in rows]
+            next_cursor = None
+            if rows and start + limit < len(order):
+                next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+        return TodoPage(items=items, next_cursor=next_cursor)
+
+    def search(self, query, limit=50) -> List[TodoSummary]:
+        """
+        Search titles and attachment filenames by scanning the records.
+
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        ranked = []
+        with self._lock:
+            for row, record in self._live_records():
+                title = set(tokenize(self._text(record[5], record[6])))
+                filename = set(tokenize(self._text(record[7], record[8])))
+                tokens = title | filename
+                if all(any(token.startswith(term) for token in tokens) for term in terms):
+                    ranked.append((-score(terms, title, filename), row))
+            ranked.sort()
+            return [self._summary(self._record(row)) for _, row in ranked[:limit]]
+
+    @staticmethod
+    def _may_match(query: TodoQuery, record: tuple) -> bool:
+        # The filters a record answers without decoding its strings
+        if query.completed is not None and bool(record[1] & _COMPLETED) != query.completed:
+            return False
+        if query.has_attachment is not None:
+            attached = bool(record[1] & (_DIGEST | _TEXT_HASH) or record[13] or record[12])
+            if attached != query.has_attachment:
+                return False
+        return True
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        """
+        List the Todo items matching a query. IDs are looked up in the
+        index, and the completed and attachment filters are checked on
+        the record flags before any strings are read.
+
+        :param query: The filters, sort order and limit.
+        :return: The matching summaries in query order.
+        """
+        with self._lock:
+            if query.ids is not None:
+                rows = sorted(row for row in map(self._find, query.ids) if row >= 0)
+                records = ((row, self._record(row)) for row in rows)
+            else:
+                records = self._live_records()
+            summaries = [self._summary(record) for _, record in records if self._may_match(query, record)]
+        return query.apply(summaries)
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        """
+        Set fields of every Todo item matching a query. Setting only
+        completed flips the flag of each record in place.
+
+        :param query: The filters, sort order and limit; the limit counts
+            only items that change.
+        :param changes: The new values, for fields in UPDATABLE_FIELDS.
+        :return: The IDs of the updated items.
+        """
+        check_changes(changes)
+        if set(changes) != {"completed"}:
+            return super().update_where(query, **changes)
+        completed = changes["completed"]
+        with self._lock:
+            summaries = self.query(query.with_limit(None))
+            changing = [summary.id for summary in summaries if summary.completed != completed][:query.limit]
+            for todo_id in changing:
+                self._set_completed(self._find(todo_id), completed)
+            self._write_header()
+        return changing
+
+    def stats(self) -> TodoStats:
+        """
+        Read the counts kept in the file header, updated on every write.
+
+        :return: The counts.
+        """
+        with self._lock:
+            return TodoStats(self._count, self._completed_count, self._attached_count, self._attachment_bytes)
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the header counts with a count of every record.
+
+        :param repair: Overwrite the header counts with the count if they differ.
+        :return: The header counts as they were, and the count.
+        """
+        with self._lock:
+            stats, counted = self.stats(), count_stats(self.list_summaries())
+            if repair and stats != counted:
+                (self._count, self._completed_count, self._attached_count,
+                 self._attachment_bytes) = (counted.total, counted.completed, counted.with_attachment,
+                                            counted.attachment_bytes)
+                self._write_header()
+        return stats, counted
@@ -3,11 +3,14 @@ This module defines the abstract base class for the TodoRepository
 which outlines the methods required for managing Todo items.
 """
 
-from abc import ABC, abstractmethod
-from typing import List
-from application.models import TodoItem
+from abc import abstractmethod
+from typing import Iterable, Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE, iter_chunks
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage
+from application.query import TodoQuery, check_changes, count_stats, needs_change
+from domain.interfaces import ITodoRepository
 
-class TodoRepository(ABC):
+class TodoRepository(ITodoRepository):
     """
     TodoRepository is an abstract base class that defines the methods
     required for managing Todo items.
@@ -58,3 +61,170 @@ class TodoRepository(ABC):
         :return: A list of all Todo items.
         """
         pass
+
+    @abstractmethod
+    def list_summaries(self) -> List[TodoSummary]:
+        """
+        List all Todo items without their attachment bytes.
+        
+        :return: A list of summaries with lazy attachment handles.
+        """
+        pass
+
+    @abstractmethod
+    def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        """
+        Get the attachment bytes of a Todo item.
+        
+        :param todo_id: The ID of the Todo item.
+        :return: The attachment bytes, or None if there is no attachment.
+        """
+        pass
+
+    @abstractmethod
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        """
+        List one page of Todo summaries ordered by creation time.
+        
+        :param cursor: The next_cursor of the previous page, or None for the first page.
+        :param limit: The maximum number of items on the page.
+        :return: The page of summaries and the cursor of the following page.
+        """
+        pass
+
+    @abstractmethod
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Add several Todo items in one write.
+        
+        :param todos: The Todo items to be added.
+        :return: The added Todo items.
+        """
+        pass
+
+    @abstractmethod
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        """
+        Update several existing Todo items in one write.
+        
+        :param todos: The Todo items to be updated.
+        :return: The updated Todo items.
+        :raises ValueError: If any of the Todo items is not found; nothing is updated then.
+        """
+        pass
+
+    @abstractmethod
+    def delete_many(self, todo_ids: Iterable[str]) -> None:
+        """
+        Delete several Todo items in one write. Unknown IDs are ignored.
+        
+        :param todo_ids: The IDs of the Todo items to be deleted.
+        """
+        pass
+
+    @abstractmethod
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        """
+        Full-text search over titles and attachment filenames.
+        
+        :param query: Free text; every word must match the start of a word.
+        :param limit: The maximum number of results.
+        :return: The best matching summaries, best first.
+        """
+        pass
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        """
+        Replace the attachment of a Todo item with the contents of a stream.
+        
+        This default collects the stream in memory and updates the item;
+        repositories that can write incrementally override it.
+        
+        :param todo_id: The ID of the Todo item.
+        :param stream: The new attachment, with its filename and mimetype.
+        :return: The updated Todo item.
+        :raises ValueError: If the item does not exist or the stream is
+            larger than its size limit.
+        """
+        todo = self.get(todo_id)
+        if todo is None:
+            raise ValueError("Todo not found")
+        todo.set_attachment(b"".join(stream), stream.filename, stream.mimetype)
+        self.update(todo)
+        return todo
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read the attachment of a Todo item in chunks.
+        
+        :param todo_id: The ID of the Todo item.
+        :param chunk_size: The maximum size of each chunk.
+        :return: An iterator over the attachment bytes; empty if there is none.
+        """
+        return iter_chunks(self.get_attachment(todo_id), chunk_size)
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        """
+        List the Todo items matching a query.
+        
+        This default filters every summary in memory; repositories with
+        indexes override it.
+        
+        :param query: The filters, sort order and limit.
+        :return: The matching summaries in query order.
+        """
+        return query.apply(self.list_summaries())
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        """
+        Set fields of every Todo item matching a query in one write. Items
+        that already have the given values are left alone.
+        
+        :param query: The filters, sort order and limit; the limit counts
+            only items that change.
+        :param changes: The new values, for fields in UPDATABLE_FIELDS.
+        :return: The IDs of the updated items.
+        :raises ValueError: If a field cannot be updated by query.
+        """
+        check_changes(changes)
+        summaries = query.with_limit(None).apply(self.list_summaries())
+        changing = [summary.id for summary in summaries if needs_change(summary, changes)][:query.limit]
+        todos = [self.get(todo_id) for todo_id in changing]
+        for todo in todos:
+            for name, value in changes.items():
+                setattr(todo, name, value)
+        self.update_many(todos)
+        return changing
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        """
+        Delete every Todo item matching a query in one write.
+        
+        :param query: The filters, sort order and limit.
+        :return: The IDs of the deleted items.
+        """
+        todo_ids = [summary.id for summary in self.query(query)]
+        self.delete_many(todo_ids)
+        return todo_ids
+
+    def stats(self) -> TodoStats:
+        """
+        Count all Todo items, those completed and those with an attachment,
+        and sum the attachment sizes.
+        
+        This default counts every summary; repositories that keep counters
+        up to date on each write override it.
+        
+        :return: The counts.
+        """
+        return count_stats(self.list_summaries())
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the counters stats() reads with a count of every Todo item.
+        
+        :param repair: Reset the counters to the count if they differ.
+        :return: The counters as they were, and the count.
+        """
+        stats = self.stats()
+        return stats, stats
@@ -0,0 +1,141 @@
+"""
+This module provides an incrementally maintained inverted index over todo
+titles and attachment filenames, used by the in-memory and file
+repositories for full-text search.
+"""
+
+import bisect
+import heapq
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+# Letters and digits only, like SQLite's unicode61 tokenizer: "q3_report.pdf"
+# becomes "q3", "report", "pdf"
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+# Score of a term matching a title / filename token exactly or by prefix
+_WEIGHTS = {("title", True): 4, ("title", False): 2, ("filename", True): 2, ("filename", False): 1}
+
+
+def score(terms: List[str], title: Set[str], filename: Set[str]) -> int:
+    """
+    Rank a match: exact tokens beat prefixes, and title matches beat
+    filename matches.
+
+    :param terms: The query terms.
+    :param title: The tokens of the title.
+    :param filename: The tokens of the attachment filename.
+    """
+    total = 0
+    for term in terms:
+        for name, tokens in (("title", title), ("filename", filename)):
+            if term in tokens:
+                total += _WEIGHTS[(name, True)]
+            elif any(token.startswith(term) for token in tokens):
+                total += _WEIGHTS[(name, False)]
+    return total
+
+
+class SearchIndex:
+    """
+    SearchIndex maps each token to the IDs of the todos containing it.
+
+    Every query term is matched as a prefix of a token, and a todo must
+    match all terms. Results are ranked by how well they match: exact
+    tokens beat prefixes, and title matches beat filename matches.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._postings: Dict[str, Set[str]] = {}
+        # Sorted vocabulary, so a prefix maps to a contiguous range of tokens
+        self._tokens: List[str] = []
+        self._docs: Dict[str, Tuple[Set[str], Set[str]]] = {}
+
+    def add(self, doc_id: str, title: Optional[str], filename: Optional[str] = None):
+        """
+        Index a todo, replacing what was indexed for it before.
+        
+        :param doc_id: The ID of the Todo item.
+        :param title: The title of the Todo item.
+        :param filename: The attachment filename, if any.
+        """
+        fields = (set(tokenize(title)), set(tokenize(filename)))
+        old = self._docs.get(doc_id)
+        if old == fields:
+            return
+        if old is not None:
+            self.remove(doc_id)
+        self._docs[doc_id] = fields
+        for token in fields[0] | fields[1]:
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = set()
+                bisect.insort(self._tokens, token)
+            posting.add(doc_id)
+
+    def remove(self, doc_id: str):
+        """
+        Drop a todo from the index.
+        
+        :param doc_id: The ID of the Todo item.
+        """
+        fields = self._docs.pop(doc_id, None)
+        if fields is None:
+            return
+        for token in fields[0] | fields[1]:
+            posting = self._postings[token]
+            posting.discard(doc_id)
+            if not posting:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _prefix_range(self, term: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(self._tokens, term)
+        return start, bisect.bisect_left(self._tokens, term + "\U0010ffff", start)
+
+    def _prefix_matches(self, start: int, end: int) -> Set[str]:
+        if end - start == 1:
+            return self._postings[self._tokens[start]]
+        matches = set()
+        for token in self._tokens[start:end]:
+            matches |= self._postings[token]
+        return matches
+
+    def _matches(self, doc_id: str, term: str) -> bool:
+        title, filename = self._docs[doc_id]
+        return any(token.startswith(term) for token in title) or any(
+            token.startswith(term) for token in filename
+        )
+
+    def _score(self, doc_id: str, terms: List[str]) -> int:
+        return score(terms, *self._docs[doc_id])
+
+    def search(self, query: str, limit: int = 50) -> List[str]:
+        """
+        Find the todos matching every term of a query.
+        
+        :param query: Free text; each word is matched as a token prefix.
+        :param limit: The maximum number of results.
+        :return: The IDs of the best matches, best first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Expand only the term with the narrowest prefix range into a
+        # candidate set, then check the other terms against each candidate's
+        # own tokens instead of unioning their (possibly huge) postings
+        ranges = sorted(((self._prefix_range(term), term) for term in set(terms)),
+                        key=lambda item: item[0][1] - item[0][0])
+        (start, end), _ = ranges[0]
+        candidates = self._prefix_matches(start, end)
+        for _, term in ranges[1:]:
+            if not candidates:
+                break
+            candidates = {doc_id for doc_id in candidates if self._matches(doc_id, term)}
+        return heapq.nlargest(limit, candidates, key=lambda doc_id: self._score(doc_id, terms))
@@ -0,0 +1,502 @@
+"""
+This module provides a repository that partitions todos across several
+SQLite database files by a hash of their ID. Point operations go to one
+shard; listings, searches and counts query every shard in parallel on a
+process pool and merge the results.
+"""
+
+import dataclasses
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage, encode_cursor, decode_cursor
+from application.query import TodoQuery, check_changes
+from infrastructure.blob_store import BlobStore
+from infrastructure.search_index import tokenize
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+from domain.interfaces import ITodoRepository
+
+MANIFEST = "shards.json"
+DEFAULT_SHARDS = 4
+
+# Read-only connections of a pool worker process, by database path
+_worker_connections: Dict[str, sqlite3.Connection] = {}
+
+# Pool workers are not forked from the caller: the GUI and the API server
+# call from threads, and a forked child would inherit locks held by other
+# threads and their open SQLite connections. Workers start clean and open
+# their own read-only connections.
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def shard_of(todo_id: str, shards: int) -> int:
+    """
+    The shard a todo lives in. This is a jump consistent hash of the ID,
+    so going from N to N+1 shards moves only about 1/(N+1) of the todos.
+
+    :param todo_id: The ID of the Todo item.
+    :param shards: The number of shards.
+    :return: The shard index, from 0 to shards - 1.
+    """
+    key = int.from_bytes(hashlib.blake2b(todo_id.encode("utf-8"), digest_size=8).digest(), "big")
+    bucket, candidate = -1, 0
+    while candidate < shards:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"shard-{index:03d}.db")
+
+
+def _query(path: str, sql: str, params) -> list:
+    # Runs in a pool worker; each worker keeps one connection per shard
+    conn = _worker_connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(Path(path).as_uri() + "?mode=ro", uri=True)
+        _worker_connections[path] = conn
+    return conn.execute(sql, params).fetchall()
+
+
+def _read_manifest(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(directory: str, manifest: dict):
+    path = os.path.join(directory, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _remove_database(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+
+class ShardedSQLiteTodoRepo(ITodoRepository):
+    """
+    ShardedSQLiteTodoRepo keeps todos in several SQLite files in one
+    directory, each a SQLiteTodoRepo with its own connection pool, so
+    writes to different shards do not wait for each other.
+
+    The shard count is recorded in shards.json and changed with
+    rebalance(). Batch writes touching several shards commit once per
+    shard; they are not atomic across shards.
+    """
+
+    def __init__(
+        self,
+        directory: str = "todos_shards",
+        shards: Optional[int] = None,
+        blob_store: Optional[BlobStore] = None,
+        workers: Optional[int] = None,
+        pool_size: int = 4
+    ):
+        """
+        Open or create a sharded repository.
+
+        :param directory: The directory holding the shard files.
+        :param shards: The number of shards of a new repository; an
+            existing one keeps the count it was created or rebalanced with.
+        :param blob_store: If given, attachment bytes are kept in the blob
+            store and rows only hold their digest. It is shared by all shards.
+        :param workers: Processes that scan shards in parallel; None for one
+            per shard up to the CPU count, 0 or 1 to scan them in this process.
+        :param pool_size: The maximum number of connections per shard.
+        """
+        self.directory = directory
+        self.blob_store = blob_store
+        self.pool_size = pool_size
+        os.makedirs(directory, exist_ok=True)
+        manifest = _read_manifest(directory)
+        if manifest is None:
+            manifest = {"shards": shards or DEFAULT_SHARDS}
+            _write_manifest(directory, manifest)
+        elif shards is not None and shards != manifest["shards"] and manifest.get("rebalance_to") != shards:
+            raise ValueError(
+                f"{directory} has {manifest['shards']} shards, not {shards}; use rebalance() to change it"
+            )
+        self.shards: List[SQLiteTodoRepo] = [
+            self._open_shard(index) for index in range(manifest["shards"])
+        ]
+        self._workers = min(len(self.shards), os.cpu_count() or 1) if workers is None else workers
+        self._executor: Optional[Executor] = None
+        if "rebalance_to" in manifest:
+            # A rebalance was interrupted; moving rows is idempotent, so
+            # finish it before anything is routed
+            self.rebalance(manifest["rebalance_to"])
+
+    def _open_shard(self, index: int) -> SQLiteTodoRepo:
+        return SQLiteTodoRepo(shard_path(self.directory, index), blob_store=self.blob_store, pool_size=self.pool_size)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for shard in self.shards:
+            shard.close()
+
+    def _shard(self, todo_id: str) -> SQLiteTodoRepo:
+        return self.shards[shard_of(todo_id, len(self.shards))]
+
+    def _group(self, todo_ids: Iterable[str]) -> Dict[int, List[str]]:
+        groups: Dict[int, List[str]] = {}
+        for todo_id in todo_ids:
+            groups.setdefault(shard_of(todo_id, len(self.shards)), []).append(todo_id)
+        return groups
+
+    def _fan_out(self, sql: str, params=(), shards: Optional[List[int]] = None) -> List[list]:
+        """
+        Run one read query on every shard and return each shard's rows,
+        in shard order.
+        """
+        indexes = range(len(self.shards)) if shards is None else shards
+        if self._workers <= 1 or len(indexes) <= 1:
+            results = []
+            for index in indexes:
+                with self.shards[index].pool.connection() as conn:
+                    results.append(conn.execute(sql, params).fetchall())
+            return results
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers, mp_context=multiprocessing.get_context(_START_METHOD)
+            )
+        futures = [
+            self._executor.submit(_query, os.path.abspath(shard_path(self.directory, index)), sql, params)
+            for index in indexes
+        ]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _merged(results: List[list], key, reverse: bool = False) -> Iterator[tuple]:
+        # (shard index, row) pairs of the per-shard sorted results, in key
+        # order; ties go to the lower shard and rows are never compared
+        sign = -1 if reverse else 1
+
+        def tag(index: int, rows: list):
+            return ((key(row), sign * index, sign * position, row) for position, row in enumerate(rows))
+
+        tagged = [tag(index, rows) for index, rows in enumerate(results)]
+        for _, index, _, row in heapq.merge(*tagged, key=lambda entry: entry[:3], reverse=reverse):
+            yield sign * index, row
+
+    @staticmethod
+    def _created_key(row):
+        return row[6], row[0]
+
+    # Point operations
+
+    def add(self, todo: TodoItem) -> TodoItem:
+        return self._shard(todo.id).add(todo)
+
+    def get(self, todo_id: str) -> Optional[TodoItem]:
+        return self._shard(todo_id).get(todo_id)
+
+    def update(self, todo: TodoItem) -> TodoItem:
+        return self._shard(todo.id).update(todo)
+
+    def delete(self, todo_id: str) -> None:
+        self._shard(todo_id).delete(todo_id)
+
+    def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        return self._shard(todo_id).get_attachment(todo_id)
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        return self._shard(todo_id).write_attachment(todo_id, stream)
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return self._shard(todo_id).iter_attachment(todo_id, chunk_size)
+
+    # Batches, one transaction per shard touched
+
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        by_id = {todo.id: todo for todo in todos}
+        for index, todo_ids in self._group(by_id).items():
+            self.shards[index].add_many(by_id[todo_id] for todo_id in todo_ids)
+        return todos
+
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        by_id = {todo.id: todo for todo in todos}
+        for index, todo_ids in self._group(by_id).items():
+            self.shards[index].update_many(by_id[todo_id] for todo_id in todo_ids)
+        return todos
+
+    def delete_many(self, todo_ids: Iterable[str]) -> None:
+        for index, ids in self._group(todo_ids).items():
+            self.shards[index].delete_many(ids)
+
+    # Fan-out reads
+
+    def list_all(self) -> List[TodoItem]:
+        results = self._fan_out(
+            f"SELECT {SQLiteTodoRepo._ITEM_COLUMNS} FROM {SQLiteTodoRepo._ITEM_SOURCE} ORDER BY created_at, id"
+        )
+        return [self.shards[index]._item_from_row(row) for index, row in self._merged(results, self._created_key)]
+
+    def list_summaries(self) -> List[TodoSummary]:
+        results = self._fan_out(f"SELECT {SQLiteTodoRepo._SUMMARY_COLUMNS} FROM todos ORDER BY created_at, id")
+        return [self.shards[index]._summary_from_row(row) for index, row in self._merged(results, self._created_key)]
+
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        # Each shard returns its first limit + 1 rows after the cursor; the
+        # merged first limit + 1 are the page and whether another follows
+        if cursor:
+            results = self._fan_out(
+                f"SELECT {SQLiteTodoRepo._SUMMARY_COLUMNS} FROM todos WHERE (created_at, id) > (?, ?) "
+                "ORDER BY created_at, id LIMIT ?",
+                (*decode_cursor(cursor), limit + 1)
+            )
+        else:
+            results = self._fan_out(
+                f"SELECT {SQLiteTodoRepo._SUMMARY_COLUMNS} FROM todos ORDER BY created_at, id LIMIT ?",
+                (limit + 1,)
+            )
+        rows = list(itertools.islice(self._merged(results, self._created_key), limit + 1))
+        items = [self.shards[index]._summary_from_row(row) for index, row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+        return TodoPage(items=items, next_cursor=next_cursor)
+
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+        if all(shard._fts for shard in self.shards):
+            # bm25 ranks are computed per shard, so merging them is close to,
+            # but not exactly, the ranking of a single database
+            match = " ".join(f'"{term}"*' for term in terms)
+            results = self._fan_out(
+                f"SELECT {SQLiteTodoRepo._SUMMARY_COLUMNS}, rank FROM todos JOIN ("
+                "SELECT rowid AS match_rowid, rank FROM todos_fts "
+                "WHERE todos_fts MATCH ? ORDER BY rank LIMIT ?"
+                ") ON todos.rowid = match_rowid ORDER BY rank",
+                (match, limit)
+            )
+            merged = self._merged(results, lambda row: row[-1])
+        else:
+            conditions = " AND ".join("(title LIKE ? OR attachment_filename LIKE ?)" for _ in terms)
+            params = [f"%{term}%" for term in terms for _ in range(2)]
+            results = self._fan_out(
+                f"SELECT {SQLiteTodoRepo._SUMMARY_COLUMNS} FROM todos WHERE {conditions} LIMIT ?",
+                (*params, limit)
+            )
+            merged = ((index, row) for index, rows in enumerate(results) for row in rows)
+        summaries = []
+        for index, row in merged:
+            if len(summaries) == limit:
+                break
+            summaries.append(self.shards[index]._summary_from_row(row[:8]))
+        return summaries
+
+    # Queries. Each shard filters, sorts and limits with its own indexes;
+    # the sorted results are merged. Bulk writes by query commit once per
+    # shard, so like other batches they are not atomic across shards.
+
+    def _query_rows(self, query: TodoQuery, changes: Optional[dict] = None) -> List[tuple]:
+        # The first query.limit (shard index, summary row) pairs matching
+        # query, in query order
+        conditions, params = SQLiteTodoRepo._filter(query, changes)
+        sql = (
+            f"SELECT {SQLiteTodoRepo._SUMMARY_COLUMNS} FROM todos"
+            f"{SQLiteTodoRepo._where(conditions)}{SQLiteTodoRepo._order_by(query)}"
+        )
+        if query.limit is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit)
+        column = 6 if query.sort_field == "created_at" else 1
+        merged = self._merged(self._fan_out(sql, params), lambda row: (row[column], row[0]), query.descending)
+        return list(itertools.islice(merged, query.limit))
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        return [self.shards[index]._summary_from_row(row) for index, row in self._query_rows(query)]
+
+    def _write_where(self, write, query: TodoQuery, changes: Optional[dict] = None) -> List[str]:
+        # Without a limit every shard writes its own matches. With one, the
+        # rows are picked across shards first and each shard writes its
+        # picks, still only if they match.
+        if query.limit is None:
+            return [todo_id for shard in self.shards for todo_id in write(shard, query)]
+        groups: Dict[int, List[str]] = {}
+        for index, row in self._query_rows(query, changes):
+            groups.setdefault(index, []).append(row[0])
+        written = set()
+        for index, todo_ids in groups.items():
+            written.update(write(self.shards[index], dataclasses.replace(query, ids=todo_ids, limit=None)))
+        return [todo_id for todo_ids in groups.values() for todo_id in todo_ids if todo_id in written]
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        check_changes(changes)
+        return self._write_where(lambda shard, shard_query: shard.update_where(shard_query, **changes), query, changes)
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        return self._write_where(lambda shard, shard_query: shard.delete_where(shard_query), query)
+
+    def count(self) -> int:
+        """
+        Count the todos in all shards.
+
+        :return: The number of todos.
+        """
+        return sum(rows[0][0] for rows in self._fan_out("SELECT COUNT(*) FROM todos"))
+
+    def stats(self) -> TodoStats:
+        """
+        Add up the counters of every shard; see SQLiteTodoRepo.stats().
+
+        :return: The counts.
+        """
+        return sum((shard.stats() for shard in self.shards), TodoStats())
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the counters of every shard with a count of its rows; see
+        SQLiteTodoRepo.check_stats().
+
+        :param repair: Overwrite the counters of the shards that differ.
+        :return: The counters as they were, and the count, over all shards.
+        """
+        checked = [shard.check_stats(repair) for shard in self.shards]
+        return sum((stats for stats, _ in checked), TodoStats()), sum((counted for _, counted in checked), TodoStats())
+
+    def recompress(self, decompress: bool = False, batch_size: int = 100) -> Tuple[int, int, int]:
+        """
+        Re-encode the stored attachments of every shard; see
+        SQLiteTodoRepo.recompress().
+
+        :param decompress: Store every attachment uncompressed.
+        :param batch_size: The number of todos read per query.
+        :return: The number of attachments rewritten, and the stored bytes
+            before and after.
+        """
+        totals = [shard.recompress(decompress, batch_size) for shard in self.shards]
+        return tuple(sum(column) for column in zip(*totals))
+
+    # Rebalancing and migration
+
+    @staticmethod
+    def _columns(conn: sqlite3.Connection, schema: str) -> str:
+        return ", ".join(row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(todos)"))
+
+    def _move_rows(self, source: SQLiteTodoRepo, target_path: str, target: int, shards: int):
+        """
+        Move the rows of source that belong in shard target of shards,
+        with their streamed attachments. The copy commits before the
+        delete, so an interrupted move leaves rows in both shards, never in
+        neither, and running it again finishes it.
+        """
+        with source.pool.connection() as conn:
+            conn.create_function("todo_shard", 2, shard_of, deterministic=True)
+            conn.execute("ATTACH DATABASE ? AS target", (target_path,))
+            try:
+                conn.execute("PRAGMA target.synchronous=FULL")
+                columns = self._columns(conn, "main")
+                with conn:
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS moving (id TEXT PRIMARY KEY)")
+                    conn.execute("DELETE FROM temp.moving")
+                    conn.execute(
+                        "INSERT INTO temp.moving SELECT id FROM main.todos WHERE todo_shard(id, ?) = ?",
+                        (shards, target)
+                    )
+                    # Rows left by an interrupted move are replaced, through
+                    # DELETE so the target's triggers clean up after them
+                    conn.execute("DELETE FROM target.todos WHERE id IN (SELECT id FROM temp.moving)")
+                    conn.execute(
+                        f"INSERT INTO target.todos ({columns}) SELECT {columns} FROM main.todos "
+                        "WHERE id IN (SELECT id FROM temp.moving)"
+                    )
+                    conn.execute(
+                        "INSERT INTO target.todo_attachments (todo_id, data) SELECT todo_id, data "
+                        "FROM main.todo_attachments WHERE todo_id IN (SELECT id FROM temp.moving)"
+                    )
+                with conn:
+                    conn.execute("DELETE FROM main.todos WHERE id IN (SELECT id FROM temp.moving)")
+                    conn.execute("DELETE FROM temp.moving")
+            finally:
+                conn.execute("DETACH DATABASE target")
+
+    def rebalance(self, shards: int) -> None:
+        """
+        Change the number of shards and move every todo to its new shard.
+        Blob references move with their rows, so the blob store is not
+        touched. Nothing else may use the repository meanwhile; if the
+        process stops half way, opening the repository finishes the move.
+
+        :param shards: The new number of shards.
+        """
+        if shards < 1:
+            raise ValueError("A sharded repository needs at least one shard")
+        if self._executor is not None:
+            # Workers hold connections to shard files that may be removed
+            self._executor.shutdown()
+            self._executor = None
+        manifest = {"shards": len(self.shards), "rebalance_to": shards}
+        _write_manifest(self.directory, manifest)
+        repos = self.shards + [self._open_shard(index) for index in range(len(self.shards), shards)]
+        for index, source in enumerate(repos):
+            for target in range(shards):
+                if target != index:
+                    self._move_rows(source, shard_path(self.directory, target), target, shards)
+        for repo in repos[shards:]:
+            repo.close()
+            _remove_database(repo.pool.db_path)
+        self.shards = repos[:shards]
+        _write_manifest(self.directory, {"shards": shards})
+
+    def migrate_from(self, db_path: str) -> int:
+        """
+        Copy every todo of a single-file SQLite database into the shards.
+        Todos already in a shard are skipped, so an interrupted migration
+        can be run again. The source is left untouched; retire it
+        afterwards, since the blob references of its rows are now held by
+        the shards.
+
+        :param db_path: The path of the todos.db to copy.
+        :return: The number of todos copied.
+        """
+        if not os.path.exists(db_path):
+            raise ValueError(f"{db_path} does not exist")
+        # Opening it brings an older database up to the current schema
+        SQLiteTodoRepo(db_path).close()
+        copied = 0
+        for index, shard in enumerate(self.shards):
+            with shard.pool.connection() as conn:
+                conn.create_function("todo_shard", 2, shard_of, deterministic=True)
+                conn.execute("ATTACH DATABASE ? AS source", (db_path,))
+                try:
+                    columns = self._columns(conn, "source")
+                    with conn:
+                        copied += conn.execute(
+                            f"INSERT OR IGNORE INTO main.todos ({columns}) SELECT {columns} FROM source.todos "
+                            "WHERE todo_shard(id, ?) = ?",
+                            (len(self.shards), index)
+                        ).rowcount
+                        conn.execute(
+                            "INSERT OR IGNORE INTO main.todo_attachments (todo_id, data) SELECT todo_id, data "
+                            "FROM source.todo_attachments WHERE todo_shard(todo_id, ?) = ?",
+                            (len(self.shards), index)
+                        )
+                finally:
+                    conn.execute("DETACH DATABASE source")
+        return copied
@@ -0,0 +1,183 @@
+"""
+This module provides a thread-safe pool of SQLite connections shared by
+SQLiteTodoRepo instances, e.g. one per Flet session.
+"""
+
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator, List, Optional
+
+
+class _Waiter:
+    # A thread waiting for a connection, which _release() hands it directly
+    __slots__ = ("event", "conn")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn: Optional[sqlite3.Connection] = None
+
+
+class SQLiteConnectionPool:
+    """
+    SQLiteConnectionPool hands out at most max_size connections to one
+    database file. Connections are opened lazily in WAL journal mode so
+    readers no longer block behind a writer.
+
+    A thread that already holds a connection gets the same one back from
+    nested connection() calls, so repository methods can call each other
+    without exhausting the pool.
+
+    Threads waiting for a connection get one in the order they asked, so
+    busy threads taking connections back at once cannot starve them.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "todos.db",
+        max_size: int = 8,
+        timeout: float = 30.0,
+        busy_timeout_ms: int = 5000,
+        synchronous: str = "NORMAL"
+    ):
+        """
+        Initialize the pool.
+        
+        :param db_path: The path of the SQLite database file.
+        :param max_size: The maximum number of open connections.
+        :param timeout: Seconds to wait for a free connection before failing.
+        :param busy_timeout_ms: Milliseconds SQLite retries a locked database
+            before raising "database is locked".
+        :param synchronous: The PRAGMA synchronous level; NORMAL is durable
+            across application crashes in WAL mode and avoids an fsync per
+            commit.
+        """
+        if synchronous.upper() not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError("Invalid synchronous level")
+        self.db_path = db_path
+        # Every connection to ":memory:" is a separate database
+        self.max_size = 1 if db_path == ":memory:" else max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous.upper()
+        self._idle: List[sqlite3.Connection] = []
+        self._waiters: Deque[_Waiter] = deque()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            if self._idle:
+                return self._idle.pop()
+            if self._created < self.max_size:
+                self._created += 1
+                waiter = None
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+        if waiter is None:
+            try:
+                return self._connect()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+        waiter.event.wait(self.timeout)
+        with self._lock:
+            if waiter.conn is None:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                raise TimeoutError(f"No SQLite connection available after {self.timeout}s")
+        return waiter.conn
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed:
+                if self._waiters:
+                    waiter = self._waiters.popleft()
+                    waiter.conn = conn
+                    waiter.event.set()
+                else:
+                    self._idle.append(conn)
+                return
+            self._created -= 1
+        conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection for the duration of a with block.
+
+        Uncommitted changes are rolled back when the connection is returned,
+        so callers wrap writes in "with conn:" to commit them.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 0
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def dedicated_connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection outside the pool for a long read, such as
+        streaming an attachment to a slow client, so that it holds none of
+        the pooled connections. It is closed when the with block ends.
+
+        An in-memory database has only the pooled connection, which is
+        borrowed instead.
+        """
+        if self.db_path == ":memory:":
+            with self.connection() as conn:
+                yield conn
+            return
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        """Close idle connections; borrowed ones are closed when returned."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            # Waiting threads fail at once instead of timing out
+            while self._waiters:
+                self._waiters.popleft().event.set()
+        for conn in idle:
+            conn.close()
@@ -2,21 +2,82 @@
 from domain.interfaces import ITodoRepository
 import sqlite3
 import logging
-from domain.interfaces import ITodoRepository
-import sqlite3
-import logging
-from application.models import TodoItem
-from typing import List
+import contextlib
+import dataclasses
+import functools
+import itertools
+import tempfile
+from concurrent.futures import Future
+from application.attachments import AttachmentStream, CHUNK_SIZE
+from application.models import TodoItem, TodoStats, TodoSummary, TodoPage, AttachmentHandle, encode_cursor, decode_cursor
+from application.query import TodoQuery, check_changes, prefix_end
+from infrastructure.attachment_codec import (
+    MIN_SAVING, choose_codec, compress_chunks, decode, decompress_chunks, encode
+)
+from infrastructure.blob_store import BlobStore
+from infrastructure.group_commit import ADD, DELETE, DURABILITY, GROUPED, IMMEDIATE, GroupCommitWriter, Write
+from infrastructure.search_index import tokenize
+from infrastructure.sqlite_pool import SQLiteConnectionPool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Maximum number of IDs bound into a single IN (...) query
+_ID_BATCH = 500
+# Incremental BLOB I/O (Connection.blobopen) needs Python 3.11 or newer
+_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+# Attachments being written are spooled to disk past this size
+_SPOOL_SIZE = 8 * CHUNK_SIZE
+# UPDATE/DELETE ... RETURNING needs SQLite 3.35
+_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
 
 class SQLiteTodoRepo(ITodoRepository):
-    def __init__(self, db_path: str = "todos.db"):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self._create_table()
+    def __init__(
+        self,
+        db_path: str = "todos.db",
+        blob_store: Optional[BlobStore] = None,
+        pool: Optional[SQLiteConnectionPool] = None,
+        pool_size: int = 8,
+        durability: str = IMMEDIATE,
+        writer: Optional[GroupCommitWriter] = None
+    ):
+        # With a blob store, rows keep only the attachment digest and the
+        # bytes live in the store; rows written without one stay inline.
+        self.blob_store = blob_store
         self.logger = logging.getLogger(__name__)
+        # A pool passed in is shared (e.g. by all Flet sessions) and is
+        # left open by close(); otherwise the repository owns its pool.
+        self._owns_pool = pool is None
+        self.pool = pool or SQLiteConnectionPool(db_path, max_size=pool_size)
+        self._create_table()
+        # add(), update() and delete() commit at once with IMMEDIATE, or go
+        # through a group commit writer with GROUPED and ASYNC. A writer
+        # passed in is shared by every repository over the pool and left
+        # running by close(); reads of any of them see its queued writes.
+        # add_queued(), update_queued() and delete_queued() hand back the
+        # writer's future instead of waiting, at any durability.
+        if durability not in DURABILITY:
+            raise ValueError(f"Invalid durability: {durability} (use one of {', '.join(DURABILITY)})")
+        self.durability = durability
+        self._owns_writer = writer is None and durability != IMMEDIATE
+        self.writer = GroupCommitWriter(self) if self._owns_writer else writer
+
+    def close(self) -> None:
+        if self._owns_writer:
+            # Commits what is still queued
+            self.writer.close()
+        if self._owns_pool:
+            self.pool.close()
 
     def _create_table(self):
         try:
-            self.conn.execute("""
+            with self.pool.connection() as conn:
+                self._create_schema(conn)
+        except sqlite3.Error as e:
+            self.logger.error(f"Table creation failed: {str(e)}")
+            raise
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        with conn:
+            conn.execute("""
                 CREATE TABLE IF NOT EXISTS todos (
                     id TEXT PRIMARY KEY,
                     title TEXT NOT NULL,
@@ -24,63 +85,878 @@ class SQLiteTodoRepo(ITodoRepository):
                     attachment_filename TEXT,
                     attachment_mimetype TEXT,
                     attachment_data BLOB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    attachment_hash TEXT,
+                    attachment_size INTEGER,
+                    attachment_codec TEXT
                 )
             """)
-            self.conn.commit()
-        except sqlite3.Error as e:
-            self.logger.error(f"Table creation failed: {str(e)}")
-            raise
+            self._migrate_columns(conn)
+            # Keyset pagination walks this index in (created_at, id) order
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_todos_created_at_id ON todos (created_at, id)"
+            )
+            # Secondary indexes for query(), update_where() and
+            # delete_where(); each ends in the default sort key, so a
+            # filtered listing reads its rows already in order
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_todos_completed ON todos (completed, created_at, id)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_todos_mimetype ON todos (attachment_mimetype, created_at, id)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_todos_title ON todos (title, id)")
+            # Streamed attachments live in their own table. With the BLOB as
+            # the last field of its record, zeroblob() stays a placeholder
+            # until blobopen() fills it, and updating a todo row does not
+            # rewrite its attachment.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS todo_attachments (
+                    todo_id TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS todo_attachments_delete AFTER DELETE ON todos BEGIN
+                    DELETE FROM todo_attachments WHERE todo_id = old.id;
+                END
+            """)
+        self._create_stats_table(conn)
+        self._fts = self._create_search_index(conn)
 
-    def add(self, todo: TodoItem) -> TodoItem:
-        self.conn.execute(
-            "INSERT INTO todos (id, title, completed, attachment_filename, attachment_mimetype, attachment_data) VALUES (?, ?, ?, ?, ?, ?)",
-            (todo.id, todo.title, int(todo.completed), todo.attachment_filename, todo.attachment_mimetype, todo.attachment_data)
+    # Per-row terms of the todo_stats counters; a row has an attachment as
+    # in _HAS_ATTACHMENT, and its bytes are the size summaries report
+    _STATS_TRIGGERS = (
+        """CREATE TRIGGER IF NOT EXISTS todo_stats_insert AFTER INSERT ON todos BEGIN
+            UPDATE todo_stats SET
+                total = total + 1,
+                completed = completed + (new.completed IS 1),
+                with_attachment = with_attachment + (new.attachment_hash IS NOT NULL OR new.attachment_data IS NOT NULL),
+                attachment_bytes = attachment_bytes + COALESCE(new.attachment_size, length(new.attachment_data), 0);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS todo_stats_delete AFTER DELETE ON todos BEGIN
+            UPDATE todo_stats SET
+                total = total - 1,
+                completed = completed - (old.completed IS 1),
+                with_attachment = with_attachment - (old.attachment_hash IS NOT NULL OR old.attachment_data IS NOT NULL),
+                attachment_bytes = attachment_bytes - COALESCE(old.attachment_size, length(old.attachment_data), 0);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS todo_stats_update
+        AFTER UPDATE OF completed, attachment_data, attachment_hash, attachment_size ON todos BEGIN
+            UPDATE todo_stats SET
+                completed = completed - (old.completed IS 1) + (new.completed IS 1),
+                with_attachment = with_attachment
+                    - (old.attachment_hash IS NOT NULL OR old.attachment_data IS NOT NULL)
+                    + (new.attachment_hash IS NOT NULL OR new.attachment_data IS NOT NULL),
+                attachment_bytes = attachment_bytes
+                    - COALESCE(old.attachment_size, length(old.attachment_data), 0)
+                    + COALESCE(new.attachment_size, length(new.attachment_data), 0);
+        END""",
+    )
+    _STATS_COLUMNS = "total, completed, with_attachment, attachment_bytes"
+    _STATS_COUNT = (
+        "SELECT COUNT(*), COALESCE(SUM(completed IS 1), 0), "
+        "COALESCE(SUM(attachment_hash IS NOT NULL OR attachment_data IS NOT NULL), 0), "
+        "COALESCE(SUM(COALESCE(attachment_size, length(attachment_data), 0)), 0) FROM todos"
+    )
+
+    def _create_stats_table(self, conn: sqlite3.Connection):
+        # One row of counters that triggers keep in step with todos, so
+        # stats() reads four numbers instead of scanning the table
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS todo_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    total INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    with_attachment INTEGER NOT NULL,
+                    attachment_bytes INTEGER NOT NULL
+                )
+            """)
+            for trigger in self._STATS_TRIGGERS:
+                conn.execute(trigger)
+        # Until the row exists the triggers update nothing, so counting the
+        # rows written before it in the same statement that inserts it
+        # misses none
+        with conn:
+            conn.execute(
+                f"INSERT OR IGNORE INTO todo_stats (id, {self._STATS_COLUMNS}) SELECT 0, * FROM ({self._STATS_COUNT})"
+            )
+
+    _FTS_TRIGGERS = (
+        """CREATE TRIGGER IF NOT EXISTS todos_fts_insert AFTER INSERT ON todos BEGIN
+            INSERT INTO todos_fts (rowid, title, attachment_filename)
+            VALUES (new.rowid, new.title, new.attachment_filename);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS todos_fts_delete AFTER DELETE ON todos BEGIN
+            INSERT INTO todos_fts (todos_fts, rowid, title, attachment_filename)
+            VALUES ('delete', old.rowid, old.title, old.attachment_filename);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS todos_fts_update AFTER UPDATE OF title, attachment_filename ON todos BEGIN
+            INSERT INTO todos_fts (todos_fts, rowid, title, attachment_filename)
+            VALUES ('delete', old.rowid, old.title, old.attachment_filename);
+            INSERT INTO todos_fts (rowid, title, attachment_filename)
+            VALUES (new.rowid, new.title, new.attachment_filename);
+        END""",
+    )
+
+    def _create_search_index(self, conn: sqlite3.Connection) -> bool:
+        # External-content FTS5 index over titles and filenames, kept in step
+        # with todos by triggers. It is keyed by the implicit rowid, so the
+        # index must be rebuilt after a VACUUM renumbers rows.
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'todos_fts'"
+        ).fetchone()
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5(
+                        title, attachment_filename,
+                        content='todos', content_rowid='rowid', prefix='2 3'
+                    )
+                """)
+                for trigger in self._FTS_TRIGGERS:
+                    conn.execute(trigger)
+                if not exists:
+                    # Index rows written before the search table existed
+                    conn.execute("INSERT INTO todos_fts (todos_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5 fall back to a LIKE scan
+            self.logger.warning(f"Full-text search unavailable, using LIKE: {str(e)}")
+            return False
+        return True
+
+    def _migrate_columns(self, conn: sqlite3.Connection):
+        # Databases created before a column existed get it added in place
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(todos)")}
+        if "created_at" not in columns:
+            # ALTER TABLE cannot add a CURRENT_TIMESTAMP default, so existing
+            # rows are backfilled and new rows always set created_at
+            conn.execute("ALTER TABLE todos ADD COLUMN created_at TIMESTAMP")
+            conn.execute("UPDATE todos SET created_at = CURRENT_TIMESTAMP")
+        for name, declaration in (("attachment_hash", "TEXT"), ("attachment_size", "INTEGER"), ("attachment_codec", "TEXT")):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE todos ADD COLUMN {name} {declaration}")
+
+    # attachment_size is the decoded size; attachment_codec says how the
+    # stored bytes, inline or in todo_attachments, are encoded (NULL: raw)
+    _ITEM_COLUMNS = "id, title, completed, attachment_filename, attachment_mimetype, COALESCE(attachment_data, data), created_at, attachment_hash, attachment_size, attachment_codec"
+    _ITEM_SOURCE = "todos LEFT JOIN todo_attachments ON todo_id = id"
+
+    def _item_from_row(self, row) -> TodoItem:
+        data = decode(row[9], row[5])
+        if data is None and row[7] and self.blob_store:
+            data = self.blob_store.open(row[7])
+        size = row[8]
+        if size is None:
+            size = len(data) if data else 0
+        return TodoItem(
+            id=row[0],
+            title=row[1],
+            completed=bool(row[2]),
+            attachment_filename=row[3],
+            attachment_mimetype=row[4],
+            attachment_data=data,
+            created_at=row[6],
+            attachment_hash=row[7],
+            attachment_size=size
         )
-        self.conn.commit()
+
+    def _inline_data(self, todo: TodoItem) -> Tuple[Optional[bytes], Optional[str]]:
+        # The value stored in the attachment_data column, and its codec
+        if self.blob_store and todo.attachment_hash or todo.attachment_data is None:
+            return None, None
+        return encode(todo.attachment_mimetype, todo.attachment_data)
+
+    def _settle(self, todo_id: Optional[str] = None):
+        # Reads and batch writes wait for queued writes (of one todo, if
+        # given) to commit, so they see them and are ordered after them
+        if self.writer is not None and self.writer.has_pending(todo_id):
+            self.writer.flush().result()
+
+    def _queued(self, future):
+        # GROUPED callers wait for the commit of their group, ASYNC ones
+        # only for the write to be queued
+        if self.durability == GROUPED:
+            future.result()
+
+    def add(self, todo: TodoItem) -> TodoItem:
+        if self.durability == IMMEDIATE:
+            self.add_many([todo])
+        else:
+            todo.fill_attachment_meta()
+            self._queued(self.writer.add(todo))
         return todo
 
+    def add_queued(self, todo: TodoItem) -> Future:
+        # Under GROUPED and ASYNC durability, the writer's future for the
+        # insert; the caller decides whether to wait for it
+        if self.durability == IMMEDIATE:
+            return super().add_queued(todo)
+        todo.fill_attachment_meta()
+        return self.writer.add(todo)
+
     def get(self, todo_id: str) -> TodoItem:
-        cursor = self.conn.execute(
-            "SELECT id, title, completed, attachment_filename, attachment_mimetype, attachment_data FROM todos WHERE id = ?",
-            (todo_id,)
-        )
-        row = cursor.fetchone()
+        if self.writer is not None:
+            write = self.writer.pending(todo_id)
+            if write is not None:
+                # The version that is committed next
+                return None if write.kind == DELETE else dataclasses.replace(write.todo)
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT {self._ITEM_COLUMNS} FROM {self._ITEM_SOURCE} WHERE id = ?",
+                (todo_id,)
+            ).fetchone()
         if row:
-            return TodoItem(
-                id=row[0],
-                title=row[1],
-                completed=bool(row[2]),
-                attachment_filename=row[3],
-                attachment_mimetype=row[4],
-                attachment_data=row[5]
-            )
+            return self._item_from_row(row)
         return None
 
     def update(self, todo: TodoItem) -> TodoItem:
-        self.conn.execute(
-            "UPDATE todos SET title = ?, completed = ?, attachment_filename = ?, attachment_mimetype = ?, attachment_data = ? WHERE id = ?",
-            (todo.title, int(todo.completed), todo.attachment_filename, todo.attachment_mimetype, todo.attachment_data, todo.id)
-        )
-        self.conn.commit()
+        if self.durability == IMMEDIATE:
+            self.update_many([todo])
+        else:
+            todo.fill_attachment_meta()
+            self._queued(self.writer.update(todo))
         return todo
 
     def delete(self, todo_id: str) -> None:
-        self.conn.execute("DELETE FROM todos WHERE id = ?", (todo_id,))
-        self.conn.commit()
+        if self.durability == IMMEDIATE:
+            self.delete_many([todo_id])
+        else:
+            self._queued(self.writer.delete(todo_id))
 
-    def list_all(self) -> List[TodoItem]:
-        cursor = self.conn.execute(
-            "SELECT id, title, completed, attachment_filename, attachment_mimetype, attachment_data FROM todos"
+    def update_queued(self, todo: TodoItem) -> Future:
+        if self.durability == IMMEDIATE:
+            return super().update_queued(todo)
+        todo.fill_attachment_meta()
+        return self.writer.update(todo)
+
+    def delete_queued(self, todo_id: str) -> Future:
+        if self.durability == IMMEDIATE:
+            return super().delete_queued(todo_id)
+        return self.writer.delete(todo_id)
+
+    def _hashes(self, conn: sqlite3.Connection, todo_ids: List[str], query: str) -> Dict[str, str]:
+        # Runs an "id, attachment_hash" query ending in "id IN" over batches of IDs
+        hashes = {}
+        for start in range(0, len(todo_ids), _ID_BATCH):
+            batch = todo_ids[start:start + _ID_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            hashes.update(conn.execute(f"{query} ({placeholders})", batch))
+        return hashes
+
+    def _stored_blobs(self, conn: sqlite3.Connection, todo_ids: List[str]) -> Dict[str, str]:
+        # Digests of the blobs the given rows reference, for blob-backed rows.
+        # length() reads the size from the record header; IS NULL would load
+        # the whole BLOB.
+        return self._hashes(
+            conn, todo_ids,
+            "SELECT id, attachment_hash FROM todos WHERE length(attachment_data) IS NULL "
+            "AND attachment_hash IS NOT NULL "
+            "AND id NOT IN (SELECT todo_id FROM todo_attachments) AND id IN"
         )
-        todos = []
-        for row in cursor:
-            todos.append(TodoItem(
-                id=row[0],
-                title=row[1],
-                completed=bool(row[2]),
-                attachment_filename=row[3],
-                attachment_mimetype=row[4],
-                attachment_data=row[5]
+
+    def _streamed(self, conn: sqlite3.Connection, todo_ids: List[str]) -> Dict[str, str]:
+        # Digests of the given rows' attachments in todo_attachments
+        return self._hashes(
+            conn, todo_ids,
+            "SELECT id, attachment_hash FROM todos JOIN todo_attachments ON todo_id = id WHERE id IN"
+        )
+
+    # The statements of add_many(), update_many() and delete_many(), run on
+    # a connection without committing, so write_batch() can combine them in
+    # one transaction. update and delete return the blob digests to
+    # release once the transaction has committed. Blobs are stored before
+    # the transaction, and the digests of the references taken are added
+    # to taken, to be released again if it does not commit.
+
+    def _insert_rows(self, todos: List[TodoItem], taken: List[str]) -> List[tuple]:
+        # Blobs are stored and attachments compressed before the insert
+        for todo in todos:
+            todo.fill_attachment_meta()
+        if self.blob_store:
+            taken.extend(self.blob_store.put_many(
+                (todo.attachment_data, todo.attachment_hash)
+                for todo in todos if todo.attachment_data is not None
             ))
+        return [
+            (todo.id, todo.title, int(todo.completed), todo.attachment_filename, todo.attachment_mimetype, *self._inline_data(todo), todo.created_at, todo.attachment_hash, todo.attachment_size)
+            for todo in todos
+        ]
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, rows: List[tuple]):
+        conn.executemany(
+            "INSERT INTO todos (id, title, completed, attachment_filename, attachment_mimetype, attachment_data, attachment_codec, created_at, attachment_hash, attachment_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def _update(self, conn: sqlite3.Connection, todos: List[TodoItem], taken: List[str]) -> List[str]:
+        puts, released, kept = [], [], set()
+        todo_ids = [todo.id for todo in todos]
+        streamed = self._streamed(conn, todo_ids)
+        if self.blob_store:
+            old_hashes = self._stored_blobs(conn, todo_ids)
+        for todo in todos:
+            todo.fill_attachment_meta()
+            if todo.attachment_hash is not None and streamed.get(todo.id) == todo.attachment_hash:
+                # An unchanged streamed attachment stays where it is
+                kept.add(todo.id)
+            elif self.blob_store:
+                old_hash = old_hashes.get(todo.id)
+                if todo.attachment_hash != old_hash:
+                    if todo.attachment_data is not None:
+                        puts.append((todo.attachment_data, todo.attachment_hash))
+                    if old_hash:
+                        released.append(old_hash)
+        if puts:
+            taken.extend(self.blob_store.put_many(puts))
+        # A kept streamed attachment keeps its codec too
+        rows = []
+        for todo in todos:
+            data, codec = (None, None) if todo.id in kept else self._inline_data(todo)
+            rows.append((todo.title, int(todo.completed), todo.attachment_filename, todo.attachment_mimetype,
+                         data, int(todo.id in kept), codec, todo.attachment_hash, todo.attachment_size, todo.id))
+        conn.executemany(
+            "UPDATE todos SET title = ?, completed = ?, attachment_filename = ?, attachment_mimetype = ?, attachment_data = ?, "
+            "attachment_codec = CASE WHEN ? THEN attachment_codec ELSE ? END, attachment_hash = ?, attachment_size = ? WHERE id = ?",
+            rows
+        )
+        conn.executemany(
+            "DELETE FROM todo_attachments WHERE todo_id = ?",
+            [(todo_id,) for todo_id in streamed if todo_id not in kept]
+        )
+        return released
+
+    def _delete(self, conn: sqlite3.Connection, todo_ids: List[str]) -> List[str]:
+        released = self._stored_blobs(conn, todo_ids) if self.blob_store else {}
+        conn.executemany("DELETE FROM todos WHERE id = ?", [(todo_id,) for todo_id in todo_ids])
+        return list(released.values())
+
+    def _release_taken(self, taken: List[str]):
+        # The references of a write that failed, e.g. on a duplicate ID
+        if taken:
+            self.blob_store.release_many(taken)
+
+    def add_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        # One transaction, hence one commit, for the whole batch
+        todos = list(todos)
+        self._settle()
+        taken = []
+        try:
+            # Compressed before the write transaction starts
+            rows = self._insert_rows(todos, taken)
+            with self.pool.connection() as conn, conn:
+                self._insert(conn, rows)
+        except BaseException:
+            self._release_taken(taken)
+            raise
+        return todos
+
+    def update_many(self, todos: Iterable[TodoItem]) -> List[TodoItem]:
+        todos = list(todos)
+        self._settle()
+        # The implicit transaction begins with the first UPDATE, after the
+        # current attachments are read and new blobs stored
+        taken = []
+        try:
+            with self.pool.connection() as conn, conn:
+                released = self._update(conn, todos, taken)
+        except BaseException:
+            self._release_taken(taken)
+            raise
+        if released:
+            self.blob_store.release_many(released)
         return todos
+
+    def delete_many(self, todo_ids: Iterable[str]) -> None:
+        todo_ids = list(todo_ids)
+        self._settle()
+        with self.pool.connection() as conn, conn:
+            released = self._delete(conn, todo_ids)
+        if released:
+            self.blob_store.release_many(released)
+
+    def write_batch(self, writes: List[Write]) -> None:
+        """
+        Commit writes queued by a GroupCommitWriter in one transaction, in
+        queue order; consecutive writes of the same kind run as one batch.
+        If any of them fails, none is committed, and the blob references
+        they took are released, so the writer can retry them one by one.
+
+        :param writes: The queued adds, updates and deletes.
+        """
+        released, taken = [], []
+        try:
+            with self.pool.connection() as conn, conn:
+                # Taken up front, so what the updates read cannot change
+                # before they write
+                conn.execute("BEGIN IMMEDIATE")
+                for kind, group in itertools.groupby(writes, key=lambda write: write.kind):
+                    group = list(group)
+                    if kind == ADD:
+                        self._insert(conn, self._insert_rows([write.todo for write in group], taken))
+                    elif kind == DELETE:
+                        released.extend(self._delete(conn, [write.todo_id for write in group]))
+                    else:
+                        released.extend(self._update(conn, [write.todo for write in group], taken))
+        except BaseException:
+            self._release_taken(taken)
+            raise
+        if released:
+            self.blob_store.release_many(released)
+
+    def list_all(self) -> List[TodoItem]:
+        self._settle()
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT {self._ITEM_COLUMNS} FROM {self._ITEM_SOURCE}").fetchall()
+        return [self._item_from_row(row) for row in rows]
+
+    # length() reads the BLOB size from the record header, so the
+    # attachment bytes themselves are never loaded by summary queries.
+    _SUMMARY_COLUMNS = "id, title, completed, attachment_filename, attachment_mimetype, COALESCE(attachment_size, length(attachment_data)), created_at, attachment_hash"
+
+    def _summary_from_row(self, row) -> TodoSummary:
+        size = row[5] or 0
+        return TodoSummary(
+            id=row[0],
+            title=row[1],
+            completed=bool(row[2]),
+            attachment_filename=row[3],
+            attachment_mimetype=row[4],
+            attachment_size=size,
+            created_at=row[6],
+            attachment_hash=row[7],
+            attachment=AttachmentHandle(functools.partial(self.get_attachment, row[0]), size) if size else None
+        )
+
+    def list_summaries(self) -> List[TodoSummary]:
+        self._settle()
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT {self._SUMMARY_COLUMNS} FROM todos").fetchall()
+        return [self._summary_from_row(row) for row in rows]
+
+    def list_page(self, cursor: Optional[str] = None, limit: int = 50) -> TodoPage:
+        self._settle()
+        # Fetch one extra row to learn whether another page follows
+        with self.pool.connection() as conn:
+            if cursor:
+                rows = conn.execute(
+                    f"SELECT {self._SUMMARY_COLUMNS} FROM todos WHERE (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+                    (*decode_cursor(cursor), limit + 1)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT {self._SUMMARY_COLUMNS} FROM todos ORDER BY created_at, id LIMIT ?",
+                    (limit + 1,)
+                ).fetchall()
+        items = [self._summary_from_row(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+        return TodoPage(items=items, next_cursor=next_cursor)
+
+    def get_attachment(self, todo_id: str) -> Optional[bytes]:
+        self._settle(todo_id)
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT COALESCE(attachment_data, data), attachment_hash, attachment_codec FROM {self._ITEM_SOURCE} WHERE id = ?",
+                (todo_id,)
+            ).fetchone()
+        if not row:
+            return None
+        if row[0] is None and row[1] and self.blob_store:
+            return self.blob_store.open(row[1])
+        return decode(row[2], row[0])
+
+    # Queries. Every filter is a plain comparison on an indexed column, so
+    # SQLite can drive the scan from whichever index is most selective.
+
+    _HAS_ATTACHMENT = "(attachment_hash IS NOT NULL OR length(attachment_data) IS NOT NULL)"
+
+    @classmethod
+    def _filter(cls, query: TodoQuery, changes: Optional[dict] = None) -> Tuple[List[str], list]:
+        # The WHERE conditions of a query, and their parameters. With
+        # changes, rows that already have those values are excluded.
+        conditions, params = [], []
+        if query.ids is not None:
+            conditions.append(f"id IN ({', '.join('?' * len(query.ids))})")
+            params.extend(sorted(query.ids))
+        if query.completed is not None:
+            conditions.append("completed = ?")
+            params.append(int(query.completed))
+        if query.has_attachment is not None:
+            conditions.append(cls._HAS_ATTACHMENT if query.has_attachment else f"NOT {cls._HAS_ATTACHMENT}")
+        if query.mimetype is not None:
+            if query.mimetype_prefix:
+                conditions.append("attachment_mimetype >= ? AND attachment_mimetype < ?")
+                params.extend([query.mimetype, prefix_end(query.mimetype)])
+            else:
+                conditions.append("attachment_mimetype = ?")
+                params.append(query.mimetype)
+        if query.title_prefix is not None:
+            end = prefix_end(query.title_prefix)
+            conditions.append("title >= ?" if end is None else "title >= ? AND title < ?")
+            params.extend([query.title_prefix] if end is None else [query.title_prefix, end])
+        if query.created_from is not None:
+            conditions.append("created_at >= ?")
+            params.append(query.created_from)
+        if query.created_to is not None:
+            conditions.append("created_at < ?")
+            params.append(query.created_to)
+        if changes:
+            conditions.append("NOT (" + " AND ".join(f"{name} IS ?" for name in changes) + ")")
+            params.extend(cls._column_values(changes))
+        return conditions, params
+
+    @staticmethod
+    def _column_values(changes: dict) -> list:
+        return [int(value) if name == "completed" else value for name, value in changes.items()]
+
+    @staticmethod
+    def _where(conditions: List[str]) -> str:
+        return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    @staticmethod
+    def _order_by(query: TodoQuery) -> str:
+        direction = " DESC" if query.descending else ""
+        return f" ORDER BY {query.sort_field}{direction}, id{direction}"
+
+    @classmethod
+    def _target(cls, query: TodoQuery, changes: Optional[dict] = None) -> Tuple[str, list]:
+        # The WHERE clause selecting the rows update_where() or
+        # delete_where() write; a limit picks them in query order
+        conditions, params = cls._filter(query, changes)
+        if query.limit is None:
+            return cls._where(conditions), params
+        return (
+            f" WHERE id IN (SELECT id FROM todos{cls._where(conditions)}{cls._order_by(query)} LIMIT ?)",
+            params + [query.limit]
+        )
+
+    def query(self, query: TodoQuery) -> List[TodoSummary]:
+        self._settle()
+        conditions, params = self._filter(query)
+        sql = f"SELECT {self._SUMMARY_COLUMNS} FROM todos{self._where(conditions)}{self._order_by(query)}"
+        if query.limit is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [self._summary_from_row(row) for row in rows]
+
+    def _write_where(self, conn: sqlite3.Connection, statement: str, where: str, params: list) -> List[str]:
+        # Runs an UPDATE or DELETE over the rows matching where and
+        # returns their IDs
+        if _RETURNING:
+            return [row[0] for row in conn.execute(f"{statement}{where} RETURNING id", params)]
+        # Older SQLite: the IDs are read first, in the same transaction
+        todo_ids = [row[0] for row in conn.execute(f"SELECT id FROM todos{where}", params[statement.count("?"):])]
+        conn.execute(f"{statement}{where}", params)
+        return todo_ids
+
+    def update_where(self, query: TodoQuery, **changes) -> List[str]:
+        check_changes(changes)
+        self._settle()
+        where, params = self._target(query, changes)
+        assignments = ", ".join(f"{name} = ?" for name in changes)
+        with self.pool.connection() as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                return self._write_where(conn, f"UPDATE todos SET {assignments}", where, self._column_values(changes) + params)
+
+    def delete_where(self, query: TodoQuery) -> List[str]:
+        self._settle()
+        where, params = self._target(query)
+        with self.pool.connection() as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                released = {}
+                if self.blob_store:
+                    # The digests of the blob-backed rows among them
+                    released = dict(conn.execute(
+                        f"SELECT id, attachment_hash FROM todos{where}{' AND' if where else ' WHERE'} "
+                        "length(attachment_data) IS NULL AND attachment_hash IS NOT NULL "
+                        "AND id NOT IN (SELECT todo_id FROM todo_attachments)",
+                        params
+                    ))
+                todo_ids = self._write_where(conn, "DELETE FROM todos", where, params)
+        if released:
+            self.blob_store.release_many(released[todo_id] for todo_id in todo_ids if todo_id in released)
+        return todo_ids
+
+    def stats(self) -> TodoStats:
+        """
+        Read the counters the todo_stats triggers keep up to date.
+
+        :return: The counts.
+        """
+        self._settle()
+        with self.pool.connection() as conn:
+            return TodoStats(*conn.execute(f"SELECT {self._STATS_COLUMNS} FROM todo_stats").fetchone())
+
+    def check_stats(self, repair: bool = False) -> Tuple[TodoStats, TodoStats]:
+        """
+        Compare the todo_stats counters with a count of the todos table.
+
+        :param repair: Overwrite the counters with the count if they differ.
+        :return: The counters as they were, and the count.
+        """
+        self._settle()
+        with self.pool.connection() as conn, conn:
+            # No write may land between the two reads
+            conn.execute("BEGIN IMMEDIATE")
+            stats = TodoStats(*conn.execute(f"SELECT {self._STATS_COLUMNS} FROM todo_stats").fetchone())
+            counted = TodoStats(*conn.execute(self._STATS_COUNT).fetchone())
+            if repair and stats != counted:
+                conn.execute(
+                    "UPDATE todo_stats SET total = ?, completed = ?, with_attachment = ?, attachment_bytes = ?",
+                    dataclasses.astuple(counted)
+                )
+        return stats, counted
+
+    def search(self, query: str, limit: int = 50) -> List[TodoSummary]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self._settle()
+        with self.pool.connection() as conn:
+            if self._fts:
+                # Every term as a quoted prefix query, ANDed, best bm25 rank first
+                match = " ".join(f'"{term}"*' for term in terms)
+                rows = conn.execute(
+                    f"SELECT {self._SUMMARY_COLUMNS} FROM todos JOIN ("
+                    "SELECT rowid AS match_rowid, rank FROM todos_fts "
+                    "WHERE todos_fts MATCH ? ORDER BY rank LIMIT ?"
+                    ") ON todos.rowid = match_rowid ORDER BY rank",
+                    (match, limit)
+                ).fetchall()
+            else:
+                # tokenize() only yields word characters, so no LIKE escaping is needed
+                conditions = " AND ".join("(title LIKE ? OR attachment_filename LIKE ?)" for _ in terms)
+                params = [f"%{term}%" for term in terms for _ in range(2)]
+                rows = conn.execute(
+                    f"SELECT {self._SUMMARY_COLUMNS} FROM todos WHERE {conditions} LIMIT ?",
+                    (*params, limit)
+                ).fetchall()
+        return [self._summary_from_row(row) for row in rows]
+
+    def _item_meta(self, conn: sqlite3.Connection, todo_id: str) -> Optional[TodoItem]:
+        # A TodoItem with everything but the attachment bytes
+        row = conn.execute(f"SELECT {self._SUMMARY_COLUMNS} FROM todos WHERE id = ?", (todo_id,)).fetchone()
+        if row is None:
+            return None
+        return TodoItem(
+            id=row[0],
+            title=row[1],
+            completed=bool(row[2]),
+            attachment_filename=row[3],
+            attachment_mimetype=row[4],
+            attachment_size=row[5] or 0,
+            created_at=row[6],
+            attachment_hash=row[7]
+        )
+
+    def write_attachment(self, todo_id: str, stream: AttachmentStream) -> TodoItem:
+        self._settle(todo_id)
+        if self.blob_store:
+            digest, size = self.blob_store.put_stream(stream)
+            try:
+                with self.pool.connection() as conn:
+                    old_hash = self._stored_blobs(conn, [todo_id]).get(todo_id)
+                    with conn:
+                        updated = conn.execute(
+                            "UPDATE todos SET attachment_filename = ?, attachment_mimetype = ?, attachment_data = NULL, attachment_codec = NULL, attachment_hash = ?, attachment_size = ? WHERE id = ?",
+                            (stream.filename, stream.mimetype, digest, size, todo_id)
+                        ).rowcount
+                        conn.execute("DELETE FROM todo_attachments WHERE todo_id = ?", (todo_id,))
+                    todo = self._item_meta(conn, todo_id)
+            except BaseException:
+                self.blob_store.release(digest)
+                raise
+            if not updated:
+                self.blob_store.release(digest)
+                raise ValueError("Todo not found")
+            if old_hash:
+                self.blob_store.release(old_hash)
+            return todo
+        with self.pool.connection() as conn:
+            # One transaction, so a failed stream leaves the previous
+            # attachment in place
+            with conn:
+                if conn.execute("SELECT 1 FROM todos WHERE id = ?", (todo_id,)).fetchone() is None:
+                    raise ValueError("Todo not found")
+                codec = self._write_blob(conn, todo_id, stream)
+                conn.execute(
+                    "UPDATE todos SET attachment_filename = ?, attachment_mimetype = ?, attachment_data = NULL, attachment_codec = ?, attachment_hash = ?, attachment_size = ? WHERE id = ?",
+                    (stream.filename, stream.mimetype, codec, stream.digest, stream.size, todo_id)
+                )
+            return self._item_meta(conn, todo_id)
+
+    def _write_blob(self, conn: sqlite3.Connection, todo_id: str, stream: AttachmentStream) -> Optional[str]:
+        # Returns the codec the stored bytes are encoded with. The first
+        # chunk is the sample the policy probes.
+        chunks = iter(stream)
+        first = next(chunks, b"")
+        codec = choose_codec(stream.mimetype, first)
+        chunks = itertools.chain([first], chunks)
+        if codec is not None:
+            chunks = compress_chunks(codec, chunks)
+        if not _BLOBOPEN:
+            # Without incremental BLOB I/O the bytes are bound to the
+            # statement in one piece
+            conn.execute(
+                "INSERT OR REPLACE INTO todo_attachments (todo_id, data) VALUES (?, ?)",
+                (todo_id, b"".join(chunks))
+            )
+            return codec
+        if codec is None and stream.size_hint is not None:
+            # Preallocate the BLOB, then fill it in place one chunk at a time
+            self._fill_blob(conn, todo_id, stream.size_hint, chunks)
+            if stream.size != stream.size_hint:
+                raise ValueError("Attachment size changed while it was read")
+            return codec
+        # zeroblob() needs the size up front, so streams of unknown length
+        # and compressed streams are spooled (to disk past _SPOOL_SIZE) first
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE) as spool:
+            for chunk in chunks:
+                spool.write(chunk)
+            size = spool.tell()
+            spool.seek(0)
+            self._fill_blob(conn, todo_id, size, iter(lambda: spool.read(CHUNK_SIZE), b""))
+        return codec
+
+    def _fill_blob(self, conn: sqlite3.Connection, todo_id: str, size: int, chunks: Iterable[bytes]):
+        rowid = conn.execute(
+            "INSERT OR REPLACE INTO todo_attachments (todo_id, data) VALUES (?, zeroblob(?))",
+            (todo_id, size)
+        ).lastrowid
+        with conn.blobopen("todo_attachments", "data", rowid) as blob:
+            for chunk in chunks:
+                blob.write(chunk)
+
+    def iter_attachment(self, todo_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        self._settle(todo_id)
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT todos.rowid, length(attachment_data), todo_attachments.rowid, length(data), attachment_hash, attachment_codec "
+                f"FROM {self._ITEM_SOURCE} WHERE id = ?",
+                (todo_id,)
+            ).fetchone()
+        if row is None:
+            return
+        # Attachments stored before streaming existed are inline in todos
+        if row[1] is not None:
+            source = ("todos", "attachment_data", row[0], row[1])
+        elif row[3] is not None:
+            source = ("todo_attachments", "data", row[2], row[3])
+        else:
+            if row[4] and self.blob_store:
+                yield from self.blob_store.iter_chunks(row[4], chunk_size)
+            return
+        # Closed with this generator, so stopping early closes the connection
+        with contextlib.closing(self._iter_stored(*source, chunk_size)) as stored:
+            if row[5] is not None:
+                yield from decompress_chunks(row[5], stored, chunk_size)
+            else:
+                yield from stored
+
+    def _iter_stored(self, table: str, column: str, rowid: int, length: int, chunk_size: int) -> Iterator[bytes]:
+        # The stored bytes of a BLOB, as they are in the database. A slow
+        # reader keeps its own connection open, not one of the pool's.
+        with self.pool.dedicated_connection() as conn:
+            if _BLOBOPEN:
+                with conn.blobopen(table, column, rowid, readonly=True) as blob:
+                    yield from iter(lambda: blob.read(chunk_size), b"")
+            else:
+                for offset in range(1, length + 1, chunk_size):
+                    yield conn.execute(
+                        f"SELECT substr({column}, ?, ?) FROM {table} WHERE rowid = ?",
+                        (offset, chunk_size, rowid)
+                    ).fetchone()[0]
+
+    def recompress(self, decompress: bool = False, batch_size: int = 100) -> Tuple[int, int, int]:
+        """
+        Re-encode every stored attachment under the current codec policy,
+        or store them all uncompressed again. Attachments in the blob store
+        are left alone. Run it while nothing else writes to the database.
+
+        :param decompress: Store every attachment uncompressed.
+        :param batch_size: The number of todos read per query.
+        :return: The number of attachments rewritten, and the stored bytes
+            of all attachments before and after.
+        """
+        self._settle()
+        rewritten = before = after = 0
+        last_id = ""
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, attachment_mimetype, attachment_codec, length(attachment_data), length(data) "
+                    f"FROM {self._ITEM_SOURCE} WHERE id > ? AND (attachment_data IS NOT NULL OR data IS NOT NULL) "
+                    "ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return rewritten, before, after
+            for todo_id, mimetype, codec, inline_size, streamed_size in rows:
+                stored = inline_size if inline_size is not None else streamed_size
+                size = self._recompress_inline(todo_id, mimetype, codec, decompress) if inline_size is not None \
+                    else self._recompress_streamed(todo_id, mimetype, codec, decompress)
+                before += stored
+                after += stored if size is None else size
+                rewritten += size is not None
+            last_id = rows[-1][0]
+
+    def _recompress_inline(self, todo_id: str, mimetype: Optional[str], codec: Optional[str], decompress: bool) -> Optional[int]:
+        # Returns the new stored size, or None if the row was left as it is
+        with self.pool.connection() as conn:
+            data = decode(codec, conn.execute("SELECT attachment_data FROM todos WHERE id = ?", (todo_id,)).fetchone()[0])
+            stored, new_codec = (data, None) if decompress else encode(mimetype, data)
+            if new_codec == codec:
+                return None
+            # Rows from before attachment_size existed have it NULL, and are
+            # counted by their stored length until it is filled in here
+            with conn:
+                conn.execute(
+                    "UPDATE todos SET attachment_data = ?, attachment_codec = ?, attachment_size = ? WHERE id = ?",
+                    (stored, new_codec, len(data), todo_id)
+                )
+        return len(stored)
+
+    def _recompress_streamed(self, todo_id: str, mimetype: Optional[str], codec: Optional[str], decompress: bool) -> Optional[int]:
+        chunks = self.iter_attachment(todo_id)
+        first = next(chunks, b"")
+        new_codec = None if decompress else choose_codec(mimetype, first)
+        if new_codec == codec:
+            chunks.close()
+            return None
+        with contextlib.ExitStack() as stack:
+            raw = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE))
+            for chunk in itertools.chain([first], chunks):
+                raw.write(chunk)
+            spool = raw
+            if new_codec is not None:
+                # Compressed into a second spool, kept only if it saves enough
+                raw.seek(0)
+                packed = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE))
+                for chunk in compress_chunks(new_codec, iter(lambda: raw.read(CHUNK_SIZE), b"")):
+                    packed.write(chunk)
+                if packed.tell() <= raw.tell() * (1 - MIN_SAVING):
+                    spool = packed
+                elif codec is None:
+                    return None
+                else:
+                    new_codec = None
+            size = spool.tell()
+            spool.seek(0)
+            with self.pool.connection() as conn, conn:
+                if _BLOBOPEN:
+                    self._fill_blob(conn, todo_id, size, iter(lambda: spool.read(CHUNK_SIZE), b""))
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO todo_attachments (todo_id, data) VALUES (?, ?)",
+                        (todo_id, spool.read())
+                    )
+                conn.execute("UPDATE todos SET attachment_codec = ? WHERE id = ?", (new_codec, todo_id))
+        return size
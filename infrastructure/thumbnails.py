@@ -0,0 +1,95 @@
+"""
+This module provides an on-disk cache of image thumbnails, keyed by the
+SHA-256 digest of the attachment they were made from.
+"""
+
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it originals are served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Raised by Pillow for bytes that are not an image it can read, or one
+# too large to decode safely; retrying cannot fix either
+DECODE_ERRORS = (Image.UnidentifiedImageError, Image.DecompressionBombError) if Image is not None else ()
+
+
+class ThumbnailCache:
+    """
+    ThumbnailCache renders each image attachment once at a fixed size and
+    keeps the result on disk. Since attachments are content-addressed, a
+    cached thumbnail never goes stale.
+    """
+
+    def __init__(self, root: str = "uploads/thumbs", size: Tuple[int, int] = (200, 200)):
+        """
+        Initialize the thumbnail cache.
+        
+        :param root: The directory holding the thumbnails.
+        :param size: The bounding box thumbnails are scaled down to.
+        """
+        self.root = Path(root)
+        self.size = size
+        if Image is None:
+            logger.warning("Pillow is not installed; serving full-size images as thumbnails")
+
+    def _path(self, digest: str, extension: str) -> Path:
+        width, height = self.size
+        return self.root / digest[:2] / f"{digest}_{width}x{height}.{extension}"
+
+    def cached(self, digest: str) -> Optional[Path]:
+        """
+        Get the cached thumbnail of an attachment, if it was rendered before.
+        
+        :param digest: The SHA-256 hex digest of the attachment.
+        :return: The path of the thumbnail, or None.
+        """
+        for extension in ("jpg", "png"):
+            path = self._path(digest, extension)
+            if path.exists():
+                return path
+        return None
+
+    def get(self, digest: str, load: Callable[[], Optional[bytes]]) -> Optional[Path]:
+        """
+        Get the thumbnail of an attachment, rendering it on first use.
+        
+        :param digest: The SHA-256 hex digest of the attachment.
+        :param load: Returns the attachment bytes; only called on a cache miss.
+        :return: The path of the thumbnail, or None if it cannot be rendered.
+        """
+        path = self.cached(digest)
+        if path is not None or Image is None:
+            return path
+        data = load()
+        if data is None:
+            return None
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail(self.size)
+                # Keep transparency as PNG; everything else is smaller as JPEG
+                if image.mode in ("RGBA", "LA", "P"):
+                    extension, image_format = "png", "PNG"
+                else:
+                    extension, image_format = "jpg", "JPEG"
+                    image = image.convert("RGB")
+                buffer = io.BytesIO()
+                image.save(buffer, image_format)
+        except (OSError, ValueError) + DECODE_ERRORS as err:
+            logger.warning(f"Cannot render thumbnail for {digest}: {err}")
+            return None
+        path = self._path(digest, extension)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        return path
@@ -1,7 +1,6 @@
 import click
+import functools
 from presentation.cli import cli  # Assuming your CLI commands are defined here
-from presentation.flet_ui import main as flet_main
-import flet as ft
 
 @click.group()
 def main():
@@ -9,10 +8,49 @@ def main():
     pass
 
 @main.command()
-def gui():
+@click.option('--cache-mb', default=None, type=int, help='Cache recently read todos and attachments in this many MB (0 disables)')
+def gui(cache_mb):
     """Run the Flet GUI"""
+    # Flet takes most of a second to import, so only the GUI pays for it
+    import flet as ft
+    from presentation.flet_ui import main as flet_main
     print("Starting Flet GUI...")
-    ft.app(target=flet_main, host="0.0.0.0", port=8550, view=ft.WEB_BROWSER)
+    target = flet_main if cache_mb is None else functools.partial(flet_main, cache_mb=cache_mb)
+    ft.app(target=target, host="0.0.0.0", port=8550, view=ft.WEB_BROWSER)
+
+@main.command(context_settings={"ignore_unknown_options": True, "help_option_names": []})
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def bench(args):
+    """Benchmark the storage backends (see --help)"""
+    from benchmarks.suite import main as run_suite
+    run_suite(list(args), prog="main.py bench")
+
+@main.command()
+@click.option('--storage', default='sqlite', show_default=True, help='Storage backend, as for the CLI')
+@click.option('--host', default='127.0.0.1', show_default=True, help='Interface to listen on')
+@click.option('--port', default=8080, show_default=True, type=int, help='Port to listen on')
+@click.option('--blob-dir', default=None, help='Store attachments deduplicated in this directory (e.g. uploads)')
+@click.option('--cache-mb', default=0, type=int, help='Cache recently read todos and attachments in this many MB (0 disables)')
+@click.option('--workers', default=8, show_default=True, type=int, help='Threads running blocking repository calls')
+def serve(storage, host, port, blob_dir, cache_mb, workers):
+    """Serve the todos as a JSON HTTP API"""
+    import asyncio
+    from presentation.api_server import build_service, serve as serve_api
+    try:
+        service, metrics = build_service(storage, blob_dir, cache_mb, workers)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--storage")
+    try:
+        asyncio.run(serve_api(service, host, port, metrics))
+    except KeyboardInterrupt:
+        pass
+
+@main.command(context_settings={"ignore_unknown_options": True, "help_option_names": []})
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def loadgen(args):
+    """Load-test a running API server (see --help)"""
+    from benchmarks.loadgen import main as run_loadgen
+    run_loadgen(list(args), prog="main.py loadgen")
 
 main.add_command(cli, name="cli")
 
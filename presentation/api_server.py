@@ -0,0 +1,514 @@
+"""
+This module provides ApiServer, an asyncio HTTP/1.1 server that exposes
+the todos as a JSON API for scripts and other services. Connections are
+kept alive between requests, and attachments are streamed as raw bytes
+in both directions instead of being wrapped in base64 JSON:
+
+    GET    /todos                     one page of todos, optionally filtered
+    POST   /todos                     create a todo from {"title", "completed"}
+    GET    /todos/<id>                one todo
+    PATCH  /todos/<id>                change its title and/or completed
+    DELETE /todos/<id>                delete it
+    GET    /todos/<id>/attachment     download its attachment
+    PUT    /todos/<id>/attachment     upload one; the body is the file
+    GET    /stats                     counts of all, completed and attached todos
+    GET    /metrics                   operation metrics in Prometheus text format
+"""
+
+import asyncio
+import dataclasses
+import http
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterator, Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+from application.attachments import AttachmentStream, CHUNK_SIZE, MAX_ATTACHMENT_SIZE
+from application.metrics import MetricsRegistry
+from application.query import CREATED, ORDERS, TodoQuery, attachment_size, has_attachment
+from application.services import AsyncTodoService, TodoService
+
+logger = logging.getLogger(__name__)
+
+# The longest request line plus headers, in bytes
+MAX_HEADER_SIZE = 64 * 1024
+# The largest JSON request body, in bytes; attachments are limited by
+# MAX_ATTACHMENT_SIZE instead
+MAX_JSON_BODY = 1024 * 1024
+# Seconds an idle keep-alive connection waits for its next request
+IDLE_TIMEOUT = 60.0
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+# The query parameters that make GET /todos a filtered query
+_FILTERS = ("completed", "has_attachment", "mimetype", "title_prefix", "order")
+
+
+class HttpError(Exception):
+    """An error answered with its status and a JSON {"error": message} body."""
+
+    def __init__(self, status: int, message: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message or http.HTTPStatus(status).phrase)
+        self.status = status
+        self.headers = headers or {}
+
+
+class _Body:
+    """The body of a request, read from the connection on demand."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, length: int, expect_continue: bool):
+        self.reader = reader
+        self.writer = writer
+        self.remaining = length
+        # A client sending "Expect: 100-continue" waits for the go-ahead,
+        # which is only given once the handler reads the body
+        self.expect_continue = expect_continue
+
+    async def read(self, size: int) -> bytes:
+        size = min(size, self.remaining)
+        if size and self.expect_continue:
+            self.expect_continue = False
+            self.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        chunk = await self.reader.readexactly(size) if size else b""
+        self.remaining -= len(chunk)
+        return chunk
+
+    async def read_all(self, max_size: int) -> bytes:
+        if self.remaining > max_size:
+            raise HttpError(413, f"Request body larger than {max_size} bytes")
+        return await self.read(self.remaining)
+
+    def chunks(self, loop: asyncio.AbstractEventLoop, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        # Pulled by the repository on a worker thread; every read runs on
+        # the loop, which is free while the worker writes the chunk
+        while self.remaining:
+            yield asyncio.run_coroutine_threadsafe(self.read(chunk_size), loop).result()
+
+
+@dataclass
+class _Request:
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    keep_alive: bool
+    body: _Body
+    # The body of requests other than uploads, read before the handler runs
+    data: bytes = b""
+
+
+@dataclass
+class _Response:
+    status: int
+    body: bytes = b""
+    content_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Sent instead of body, with Content-Length set to length
+    stream: Optional[AsyncIterator[bytes]] = None
+    length: int = 0
+
+    @classmethod
+    def json(cls, status: int, value) -> "_Response":
+        return cls(status, json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def error(cls, err: HttpError) -> "_Response":
+        response = cls.json(err.status, {"error": str(err)})
+        response.headers.update(err.headers)
+        return response
+
+
+def todo_json(todo) -> dict:
+    """
+    The JSON form of a TodoItem or TodoSummary. Attachment bytes are left
+    out; the attachment URL serves them.
+    """
+    attachment = None
+    if has_attachment(todo):
+        attachment = {
+            "filename": todo.attachment_filename,
+            "mimetype": todo.attachment_mimetype,
+            "size": attachment_size(todo),
+            "url": f"/todos/{todo.id}/attachment",
+        }
+    return {
+        "id": todo.id,
+        "title": todo.title,
+        "completed": todo.completed,
+        "created_at": todo.created_at,
+        "attachment": attachment,
+    }
+
+
+def _flag(query: Dict[str, str], name: str) -> Optional[bool]:
+    value = query.get(name)
+    if value is None:
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise HttpError(400, f"{name} must be true or false")
+
+
+def _page_size(query: Dict[str, str]) -> int:
+    try:
+        limit = int(query.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise HttpError(400, "limit must be a number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HttpError(400, f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def _parse_head(head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> _Request:
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+    if version not in ("HTTP/1.0", "HTTP/1.1"):
+        raise HttpError(505)
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise HttpError(400, "Malformed header")
+        headers[name.strip().lower()] = value.strip()
+    connection = headers.get("connection", "").lower()
+    # HTTP/1.1 connections stay open unless closed; 1.0 ones only on request
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    if "transfer-encoding" in headers:
+        raise HttpError(411, "Send a Content-Length instead of a chunked body")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HttpError(400, "Invalid Content-Length")
+    url = urlsplit(target)
+    body = _Body(reader, writer, length, headers.get("expect", "").lower() == "100-continue")
+    return _Request(method, url.path, dict(parse_qsl(url.query)), headers, keep_alive, body)
+
+
+class ApiServer:
+    """
+    ApiServer answers HTTP/1.1 requests on one event loop. Repository
+    calls run wherever the service's async repository runs them, e.g. on
+    an ExecutorTodoRepo's thread pool, so the loop keeps reading requests
+    from other connections meanwhile.
+
+    Requests on one connection are answered in order; pipelined requests
+    wait in the socket buffer. A connection is closed after a response if
+    the client asks for it, after an error that leaves part of the request
+    body unread, or once it has been idle for idle_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        service: AsyncTodoService,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        metrics: Optional[MetricsRegistry] = None,
+        idle_timeout: float = IDLE_TIMEOUT
+    ):
+        """
+        Initialize the server.
+
+        :param service: The service requests are answered with.
+        :param host: The interface to listen on.
+        :param port: The port to listen on; 0 picks a free one.
+        :param metrics: The registry requests are recorded in under layer
+            "http" and that /metrics renders, or None.
+        :param idle_timeout: Seconds a keep-alive connection may stay idle.
+        """
+        self.service = service
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self.idle_timeout = idle_timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """Start listening; port is updated to the one bound."""
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port, limit=MAX_HEADER_SIZE)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Serve until cancelled."""
+        await self._server.serve_forever()
+
+    async def stop(self):
+        """Stop listening and close the listening socket."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, _Response.error(HttpError(431)), keep_alive=False)
+                    return
+                try:
+                    request = _parse_head(head, reader, writer)
+                except HttpError as err:
+                    await self._send(writer, _Response.error(err), keep_alive=False)
+                    return
+                response = await self._dispatch(request)
+                # A body left partly unread would be parsed as the next request
+                keep_alive = request.keep_alive and request.body.remaining == 0
+                if not await self._send(writer, response, keep_alive):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The client went away mid-request
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def _route(self, request: _Request):
+        # The handler, its path arguments and the name it is measured as
+        parts = [unquote(part) for part in request.path.strip("/").split("/")]
+        routes = {}
+        if parts == ["metrics"]:
+            name, routes = "/metrics", {"GET": self._metrics}
+        elif parts == ["stats"]:
+            name, routes = "/stats", {"GET": self._stats}
+        elif parts == ["todos"]:
+            name, routes = "/todos", {"GET": self._list, "POST": self._create}
+        elif len(parts) == 2 and parts[0] == "todos" and parts[1]:
+            name, routes = "/todos/{id}", {"GET": self._get, "PATCH": self._patch, "DELETE": self._delete}
+        elif len(parts) == 3 and parts[0] == "todos" and parts[1] and parts[2] == "attachment":
+            name, routes = "/todos/{id}/attachment", {"GET": self._download, "PUT": self._upload}
+        if not routes:
+            raise HttpError(404)
+        handler = routes.get(request.method)
+        if handler is None:
+            raise HttpError(405, headers={"Allow": ", ".join(routes)})
+        return handler, parts[1:2], f"{request.method} {name}"
+
+    async def _dispatch(self, request: _Request) -> _Response:
+        start = time.perf_counter()
+        name = None
+        op = None
+        try:
+            handler, args, name = self._route(request)
+            if self.metrics is not None:
+                op = self.metrics.measure("http", name)
+                op.bytes_read = request.body.remaining
+            if handler != self._upload:
+                request.data = await request.body.read_all(MAX_JSON_BODY)
+            response = await handler(request, *args)
+        except HttpError as err:
+            response = _Response.error(err)
+        except ValueError as err:
+            # The services' way of rejecting input, e.g. a title too long
+            response = _Response.error(HttpError(404 if str(err) == "Todo not found" else 400, str(err)))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception:
+            logger.exception("%s %s failed", request.method, request.path)
+            response = _Response.error(HttpError(500))
+        if op is not None:
+            op.bytes_written = response.length if response.stream is not None else len(response.body)
+            op.rows = 1 if response.status < 300 else 0
+            self.metrics.record(op, time.perf_counter() - start, error=response.status >= 500)
+        return response
+
+    async def _send(self, writer: asyncio.StreamWriter, response: _Response, keep_alive: bool) -> bool:
+        # Whether the connection may serve another request
+        length = response.length if response.stream is not None else len(response.body)
+        lines = [
+            f"HTTP/1.1 {response.status} {http.HTTPStatus(response.status).phrase}",
+            f"Content-Length: {length}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if length or response.stream is not None:
+            lines.append(f"Content-Type: {response.content_type}")
+        lines.extend(f"{name}: {value}" for name, value in response.headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if response.stream is None:
+            writer.write(response.body)
+            await writer.drain()
+            return keep_alive
+        sent = 0
+        try:
+            async for chunk in response.stream:
+                writer.write(chunk)
+                sent += len(chunk)
+                # Waits while the client is slower than the repository
+                await writer.drain()
+        finally:
+            await response.stream.aclose()
+        # The attachment changed since its size was read, and the client
+        # can only tell from the connection closing
+        return keep_alive and sent == length
+
+    async def _summary(self, todo_id: str):
+        # A todo without its attachment bytes
+        todos = await self.service.query_todos(TodoQuery(ids=frozenset([todo_id]), limit=1))
+        if not todos:
+            raise HttpError(404, "Todo not found")
+        return todos[0]
+
+    @staticmethod
+    def _json_body(request: _Request) -> dict:
+        try:
+            value = json.loads(request.data or b"{}")
+        except ValueError:
+            raise HttpError(400, "Request body is not valid JSON")
+        if not isinstance(value, dict):
+            raise HttpError(400, "Request body must be a JSON object")
+        return value
+
+    @staticmethod
+    def _fields(body: dict):
+        title = body.get("title")
+        completed = body.get("completed")
+        if title is not None:
+            if not isinstance(title, str) or not title.strip():
+                raise HttpError(400, "title must be a non-empty string")
+            TodoService.validate_title(title)
+        if completed is not None and not isinstance(completed, bool):
+            raise HttpError(400, "completed must be true or false")
+        return title, completed
+
+    async def _metrics(self, request: _Request) -> _Response:
+        if self.metrics is None:
+            raise HttpError(404)
+        return _Response(
+            200, self.metrics.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8",
+            {"Cache-Control": "no-store"}
+        )
+
+    async def _stats(self, request: _Request) -> _Response:
+        return _Response.json(200, dataclasses.asdict(await self.service.stats()))
+
+    async def _list(self, request: _Request) -> _Response:
+        limit = _page_size(request.query)
+        cursor = request.query.get("cursor")
+        if any(name in request.query for name in _FILTERS):
+            todos, next_cursor = await self._query_page(request.query, cursor, limit)
+        else:
+            page = await self.service.list_todos_page(cursor, limit)
+            todos, next_cursor = page.items, page.next_cursor
+        return _Response.json(200, {"items": [todo_json(todo) for todo in todos], "next_cursor": next_cursor})
+
+    async def _query_page(self, params: Dict[str, str], cursor: Optional[str], limit: int):
+        order = params.get("order", CREATED)
+        if order not in ORDERS:
+            raise HttpError(400, f"order must be one of {', '.join(ORDERS)}")
+        query = TodoQuery(
+            completed=_flag(params, "completed"), has_attachment=_flag(params, "has_attachment"),
+            mimetype=params.get("mimetype"), title_prefix=params.get("title_prefix"), order=order
+        )
+        if order != CREATED:
+            if cursor:
+                raise HttpError(400, f"cursor needs order={CREATED}")
+            return await self.service.query_todos(query.with_limit(limit)), None
+        page = await self.service.query_todos_page(query, cursor, limit)
+        return page.items, page.next_cursor
+
+    async def _create(self, request: _Request) -> _Response:
+        title, completed = self._fields(self._json_body(request))
+        if title is None:
+            raise HttpError(400, "title is required")
+        todo = await self.service.add_todo(title, completed=bool(completed))
+        return _Response.json(201, todo_json(todo))
+
+    async def _get(self, request: _Request, todo_id: str) -> _Response:
+        return _Response.json(200, todo_json(await self._summary(todo_id)))
+
+    async def _patch(self, request: _Request, todo_id: str) -> _Response:
+        title, completed = self._fields(self._json_body(request))
+        if title is None and completed is None:
+            raise HttpError(400, "Nothing to update; set title or completed")
+        todo = await self.service.update_todo(todo_id, title=title, completed=completed)
+        return _Response.json(200, todo_json(todo))
+
+    async def _delete(self, request: _Request, todo_id: str) -> _Response:
+        await self.service.delete_todo(todo_id)
+        return _Response(204)
+
+    async def _download(self, request: _Request, todo_id: str) -> _Response:
+        todo = await self._summary(todo_id)
+        if not has_attachment(todo):
+            raise HttpError(404, "Todo has no attachment")
+        headers = {}
+        if todo.attachment_filename:
+            name = todo.attachment_filename.replace('"', "").replace("\r", "").replace("\n", "")
+            headers["Content-Disposition"] = f'attachment; filename="{name}"'
+        return _Response(
+            200, content_type=todo.attachment_mimetype or "application/octet-stream", headers=headers,
+            stream=self.service.iter_attachment(todo_id), length=todo.attachment_size
+        )
+
+    async def _upload(self, request: _Request, todo_id: str) -> _Response:
+        if "content-length" not in request.headers:
+            raise HttpError(411)
+        if not request.body.remaining:
+            raise HttpError(400, "The request body is the attachment, and it is empty")
+        if request.body.remaining > MAX_ATTACHMENT_SIZE:
+            raise HttpError(413, f"Attachments may be at most {MAX_ATTACHMENT_SIZE // (1024 * 1024)}MB")
+        # Checked before the body is read, so a client waiting for
+        # 100 Continue is spared sending it
+        await self._summary(todo_id)
+        mimetype = request.headers.get("content-type", "").split(";")[0].strip() or None
+        stream = AttachmentStream(
+            request.body.chunks(asyncio.get_running_loop()), request.query.get("filename"), mimetype,
+            size_hint=request.body.remaining
+        )
+        todo = await self.service.update_todo(todo_id, attachment_stream=stream)
+        if todo is None:
+            # Deleted while the attachment was stored
+            raise HttpError(404, "Todo not found")
+        return _Response.json(200, todo_json(todo))
+
+
+def build_service(storage: str, blob_dir: Optional[str] = None, cache_mb: int = 0, workers: int = 8):
+    """
+    Build the service stack the server runs on: the storage backend,
+    measured, optionally cached, behind a thread pool of workers threads.
+
+    :return: The service and its metrics registry.
+    :raises ValueError: If there is no such storage backend.
+    """
+    from infrastructure.async_repo import async_repository
+    from infrastructure.backends import create_repository
+    from infrastructure.instrumented_repo import InstrumentedTodoRepo
+    blob_store = None
+    if blob_dir:
+        from infrastructure.blob_store import BlobStore
+        blob_store = BlobStore(blob_dir)
+    metrics = MetricsRegistry()
+    repo = InstrumentedTodoRepo(create_repository(storage, blob_store=blob_store), metrics)
+    if cache_mb > 0:
+        from infrastructure.caching_repo import CachingTodoRepo
+        repo = CachingTodoRepo(repo, max_bytes=cache_mb * 1024 * 1024)
+        metrics.watch_cache(repo.cache_stats)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="todo-api")
+    return AsyncTodoService(async_repository(repo, executor), metrics), metrics
+
+
+async def serve(service: AsyncTodoService, host: str, port: int, metrics: Optional[MetricsRegistry] = None):
+    """Serve until cancelled, then close the service."""
+    server = ApiServer(service, host, port, metrics)
+    await server.start()
+    print(f"Serving the todo API on http://{host}:{server.port}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop()
+        await service.close()
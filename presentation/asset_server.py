@@ -0,0 +1,170 @@
+"""
+This module provides a small HTTP server, run next to the Flet GUI, that
+serves attachment thumbnails and downloads as cacheable static files
+instead of shipping them as data: URLs over the websocket.
+"""
+
+import logging
+import mimetypes
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+from application.metrics import MetricsRegistry
+from infrastructure.blob_store import BlobStore
+from infrastructure.thumbnails import ThumbnailCache
+
+logger = logging.getLogger(__name__)
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_CHUNK_SIZE = 64 * 1024
+# Content-addressed URLs never change meaning, so browsers may keep them
+_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class AssetServer:
+    """
+    AssetServer serves, from a background thread:
+
+    - /thumbs/<digest>: the cached thumbnail of an image attachment
+    - /attachments/<digest>?name=<filename>: the full attachment
+    - /metrics: operation metrics in Prometheus text format, if enabled
+
+    Asset responses carry the digest as ETag so revalidations are answered
+    with 304 Not Modified.
+    """
+
+    def __init__(self, blob_store: BlobStore, thumbnails: ThumbnailCache, host: str = "0.0.0.0", port: int = 8551,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize the server.
+        
+        :param blob_store: The store attachments are read from.
+        :param thumbnails: The cache thumbnails are rendered into.
+        :param host: The interface to listen on.
+        :param port: The port to listen on.
+        :param metrics: The registry exposed at /metrics, or None for 404.
+        """
+        self.blob_store = blob_store
+        self.thumbnails = thumbnails
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        """Start serving in a daemon thread."""
+        server = self
+
+        class Handler(_AssetHandler):
+            assets = server
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+
+class _AssetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    assets = None  # type: AssetServer
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics" and self.assets.metrics is not None:
+            self._serve_metrics()
+            return
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or not _DIGEST.match(parts[1]):
+            self._send_status(404)
+            return
+        kind, digest = parts
+        if kind == "thumbs":
+            self._serve_thumbnail(digest)
+        elif kind == "attachments":
+            self._serve_attachment(digest, parse_qs(url.query))
+        else:
+            self._send_status(404)
+
+    def _not_modified(self, etag: str) -> bool:
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", _CACHE_CONTROL)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+        return False
+
+    def _serve_thumbnail(self, digest: str):
+        width, height = self.assets.thumbnails.size
+        etag = f'"{digest}-{width}x{height}"'
+        if self._not_modified(etag):
+            return
+        path = self.assets.thumbnails.get(digest, lambda: self.assets.blob_store.open(digest))
+        if path is None:
+            # Without Pillow, or for formats Pillow cannot read, the browser
+            # scales the original instead
+            self._serve_attachment(digest, {})
+            return
+        data = path.read_bytes()
+        content_type = "image/png" if path.suffix == ".png" else "image/jpeg"
+        self._send_headers(200, content_type, len(data), etag)
+        self.wfile.write(data)
+
+    def _serve_attachment(self, digest: str, query: dict):
+        etag = f'"{digest}"'
+        if self._not_modified(etag):
+            return
+        data = self.assets.blob_store.open(digest)
+        if data is None:
+            self._send_status(404)
+            return
+        name = query.get("name", [None])[0]
+        content_type = (mimetypes.guess_type(name)[0] if name else None) or "application/octet-stream"
+        disposition = None
+        if name:
+            safe_name = name.replace('"', "").replace("\r", "").replace("\n", "")
+            disposition = f'attachment; filename="{safe_name}"'
+        self._send_headers(200, content_type, len(data), etag, disposition)
+        # Write straight from the blob's mmap in chunks, without copying the
+        # whole attachment into Python bytes
+        view = memoryview(data)
+        for offset in range(0, len(view), _CHUNK_SIZE):
+            self.wfile.write(view[offset:offset + _CHUNK_SIZE])
+
+    def _serve_metrics(self):
+        data = self.assets.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_headers(self, status: int, content_type: str, length: int, etag: str, disposition: str = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", _CACHE_CONTROL)
+        if disposition:
+            self.send_header("Content-Disposition", disposition)
+        self.end_headers()
+
+    def _send_status(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
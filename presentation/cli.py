@@ -1,32 +1,57 @@
 """
 This module provides a command-line interface (CLI) for managing Todo items
-using different storage backends (in-memory, file, SQLite).
+using different storage backends (in-memory, columnar, file, journal, mmap, SQLite).
 """
 
+import csv
+import json
+import os
 import click
+from application.metrics import MetricsRegistry
+from application.models import TodoItem
+from application.query import CREATED, ORDERS, TodoQuery
 from application.services import TodoService
-from infrastructure.in_memory_repo import InMemoryTodoRepo
-from infrastructure.file_repo import FileTodoRepo
-from infrastructure.sqlite_repo import SQLiteTodoRepo
+from infrastructure.backends import backend_names, create_repository
+
+# Repositories, the blob store and the cache are imported only when
+# selected, so short commands start quickly.
 
 @click.group()
-@click.option('--storage', default='memory', help='Storage type [memory|file|sqlite]')
+@click.option('--storage', default='memory', help='Storage type [memory|columnar|file|journal|mmap|sqlite|sharded], or one installed as a todoapp.backends entry point')
+@click.option('--blob-dir', default=None, help='Store attachments deduplicated in this directory (e.g. uploads)')
+@click.option('--cache-mb', default=0, type=int, help='Cache recently read todos and attachments in this many MB (0 disables)')
+@click.option('--slow-ms', default=0, type=float, help='Log operations slower than this many milliseconds (0 disables)')
 @click.pass_context
-def cli(ctx, storage):
+def cli(ctx, storage, blob_dir, cache_mb, slow_ms):
     """
     CLI entry point for managing Todo items.
     
-    :param storage: The storage type to be used [memory|file|sqlite].
+    :param storage: The name of a registered storage backend.
+    :param blob_dir: The blob store directory, or None to keep attachments inline.
+    :param cache_mb: The read cache budget in megabytes, or 0 for no cache.
+    :param slow_ms: The slow-operation log threshold in milliseconds, or 0.
     """
-    if storage == "memory":
-        repo = InMemoryTodoRepo()
-    elif storage == "file":
-        repo = FileTodoRepo()
-    elif storage == "sqlite":
-        repo = SQLiteTodoRepo()
-    else:
-        raise ValueError("Invalid storage type")
-    ctx.obj = TodoService(repo)
+    blob_store = None
+    if blob_dir:
+        from infrastructure.blob_store import BlobStore
+        blob_store = BlobStore(blob_dir)
+    try:
+        repo = create_repository(storage, blob_store=blob_store)
+    except ValueError:
+        raise click.BadParameter(
+            f"{storage!r} is not one of {', '.join(backend_names())}", param_hint="--storage"
+        )
+    metrics = None
+    if slow_ms > 0:
+        from infrastructure.instrumented_repo import InstrumentedTodoRepo
+        metrics = MetricsRegistry(slow_threshold=slow_ms / 1000)
+        repo = InstrumentedTodoRepo(repo, metrics)
+    if cache_mb > 0:
+        from infrastructure.caching_repo import CachingTodoRepo
+        repo = CachingTodoRepo(repo, max_bytes=cache_mb * 1024 * 1024)
+    ctx.obj = TodoService(repo, metrics)
+    # Lets the mmap store mark itself cleanly closed
+    ctx.call_on_close(ctx.obj.close)
 
 @cli.command()
 @click.argument("title")
@@ -43,5 +68,263 @@ def add(service: TodoService, title, attachment):
     todo = service.add_todo(title, attachment if attachment else None)
     click.echo(f"Added todo: {todo.id} - {todo.title}")
 
+@cli.command(name="list")
+@click.option("--completed/--open", default=None, help="Only completed, or only open, todos")
+@click.option("--with-attachment/--without-attachment", default=None, help="Only todos with, or without, an attachment")
+@click.option("--mimetype", default=None, help="Attachment mimetype, or a prefix ending in / (e.g. image/)")
+@click.option("--title-prefix", default=None, help="Only titles starting with this (case-sensitive)")
+@click.option("--sort", type=click.Choice(ORDERS), default=CREATED, show_default=True,
+              help="Sort order; a leading - sorts descending")
+@click.option("--limit", default=None, type=click.IntRange(min=0), help="Maximum number of todos")
+@click.pass_obj
+def list_todos(service: TodoService, completed, with_attachment, mimetype, title_prefix, sort, limit):
+    """
+    List Todo items, filtered and sorted by the repository.
+    
+    :param service: The TodoService instance.
+    :param completed: True or False to filter on completion, None for all.
+    :param with_attachment: True or False to filter on having an attachment, None for all.
+    :param mimetype: The attachment mimetype or mimetype prefix.
+    :param title_prefix: The start of the title.
+    :param sort: One of the query sort orders.
+    :param limit: The maximum number of todos, or None for all.
+    """
+    query = TodoQuery(
+        completed=completed, has_attachment=with_attachment, mimetype=mimetype,
+        title_prefix=title_prefix, order=sort, limit=limit
+    )
+    for todo in service.query_todos(query):
+        status = "x" if todo.completed else " "
+        attachment = f" ({todo.attachment_filename})" if todo.attachment_filename else ""
+        click.echo(f"[{status}] {todo.id} - {todo.title}{attachment}")
+
+@cli.command()
+@click.argument("query")
+@click.option("--limit", default=20, show_default=True, help="Maximum number of results")
+@click.pass_obj
+def search(service: TodoService, query, limit):
+    """
+    Search Todo items by title and attachment filename.
+    
+    :param service: The TodoService instance.
+    :param query: Words to match; each must start a word in the title or filename.
+    :param limit: The maximum number of results.
+    """
+    for todo in service.search_todos(query, limit):
+        status = "x" if todo.completed else " "
+        attachment = f" ({todo.attachment_filename})" if todo.attachment_filename else ""
+        click.echo(f"[{status}] {todo.id} - {todo.title}{attachment}")
+
+@cli.command()
+@click.argument("todo_id")
+@click.option("--output", "-o", type=click.File("wb"), default="-", help="File to write to (default stdout)")
+@click.pass_obj
+def attachment(service: TodoService, todo_id, output):
+    """
+    Write the attachment of a Todo item, streamed in chunks.
+    
+    :param service: The TodoService instance.
+    :param todo_id: The ID of the Todo item.
+    :param output: The file to write the attachment to.
+    """
+    written = 0
+    for chunk in service.iter_attachment(todo_id):
+        output.write(chunk)
+        written += len(chunk)
+    if not written:
+        raise click.ClickException(f"Todo {todo_id} has no attachment")
+
+@cli.command()
+@click.pass_obj
+def gc(service: TodoService):
+    """
+    Delete attachment blobs no longer referenced by any Todo item.
+    
+    :param service: The TodoService instance.
+    """
+    blob_store = getattr(service.repository, "blob_store", None)
+    if not blob_store:
+        raise click.UsageError("gc needs a blob store; pass --blob-dir")
+    click.echo(f"Removed {blob_store.gc()} unreferenced blobs")
+
+@cli.command()
+@click.option("--decompress", is_flag=True, help="Store every attachment uncompressed instead")
+@click.option("--batch-size", default=100, show_default=True, help="Todos read per query")
+@click.pass_obj
+def recompress(service: TodoService, decompress, batch_size):
+    """
+    Re-encode stored attachments under the current compression policy.
+    Stop the GUI and other writers first.
+    
+    :param service: The TodoService instance.
+    :param decompress: Store every attachment uncompressed.
+    :param batch_size: The number of Todo items read per query.
+    """
+    import time
+    repo = service.repository
+    # Caching and instrumented repositories wrap the one that stores the bytes
+    while not hasattr(repo, "recompress") and hasattr(repo, "inner"):
+        repo = repo.inner
+    if not hasattr(repo, "recompress"):
+        raise click.UsageError("recompress needs --storage sqlite or sharded")
+    start = time.process_time()
+    rewritten, before, after = repo.recompress(decompress, batch_size)
+    cpu = time.process_time() - start
+    saved = (before - after) / 1024 / 1024
+    click.echo(f"Rewrote {rewritten} attachments: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB "
+               f"({saved:+.1f} MB saved) in {cpu:.2f}s CPU")
+
+@cli.command(name="check-stats")
+@click.option("--repair", is_flag=True, help="Reset the counters to the recount if they differ")
+@click.pass_obj
+def check_stats(service: TodoService, repair):
+    """
+    Recount every Todo item and compare the counts with the counters the
+    repository keeps up to date on each write.
+    
+    :param service: The TodoService instance.
+    :param repair: Reset the counters to the recount.
+    """
+    import dataclasses
+    stats, counted = service.check_stats(repair)
+    for field in dataclasses.fields(stats):
+        kept, actual = getattr(stats, field.name), getattr(counted, field.name)
+        click.echo(f"{field.name:>16}: {kept:>12} counted {actual:>12}{'' if kept == actual else '  MISMATCH'}")
+    if stats == counted:
+        click.echo("Counters are consistent")
+    elif repair:
+        click.echo("Counters repaired")
+    else:
+        raise click.ClickException("Counters differ from the recount; run check-stats --repair")
+
+@cli.command()
+@click.option("--url", default=None,
+              help="Metrics endpoint of the running GUI (default http://127.0.0.1:$TODO_ASSETS_PORT/metrics)")
+def stats(url):
+    """
+    Print the operation metrics of the running GUI in Prometheus text format.
+    
+    :param url: The /metrics URL of the GUI's asset server.
+    """
+    import urllib.error
+    import urllib.request
+    url = url or f"http://127.0.0.1:{os.environ.get('TODO_ASSETS_PORT', '8551')}/metrics"
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            click.echo(response.read().decode("utf-8"), nl=False)
+    except (urllib.error.URLError, OSError) as err:
+        raise click.ClickException(f"Could not read metrics from {url}: {err}")
+
+def _read_records(source, fmt):
+    """
+    Lazily yield (record number, raw record) pairs so the input is never
+    loaded into memory as a whole.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(source, 1):
+            if line.strip():
+                yield line_no, line
+
+def _todo_from_record(raw) -> TodoItem:
+    record = json.loads(raw) if isinstance(raw, str) else raw
+    if not isinstance(record, dict) or not record.get("title"):
+        raise ValueError("missing title")
+    completed = record.get("completed") or False
+    if isinstance(completed, str):
+        completed = completed.strip().lower() in ("1", "true", "yes", "y")
+    fields = {"title": str(record["title"]), "completed": bool(completed)}
+    # Keep identifiers and timestamps from the export when it has them
+    for name in ("id", "created_at"):
+        if record.get(name):
+            fields[name] = str(record[name])
+    return TodoItem(**fields)
+
+@cli.command(name="import")
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(["jsonl", "csv"]), default=None,
+              help="Input format; guessed from the file extension, jsonl for stdin")
+@click.option("--batch-size", default=1000, show_default=True, help="Todos written per transaction")
+@click.pass_obj
+def import_todos(service: TodoService, source, fmt, batch_size):
+    """
+    Import Todo items from a JSONL or CSV file, or from stdin ("-").
+    
+    :param service: The TodoService instance.
+    :param source: The file to read; each record needs a title and may have
+        completed, id and created_at.
+    :param fmt: The input format [jsonl|csv].
+    :param batch_size: The number of Todo items written per batch.
+    """
+    if fmt is None:
+        fmt = "csv" if source.name.lower().endswith(".csv") else "jsonl"
+    imported = skipped = 0
+    batch = []
+    for record_no, raw in _read_records(source, fmt):
+        try:
+            todo = _todo_from_record(raw)
+            service.validate_title(todo.title)
+        except ValueError as err:
+            click.echo(f"Skipping record {record_no}: {err}", err=True)
+            skipped += 1
+            continue
+        batch.append(todo)
+        if len(batch) >= batch_size:
+            service.add_many(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        service.add_many(batch)
+        imported += len(batch)
+    click.echo(f"Imported {imported} todos, skipped {skipped}")
+
+@cli.command(name="migrate-shards")
+@click.argument("source", default="todos.db")
+@click.option("--dir", "directory", default="todos_shards", show_default=True, help="Directory of the sharded store")
+@click.option("--shards", default=None, type=int, help="Number of shards if the store is new (default 4)")
+def migrate_shards(source, directory, shards):
+    """
+    Copy a single-file SQLite database into a sharded store (--storage sharded).
+    
+    :param source: The todos.db to copy; it is left untouched.
+    :param directory: The directory of the sharded store.
+    :param shards: The number of shards of a new store.
+    """
+    from infrastructure.sharded_sqlite_repo import ShardedSQLiteTodoRepo
+    try:
+        repo = ShardedSQLiteTodoRepo(directory, shards=shards)
+        try:
+            copied = repo.migrate_from(source)
+        finally:
+            repo.close()
+    except ValueError as err:
+        raise click.ClickException(str(err))
+    click.echo(f"Copied {copied} todos from {source} into {len(repo.shards)} shards in {directory}")
+
+@cli.command(name="rebalance-shards")
+@click.argument("shards", type=int)
+@click.option("--dir", "directory", default="todos_shards", show_default=True, help="Directory of the sharded store")
+def rebalance_shards(shards, directory):
+    """
+    Change the number of shards of a sharded store and move todos to
+    their new shards. Stop the GUI and other writers first.
+    
+    :param shards: The new number of shards.
+    :param directory: The directory of the sharded store.
+    """
+    from infrastructure.sharded_sqlite_repo import ShardedSQLiteTodoRepo
+    repo = ShardedSQLiteTodoRepo(directory)
+    try:
+        before = len(repo.shards)
+        repo.rebalance(shards)
+    except ValueError as err:
+        raise click.ClickException(str(err))
+    finally:
+        repo.close()
+    click.echo(f"Rebalanced {directory} from {before} to {shards} shards")
+
 # Add other CLI commands
 
@@ -1,15 +1,230 @@
 import flet as ft
+import asyncio
+import atexit
 import base64
+import dataclasses
 import mimetypes
 import functools
-from application.services import TodoService
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from application.attachments import AttachmentStream, MAX_ATTACHMENT_SIZE
+from application.changes import CREATED, DELETED, SUMMARY_FIELDS, ChangeFeed
+from application.jobs import JobQueue
+from application.metrics import MetricsRegistry
+from application.query import TodoQuery
+from application.services import AsyncTodoService
+from infrastructure.async_repo import ExecutorTodoRepo
 from infrastructure.sqlite_repo import SQLiteTodoRepo  # Using SQLite for attachments
+from infrastructure.blob_store import BlobStore
+from infrastructure.caching_repo import CachingTodoRepo, TodoCache
+from infrastructure.change_feed_repo import ChangeFeedTodoRepo
+from infrastructure.group_commit import IMMEDIATE, GroupCommitWriter
+from infrastructure.instrumented_repo import InstrumentedTodoRepo
+from infrastructure.sqlite_pool import SQLiteConnectionPool
+from infrastructure.thumbnails import DECODE_ERRORS, ThumbnailCache
+from presentation.asset_server import AssetServer
+
+# Thumbnails and downloads are served by AssetServer on a port next to the
+# GUI; TODO_ASSETS_URL is the address browsers reach it at
+ASSETS_PORT = int(os.environ.get("TODO_ASSETS_PORT", "8551"))
+ASSETS_URL = os.environ.get("TODO_ASSETS_URL", f"http://localhost:{ASSETS_PORT}")
+
+# Read cache shared by all sessions, in MB; 0 disables it
+CACHE_MB = int(os.environ.get("TODO_CACHE_MB", "0"))
+
+# Operations slower than this many milliseconds are logged; 0 disables the log
+SLOW_MS = float(os.environ.get("TODO_SLOW_MS", "250"))
+
+# Attachments stored and processed at once in the background, for all sessions
+JOB_WORKERS = int(os.environ.get("TODO_JOB_WORKERS", "2"))
+
+# How single-task writes commit: immediate, grouped or async, and how long
+# a group waits for more writes, in milliseconds
+DURABILITY = os.environ.get("TODO_DURABILITY", IMMEDIATE)
+COMMIT_WINDOW_MS = float(os.environ.get("TODO_COMMIT_WINDOW_MS", "5"))
+
+MAX_ATTACHMENT_MB = MAX_ATTACHMENT_SIZE // (1024 * 1024)
+
+PAGE_SIZE = 30
+# Distance in pixels from the end of the list at which the next page is fetched
+SCROLL_THRESHOLD = 300
+# Seconds the search box must be idle before a query is run
+SEARCH_DEBOUNCE = 0.3
+SEARCH_LIMIT = 50
+
+ALL_TASKS = TodoQuery()
+# The filter chips above the list and the query each one shows
+FILTERS = (
+    ("All", ALL_TASKS),
+    ("Open", TodoQuery(completed=False)),
+    ("Completed", TodoQuery(completed=True)),
+    ("With attachment", TodoQuery(has_attachment=True)),
+)
+
+@functools.lru_cache(maxsize=None)
+def shared_storage():
+    """
+    Connection pool and blob store shared by every session of this process,
+    so the number of open SQLite connections stays bounded.
+    """
+    pool = SQLiteConnectionPool("todos.db", max_size=8)
+    blob_store = BlobStore("uploads")
+    atexit.register(pool.close)
+    atexit.register(blob_store.close)
+    return pool, blob_store
+
+@functools.lru_cache(maxsize=None)
+def shared_executor():
+    """
+    Threads that run blocking repository calls for every session, sized to
+    the connection pool so each worker can hold a connection.
+    """
+    pool, _ = shared_storage()
+    executor = ThreadPoolExecutor(max_workers=pool.max_size, thread_name_prefix="todo-repo")
+    atexit.register(executor.shutdown, wait=False)
+    return executor
+
+@functools.lru_cache(maxsize=None)
+def shared_writer():
+    """
+    Group commit writer for every session, so toggles from many sessions
+    share transactions; None with immediate durability.
+    """
+    if DURABILITY == IMMEDIATE:
+        return None
+    pool, blob_store = shared_storage()
+    writer = GroupCommitWriter(SQLiteTodoRepo(blob_store=blob_store, pool=pool), window=COMMIT_WINDOW_MS / 1000)
+    # Registered after the pool is, so it is closed, and flushed, first
+    atexit.register(writer.close)
+    return writer
+
+@functools.lru_cache(maxsize=None)
+def shared_cache(max_bytes: int) -> TodoCache:
+    # One cache per process, so a write in one session invalidates the
+    # entry every other session would read
+    cache = TodoCache(max_bytes)
+    shared_metrics().watch_cache(cache.stats)
+    return cache
+
+@functools.lru_cache(maxsize=None)
+def shared_metrics() -> MetricsRegistry:
+    # Recorded by every session and served at /metrics by the asset server
+    return MetricsRegistry(slow_threshold=SLOW_MS / 1000 if SLOW_MS > 0 else None)
+
+@functools.lru_cache(maxsize=None)
+def shared_changes() -> ChangeFeed:
+    # Every session publishes its writes here and applies the others'
+    return ChangeFeed()
+
+@functools.lru_cache(maxsize=None)
+def shared_jobs() -> JobQueue:
+    # Attachment uploads of every session queue here, so at most
+    # JOB_WORKERS of them read, hash and store files at once. Images
+    # Pillow cannot decode fail without retries.
+    jobs = JobQueue(workers=JOB_WORKERS, permanent=(ValueError,) + DECODE_ERRORS)
+    atexit.register(jobs.close)
+    return jobs
+
+@functools.lru_cache(maxsize=None)
+def shared_thumbnails() -> ThumbnailCache:
+    return ThumbnailCache("uploads/thumbs")
+
+def prerender_thumbnail(todo):
+    """
+    Attachment processor that renders the thumbnail of a new image in the
+    background, so the first card showing it does not wait for Pillow.
+    """
+    _, blob_store = shared_storage()
+    if todo.attachment_hash and todo.attachment_mimetype and todo.attachment_mimetype.startswith("image/"):
+        shared_thumbnails().get(todo.attachment_hash, lambda: blob_store.open(todo.attachment_hash))
+
+@functools.lru_cache(maxsize=None)
+def asset_server():
+    _, blob_store = shared_storage()
+    server = AssetServer(blob_store, shared_thumbnails(), port=ASSETS_PORT, metrics=shared_metrics())
+    server.start()
+    atexit.register(server.stop)
+    return server
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_stats(stats) -> str:
+    # The header line, e.g. "3 of 120 done · 5 with attachments (12.3 MB)"
+    text = f"{stats.completed} of {stats.total} done"
+    if stats.with_attachment:
+        text += f" · {stats.with_attachment} with attachments ({format_size(stats.attachment_bytes)})"
+    return text
+
+class TaskCard(ft.Card):
+    """
+    Card showing one todo. Cards are isolated: updating the task list only
+    diffs which cards it holds, and a card's own content is sent again only
+    when that card is updated explicitly.
+    """
+
+    def is_isolated(self):
+        return True
+
+class TaskGroup(ft.Column):
+    """
+    Column of up to PAGE_SIZE cards. The task list holds groups rather than
+    cards, so inserting or removing a card re-diffs one group instead of
+    every card in the list.
+    """
+
+    def __init__(self):
+        super().__init__(spacing=10)
+
+    def is_isolated(self):
+        return True
 
 class TodoApp:
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, service: AsyncTodoService = None, cache_mb: int = CACHE_MB):
         self.page = page
-        # Use SQLite repo so attachments are stored in the database
-        self.service = TodoService(SQLiteTodoRepo())
+        if service is None:
+            # Use SQLite repo for todos; attachment bytes are deduplicated in
+            # the blob store under ./uploads and rows only keep their digest
+            pool, blob_store = shared_storage()
+            # Measured below the cache, so the metrics show what reaches SQLite
+            repo = InstrumentedTodoRepo(
+                SQLiteTodoRepo(blob_store=blob_store, pool=pool, durability=DURABILITY, writer=shared_writer()),
+                shared_metrics()
+            )
+            if cache_mb > 0:
+                repo = CachingTodoRepo(repo, cache=shared_cache(cache_mb * 1024 * 1024))
+            # Above the cache, so reading the version an update replaces is cheap
+            repo = ChangeFeedTodoRepo(repo, shared_changes())
+            # Blocking SQLite and blob I/O runs on the shared executor, so
+            # one session's large insert never stalls the others
+            service = AsyncTodoService(
+                ExecutorTodoRepo(repo, executor=shared_executor()), shared_metrics(), changes=shared_changes(),
+                jobs=shared_jobs(), attachment_processors=[prerender_thumbnail]
+            )
+            asset_server()
+        self.service = service
+        self.blob_store = getattr(service.repository, "blob_store", None)
+        # Changes made by other sessions, applied as they arrive. last_seq
+        # is the last event applied, from which a reconnecting session
+        # catches up.
+        self.changes = getattr(service, "changes", None)
+        self.last_seq = 0
+        self.unsubscribe = None
+        self.pending_changes = []
+        # Attachments this session is storing in the background: the job
+        # and the file name by todo id, and the tasks waiting for them
+        self.jobs = getattr(service, "jobs", None)
+        self.pending_attachments = {}
+        self.job_watchers = set()
+        # Reads of images stored inline, for cards already on screen
+        self.image_loads = set()
+        self.page.on_connect = self.on_connect
+        self.page.on_disconnect = self.on_disconnect
+        self.page.on_close = self.on_close
         self.page.title = "Todo App"
         self.page.theme_mode = ft.ThemeMode.DARK
         self.page.padding = 20
@@ -22,12 +237,58 @@ class TodoApp:
 
     def main_ui(self):
         self.new_task = ft.TextField(hint_text="What needs to be done?", expand=True)
+        self.search_box = ft.TextField(
+            hint_text="Search tasks",
+            prefix_icon=ft.icons.SEARCH,
+            on_change=self.on_search_change
+        )
+        # Incremented on every keystroke; a pending search only runs if no
+        # newer keystroke arrived during its debounce delay
+        self.search_generation = 0
+        self.loading_page = False
+        # The query of the selected filter chip; searches are narrowed by it too
+        self.filter = ALL_TASKS
+        self.filter_chips = ft.Row([
+            *[
+                ft.Chip(
+                    label=ft.Text(name),
+                    data=query,
+                    selected=query == self.filter,
+                    on_select=functools.partial(self.select_filter, query)
+                )
+                for name, query in FILTERS
+            ],
+            ft.IconButton(
+                icon=ft.icons.DONE_ALL,
+                on_click=self.complete_all,
+                tooltip="Mark all as completed"
+            ),
+        ], wrap=True)
         # Create file pickers for new tasks and edits
         self.attach_picker = ft.FilePicker(on_result=self.on_file_picked)
         self.edit_attach_picker = ft.FilePicker(on_result=self.on_edit_file_picked)
         self.page.overlay.append(self.attach_picker)
         self.page.overlay.append(self.edit_attach_picker)
-        self.tasks_view = ft.ListView(expand=True, spacing=10)
+        self.snack_bar = ft.SnackBar(ft.Text(""), bgcolor=ft.colors.GREY_900)
+        self.page.overlay.append(self.snack_bar)
+        self.next_cursor = None
+        # Counts over all tasks from the repository's counters, refreshed
+        # after every change; one refresh runs at a time, and changes during
+        # it make it run once more
+        self.stats_text = ft.Text("", color=ft.colors.GREY_500)
+        self.stats_task = None
+        self.stats_dirty = False
+        # Card of every todo currently shown, the group holding it and the
+        # summary it shows, by todo id
+        self.cards = {}
+        self.groups = {}
+        self.shown = {}
+        self.tasks_view = ft.ListView(
+            expand=True,
+            spacing=10,
+            on_scroll=self.on_tasks_scroll,
+            on_scroll_interval=100
+        )
         # Always add a visible Column to the page
         self.page.controls = [
             ft.Column([
@@ -45,42 +306,193 @@ class TodoApp:
                     ),
                 ], alignment=ft.MainAxisAlignment.CENTER),
                 ft.Divider(height=20, color=ft.colors.TRANSPARENT),
-                ft.Text("Your Tasks:", size=20, weight=ft.FontWeight.BOLD),
+                ft.Row([
+                    ft.Text("Your Tasks:", size=20, weight=ft.FontWeight.BOLD),
+                    self.stats_text,
+                ], vertical_alignment=ft.CrossAxisAlignment.CENTER),
+                self.search_box,
+                self.filter_chips,
                 self.tasks_view
             ], expand=True)
         ]
-        self.load_tasks()
         self.page.update()
 
+    async def start(self):
+        """Fetch and show the first page of tasks, then follow changes."""
+        # Subscribed first, so nothing published while the page loads is missed
+        self.follow_changes()
+        self.schedule_stats()
+        await self.load_tasks()
+        self.flush(self.tasks_view)
+
+    async def on_connect(self, e):
+        # Apply what other sessions changed while this one was away, or
+        # reload if the feed no longer holds all of it
+        if self.changes is None or self.unsubscribe is not None:
+            return
+        if not self.follow_changes(since=self.last_seq):
+            self.follow_changes()
+            await self.reload()
+
+    async def on_disconnect(self, e):
+        self.search_generation += 1
+        self.stop_following()
+
+    async def on_close(self, e):
+        self.stop_following()
+        # Jobs still running finish; only the waiting for them stops
+        for watcher in list(self.job_watchers):
+            watcher.cancel()
+        for load in list(self.image_loads):
+            load.cancel()
+        await self.service.close()
+
+    def follow_changes(self, since=None) -> bool:
+        """
+        Subscribe to the change feed. Events are handed to the event loop
+        and applied in batches by apply_changes().
+
+        :param since: The last event already applied, to catch up from.
+        :return: False if the events after since are no longer kept.
+        """
+        if self.changes is None:
+            return True
+        loop = asyncio.get_running_loop()
+
+        def on_change(event):
+            loop.call_soon_threadsafe(self.queue_change, event)
+
+        try:
+            self.unsubscribe = self.changes.subscribe(on_change, since=since)
+        except ValueError:
+            return False
+        if since is None:
+            self.last_seq = self.changes.last_seq
+        return True
+
+    def stop_following(self):
+        if self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
+
+    def queue_change(self, event):
+        # Events arriving in the same loop iteration are sent in one flush
+        if not self.pending_changes:
+            asyncio.get_running_loop().call_soon(self.apply_changes)
+        self.pending_changes.append(event)
+
+    def apply_changes(self):
+        events, self.pending_changes = self.pending_changes, []
+        changed = []
+        for event in events:
+            if event.seq <= self.last_seq:
+                continue
+            self.last_seq = event.seq
+            control = self.apply_change(event)
+            if control is not None and all(control is not c for c in changed):
+                changed.append(control)
+        if changed:
+            self.page.update(*changed)
+        if events:
+            # Every session's writes, this one's included, come through here
+            self.schedule_stats()
+
+    def apply_change(self, event):
+        """
+        Apply one change to the list. This session's own changes are
+        already shown and come back unchanged, so they are skipped.
+
+        :return: The control that has to be sent to the client, or None.
+        """
+        if event.kind == DELETED:
+            return self.remove_card(event.todo_id)
+        shown = self.shown.get(event.todo_id)
+        if shown is not None:
+            if not self.filter.matches(event.todo):
+                return self.remove_card(event.todo_id)
+            if self.card_state(shown) == self.card_state(event.todo):
+                return None
+            return self.render_card(event.todo)
+        if event.kind == CREATED and not self.search_box.value.strip() and self.filter.matches(event.todo):
+            # Like this session's own new tasks, it sorts last
+            return self.append_card(self.render_card(event.todo), event.todo_id)
+        return None
+
+    @staticmethod
+    def card_state(todo):
+        return tuple(getattr(todo, name) for name in SUMMARY_FIELDS)
+
+    def schedule_stats(self):
+        """Refresh the counts in the header, unless a refresh is pending."""
+        self.stats_dirty = True
+        if self.stats_task is None or self.stats_task.done():
+            self.stats_task = asyncio.ensure_future(self.refresh_stats())
+
+    async def refresh_stats(self):
+        while self.stats_dirty:
+            self.stats_dirty = False
+            try:
+                stats = await self.service.stats()
+            except Exception:
+                # The header keeps its last counts; the list shows the error
+                return
+            text = format_stats(stats)
+            if text != self.stats_text.value:
+                self.stats_text.value = text
+                self.page.update(self.stats_text)
+
+    async def reload(self):
+        self.schedule_stats()
+        if self.search_box.value.strip():
+            await self.run_search(self.search_box.value)
+        else:
+            await self.load_tasks()
+            self.flush(self.tasks_view)
+
+    def flush(self, *controls):
+        """
+        Send the controls an action changed, and the snack bar, to the
+        client in one batch instead of re-diffing the whole page. None
+        entries stand for "nothing changed" and are skipped.
+        """
+        self.page.update(*[c for c in controls if c is not None], self.snack_bar)
+
     def pick_file(self, e):
         self.attach_picker.pick_files(allow_multiple=False)
 
+    @staticmethod
+    def picked_file(file):
+        # Only where the file is is kept; its bytes are streamed into
+        # storage when the task is saved
+        if not (getattr(file, "content", None) or file.path):
+            return None
+        mimetype, _ = mimetypes.guess_type(file.name)
+        return {"file": file, "name": file.name, "mimetype": mimetype}
+
+    @staticmethod
+    def picked_stream(picked) -> AttachmentStream:
+        file = picked["file"]
+        # For web mode, file.content is base64 encoded
+        if getattr(file, "content", None):
+            return AttachmentStream.from_base64(file.content, picked["name"], picked["mimetype"])
+        stream = AttachmentStream.from_path(file.path)
+        stream.filename, stream.mimetype = picked["name"], picked["mimetype"]
+        return stream
+
     def on_file_picked(self, e: ft.FilePickerResultEvent):
         if e.files:
             file = e.files[0]
-            if file.size > 5 * 1024 * 1024:
-                self.show_error("File is too large (max 5MB)")
+            if file.size > MAX_ATTACHMENT_SIZE:
+                self.show_error(f"File is too large (max {MAX_ATTACHMENT_MB}MB)")
+                self.flush()
                 return
-            # For web mode, file.content is base64 encoded
-            if hasattr(file, "content") and file.content:
-                attachment_data = base64.b64decode(file.content)
-            elif file.path:
-                with open(file.path, "rb") as f:
-                    attachment_data = f.read()
-            else:
-                attachment_data = None
-            if attachment_data:
-                attachment_filename = file.name
-                attachment_mimetype, _ = mimetypes.guess_type(file.name)
-                self.attachment_file = {
-                    "data": attachment_data,
-                    "name": attachment_filename,
-                    "mimetype": attachment_mimetype
-                }
-                self.show_success(f"Selected for new task: {attachment_filename}")
+            picked = self.picked_file(file)
+            if picked:
+                self.attachment_file = picked
+                self.show_success(f"Selected for new task: {picked['name']}")
             else:
                 self.show_error("Failed to load file")
-            self.page.update()
+            self.flush()
 
     def edit_pick_file(self, e):
         self.edit_attach_picker.pick_files(allow_multiple=False)
@@ -88,103 +500,316 @@ class TodoApp:
     def on_edit_file_picked(self, e: ft.FilePickerResultEvent):
         if e.files:
             file = e.files[0]
-            if file.size > 5 * 1024 * 1024:
-                self.show_error("File is too large (max 5MB)")
+            if file.size > MAX_ATTACHMENT_SIZE:
+                self.show_error(f"File is too large (max {MAX_ATTACHMENT_MB}MB)")
+                self.flush()
                 return
-            if hasattr(file, "content") and file.content:
-                attachment_data = base64.b64decode(file.content)
-            elif file.path:
-                with open(file.path, "rb") as f:
-                    attachment_data = f.read()
-            else:
-                attachment_data = None
-            if attachment_data:
-                attachment_filename = file.name
-                attachment_mimetype, _ = mimetypes.guess_type(file.name)
-                self.edit_attachment_file = {
-                    "data": attachment_data,
-                    "name": attachment_filename,
-                    "mimetype": attachment_mimetype
-                }
-                self.show_success(f"Selected for edit: {attachment_filename}")
+            picked = self.picked_file(file)
+            if picked:
+                self.edit_attachment_file = picked
+                self.show_success(f"Selected for edit: {picked['name']}")
             else:
                 self.show_error("Failed to load file for edit")
-            self.page.update()
+            self.flush()
 
-    def add_task(self, e):
+    async def add_task(self, e):
         if self.new_task.value.strip():
             try:
-                if self.attachment_file:
-                    self.service.add_todo(
+                if self.attachment_file and self.jobs is None:
+                    todo = await self.service.add_todo(
                         self.new_task.value,
-                        attachment_data=self.attachment_file["data"],
-                        attachment_filename=self.attachment_file["name"],
-                        attachment_mimetype=self.attachment_file["mimetype"]
+                        attachment_stream=self.picked_stream(self.attachment_file)
                     )
                     self.show_success("Task added with attachment successfully.")
                     self.attachment_file = None
+                elif self.attachment_file:
+                    # The card is shown at once; the file is read and
+                    # stored in the background while the card says so
+                    todo = await self.service.add_todo(self.new_task.value)
+                    self.store_attachment(todo.id, self.attachment_file)
+                    self.show_success(f"Task added; storing {self.attachment_file['name']}...")
+                    self.attachment_file = None
                 else:
-                    self.service.add_todo(self.new_task.value)
+                    todo = await self.service.add_todo(self.new_task.value)
                     self.show_success("Task added successfully.")
+                # Newest todos sort last; if later pages are still unloaded
+                # the card is shown now and skipped when its page arrives
+                summary = self.service.summarize(todo)
+                changed = None
+                if self.filter.matches(summary):
+                    changed = self.append_card(self.render_card(summary), todo.id)
             except Exception as err:
                 self.show_error(str(err))
+                changed = None
             self.new_task.value = ""
-            self.load_tasks()
-            self.page.update()
-
-    def load_tasks(self):
-      self.tasks_view.controls = []
-      for todo in self.service.list_todos():
-          card_children = [
-              ft.Row([
-                  ft.Checkbox(
-                      value=todo.completed,
-                      on_change=lambda e, tid=todo.id: self.toggle_complete(tid, e)
-                  ),
-                  ft.Text(todo.title, expand=True),
-              ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
-          ]
-          if todo.attachment_data:
-              if todo.attachment_mimetype and todo.attachment_mimetype.startswith("image/"):
-                  encoded = base64.b64encode(todo.attachment_data).decode("utf-8")
-                  image_src = f"data:{todo.attachment_mimetype};base64,{encoded}"
-                  card_children.append(ft.Image(src=image_src, width=200, height=200))
-              elif todo.attachment_mimetype == "application/pdf":
-                  card_children.append(ft.Text(f"PDF attached: {todo.attachment_filename}"))
-              card_children.append(
-                  ft.ElevatedButton(
-                      "Download Attachment",
-                      on_click=lambda e, t=todo: self.download_attachment(t, e)
-                  )
-              )
-          card_children.append(
-              ft.Row([
-                  ft.IconButton(
-                      icon=ft.icons.EDIT,
-                      tooltip="Edit Task",
-                      on_click=lambda e, t=todo: self.edit_task(t, e)
-                  ),
-                  ft.IconButton(
-                      icon=ft.icons.DELETE,
-                      tooltip="Delete Task",
-                      on_click=lambda e, tid=todo.id: self.delete_task(tid, e)
-                  ),
-              ], alignment=ft.MainAxisAlignment.END, spacing=10)
-          )
-          self.tasks_view.controls.append(
-              ft.Card(
-                  content=ft.Container(
-                      content=ft.Column(card_children, spacing=10),
-                      padding=10,
-                  )
-              )
-          )
-      self.page.update()
-
-    def toggle_complete(self, todo_id, e):
-        todo = self.service.repository.get(todo_id)
-        self.service.update_todo(todo_id, completed=not todo.completed)
-        self.load_tasks()
+            self.flush(self.new_task, changed)
+
+    def store_attachment(self, todo_id, picked):
+        """
+        Store a picked file as the attachment of a todo on the job queue.
+        Its card shows a pending state until the job has finished.
+        """
+        job = self.service.attach_in_background(todo_id, functools.partial(self.picked_stream, picked))
+        self.pending_attachments[todo_id] = (job, picked["name"])
+        watcher = asyncio.ensure_future(self.watch_job(todo_id, job, picked["name"]))
+        self.job_watchers.add(watcher)
+        watcher.add_done_callback(self.job_watchers.discard)
+
+    async def watch_job(self, todo_id, job, name):
+        try:
+            todo = await asyncio.wrap_future(job.future)
+            self.show_success(f"Attachment {name} stored.")
+        except Exception as err:
+            todo = None
+            self.show_error(f"Could not store {name}: {err}")
+        if self.pending_attachments.get(todo_id, (None,))[0] is job:
+            del self.pending_attachments[todo_id]
+        changed = None
+        if todo_id in self.cards:
+            # Re-rendered without the pending state, with the stored
+            # attachment unless the change feed showed it already
+            changed = self.render_card(self.service.summarize(todo) if todo else self.shown[todo_id])
+        elif todo is not None and not self.search_box.value.strip():
+            # A new task left out of "With attachment" until now
+            summary = self.service.summarize(todo)
+            if self.filter.matches(summary):
+                changed = self.append_card(self.render_card(summary), todo_id)
+        self.flush(changed)
+
+    def append_card(self, card, todo_id):
+        """
+        Add a card at the end of the list, unless the change feed already
+        put it there.
+
+        :return: The control that has to be sent to the client.
+        """
+        if todo_id in self.groups:
+            return card
+        groups = self.tasks_view.controls
+        if groups and len(groups[-1].controls) < PAGE_SIZE:
+            group, changed = groups[-1], groups[-1]
+        else:
+            group, changed = TaskGroup(), self.tasks_view
+            groups.append(group)
+        group.controls.append(card)
+        self.groups[todo_id] = group
+        return changed
+
+    async def load_tasks(self):
+        # Only the first page is fetched up front; further pages are
+        # requested by on_tasks_scroll as the user nears the end of the list
+        self.tasks_view.controls = []
+        self.cards = {}
+        self.groups = {}
+        self.shown = {}
+        self.next_cursor = None
+        await self.append_page()
+
+    async def append_page(self):
+        if self.filter == ALL_TASKS:
+            page = await self.service.list_todos_page(self.next_cursor, PAGE_SIZE)
+            todos, self.next_cursor = page.items, page.next_cursor
+        else:
+            todos, self.next_cursor = await self.query_page(self.next_cursor)
+        group = TaskGroup()
+        for todo in todos:
+            if todo.id not in self.cards:
+                group.controls.append(self.render_card(todo))
+                self.groups[todo.id] = group
+        if group.controls:
+            self.tasks_view.controls.append(group)
+
+    async def query_page(self, cursor):
+        """
+        Fetch one page of the todos matching the selected filter, in
+        creation order.
+
+        :return: The todos and the cursor of the next page, or None.
+        """
+        page = await self.service.query_todos_page(self.filter, cursor, PAGE_SIZE)
+        return page.items, page.next_cursor
+
+    async def load_next_page(self):
+        # Scroll events keep arriving while a page is fetched; only one
+        # fetch per cursor may be in flight
+        if self.loading_page:
+            return
+        self.loading_page = True
+        try:
+            await self.append_page()
+        finally:
+            self.loading_page = False
+        self.flush(self.tasks_view)
+
+    async def on_tasks_scroll(self, e: ft.OnScrollEvent):
+        if self.next_cursor and e.pixels >= e.max_scroll_extent - SCROLL_THRESHOLD:
+            await self.load_next_page()
+
+    async def on_search_change(self, e):
+        # Debounce keystrokes so only the query the user settles on is run
+        self.search_generation += 1
+        generation = self.search_generation
+        await asyncio.sleep(SEARCH_DEBOUNCE)
+        if generation == self.search_generation:
+            await self.run_search(e.control.value)
+
+    async def run_search(self, query):
+        if not query.strip():
+            await self.load_tasks()
+        else:
+            # Matches are shown in rank order as a single group; paging
+            # stays off until the search box is cleared
+            self.tasks_view.controls = []
+            self.cards = {}
+            self.groups = {}
+            self.shown = {}
+            self.next_cursor = None
+            group = TaskGroup()
+            for todo in await self.service.search_todos(query, SEARCH_LIMIT):
+                if not self.filter.matches(todo):
+                    continue
+                group.controls.append(self.render_card(todo))
+                self.groups[todo.id] = group
+            if group.controls:
+                self.tasks_view.controls.append(group)
+        self.flush(self.tasks_view)
+
+    async def select_filter(self, query, e):
+        # Chips act as radio buttons; selecting the current one keeps it
+        self.filter = query
+        for chip in self.filter_chips.controls[:len(FILTERS)]:
+            chip.selected = chip.data == query
+        self.flush(self.filter_chips)
+        await self.reload()
+
+    async def complete_all(self, e):
+        # One bulk update in the repository for every task of the filter,
+        # or while searching, every match shown
+        query = self.filter
+        if self.search_box.value.strip():
+            query = dataclasses.replace(query, ids=frozenset(self.cards))
+        try:
+            completed = await self.service.update_where(query, completed=True)
+        except Exception as err:
+            self.show_error(str(err))
+            self.flush()
+            return
+        self.show_success(f"Marked {len(completed)} tasks as completed.")
+        await self.reload()
+
+    def render_card(self, todo):
+        """
+        Return the card of a todo, reusing and patching its existing card so
+        only that card's content changes.
+        """
+        card = self.cards.get(todo.id)
+        if card is None:
+            card = self.cards[todo.id] = TaskCard()
+        card.content = self.build_task_content(todo)
+        self.shown[todo.id] = todo
+        return card
+
+    def build_task_content(self, todo):
+        card_children = [
+            ft.Row([
+                ft.Checkbox(
+                    value=todo.completed,
+                    on_change=functools.partial(self.toggle_complete, todo.id)
+                ),
+                ft.Text(todo.title, expand=True),
+            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
+        ]
+        pending = self.pending_attachments.get(todo.id)
+        if pending is not None:
+            card_children.append(ft.Row([
+                ft.ProgressRing(width=16, height=16, stroke_width=2),
+                ft.Text(f"Storing {pending[1]}...", italic=True, color=ft.colors.GREY_400),
+            ], spacing=10))
+        if todo.attachment:
+            if todo.attachment_mimetype and todo.attachment_mimetype.startswith("image/"):
+                image_src = self.asset_url(todo, "thumbs")
+                if image_src:
+                    card_children.append(ft.Image(src=image_src, width=200, height=200, fit=ft.ImageFit.CONTAIN))
+                else:
+                    # Only images stored inline, before the blob store, get
+                    # here; the card shows a spinner until they are read
+                    frame = ft.Container(
+                        ft.ProgressRing(width=16, height=16, stroke_width=2),
+                        width=200, height=200, alignment=ft.alignment.center
+                    )
+                    load = asyncio.ensure_future(self.load_inline_image(todo, frame))
+                    self.image_loads.add(load)
+                    load.add_done_callback(self.image_loads.discard)
+                    card_children.append(frame)
+            elif todo.attachment_mimetype == "application/pdf":
+                card_children.append(ft.Text(f"PDF attached: {todo.attachment_filename}"))
+            card_children.append(
+                ft.ElevatedButton(
+                    "Download Attachment",
+                    on_click=functools.partial(self.download_attachment, todo)
+                )
+            )
+        card_children.append(
+            ft.Row([
+                ft.IconButton(
+                    icon=ft.icons.EDIT,
+                    tooltip="Edit Task",
+                    on_click=lambda e, t=todo: self.edit_task(t, e)
+                ),
+                ft.IconButton(
+                    icon=ft.icons.DELETE,
+                    tooltip="Delete Task",
+                    on_click=functools.partial(self.delete_task, todo.id)
+                ),
+            ], alignment=ft.MainAxisAlignment.END, spacing=10)
+        )
+        return ft.Container(
+            content=ft.Column(card_children, spacing=10),
+            padding=10,
+        )
+
+    async def load_inline_image(self, todo, frame):
+        # Read through the repository's executor, never on the event loop
+        try:
+            data = await self.service.get_attachment(todo.id)
+        except Exception:
+            data = None
+        if data:
+            encoded = base64.b64encode(data).decode("utf-8")
+            frame.content = ft.Image(
+                src=f"data:{todo.attachment_mimetype};base64,{encoded}",
+                width=200, height=200, fit=ft.ImageFit.CONTAIN
+            )
+        else:
+            frame.content = ft.Text("Image unavailable", italic=True, color=ft.colors.GREY_400)
+        # A card not sent yet takes the image along when it is
+        if frame.page is not None:
+            self.flush(frame)
+
+    async def toggle_complete(self, todo_id, e):
+        # The checkbox already shows the new state on the client, so a
+        # successful toggle sends nothing back
+        # Recorded first, so the change coming back from the feed is
+        # recognized as already shown
+        shown = self.shown.get(todo_id)
+        if shown is not None:
+            self.shown[todo_id] = dataclasses.replace(shown, completed=e.control.value)
+        try:
+            _, committed = await self.service.update_todo_queued(todo_id, completed=e.control.value)
+            # Under async durability the toggle returns once queued; a
+            # commit that fails later is undone on screen like a refused one
+            await committed
+        except Exception as err:
+            if shown is not None:
+                self.shown[todo_id] = shown
+            e.control.value = not e.control.value
+            self.show_error(str(err))
+            self.flush(e.control)
+            return
+        current = self.shown.get(todo_id)
+        if current is not None and not self.filter.matches(current):
+            # E.g. completed while only open tasks are listed
+            self.flush(self.remove_card(todo_id))
 
     def edit_task(self, todo, e=None):
         # Debug: confirm edit is triggered
@@ -193,6 +818,10 @@ class TodoApp:
         self.edit_dialog_todo = todo  
         self.edit_attachment_file = None  
         edit_field = ft.TextField(value=todo.title, expand=True)
+
+        async def on_save(e):
+            await self.save_edit(edit_field.value, dialog)
+
         dialog = ft.AlertDialog(
             title=ft.Text("Edit Task"),
             content=ft.Column([
@@ -202,7 +831,7 @@ class TodoApp:
                 ft.ElevatedButton("Pick File", on_click=self.edit_pick_file)
             ]),
             actions=[
-                ft.TextButton("Save", on_click=lambda e: self.save_edit(edit_field.value, dialog)),
+                ft.TextButton("Save", on_click=on_save),
                 ft.TextButton("Cancel", on_click=lambda e: self.close_edit_dialog(dialog))
             ],
             actions_alignment=ft.MainAxisAlignment.END
@@ -211,61 +840,99 @@ class TodoApp:
         dialog.open = True
         self.page.update()
 
-    def save_edit(self, new_title, dialog):
-        # Use new attachment if selected; otherwise, use existing one
-        if self.edit_attachment_file:
-            filename = self.edit_attachment_file["name"]
-            mimetype = self.edit_attachment_file["mimetype"]
-            data = self.edit_attachment_file["data"]
-        else:
-            filename = self.edit_dialog_todo.attachment_filename
-            mimetype = self.edit_dialog_todo.attachment_mimetype
-            data = self.edit_dialog_todo.attachment_data
+    async def save_edit(self, new_title, dialog):
+        # Use new attachment if selected; otherwise update_todo keeps the
+        # existing one, so its bytes never need to be loaded here
+        changed = [dialog]
         try:
-            self.service.update_todo(
+            attachment = {}
+            if self.edit_attachment_file and self.jobs is None:
+                attachment["attachment_stream"] = self.picked_stream(self.edit_attachment_file)
+            todo = await self.service.update_todo(
                 self.edit_dialog_todo.id,
                 title=new_title,
-                attachment_filename=filename,
-                attachment_mimetype=mimetype,
-                attachment_data=data
+                **attachment
             )
+            if self.edit_attachment_file and self.jobs is not None:
+                self.store_attachment(todo.id, self.edit_attachment_file)
+                self.edit_attachment_file = None
+            summary = self.service.summarize(todo)
+            # The change feed may have shown the new version already, but
+            # not the pending state of an attachment just queued
+            if todo.id in self.cards and (
+                todo.id in self.pending_attachments or self.card_state(self.shown[todo.id]) != self.card_state(summary)
+            ):
+                changed.append(self.render_card(summary))
             self.show_success("Task updated successfully!")
         except Exception as err:
             self.show_error(str(err))
         dialog.open = False
-        self.load_tasks()
-        self.page.update()
+        self.flush(*changed)
 
     def close_edit_dialog(self, dialog):
         dialog.open = False
-        self.page.update()
+        self.flush(dialog)
 
-    def delete_task(self, todo_id, e):
-        self.service.delete_todo(todo_id)
+    async def delete_task(self, todo_id, e):
+        await self.service.delete_todo(todo_id)
         self.show_success("Task deleted successfully.")
-        self.load_tasks()
-        self.page.update()
+        self.flush(self.remove_card(todo_id))
+
+    def remove_card(self, todo_id):
+        """
+        Remove the card of a todo from the list, if it is shown.
 
-    def download_attachment(self, todo, e):
-        if todo.attachment_data:
-            encoded = base64.b64encode(todo.attachment_data).decode("utf-8")
-            data_url = f"data:{todo.attachment_mimetype};base64,{encoded}"
-            ft.launch_url(data_url)
-            self.show_success("Download started.")
-            self.page.update()
+        :return: The control that has to be sent to the client, or None.
+        """
+        card = self.cards.pop(todo_id, None)
+        if card is None:
+            return None
+        del self.shown[todo_id]
+        group = self.groups.pop(todo_id)
+        group.controls.remove(card)
+        if group.controls:
+            return group
+        self.tasks_view.controls.remove(group)
+        return self.tasks_view
+
+    def asset_url(self, todo, kind):
+        """
+        URL of an attachment ("attachments") or its thumbnail ("thumbs") on
+        the asset server, or None for attachments stored inline before the
+        blob store was used.
+        """
+        if not (todo.attachment_hash and self.blob_store and self.blob_store.path(todo.attachment_hash).exists()):
+            return None
+        url = f"{ASSETS_URL}/{kind}/{todo.attachment_hash}"
+        if kind == "attachments" and todo.attachment_filename:
+            url += f"?name={quote(todo.attachment_filename)}"
+        return url
+
+    async def download_attachment(self, todo, e):
+        url = self.asset_url(todo, "attachments")
+        if not url:
+            data = await self.service.get_attachment(todo.id) if todo.attachment else None
+            if not data:
+                return
+            encoded = base64.b64encode(data).decode("utf-8")
+            url = f"data:{todo.attachment_mimetype};base64,{encoded}"
+        self.page.launch_url(url)
+        self.show_success("Download started.")
+        self.flush()
+
+    # show_success/show_error only prepare the snack bar; the handler that
+    # calls them sends it along with its other changes via flush()
 
     def show_success(self, message):
-        self.page.snack_bar = ft.SnackBar(ft.Text(message, color=ft.colors.GREEN_200), bgcolor=ft.colors.GREY_900)
-        self.page.snack_bar.open = True
-        self.page.update()
+        self.snack_bar.content = ft.Text(message, color=ft.colors.GREEN_200)
+        self.snack_bar.open = True
 
     def show_error(self, message):
-        self.page.snack_bar = ft.SnackBar(ft.Text(message, color=ft.colors.RED_200), bgcolor=ft.colors.GREY_900)
-        self.page.snack_bar.open = True
-        self.page.update()
+        self.snack_bar.content = ft.Text(message, color=ft.colors.RED_200)
+        self.snack_bar.open = True
 
-def main(page: ft.Page):
-    TodoApp(page)
+async def main(page: ft.Page, cache_mb: int = CACHE_MB):
+    await TodoApp(page, cache_mb=cache_mb).start()
 
 if __name__ == "__main__":
     ft.app(target=main, host="0.0.0.0", port=8550, view=ft.WEB_BROWSER)
@@ -0,0 +1,21 @@
+import pytest
+from infrastructure.columnar_repo import ColumnarTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from infrastructure.mmap_repo import MmapTodoRepo
+from infrastructure.sharded_sqlite_repo import ShardedSQLiteTodoRepo
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+BACKENDS = {
+    "memory": lambda path: InMemoryTodoRepo(),
+    "columnar": lambda path: ColumnarTodoRepo(),
+    "sqlite": lambda path: SQLiteTodoRepo(str(path / "todos.db")),
+    "sharded": lambda path: ShardedSQLiteTodoRepo(str(path / "shards"), shards=2),
+    "mmap": lambda path: MmapTodoRepo(str(path / "todos.mmap")),
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def repo(request, tmp_path):
+    repository = BACKENDS[request.param](tmp_path)
+    yield repository
+    repository.close()
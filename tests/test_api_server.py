@@ -0,0 +1,30 @@
+import asyncio
+import json
+from application.changes import ChangeFeed
+from application.services import AsyncTodoService
+from benchmarks.loadgen import Connection
+from infrastructure.async_repo import ExecutorTodoRepo
+from infrastructure.change_feed_repo import ChangeFeedTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from presentation.api_server import ApiServer
+
+
+def test_create_completed_todo_is_one_write():
+    feed = ChangeFeed()
+    repo = InMemoryTodoRepo()
+
+    async def create():
+        server = ApiServer(AsyncTodoService(ExecutorTodoRepo(ChangeFeedTodoRepo(repo, feed))), port=0)
+        await server.start()
+        conn = Connection("127.0.0.1", server.port)
+        try:
+            return await conn.request("POST", "/todos", json.dumps({"title": "Done", "completed": True}).encode())
+        finally:
+            conn.close()
+            await server.stop()
+
+    status, body = asyncio.run(create())
+    assert status == 201 and json.loads(body)["completed"] is True
+    events = feed.since(0)
+    assert [(event.kind, event.todo.completed) for event in events] == [("created", True)]
+    assert repo.get(json.loads(body)["id"]).completed
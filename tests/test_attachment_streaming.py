@@ -0,0 +1,62 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from application.attachments import AttachmentStream
+from application.models import TodoItem
+from infrastructure.async_repo import ExecutorTodoRepo
+from infrastructure.sqlite_pool import SQLiteConnectionPool
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+CHUNK = 1024
+DATA = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def repo(tmp_path):
+    # One pooled connection, which a stalled download must not hold
+    pool = SQLiteConnectionPool(str(tmp_path / "todos.db"), max_size=1, timeout=1)
+    repository = SQLiteTodoRepo(pool=pool)
+    yield repository
+    pool.close()
+
+
+def add_streamed(repo):
+    todo = repo.add(TodoItem(title="Scan"))
+    repo.write_attachment(todo.id, AttachmentStream([DATA], "scan.bin", "application/octet-stream"))
+    return todo
+
+
+def test_paused_download_leaves_the_pool_free(repo):
+    todo = add_streamed(repo)
+    chunks = repo.iter_attachment(todo.id, CHUNK)
+    first = next(chunks)
+    # Another request, as another server thread would make it
+    with ThreadPoolExecutor(1) as other:
+        assert other.submit(repo.get, todo.id).result().title == "Scan"
+    assert first + b"".join(chunks) == DATA
+
+
+def test_abandoned_download_closes_its_connection(repo):
+    todo = add_streamed(repo)
+    chunks = repo.iter_attachment(todo.id, CHUNK)
+    next(chunks)
+    chunks.close()
+    with ThreadPoolExecutor(1) as other:
+        other.submit(repo.delete, todo.id).result()
+    assert repo.get(todo.id) is None
+
+
+def test_async_download_holds_no_worker_between_chunks(repo):
+    todo = add_streamed(repo)
+
+    async def scenario():
+        adapter = ExecutorTodoRepo(repo, max_workers=1)
+        chunks = adapter.iter_attachment(todo.id, CHUNK)
+        first = await chunks.__anext__()
+        # Would wait for the stalled download with a single worker
+        assert (await asyncio.wait_for(adapter.get(todo.id), 5)).title == "Scan"
+        rest = [chunk async for chunk in chunks]
+        await adapter.close()
+        return first + b"".join(rest)
+
+    assert asyncio.run(scenario()) == DATA
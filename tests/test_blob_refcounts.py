@@ -0,0 +1,49 @@
+import dataclasses
+import sqlite3
+import pytest
+from application.models import TodoItem
+from infrastructure.blob_store import BlobStore
+from infrastructure.group_commit import GroupCommitWriter
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repository = SQLiteTodoRepo(str(tmp_path / "todos.db"), blob_store=BlobStore(str(tmp_path / "uploads")))
+    yield repository
+    repository.close()
+    repository.blob_store.close()
+
+
+def attached(title: str) -> TodoItem:
+    todo = TodoItem(title=title)
+    todo.set_attachment(b"%PDF-1.7 quarterly numbers", "report.pdf", "application/pdf")
+    return todo
+
+
+def test_failed_insert_releases_its_blob(repo):
+    todo = repo.add(attached("Report"))
+    with pytest.raises(sqlite3.IntegrityError):
+        repo.add(dataclasses.replace(todo, title="Duplicate"))
+    repo.delete(todo.id)
+    assert repo.blob_store.gc() == 1
+    assert not repo.blob_store.path(todo.attachment_hash).exists()
+
+
+def test_group_retried_one_by_one_takes_each_blob_once(repo):
+    first = repo.add(attached("Report"))
+    writer = GroupCommitWriter(repo, window=1)
+    # One group: its duplicate insert fails it, and both are retried alone
+    second = attached("Copy")
+    committed = writer.add(second)
+    failed = writer.add(dataclasses.replace(first, title="Duplicate"))
+    writer.flush().result()
+    writer.close()
+    assert committed.result() is None
+    with pytest.raises(sqlite3.IntegrityError):
+        failed.result()
+
+    repo.delete(first.id)
+    assert repo.blob_store.gc() == 0
+    repo.delete(second.id)
+    assert repo.blob_store.gc() == 1
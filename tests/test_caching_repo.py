@@ -0,0 +1,31 @@
+from application.models import TodoItem
+from infrastructure.caching_repo import CachingTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+
+
+def test_cache_counters_and_todo_counts_are_both_reachable():
+    repo = CachingTodoRepo(InMemoryTodoRepo(), max_bytes=1024 * 1024)
+    todo = repo.add(TodoItem(title="Groceries", completed=True))
+    repo.get(todo.id)
+    repo.get(todo.id)
+    items = repo.cache_stats()["items"]
+    assert (items["misses"], items["hits"]) == (1, 1)
+    assert repo.stats().total == 1 and repo.stats().completed == 1
+
+
+class MappedAttachmentRepo(InMemoryTodoRepo):
+    """Hands out attachments as views, as the blob store's mmap reads do."""
+
+    def get_attachment(self, todo_id):
+        data = super().get_attachment(todo_id)
+        return memoryview(data) if data is not None else None
+
+
+def test_attachment_over_budget_is_not_copied():
+    repo = CachingTodoRepo(MappedAttachmentRepo(), max_bytes=4096)
+    todo = TodoItem(title="Scan")
+    todo.set_attachment(b"\0" * 8192, "scan.bin", "application/octet-stream")
+    repo.add(todo)
+    data = repo.get_attachment(todo.id)
+    assert isinstance(data, memoryview) and len(data) == 8192
+    assert repo.cache_stats()["attachments"]["entries"] == 0
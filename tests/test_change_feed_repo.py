@@ -0,0 +1,45 @@
+import dataclasses
+import threading
+from application.changes import UPDATED, ChangeFeed
+from application.models import TodoItem
+from infrastructure.change_feed_repo import ChangeFeedTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+
+
+class SlowUpdateRepo(InMemoryTodoRepo):
+    """Stalls after storing the first title "A", until another update arrives."""
+
+    def __init__(self):
+        super().__init__()
+        self.other_update = threading.Event()
+        self.stored_a = threading.Event()
+
+    def update(self, todo: TodoItem):
+        result = super().update(todo)
+        if todo.title == "A":
+            self.stored_a.set()
+            # Returns at once if the other session's update got in between
+            self.other_update.wait(0.5)
+        else:
+            self.other_update.set()
+        return result
+
+
+def test_sessions_sharing_a_feed_publish_in_storage_order():
+    feed = ChangeFeed()
+    inner = SlowUpdateRepo()
+    todo = inner.add(TodoItem(title="Groceries"))
+    # One wrapper per session, as the Flet app builds them
+    first, second = ChangeFeedTodoRepo(inner, feed), ChangeFeedTodoRepo(inner, feed)
+    events = []
+    feed.subscribe(events.append)
+
+    writer = threading.Thread(target=first.update, args=(dataclasses.replace(todo, title="A"),))
+    writer.start()
+    assert inner.stored_a.wait(5)
+    second.update(dataclasses.replace(todo, title="B"))
+    writer.join()
+
+    titles = [event.todo.title for event in events if event.kind == UPDATED]
+    assert titles == ["A", "B"]
+    assert inner.get(todo.id).title == titles[-1]
@@ -0,0 +1,63 @@
+import io
+import pytest
+from application.attachments import AttachmentStream
+from application.jobs import JobQueue
+from application.models import TodoItem
+from application.services import submit_attachment
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+from infrastructure.thumbnails import Image, ThumbnailCache
+
+
+class CountingRepo(InMemoryTodoRepo):
+    def __init__(self):
+        super().__init__()
+        self.stored = 0
+
+    def write_attachment(self, todo_id, stream):
+        self.stored += 1
+        return super().write_attachment(todo_id, stream)
+
+
+def test_failed_processor_is_retried_without_storing_again():
+    repo = CountingRepo()
+    todo = repo.add(TodoItem(title="Photo"))
+    calls = []
+
+    def flaky_thumbnail(stored):
+        calls.append(stored.id)
+        if len(calls) == 1:
+            raise OSError("thumbnail directory busy")
+
+    jobs = JobQueue(backoff=0.01)
+    try:
+        job = submit_attachment(
+            jobs, repo, todo.id, lambda: AttachmentStream([b"image bytes"], "photo.png", "image/png"), [flaky_thumbnail]
+        )
+        assert job.future.result(5).attachment_filename == "photo.png"
+    finally:
+        jobs.close()
+    assert (repo.stored, len(calls), job.attempts) == (1, 2, 3)
+
+
+def test_permanent_error_in_a_later_step_is_not_retried():
+    def reject(result):
+        raise ValueError(f"cannot process {result}")
+
+    jobs = JobQueue(backoff=0.01)
+    try:
+        job = jobs.submit("two steps", lambda: "stored", then=[reject])
+        with pytest.raises(ValueError):
+            job.future.result(5)
+    finally:
+        jobs.close()
+    assert job.attempts == 2
+
+
+@pytest.mark.skipif(Image is None, reason="Pillow is not installed")
+def test_decompression_bomb_renders_no_thumbnail(tmp_path, monkeypatch):
+    buffer = io.BytesIO()
+    Image.new("RGB", (100, 100)).save(buffer, "PNG")
+    # Twice the limit and more is refused with DecompressionBombError
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    thumbnails = ThumbnailCache(str(tmp_path / "thumbs"))
+    assert thumbnails.get("ab" * 32, buffer.getvalue) is None
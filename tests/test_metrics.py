@@ -0,0 +1,19 @@
+from application.metrics import MetricsRegistry
+from application.models import TodoItem
+from infrastructure.caching_repo import CachingTodoRepo
+from infrastructure.in_memory_repo import InMemoryTodoRepo
+
+
+def test_cache_counters_are_rendered_with_the_metrics():
+    metrics = MetricsRegistry()
+    repo = CachingTodoRepo(InMemoryTodoRepo(), max_bytes=1024 * 1024)
+    metrics.watch_cache(repo.cache_stats)
+    todo = repo.add(TodoItem(title="Groceries"))
+    for _ in range(3):
+        repo.get(todo.id)
+    text = metrics.render_prometheus()
+    assert "# TYPE todo_cache_hits_total counter" in text
+    assert 'todo_cache_hits_total{cache="items"} 2' in text
+    assert 'todo_cache_misses_total{cache="items"} 1' in text
+    assert 'todo_cache_evictions_total{cache="attachments"} 0' in text
+    assert 'todo_cache_entries{cache="items"} 1' in text
@@ -0,0 +1,28 @@
+from application.models import TodoItem
+from application.query import TodoQuery
+from application.services import TodoService
+
+
+def test_rename_through_service_updates_title_index(repo):
+    service = TodoService(repo)
+    todo = service.add_todo("Groceries")
+    service.add_todo("Gardening")
+    service.update_todo(todo.id, title="Taxes")
+    assert [found.id for found in repo.query(TodoQuery(title_prefix="Tax"))] == [todo.id]
+    assert [found.title for found in repo.query(TodoQuery(title_prefix="Gro"))] == []
+
+
+def test_toggle_through_service_updates_completed_index(repo):
+    service = TodoService(repo)
+    todo = service.add_todo("Groceries")
+    service.update_todo(todo.id, completed=True)
+    assert [found.id for found in repo.query(TodoQuery(completed=True))] == [todo.id]
+    assert repo.query(TodoQuery(completed=False)) == []
+    assert repo.stats().completed == 1
+
+
+def test_changing_a_returned_item_does_not_change_the_store(repo):
+    repo.add(TodoItem(title="Groceries", id="a"))
+    repo.get("a").title = "Taxes"
+    assert repo.get("a").title == "Groceries"
+    assert [found.id for found in repo.query(TodoQuery(title_prefix="Gro"))] == ["a"]
@@ -0,0 +1,47 @@
+import asyncio
+from application.models import TodoItem
+from application.query import TodoQuery
+from application.services import AsyncTodoService, TodoService
+from infrastructure.async_repo import ExecutorTodoRepo
+from presentation.flet_ui import PAGE_SIZE
+
+# As stamped on every row by the created_at migration, or kept by imports
+SHARED_CREATED = "2024-01-01 00:00:00"
+
+
+def add_same_time(repo, count, **fields):
+    todos = [TodoItem(title=f"Task {i}", created_at=SHARED_CREATED, **fields) for i in range(count)]
+    repo.add_many(todos)
+    return todos
+
+
+def test_query_pages_cover_todos_sharing_created_at(repo):
+    todos = add_same_time(repo, 2 * PAGE_SIZE + 5)
+    add_same_time(repo, 10, completed=True)
+    service = TodoService(repo)
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = service.query_todos_page(TodoQuery(completed=False), cursor, PAGE_SIZE)
+        assert len(page.items) <= PAGE_SIZE
+        seen += [todo.id for todo in page.items]
+        pages += 1
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+        assert pages <= len(todos)
+    assert seen == sorted(todo.id for todo in todos)
+    assert pages == 3
+
+
+def test_async_query_pages_cover_todos_sharing_created_at(repo):
+    todos = add_same_time(repo, PAGE_SIZE + 1)
+
+    async def all_pages():
+        service = AsyncTodoService(ExecutorTodoRepo(repo))
+        first = await service.query_todos_page(TodoQuery(completed=False), None, PAGE_SIZE)
+        second = await service.query_todos_page(TodoQuery(completed=False), first.next_cursor, PAGE_SIZE)
+        return first, second
+
+    first, second = asyncio.run(all_pages())
+    assert len(first.items) == PAGE_SIZE and second.next_cursor is None
+    assert [todo.id for todo in first.items + second.items] == sorted(todo.id for todo in todos)
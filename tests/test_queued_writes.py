@@ -0,0 +1,39 @@
+import asyncio
+import dataclasses
+import sqlite3
+import pytest
+from application.models import TodoItem
+from application.services import AsyncTodoService
+from infrastructure.async_repo import ExecutorTodoRepo
+from infrastructure.group_commit import ASYNC
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+
+def test_repositories_committing_at_once_return_resolved_futures(repo):
+    todo = TodoItem(title="Groceries")
+    committed = repo.add_queued(todo)
+    assert committed.done() and committed.result() is None
+    assert repo.get(todo.id).title == "Groceries"
+
+
+def test_async_durability_reports_commits_and_failures(tmp_path):
+    async def scenario(service):
+        todo, committed = await service.add_todo_queued("Groceries")
+        assert await committed is None
+        _, committed = await service.update_todo_queued(todo.id, completed=True)
+        await committed
+        # A second insert of the same ID fails only when its group commits
+        failing = await service.repository.add_queued(dataclasses.replace(todo, title="Duplicate"))
+        with pytest.raises(sqlite3.IntegrityError):
+            await failing
+        return todo
+
+    repo = SQLiteTodoRepo(str(tmp_path / "todos.db"), durability=ASYNC)
+    service = AsyncTodoService(ExecutorTodoRepo(repo))
+    try:
+        todo = asyncio.run(scenario(service))
+        stored = repo.get(todo.id)
+        assert (stored.title, stored.completed) == ("Groceries", True)
+    finally:
+        asyncio.run(service.close())
+        repo.close()
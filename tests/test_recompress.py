@@ -0,0 +1,27 @@
+from application.models import TodoItem
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+TEXT = b"All work and no play makes Jack a dull boy.\n" * 2000
+
+
+def test_recompressing_a_legacy_row_keeps_its_size(tmp_path):
+    repo = SQLiteTodoRepo(str(tmp_path / "todos.db"))
+    todo = repo.add(TodoItem(title="Notes"))
+    # As stored before attachments had a size column or a codec
+    with repo.pool.connection() as conn, conn:
+        conn.execute(
+            "UPDATE todos SET attachment_filename = 'notes.txt', attachment_mimetype = 'text/plain', "
+            "attachment_data = ?, attachment_codec = NULL, attachment_size = NULL WHERE id = ?",
+            (TEXT, todo.id)
+        )
+    repo.check_stats(repair=True)
+
+    rewritten, before, after = repo.recompress()
+
+    assert (rewritten, before) == (1, len(TEXT)) and after < before
+    assert repo.list_summaries()[0].attachment_size == len(TEXT)
+    assert repo.stats().attachment_bytes == len(TEXT)
+    counters, counted = repo.check_stats()
+    assert counters == counted
+    assert repo.get_attachment(todo.id) == TEXT
+    repo.close()
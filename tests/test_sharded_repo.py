@@ -0,0 +1,112 @@
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from application.attachments import AttachmentStream
+from application.models import TodoItem
+from infrastructure.blob_store import BlobStore
+from infrastructure.sharded_sqlite_repo import MANIFEST, ShardedSQLiteTodoRepo, shard_of, shard_path
+
+
+@pytest.fixture(params=[0, 2], ids=["in-process", "worker-processes"])
+def sharded(request, tmp_path):
+    repo = ShardedSQLiteTodoRepo(str(tmp_path / "shards"), shards=2, workers=request.param)
+    yield repo
+    repo.close()
+
+
+def add_attached(repo, count):
+    todos = []
+    for i in range(count):
+        # Fixed IDs, which spread over both shards
+        todo = TodoItem(title=f"Report {i}", id=f"report-{i}")
+        todo.set_attachment(f"contents of {i}".encode(), f"report{i}.txt", "text/plain")
+        todos.append(todo)
+    repo.add_many(todos)
+    return {todo.id: todo.attachment_data for todo in todos}
+
+
+def test_merged_listings_load_attachments_from_their_own_shard(sharded):
+    attachments = add_attached(sharded, 10)
+    assert {shard_of(todo_id, 2) for todo_id in attachments} == {0, 1}
+    for listing in (sharded.list_summaries(), sharded.list_page(limit=20).items, sharded.search("report")):
+        assert len(listing) == 10
+        for summary in listing:
+            assert bytes(summary.attachment.load()) == attachments[summary.id]
+    for todo in sharded.list_all():
+        assert bytes(todo.attachment_data) == attachments[todo.id]
+
+
+def test_worker_processes_are_not_forked_from_threads(tmp_path):
+    repo = ShardedSQLiteTodoRepo(str(tmp_path / "shards"), shards=2, workers=2)
+    try:
+        attachments = add_attached(repo, 4)
+        # As the API server calls it, from a worker thread
+        with ThreadPoolExecutor(max_workers=1) as threads:
+            listing = threads.submit(repo.list_summaries).result()
+        assert sorted(summary.id for summary in listing) == sorted(attachments)
+        assert repo._executor._mp_context.get_start_method() != "fork"
+    finally:
+        repo.close()
+
+
+def stored_ids(directory, shards):
+    # Every todo ID in every shard file, with the shard it is in
+    found = []
+    for index in range(shards):
+        conn = sqlite3.connect(shard_path(directory, index))
+        try:
+            found += [(todo_id, index) for (todo_id,) in conn.execute("SELECT id FROM todos")]
+        finally:
+            conn.close()
+    return found
+
+
+@pytest.mark.parametrize("with_blobs", [False, True], ids=["inline", "blob-store"])
+def test_interrupted_rebalance_is_finished_on_reopen(tmp_path, with_blobs):
+    directory = str(tmp_path / "shards")
+    blob_store = BlobStore(str(tmp_path / "uploads")) if with_blobs else None
+    repo = ShardedSQLiteTodoRepo(directory, shards=2, blob_store=blob_store, workers=0)
+    attachments = add_attached(repo, 40)
+    streamed = repo.add(TodoItem(title="Scan", id="scan"))
+    repo.write_attachment(streamed.id, AttachmentStream([b"scanned page" * 1000], "scan.bin", "application/octet-stream"))
+    attachments[streamed.id] = b"scanned page" * 1000
+    # Stops the move out of shard 0 after its copy committed and before
+    # the delete, as a crash there would
+    with repo.shards[0].pool.connection() as conn, conn:
+        conn.execute("CREATE TRIGGER interrupt BEFORE DELETE ON todos BEGIN SELECT RAISE(ABORT, 'interrupted'); END")
+    with pytest.raises(sqlite3.IntegrityError):
+        repo.rebalance(3)
+
+    ids = [todo_id for todo_id, _ in stored_ids(directory, 3)]
+    assert len(ids) > len(set(ids)) and set(ids) == set(attachments)
+    # Still routed by the old count until the move is finished
+    for todo_id, data in attachments.items():
+        assert bytes(repo.get(todo_id).attachment_data) == data
+    with repo.shards[0].pool.connection() as conn, conn:
+        conn.execute("DROP TRIGGER interrupt")
+    repo.close()
+
+    with pytest.raises(ValueError):
+        ShardedSQLiteTodoRepo(directory, shards=4)
+    repo = ShardedSQLiteTodoRepo(directory, shards=3, blob_store=blob_store, workers=0)
+    try:
+        assert len(repo.shards) == 3
+        assert sorted(stored_ids(directory, 3)) == sorted((todo_id, shard_of(todo_id, 3)) for todo_id in attachments)
+        for todo_id, data in attachments.items():
+            assert bytes(repo.get(todo_id).attachment_data) == data
+            assert b"".join(repo.iter_attachment(todo_id)) == data
+        counters, counted = repo.check_stats()
+        assert counters == counted and counted.total == len(attachments)
+        if with_blobs:
+            # Blob references moved with their rows, none taken or dropped
+            assert blob_store.gc() == 0
+            repo.delete_many(list(attachments))
+            assert blob_store.gc() == len(attachments)
+    finally:
+        repo.close()
+        if blob_store is not None:
+            blob_store.close()
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+        assert json.load(f) == {"shards": 3}
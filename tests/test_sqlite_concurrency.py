@@ -0,0 +1,77 @@
+import threading
+import pytest
+from application.models import TodoItem
+from application.query import TodoQuery
+from application.services import TodoService
+from infrastructure.group_commit import DURABILITY, IMMEDIATE, GroupCommitWriter
+from infrastructure.sqlite_pool import SQLiteConnectionPool
+from infrastructure.sqlite_repo import SQLiteTodoRepo
+
+WRITERS = 8
+READERS = 8
+TODOS_PER_WRITER = 40
+
+
+@pytest.mark.parametrize("durability", DURABILITY)
+def test_concurrent_sessions_lose_no_writes(tmp_path, durability):
+    # One repository per session over a shared pool, as the GUI runs them
+    pool = SQLiteConnectionPool(str(tmp_path / "todos.db"), max_size=4)
+    writer = None
+    if durability != IMMEDIATE:
+        writer = GroupCommitWriter(SQLiteTodoRepo(pool=pool))
+    sessions = [SQLiteTodoRepo(pool=pool, durability=durability, writer=writer) for _ in range(WRITERS + READERS)]
+    errors = []
+    expected = {}
+    expected_lock = threading.Lock()
+    start = threading.Barrier(WRITERS + READERS)
+    writing = [WRITERS]
+
+    def write(repo, number):
+        service = TodoService(repo)
+        start.wait()
+        for i in range(TODOS_PER_WRITER):
+            todo = service.add_todo(f"Session {number} task {i}")
+            # Every other todo is toggled twice, the rest once
+            service.update_todo(todo.id, completed=True)
+            if i % 2:
+                service.update_todo(todo.id, completed=False)
+            with expected_lock:
+                expected[todo.id] = not i % 2
+
+    def read(repo):
+        start.wait()
+        while writing[0]:
+            page = repo.list_page(limit=20)
+            for summary in page.items:
+                repo.get(summary.id)
+            repo.query(TodoQuery(completed=True, limit=10))
+            repo.stats()
+
+    def run(target, *args):
+        try:
+            target(*args)
+        except Exception as err:
+            errors.append(err)
+        finally:
+            if target is write:
+                with expected_lock:
+                    writing[0] -= 1
+
+    threads = [threading.Thread(target=run, args=(write, repo, number)) for number, repo in enumerate(sessions[:WRITERS])]
+    threads += [threading.Thread(target=run, args=(read, repo)) for repo in sessions[WRITERS:]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=120)
+    if writer is not None:
+        # Commits what async durability still has queued
+        writer.close()
+
+    assert not [err for err in errors if "locked" in str(err)]
+    assert errors == []
+    repo = SQLiteTodoRepo(pool=pool)
+    stored = {summary.id: summary.completed for summary in repo.list_summaries()}
+    assert stored == expected
+    assert len(stored) == WRITERS * TODOS_PER_WRITER
+    assert repo.stats().completed == TODOS_PER_WRITER // 2 * WRITERS
+    pool.close()